@@ -0,0 +1,197 @@
+# filename: benchmark_NHDNetwork.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Time NHDNetwork operations on synthetic networks from 10^3 to 10^6 flowlines and compare the timings to
+# stored baselines. Runs without arcpy.
+#
+# usage: python benchmark_NHDNetwork.py [--scales 1000 10000] [--threshold 1.5] [--update-baselines] [--all]
+# Exits with status 1 if any operation is slower than its baseline by more than the threshold.
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lagosGIS'))
+from synthetic_network import SyntheticNHDNetwork, generate_network_tables
+
+BASELINES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines.csv')
+SCALES = (1000, 10000, 100000, 1000000)
+THRESHOLD = 1.5
+SAMPLE_LAKES = 50  # lakes used for the interlake and classification operations
+MIN_SECONDS = 0.01  # timings below this are too noisy to flag
+REPEATS = 5  # timed runs per operation, the median is kept
+LARGE_SCALE_REPEATS = 3  # timed runs per operation at 10^5 flowlines and above
+
+# largest scale each operation runs at unless --all is used
+MAX_SCALE = {'construction': 1000000,
+             'single_trace': 1000000,
+             'bulk_traces': 100000,
+             'define_interlake_erasable': 100000,
+             'classification': 1000000,
+             'outlet_detection': 1000000}
+
+
+# ---OPERATIONS-----
+# each takes the generated tables and a built network and returns the seconds taken by the operation alone
+def construction(tables, network):
+    fresh = SyntheticNHDNetwork(0, tables=tables)
+    start = time.time()
+    fresh.prepare_upstream()
+    fresh.prepare_downstream()
+    fresh.map_flowlines_to_waterbodies()
+    fresh.map_waterbodies_to_flowlines()
+    fresh.define_lakes()
+    return time.time() - start
+
+
+def single_trace(tables, network):
+    outlet = network.outlets[0]
+    start = time.time()
+    network.trace_up_from_a_flowline(outlet)
+    return time.time() - start
+
+
+def bulk_traces(tables, network):
+    # every lake, as in the watershed toolchain, so that the traced network grows with the scale (a fixed sample of
+    # lakes can trace fewer elements in a larger network)
+    network.set_start_ids(sorted(network.lakes_areas.keys()))
+    start = time.time()
+    network.trace_up_from_waterbody_starts()
+    return time.time() - start
+
+
+def define_interlake_erasable(tables, network):
+    network.set_start_ids(sample_lakes(network)[:10])
+    start = time.time()
+    network.define_interlake_erasable()
+    return time.time() - start
+
+
+def classification(tables, network):
+    lakes = sample_lakes(network)
+    start = time.time()
+    for lake in lakes:
+        network.classify_waterbody_connectivity(lake)
+    return time.time() - start
+
+
+def outlet_detection(tables, network):
+    start = time.time()
+    network.identify_subregion_outlets()
+    network.identify_all_lakes_outlets()
+    return time.time() - start
+
+
+OPERATIONS = [construction, single_trace, bulk_traces, define_interlake_erasable, classification, outlet_detection]
+
+
+def sample_lakes(network):
+    """Evenly spaced sample of the defined lakes, the same every run."""
+    lakes = sorted(network.lakes_areas.keys())
+    step = max(1, len(lakes) // SAMPLE_LAKES)
+    return lakes[::step][:SAMPLE_LAKES]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def calibrate(repeats=REPEATS):
+    """
+    Time a fixed dictionary and set workload similar to network tracing. Timings are divided by this value before they
+    are compared to the baselines so that baselines recorded on one machine remain usable on another.
+    :return: Median seconds for the calibration workload
+    """
+    timings = []
+    for r in range(repeats):
+        start = time.time()
+        d = {}
+        for i in range(200000):
+            d.setdefault(str(i % 5000), []).append(i)
+        s = set()
+        for v in d.values():
+            s.update(v)
+        timings.append(time.time() - start)
+    return median(timings)
+
+
+def read_baselines(baselines_csv=BASELINES_CSV):
+    """
+    :return: Dictionary with key = (scale, operation), value = normalized seconds
+    """
+    if not os.path.exists(baselines_csv):
+        return {}
+    with open(baselines_csv) as f:
+        return {(int(r['scale']), r['operation']): float(r['normalized']) for r in csv.DictReader(f)}
+
+
+def write_baselines(baselines, baselines_csv=BASELINES_CSV):
+    with open(baselines_csv, 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['scale', 'operation', 'normalized'])
+        for (scale, operation), normalized in sorted(baselines.items()):
+            writer.writerow([scale, operation, '{:.4f}'.format(normalized)])
+
+
+def run(scales=SCALES, threshold=THRESHOLD, update_baselines=False, run_all=False, repeats=REPEATS):
+    """
+    Run the benchmarks and compare them to the stored baselines.
+    :param scales: Network sizes (number of flowlines) to benchmark
+    :param float threshold: Allowed ratio of current to baseline time before an operation is flagged
+    :param bool update_baselines: Save the timings from this run as the new baselines
+    :param bool run_all: Ignore MAX_SCALE and run every operation at every scale
+    :param int repeats: Timed runs per operation below 10^5 flowlines (LARGE_SCALE_REPEATS above); the median is kept
+    :return: List of (scale, operation) pairs that regressed
+    """
+    baselines = read_baselines()
+    calibration = calibrate()
+    print("Calibration: {:.4f} seconds".format(calibration))
+    print("{:>9} {:<27} {:>10} {:>10} {:>10}".format('scale', 'operation', 'seconds', 'normalized', 'baseline'))
+    regressions = []
+    for scale in scales:
+        tables = generate_network_tables(scale)
+        network = SyntheticNHDNetwork(scale, tables=tables)
+        network.define_lakes()
+        network.identify_subregion_outlets()
+        for operation in OPERATIONS:
+            name = operation.__name__
+            if scale > MAX_SCALE[name] and not run_all:
+                continue
+            n = repeats if scale < 100000 else LARGE_SCALE_REPEATS
+            timings = []
+            for r in range(n):
+                timings.append(operation(tables, network))
+                network.deactivate_stops()
+            seconds = median(timings)
+            normalized = seconds / calibration
+            baseline = baselines.get((scale, name))
+            flag = ''
+            if baseline and normalized > baseline * threshold and seconds > MIN_SECONDS:
+                flag = 'REGRESSION'
+                regressions.append((scale, name))
+            print("{:>9} {:<27} {:>10.4f} {:>10.3f} {:>10} {}".format(
+                scale, name, seconds, normalized, '{:.3f}'.format(baseline) if baseline else '-', flag))
+            if update_baselines:
+                baselines[(scale, name)] = normalized
+    if update_baselines:
+        write_baselines(baselines)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark NHDNetwork on synthetic networks.')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES))
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--update-baselines', action='store_true')
+    parser.add_argument('--all', action='store_true', help='run every operation at every scale')
+    args = parser.parse_args()
+    regressions = run(args.scales, args.threshold, args.update_baselines, args.all)
+    if regressions:
+        print("{} operations regressed beyond {}x their baselines.".format(len(regressions), args.threshold))
+        sys.exit(1)
@@ -9,10 +9,15 @@ import os
 import re
 from collections import defaultdict
 
-import arcpy
-from arcpy import management as DM
+try:
+    import arcpy
+except ImportError:
+    # without ArcGIS, tables are read through OGR (see data_access.py) or supplied by a subclass (see synthetic_network.py)
+    arcpy = None
 
-import lagosGIS
+import data_access
+
+LAGOS_FCODE_LIST = (39000,39004,39009,39010,39011,39012,43600,43613,43615,43617,43618,43619,43621)
 
 
 class NHDNetwork:
@@ -69,7 +74,7 @@ class NHDNetwork:
 
     def __init__(self, nhd_gdb):
         self.gdb = nhd_gdb
-        self.plus = True if arcpy.Exists(os.path.join(self.gdb, 'NHDPlus')) else False
+        self.plus = True if self._exists(os.path.join(self.gdb, 'NHDPlus')) else False
         self.huc4 = re.search('\d{4}', os.path.basename(nhd_gdb)).group()
 
         if self.plus:
@@ -111,6 +116,23 @@ class NHDNetwork:
         self.lagos_pop_path = r'F:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.9.gdb\Lakes\LAGOS_US_All_Lakes_1ha'
 
     # ---UTILITIES FOR HIGHER METHODS-----------------------------------------------------------------------------------
+    def _exists(self, path):
+        """
+        Test whether a geodatabase item exists. Override together with _read_rows to supply tables from another source.
+        :param str path: Path to the geodatabase item
+        :return: bool
+        """
+        return data_access.exists(path)
+
+    def _read_rows(self, table, fields):
+        """
+        Read rows from one of the geodatabase tables. All NHDNetwork table reads go through this method.
+        :param str table: Path to the table or feature class
+        :param list fields: Field names to read
+        :return: Generator of row tuples
+        """
+        return data_access.read_rows(table, fields)
+
     def prepare_upstream(self, force_refresh=False):
         """
         Read the geodatabase flow table and collapse into a flow dictionary, if the flow dictionary was not already
@@ -121,15 +143,14 @@ class NHDNetwork:
         """Read the geodatabase flow table and collapse into a flow dictionary."""
         if not self.upstream or force_refresh:
             self.upstream = defaultdict(list)
-            with arcpy.da.SearchCursor(self.flow, [self.from_column, self.to_column]) as cursor:
-                for row in cursor:
-                    from_id, to_id = row
-                    if from_id == '0': # see drop_intermittent_flow
-                        self.upstream[to_id] = []
-                    elif from_id not in self.intermit_flowline_ids: # see drop_intermittent_flow
-                        self.upstream[to_id].append(from_id)
-                    else:
-                        continue
+            for row in self._read_rows(self.flow, [self.from_column, self.to_column]):
+                from_id, to_id = row
+                if from_id == '0': # see drop_intermittent_flow
+                    self.upstream[to_id] = []
+                elif from_id not in self.intermit_flowline_ids: # see drop_intermittent_flow
+                    self.upstream[to_id].append(from_id)
+                else:
+                    continue
         return self.upstream
 
     def prepare_downstream(self, force_refresh=False):
@@ -140,15 +161,14 @@ class NHDNetwork:
         """
         if not self.downstream or force_refresh:
             self.downstream = defaultdict(list)
-            with arcpy.da.SearchCursor(self.flow, [self.from_column, self.to_column]) as cursor:
-                for row in cursor:
-                    from_id, to_id = row
-                    if to_id == '0':
-                        self.downstream[from_id] = []
-                    elif to_id not in self.intermit_flowline_ids: # see drop_intermittent_flow
-                        self.downstream[from_id].append(to_id)
-                    else:
-                        continue
+            for row in self._read_rows(self.flow, [self.from_column, self.to_column]):
+                from_id, to_id = row
+                if to_id == '0':
+                    self.downstream[from_id] = []
+                elif to_id not in self.intermit_flowline_ids: # see drop_intermittent_flow
+                    self.downstream[from_id].append(to_id)
+                else:
+                    continue
         return self.downstream
 
     def map_nhdpid_to_flowlines(self):
@@ -157,7 +177,7 @@ class NHDNetwork:
         :return: self.nhdpid_flowline
         """
         self.nhdpid_flowline = {r[0]: r[1]
-                                for r in arcpy.da.SearchCursor(self.flowline, ['NHDPlusID', 'Permanent_Identifier'])}
+                                for r in self._read_rows(self.flowline, ['NHDPlusID', 'Permanent_Identifier'])}
         return self.nhdpid_flowline
 
     def map_waterbody_to_nhdpids(self):
@@ -166,7 +186,7 @@ class NHDNetwork:
         :return: None
         """
         self.waterbody_nhdpid = {r[0]: r[1]
-                                 for r in arcpy.da.SearchCursor(self.waterbody, ['Permanent_Identifier', 'NHDPlusID'])}
+                                 for r in self._read_rows(self.waterbody, ['Permanent_Identifier', 'NHDPlusID'])}
         self.nhdpid_waterbody = {v: k for k, v in self.waterbody_nhdpid.items()}
 
     def drop_intermittent_flow(self):
@@ -175,7 +195,7 @@ class NHDNetwork:
         between them is not permanent).
         :return: None
         """
-        self.intermit_flowline_ids= {r[0] for r in arcpy.da.SearchCursor(self.flowline,
+        self.intermit_flowline_ids= {r[0] for r in self._read_rows(self.flowline,
                                                         ['Permanent_Identifier', 'FCode']) if
                                      r[1] in [46003, 46007]}
         self.exclude_intermittent_flow = True
@@ -208,9 +228,9 @@ class NHDNetwork:
         :return: self.flowline_waterbody
         """
         self.flowline_waterbody = {r[0]: r[1]
-                                   for r in arcpy.da.SearchCursor(self.flowline,
-                                                                  ['Permanent_Identifier',
-                                                                   'WBArea_Permanent_Identifier'])
+                                   for r in self._read_rows(self.flowline,
+                                                            ['Permanent_Identifier',
+                                                             'WBArea_Permanent_Identifier'])
                                    if r[1]}
         return self.flowline_waterbody
 
@@ -219,11 +239,10 @@ class NHDNetwork:
         Construct the waterbody_flowline identifier mapping dictionary.
         :return: self.waterbody_flowline
         """
-        with arcpy.da.SearchCursor(self.flowline, ['Permanent_Identifier', 'WBArea_Permanent_Identifier']) as cursor:
-            for row in cursor:
-                flowline_id, waterbody_id = row
-                if waterbody_id:
-                    self.waterbody_flowline[waterbody_id].append(flowline_id)
+        for row in self._read_rows(self.flowline, ['Permanent_Identifier', 'WBArea_Permanent_Identifier']):
+            flowline_id, waterbody_id = row
+            if waterbody_id:
+                self.waterbody_flowline[waterbody_id].append(flowline_id)
         self.waterbody_flowline
 
     def define_lakes(self, strict_minsize=False, force_lagos=False):
@@ -237,22 +256,21 @@ class NHDNetwork:
         :return self.lakes_areas: A dictionary with lake permids as the keys and the lake area as the values.
         """
         self.lakes_areas = {} # clear prior definition
-        lagos_fcode_list = lagosGIS.LAGOS_FCODE_LIST
+        lagos_fcode_list = LAGOS_FCODE_LIST
         lake_minsize = 0.01 if strict_minsize else 0.009
         if force_lagos:
-            if arcpy.Exists(self.lagos_pop_path):
+            if self._exists(self.lagos_pop_path):
                 arcpy.AddMessage("Defining lakes with force_lagos = True...")
-                force_ids = {r[0] for r in arcpy.da.SearchCursor(self.lagos_pop_path, 'Permanent_Identifier')}
+                force_ids = {r[0] for r in self._read_rows(self.lagos_pop_path, ['Permanent_Identifier'])}
             else:
                 arcpy.AddMessage("Parameter to force LAGOS lake population was requested but the LAGOS lake path does not exist.")
                 force_ids = {}
         else:
             force_ids = {}
-        with arcpy.da.SearchCursor(self.waterbody, ['Permanent_Identifier', 'AreaSqKm', 'FCode']) as cursor:
-            for row in cursor:
-                id, area, fcode = row
-                if (area >= lake_minsize and fcode in lagos_fcode_list) or id in force_ids:
-                    self.lakes_areas[id] = area
+        for row in self._read_rows(self.waterbody, ['Permanent_Identifier', 'AreaSqKm', 'FCode']):
+            id, area, fcode = row
+            if (area >= lake_minsize and fcode in lagos_fcode_list) or id in force_ids:
+                self.lakes_areas[id] = area
         return self.lakes_areas
 
     # ---NETWORK SETUP FOR TRACING--------------------------------------------------------------------------------------
@@ -861,7 +879,7 @@ class NHDNetwork:
             connclass = 'Isolated'
         # otherwise subtract lake's self and internal flowlines, check for 10 ha lakes in trace, and classify
         else:
-            inside_ids = self.waterbody_flowline[waterbody_start_id]
+            inside_ids = self.waterbody_flowline[waterbody_start_id][:]
             inside_ids.append(waterbody_start_id)
             nonself_trace_down = set(trace_down).difference(set(inside_ids))
             nonself_trace_up = set(trace_up).difference(set(inside_ids))
@@ -920,4 +938,16 @@ class NHDNetwork:
             return lake_count
         if result_type == 'area_hectares':
             lake_area = sum([self.lakes_areas[id] for id in upstream_lakes]) * 100 # convert to hectares
-            return lake_area
\ No newline at end of file
+            return lake_area
+
+    # ---SHARING WITH OTHER PROCESSES-----------------------------------------------------------------------------------
+    def publish(self, out_dir):
+        """
+        Publish this network to a directory of memory-mapped arrays that worker processes can attach to read-only with
+        shared_network.SharedNetwork, instead of each worker building its own NHDNetwork. Barriers and start locations
+        are not published; workers set their own.
+        :param str out_dir: Directory to create (or overwrite) with the published network
+        :return: out_dir
+        """
+        import shared_network
+        return shared_network.publish_network(self, out_dir)
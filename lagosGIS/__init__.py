@@ -26,90 +26,67 @@ __all__ = ["lake_connectivity_classification",
            "spatial_divisions_processing"
     ]
 
+import importlib
 import os
-import arcpy
+import sys
 import tempfile
-from lake_connectivity_classification import classify as lake_connectivity_classification
-from upstream_lakes import count as upstream_lakes
-from locate_lake_outlets import locate_lake_outlets
-from locate_lake_inlets import locate_lake_inlets
-from watershed_delineation.aggregate_watersheds import aggregate_watersheds as aggregate_watersheds
-from watershed_delineation.postprocess_watersheds import calc_watershed_subtype
-from watershed_delineation.postprocess_watersheds import calc_watershed_equality
-
-from point_density_in_zones import calc as point_density_in_zones
-from line_density_in_zones import calc as line_density_in_zones
-from polygon_density_in_zones import calc as polygon_density_in_zones
-from stream_density import calc_all as stream_density
-from lake_density import calc_all as lake_density
-
-from flatten_overlapping_zones import flatten as flatten_overlaps
-from rasterize_zones import rasterize as rasterize_zones
-from zonal_summary_of_raster_data import calc as zonal_summary_of_raster_data
-from preprocess_padus import preprocess as preprocess_padus
-
-from zonal_summary_of_classed_polygons import summarize as zonal_summary_of_classed_polygons
-from point_attribution_of_raster_data import attribution as point_attribution_of_raster_data
-
-from georeference import spatialize_sites
-from georeference import georeference_lake_sites
-
-from export_to_csv import export as export_to_csv
-import spatial_divisions_processing
-
-
-LAGOS_FCODE_LIST = (39000,39004,39009,39010,39011,39012,43600,43613,43615,43617,43618,43619,43621)
-
-def efficient_merge(feature_class_or_table_list, output_fc, filter =''):
-    fc_count = len(feature_class_or_table_list)
+import types
+
+try:
+    _string_types = basestring
+except NameError:  # Python 3
+    _string_types = str
+
+# Tools are loaded on first use: the module behind each public name below (and arcpy, which the tool modules import)
+# is imported the first time the name is accessed, so "import lagosGIS" is fast and needs no ArcGIS installation.
+# Other submodules, e.g. lagosGIS.data_access, are imported on first access too.
+_TOOLS = {
+    'lake_connectivity_classification': ('lake_connectivity_classification', 'classify'),
+    'upstream_lakes': ('upstream_lakes', 'count'),
+    'locate_lake_outlets': ('locate_lake_outlets', 'locate_lake_outlets'),
+    'locate_lake_inlets': ('locate_lake_inlets', 'locate_lake_inlets'),
+    'aggregate_watersheds': ('watershed_delineation.aggregate_watersheds', 'aggregate_watersheds'),
+    'calc_watershed_subtype': ('watershed_delineation.postprocess_watersheds', 'calc_watershed_subtype'),
+    'calc_watershed_equality': ('watershed_delineation.postprocess_watersheds', 'calc_watershed_equality'),
+
+    'point_density_in_zones': ('point_density_in_zones', 'calc'),
+    'line_density_in_zones': ('line_density_in_zones', 'calc'),
+    'polygon_density_in_zones': ('polygon_density_in_zones', 'calc'),
+    'stream_density': ('stream_density', 'calc_all'),
+    'lake_density': ('lake_density', 'calc_all'),
+
+    'flatten_overlaps': ('flatten_overlapping_zones', 'flatten'),
+    'rasterize_zones': ('rasterize_zones', 'rasterize'),
+    'zonal_summary_of_raster_data': ('zonal_summary_of_raster_data', 'calc'),
+    'preprocess_padus': ('preprocess_padus', 'preprocess'),
+
+    'zonal_summary_of_classed_polygons': ('zonal_summary_of_classed_polygons', 'summarize'),
+    'point_attribution_of_raster_data': ('point_attribution_of_raster_data', 'attribution'),
+
+    'spatialize_sites': ('georeference', 'spatialize_sites'),
+    'georeference_lake_sites': ('georeference', 'georeference_lake_sites'),
+
+    'export_to_csv': ('export_to_csv', 'export'),
+    'LAGOS_FCODE_LIST': ('NHDNetwork', 'LAGOS_FCODE_LIST')
+}
+_loaded = {}
+
+
+def efficient_merge(feature_class_or_table_list, output_fc, filter ='', processes = 1):
+    """
+    Merge feature classes or tables into one output with the bulk_merge engine: schemas are combined up front, the
+    filter is applied as each source is read, and all rows are written through one cursor.
+    :param feature_class_or_table_list: List of feature classes or tables to merge
+    :param output_fc: Output feature class or table
+    :param filter: (Optional) SQL filter applied to every input
+    :param processes: (Optional) Number of reader processes, see bulk_merge.merge
+    :return: Catalog path of the output, or False if any input does not exist
+    """
+    import arcpy
+    import bulk_merge
     all_exist_test = all(arcpy.Exists(fct) for fct in feature_class_or_table_list)
-
-    # EXECUTE
-    # Start with FC containing largest extent to prevent spatial grid errors
-    description = arcpy.Describe(feature_class_or_table_list[0])
-    if description.dataType == "FeatureClass":
-        descriptions = [arcpy.Describe(fc).extent for fc in feature_class_or_table_list]
-        fc_areas = [int(d.XMax-d.XMin) * int(d.YMax-d.YMin) for d in descriptions]
-        index = [i for i, x in enumerate(fc_areas) if x == max(fc_areas)]
-        first_fc = feature_class_or_table_list[index[0]]
-        feature_class_or_table_list.remove(first_fc)
-    else:
-        first_fc = feature_class_or_table_list.pop(0)
-
-
-    # This is a fast and stable merge method for this number of features compared to arcpy Merge
     if all_exist_test:
-        print("Beginning merge of {} feature classes, copying first feature class {} to output...".format(fc_count, first_fc))
-        if description.dataType == "FeatureClass":
-            arcpy.Select_analysis(first_fc, output_fc, filter)
-        else:
-            arcpy.TableSelect_analysis(first_fc, output_fc, filter)
-        arcpy.SetLogHistory = False  # speeds up iterative updates, won't write to geoprocessing for every step
-        cursor_fields = list(arcpy.da.SearchCursor(output_fc, ['*']).fields)
-        if description.dataType == "FeatureClass":
-            cursor_fields.append('SHAPE@')
-        insertRows = arcpy.da.InsertCursor(output_fc, cursor_fields)
-
-        for fc in feature_class_or_table_list:
-            counter = 0
-            searchRows = arcpy.da.SearchCursor(fc, cursor_fields, filter)
-            for searchRow in searchRows:
-                insertRows.insertRow(searchRow)
-                counter +=1
-            try:
-                del searchRow, searchRows
-            except:
-                print("Merged NO features from {}; filter eliminated all features".format(fc))
-            print("Merged {0} features from {1}".format(counter, fc))
-        del insertRows
-        arcpy.SetLogHistory = True
-
-        # Rebuild indexes
-        try:
-            arcpy.AddIndex_management(output_fc, 'Permanent_Identifier', 'IDX_Permanent_Identifier')
-            arcpy.AddIndex_management(output_fc, 'nhd_merge_id', 'IDX_nhd_merge_id')
-        except:
-           arcpy.AddWarning('Could not build Permanent_Identifier index because there is no such field.')
+        bulk_merge.merge(feature_class_or_table_list, output_fc, filter, processes)
         return arcpy.Describe(output_fc).catalogPath
 
     else:
@@ -126,7 +103,7 @@ def list_shared_words(string1, string2, exclude_lake_words = True ):
     :return: A list of words.
     """
     EXCLUSION_SET = set(['LAKE', 'POND', 'RESERVOIR', 'DAM'])
-    if not (isinstance(string1, basestring) and isinstance(string2, basestring)):
+    if not (isinstance(string1, _string_types) and isinstance(string2, _string_types)):
         raise TypeError("inputs must each be a string")
 
     words1 = set(string1.upper().split())
@@ -145,6 +122,7 @@ def select_fields(feature_class_or_table, output, field_list, convert_to_table =
     :param convert_to_table: Optional, boolean. Default False. Whether to return the output as the Table dataset type.
     :return: ArcGIS Result object.
     '''
+    import arcpy
     input_type = arcpy.Describe(feature_class_or_table).dataType
     dir_name = os.path.dirname(output)
     if dir_name:
@@ -175,24 +153,18 @@ def multi_msg(message):
     interpreter and ArcGIS geoprocessing dialog using
     print statement, also ArcGIS Results window (for background processing) or geoprocessing dialog using
     arcpy.AddMessage"""
+    import arcpy
     print(message)
     arcpy.AddMessage(message)
 
 
-def merge_many(merge_list, out_fc, group_size = 20):
+def merge_many(merge_list, out_fc, group_size = 20, processes = 1):
     """arcpy merge a list without blowing up your system
-        this can be slow, but is usually better than the alternative
-        if there are more than x (usually 20) files to merge, merge them in
-        groups of 20 at a time to speed it up some"""
-    if len(merge_list) > group_size:
-        partitions = 1 + len(merge_list) // (group_size)
-        multi_msg("Merging partition 1 of %s" % partitions)
-        arcpy.Merge_management(merge_list[:group_size], out_fc)
-        for n in range(2, partitions+1):
-            multi_msg("Merging partition %s of %s" % (n, partitions))
-            arcpy.Append_management(merge_list[group_size*(n-1):group_size*n], out_fc)
-    else:
-        arcpy.Merge_management(merge_list, out_fc)
+        merges with the bulk_merge engine, which streams record batches from each input to one insert cursor,
+        so the inputs no longer need to be merged in groups. group_size is kept for existing callers and unused."""
+    import bulk_merge
+    multi_msg("Merging %s inputs" % len(merge_list))
+    bulk_merge.merge(merge_list, out_fc, processes=processes)
 
 
 def rename_field(inTable, oldFieldName, newFieldName, deleteOld = False):
@@ -217,6 +189,7 @@ def one_in_one_out(tool_table, zone_fc, zone_field, output_table):
     extent_fc
     output_table: the final output table
     """
+    import arcpy
     # get list of zones that need nulls inserted
     original_zones = {r[0] for r in arcpy.da.SearchCursor(zone_fc, zone_field)}
     null_zones = original_zones.difference({r[0] for r in arcpy.da.SearchCursor(tool_table, zone_field)})
@@ -245,6 +218,7 @@ def redefine_nulls(in_table, in_fields, out_values):
     out_values: a list the same length as in_fields, with the value to replace
     Null/NoData/None with.
     """
+    import arcpy
     arcpy.MakeTableView_management(in_table, 'table')
     for f, v in zip(in_fields, out_values):
         null_expr = '''"{0}" is null'''.format(f)
@@ -258,6 +232,7 @@ def resolution_comparison(feature_class, raster):
     """Compare the feature resolution to the raster resolution.
     Returns a value from 0-100 describing the percent of features that are
     larger than the area of one cell in the raster"""
+    import arcpy
     fc_count = int(arcpy.GetCount_management(feature_class).getOutput(0))
 
     # ask what the area of a cell in the raster is
@@ -282,6 +257,7 @@ def shortname(path):
 
 
 def create_temp_GDB(name):
+    import arcpy
     temp_dir = os.path.join(tempfile.gettempdir(), name)
     index = 0
     while os.path.exists(temp_dir):
@@ -293,6 +269,7 @@ def create_temp_GDB(name):
 
 
 def lengthen_field(table_or_fc, field, new_length):
+    import arcpy
     old_field = arcpy.ListFields(table_or_fc, field)
     temp_field = 't_' + field
     arcpy.AddField_management(table_or_fc, temp_field, old_field[0].type, field_length = new_length)
@@ -300,4 +277,49 @@ def lengthen_field(table_or_fc, field, new_length):
     arcpy.DeleteField_management(table_or_fc, field)
     arcpy.AddField_management(table_or_fc, field, old_field[0].type, field_length = new_length)
     arcpy.CalculateField_management(table_or_fc, field, '!{}!'.format(temp_field), 'PYTHON')
-    arcpy.DeleteField_management(table_or_fc, temp_field)
\ No newline at end of file
+    arcpy.DeleteField_management(table_or_fc, temp_field)
+
+
+# ---LAZY LOADING-------------------------------------------------------------------------------------------------------
+def _is_submodule(name):
+    path = os.path.join(__path__[0], name)
+    return os.path.exists(path + '.py') or os.path.exists(os.path.join(path, '__init__.py'))
+
+
+def _load_tool(name):
+    if name not in _loaded:
+        module_name, attribute = _TOOLS[name]
+        module = importlib.import_module('{}.{}'.format(__name__, module_name))
+        _loaded[name] = getattr(module, attribute)
+    return _loaded[name]
+
+
+def _tool_property(name):
+    def load(package):
+        return _load_tool(name)
+
+    def set_submodule(package, value):
+        # importing a submodule records it under its own name, which some tools share, e.g. lagosGIS.rasterize_zones
+        package.__dict__[name] = value
+
+    return property(load, set_submodule)
+
+
+class _LazyPackage(types.ModuleType):
+    """The lagosGIS package, with the tools in _TOOLS and the submodules imported on first access."""
+
+    def __init__(self, package):
+        types.ModuleType.__init__(self, package.__name__, package.__doc__)
+        self.__dict__.update(package.__dict__)
+        self._package = package  # keeps the namespace of the functions above alive
+
+    def __getattr__(self, name):
+        # only called for names not set yet
+        if name.startswith('__') or not _is_submodule(name):
+            raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+        return importlib.import_module('{}.{}'.format(__name__, name))
+
+
+for _name in _TOOLS:
+    setattr(_LazyPackage, _name, _tool_property(_name))
+sys.modules[__name__] = _LazyPackage(sys.modules[__name__])
@@ -0,0 +1,347 @@
+# filename: bulk_merge.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Merge many feature classes or tables (e.g. the 202 subregion outputs or NHD geodatabases) into one, with a
+# pool of reader processes streaming record batches (attributes plus geometry) through a bounded queue to a single
+# writer that bulk-inserts them through one cursor.
+
+import os
+import traceback
+from multiprocessing import Manager, Process
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy as np
+
+import data_access
+
+BATCH_SIZE = 20000
+QUEUE_BATCHES = 8  # batches waiting for the writer; bounds the memory used when the readers outpace it
+POLL_SECONDS = 10  # how often the writer checks that the readers are still running while it waits for a batch
+INDEX_FIELDS = ('Permanent_Identifier', 'nhd_merge_id')
+FIELD_TYPES = {'String': 'TEXT', 'Integer': 'LONG', 'SmallInteger': 'SHORT', 'Double': 'DOUBLE', 'Single': 'FLOAT',
+               'Date': 'DATE', 'GUID': 'GUID'}
+MANAGED_FIELDS = ('shape_length', 'shape_area', 'shape_leng')  # maintained by the geodatabase, never copied
+
+
+# ---SCHEMA-------------------------------------------------------------------------------------------------------------
+def harmonize_schema(sources, field_lengths=None):
+    """
+    Combine the attribute fields of all sources: every field in any source, typed as in the first source that has it,
+    with text fields long enough for the longest definition.
+    :param sources: Feature class or table paths
+    :param dict field_lengths: (Optional) Minimum text lengths by field name, e.g. {'Permanent_Identifier': 255}
+    :return: Tuple of (list of (name, (arcpy field type, length)), dictionary of source to its fields in the output)
+    """
+    schema = []
+    positions = {}
+    source_fields = {}
+    minimums = {k.lower(): v for k, v in (field_lengths or {}).items()}
+    for source in sources:
+        source_fields[source] = []
+        for field in data_access.list_fields(source):
+            key = field.name.lower()
+            if field.type not in FIELD_TYPES or key in MANAGED_FIELDS:
+                continue
+            source_fields[source].append(field.name)
+            length = field.length if field.type == 'String' else None
+            if key not in positions:
+                positions[key] = len(schema)
+                if length is not None:
+                    length = max(length, minimums.get(key, 0))
+                schema.append((field.name, (FIELD_TYPES[field.type], length)))
+            elif length is not None:
+                name, (field_type, old_length) = schema[positions[key]]
+                if field_type == 'TEXT' and length > old_length:
+                    schema[positions[key]] = (name, (field_type, length))
+    output_names = {name.lower(): name for name, t in schema}
+    source_fields = {s: [(f, output_names[f.lower()]) for f in fields] for s, fields in source_fields.items()}
+    return schema, source_fields
+
+
+def output_location(out_path, workspace):
+    """
+    Split the output path into workspace and name, resolving a bare name against the current workspace as the
+    geoprocessing tools do.
+    :param str out_path: Output path or name
+    :param str workspace: Current workspace (arcpy.env.workspace)
+    :return: Tuple of (workspace, name)
+    """
+    location, name = os.path.split(out_path)
+    if not location:
+        if not workspace:
+            raise ValueError("Output {} has no workspace and arcpy.env.workspace is not set.".format(out_path))
+        location = workspace
+    return location, name
+
+
+def _largest_extent_first(sources):
+    """Put the source with the largest extent first, which sets the output extent and prevents spatial grid errors."""
+    import arcpy
+    areas = []
+    for source in sources:
+        extent = arcpy.Describe(source).extent
+        areas.append(int(extent.XMax - extent.XMin) * int(extent.YMax - extent.YMin))
+    first = areas.index(max(areas))
+    return [sources[first]] + sources[:first] + sources[first + 1:]
+
+
+# ---READERS------------------------------------------------------------------------------------------------------------
+def _spatial_reference(value):
+    """arcpy SpatialReference from a factory code or from the string of SpatialReference.exportToString()."""
+    import arcpy
+    if isinstance(value, int):
+        return arcpy.SpatialReference(value)
+    spatial_reference = arcpy.SpatialReference()
+    spatial_reference.loadFromString(value)
+    return spatial_reference
+
+
+def geometry_token(backend=None):
+    """
+    The geometry token copied by the merge: the native arcpy geometry (SHAPE@), which keeps true curves and Z and M
+    values, or WKB when data access goes through OGR.
+    :param str backend: (Optional) 'arcpy' or 'ogr', see data_access.get_backend
+    """
+    if data_access.get_backend(backend).name == 'arcpy':
+        return data_access.GEOMETRY_TOKEN
+    return data_access.WKB_TOKEN
+
+
+def _pack(batch):
+    """Replace arcpy geometries with their Esri JSON (which keeps curves, Z and M) to pass a batch between processes."""
+    if data_access.GEOMETRY_TOKEN in batch:
+        shapes = batch[data_access.GEOMETRY_TOKEN].tolist()
+        batch[data_access.GEOMETRY_TOKEN] = np.array([None if g is None else g.JSON for g in shapes], dtype=object)
+    return batch
+
+
+def _unpack(batch):
+    """Inverse of _pack."""
+    if data_access.GEOMETRY_TOKEN in batch:
+        import arcpy
+        shapes = batch[data_access.GEOMETRY_TOKEN].tolist()
+        batch[data_access.GEOMETRY_TOKEN] = np.array([None if g is None else arcpy.AsShape(g, True) for g in shapes],
+                                                     dtype=object)
+    return batch
+
+
+def _read_batches(source, fields, where_clause, batch_size, spatial_reference):
+    """Read batches, projecting the geometry on the fly if spatial_reference is given."""
+    if spatial_reference is None:
+        for batch in data_access.read_batches(source, fields, where_clause or None, batch_size):
+            yield batch
+        return
+    import arcpy
+    rows = []
+    with arcpy.da.SearchCursor(source, fields, where_clause or None,
+                               spatial_reference=_spatial_reference(spatial_reference)) as cursor:
+        for row in cursor:
+            rows.append(row)
+            if len(rows) == batch_size:
+                yield data_access.rows_to_batch(fields, rows)
+                rows = []
+    if rows:
+        yield data_access.rows_to_batch(fields, rows)
+
+
+def _filter_batch(batch, keep):
+    """Keep only the rows whose keep[0] field value is in the set keep[1]."""
+    if keep is None:
+        return batch
+    field, values = keep
+    field = [f for f in batch if f.lower() == field.lower()][0]
+    mask = np.array([v in values for v in batch[field].tolist()], dtype=bool)
+    return {f: column[mask] for f, column in batch.items()}
+
+
+def read_source(source, fields, where_clause='', batch_size=BATCH_SIZE, spatial_reference=None, keep=None):
+    """
+    Read one source as record batches, filtered at read time.
+    :param str source: Feature class or table
+    :param list fields: Source field names, plus the geometry token for feature classes (see geometry_token)
+    :param str where_clause: (Optional) SQL filter
+    :param int batch_size: Maximum rows per batch
+    :param spatial_reference: (Optional) Factory code, or string from SpatialReference.exportToString(), of the
+    coordinate system to project the geometry to
+    :param keep: (Optional) Tuple of (field, set of values); other rows are dropped
+    :return: Generator of non-empty record batches
+    """
+    for batch in _read_batches(source, fields, where_clause, batch_size, spatial_reference):
+        batch = _filter_batch(batch, keep)
+        if len(batch[fields[0]]):
+            yield batch
+
+
+def _reader_process(tasks, queue, keep):
+    """
+    Reader process: take sources from the task queue until it is empty, stream the batches of each to the writer's
+    queue and report its row count, or the error that stopped the reader.
+    """
+    source = None
+    try:
+        while True:
+            try:
+                source, fields, where_clause, batch_size, spatial_reference = tasks.get_nowait()
+            except Empty:
+                return
+            count = 0
+            for batch in read_source(source, fields, where_clause, batch_size, spatial_reference, keep):
+                count += len(batch[fields[0]])
+                queue.put(('batch', source, _pack(batch)))
+            queue.put(('done', source, count))
+    except BaseException:
+        queue.put(('error', source, traceback.format_exc()))
+
+
+# ---WRITER-------------------------------------------------------------------------------------------------------------
+def merge(sources, out_path, where_clause='', processes=1, keep=None, spatial_reference=None, field_lengths=None,
+          batch_size=BATCH_SIZE, queue_batches=QUEUE_BATCHES, index_fields=INDEX_FIELDS):
+    """
+    Merge feature classes or tables into a new output. The schemas are combined up front, every source is read as
+    record batches with the filters applied at read time, all batches are inserted through one cursor, and the
+    indexes are built once at the end.
+    :param sources: Feature classes or tables to merge, all of the same geometry type
+    :param str out_path: Output feature class or table (replaced if it exists). A bare name is created in
+    arcpy.env.workspace.
+    :param str where_clause: (Optional) SQL filter applied to every source
+    :param int processes: Number of reader processes. 1 reads the sources one after another in this process. Use more
+    only from a script with an if __name__ == '__main__' guard, since the readers re-import the main script on Windows.
+    :param keep: (Optional) Tuple of (field, set of values). Only rows with a value in the set are written.
+    :param spatial_reference: (Optional) Factory code of the output coordinate system, e.g. 102039. Default is the
+    coordinate system of the first source. Sources in another coordinate system are projected as they are read.
+    :param dict field_lengths: (Optional) Minimum text lengths by field name
+    :param int batch_size: Rows per record batch
+    :param int queue_batches: Maximum batches waiting for the writer
+    :param index_fields: Attribute indexes to build at the end, for the fields that exist
+    :return: Dictionary of source to number of rows merged
+    """
+    import arcpy
+    sources = list(sources)
+    description = arcpy.Describe(sources[0])
+    is_feature_class = description.dataType in ('FeatureClass', 'ShapeFile')
+    if is_feature_class:
+        sources = _largest_extent_first(sources)
+        description = arcpy.Describe(sources[0])
+    schema, source_fields = harmonize_schema(sources, field_lengths)
+
+    # ---CREATE OUTPUT-----
+    workspace, name = output_location(out_path, arcpy.env.workspace)
+    out_path = os.path.join(workspace, name)
+    if arcpy.Exists(out_path):
+        arcpy.Delete_management(out_path)
+    source_srs = {}
+    if is_feature_class:
+        output_sr = arcpy.SpatialReference(spatial_reference) if spatial_reference else description.spatialReference
+        # sources already in the output coordinate system are read without projecting
+        output_sr_string = output_sr.exportToString()
+        for source in sources:
+            source_sr_string = arcpy.Describe(source).spatialReference.exportToString()
+            source_srs[source] = None if source_sr_string == output_sr_string else output_sr_string
+        arcpy.CreateFeatureclass_management(workspace, name, description.shapeType.upper(),
+                                            has_m='ENABLED' if description.hasM else 'DISABLED',
+                                            has_z='ENABLED' if description.hasZ else 'DISABLED',
+                                            spatial_reference=output_sr)
+    else:
+        arcpy.CreateTable_management(workspace, name)
+    data_access.add_fields(out_path, schema)
+    shape_token = geometry_token()
+    out_fields = [f for f, t in schema] + ([shape_token] if is_feature_class else [])
+
+    def read_fields(source):
+        fields = [f for f, out_f in source_fields[source]]
+        if is_feature_class:
+            fields.append(shape_token)
+        return fields
+
+    def to_rows(source, batch):
+        renamed = {out_f: batch[f] for f, out_f in source_fields[source]}
+        if is_feature_class:
+            renamed[shape_token] = batch[shape_token]
+        count = len(batch[read_fields(source)[0]])
+        columns = [renamed[f].tolist() if f in renamed else [None] * count for f in out_fields]
+        return zip(*columns)
+
+    counts = {}
+
+    def report(source, count):
+        counts[source] = count
+        if not count:
+            print("Merged NO features from {}; filter eliminated all features".format(source))
+        print("Merged {0} features from {1}".format(count, source))
+
+    # ---READ AND WRITE-----
+    def serial_rows():
+        for source in sources:
+            count = 0
+            for batch in read_source(source, read_fields(source), where_clause, batch_size, source_srs.get(source),
+                                     keep):
+                count += len(batch[read_fields(source)[0]])
+                for row in to_rows(source, batch):
+                    yield row
+            report(source, count)
+
+    def parallel_rows(queue, readers):
+        pending = len(sources)
+        while pending:
+            try:
+                kind, source, payload = queue.get(timeout=POLL_SECONDS)
+            except Empty:
+                # a reader puts all its messages before it exits, so if every reader has stopped and the queue is
+                # still empty, or one of them died, some sources will never be reported
+                stopped = all(r.exitcode is not None for r in readers)
+                crashed = any(r.exitcode not in (None, 0) for r in readers)
+                if not (stopped or crashed):
+                    continue
+                try:
+                    kind, source, payload = queue.get_nowait()
+                except Empty:
+                    raise RuntimeError("Reader processes stopped with {} sources not merged (exit codes {}).".format(
+                        pending, ', '.join(str(r.exitcode) for r in readers)))
+            if kind == 'batch':
+                for row in to_rows(source, _unpack(payload)):
+                    yield row
+            elif kind == 'done':
+                report(source, payload)
+                pending -= 1
+            else:
+                raise RuntimeError("Reading {} failed:\n{}".format(source, payload))
+
+    print("Beginning merge of {} feature classes...".format(len(sources)))
+    if processes > 1 and len(sources) > 1:
+        manager = Manager()
+        queue = manager.Queue(queue_batches)
+        tasks = manager.Queue()
+        for source in sources:
+            tasks.put((source, read_fields(source), where_clause, batch_size, source_srs.get(source)))
+        readers = [Process(target=_reader_process, args=(tasks, queue, keep))
+                   for i in range(min(processes, len(sources)))]
+        try:
+            for reader in readers:
+                reader.start()
+            data_access.insert_rows(out_path, out_fields, parallel_rows(queue, readers))
+            for reader in readers:
+                reader.join()
+        finally:
+            for reader in readers:
+                if reader.is_alive():
+                    reader.terminate()
+            manager.shutdown()
+    else:
+        data_access.insert_rows(out_path, out_fields, serial_rows())
+
+    # ---INDEXES-----
+    existing = {f.name.lower() for f in data_access.list_fields(out_path)}
+    for field in index_fields:
+        if field.lower() in existing:
+            arcpy.AddIndex_management(out_path, field, 'IDX_{}'.format(field))
+    if is_feature_class:
+        try:
+            arcpy.AddSpatialIndex_management(out_path)
+        except arcpy.ExecuteError:
+            arcpy.AddWarning('Could not build the spatial index for {}.'.format(out_path))
+    return counts
@@ -0,0 +1,654 @@
+# filename: data_access.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): all
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: One interface for reading and writing tables and feature classes through either arcpy or GDAL/OGR, so that
+# tools can run outside a licensed ArcGIS session and can read record batches instead of one row tuple at a time.
+
+import os
+import uuid
+from collections import namedtuple
+
+import numpy as np
+
+BACKEND_ENV = 'LAGOSGIS_BACKEND'
+DEFAULT_BATCH_SIZE = 100000
+
+# geometry and id tokens understood by both backends, named as in arcpy.da
+OID_TOKEN = 'OID@'
+GEOMETRY_TOKEN = 'SHAPE@'  # native geometry object of the backend
+WKB_TOKEN = 'SHAPE@WKB'
+AREA_TOKEN = 'SHAPE@AREA'
+LENGTH_TOKEN = 'SHAPE@LENGTH'
+XY_TOKEN = 'SHAPE@XY'  # (x, y) of a point, or the centroid of a line or polygon
+TOKENS = (OID_TOKEN, GEOMETRY_TOKEN, WKB_TOKEN, AREA_TOKEN, LENGTH_TOKEN, XY_TOKEN)
+
+# containers holding many tables; anything else is a single-table file
+MULTI_TABLE_EXTENSIONS = ('.gdb', '.gpkg', '.sqlite')
+OGR_DRIVERS = {'.gdb': 'OpenFileGDB', '.gpkg': 'GPKG', '.sqlite': 'SQLite', '.shp': 'ESRI Shapefile',
+               '.parquet': 'Parquet'}
+
+Field = namedtuple('Field', ['name', 'type', 'length'])
+
+_backends = {}
+
+
+# ---SHARED UTILITIES-----------------------------------------------------------------------------------------------
+def rows_to_batch(fields, rows):
+    """
+    Transpose row tuples into a record batch: a dictionary with key = field, value = numpy array. Text, geometry and
+    any column containing nulls are object arrays.
+    :param list fields: Field names, in row order
+    :param list rows: Row tuples
+    :return: dict
+    """
+    columns = list(zip(*rows)) if rows else [[] for f in fields]
+    batch = {}
+    for field, values in zip(fields, columns):
+        if field in (GEOMETRY_TOKEN, WKB_TOKEN, XY_TOKEN) or any(v is None for v in values):
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+        else:
+            array = np.array(values)
+            if array.dtype.kind in ('U', 'S'):
+                array = array.astype(object)
+        batch[field] = array
+    return batch
+
+
+def batch_to_rows(fields, batch):
+    """
+    Transpose a record batch back into row tuples.
+    :param list fields: Field names, in the order wanted in each row
+    :param dict batch: Record batch
+    :return: Generator of row tuples
+    """
+    columns = [batch[f].tolist() if hasattr(batch[f], 'tolist') else list(batch[f]) for f in fields]
+    for row in zip(*columns):
+        yield row
+
+
+def infer_field_type(array):
+    """
+    Choose a geodatabase field type for a column.
+    :param array: numpy array of column values
+    :return: Tuple of (arcpy field type, length or None)
+    """
+    kind = array.dtype.kind
+    if kind == 'f':
+        return 'DOUBLE', None
+    if kind in ('i', 'u'):
+        return ('SHORT', None) if array.dtype.itemsize <= 2 else ('LONG', None)
+    if kind == 'b':
+        return 'SHORT', None
+    values = [v for v in array.tolist() if v is not None]
+    if values and all(isinstance(v, float) for v in values):
+        return 'DOUBLE', None
+    if values and all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return 'LONG', None
+    length = max([len(str(v)) for v in values] + [1])
+    return 'TEXT', max(length, 50)
+
+
+def split_path(path):
+    """
+    Split a table path into its data source and table name, ignoring any feature dataset in between.
+    :param str path: e.g. r'D:\\NHD.gdb\\Hydrography\\NHDFlowline' or '/data/zones.gpkg/hu12'
+    :return: Tuple of (data source path, table name or None for single-table files)
+    """
+    parts = path.replace('\\', '/').split('/')
+    for i, part in enumerate(parts):
+        if os.path.splitext(part)[1].lower() in MULTI_TABLE_EXTENSIONS and i < len(parts) - 1:
+            return '/'.join(parts[:i + 1]), parts[-1]
+    return path, None
+
+
+def get_backend(name=None):
+    """
+    Return the backend used for data access. The backend named here wins, then the LAGOSGIS_BACKEND environment
+    variable, then arcpy if it can be imported, otherwise OGR.
+    :param str name: 'arcpy' or 'ogr'
+    :return: ArcpyBackend or OGRBackend
+    """
+    name = name or os.environ.get(BACKEND_ENV, '')
+    if not name:
+        try:
+            import arcpy
+            name = 'arcpy'
+        except ImportError:
+            name = 'ogr'
+    if name not in _backends:
+        if name == 'arcpy':
+            _backends[name] = ArcpyBackend()
+        elif name == 'ogr':
+            _backends[name] = OGRBackend()
+        else:
+            raise ValueError("Data access backend must be 'arcpy' or 'ogr', not '{}'".format(name))
+    return _backends[name]
+
+
+# ---ARCPY BACKEND--------------------------------------------------------------------------------------------------
+class ArcpyBackend:
+    """Data access through arcpy.da cursors."""
+    name = 'arcpy'
+
+    def __init__(self):
+        import arcpy
+        self.arcpy = arcpy
+
+    def exists(self, path):
+        return self.arcpy.Exists(path)
+
+    def list_fields(self, table):
+        return [Field(f.name, f.type, f.length) for f in self.arcpy.ListFields(table)]
+
+    def _spatial_reference(self, spatial_reference):
+        """arcpy SpatialReference from a factory code or a well-known text string."""
+        if isinstance(spatial_reference, int):
+            return self.arcpy.SpatialReference(spatial_reference)
+        result = self.arcpy.SpatialReference()
+        result.loadFromString(spatial_reference)
+        return result
+
+    def _select_extent(self, table, extent, spatial_reference):
+        """Feature layer of the features intersecting extent, or the table itself if there is no extent."""
+        if extent is None:
+            return table
+        if spatial_reference is None:
+            sr = self.arcpy.Describe(table).spatialReference
+        else:
+            sr = self._spatial_reference(spatial_reference)
+        xmin, ymin, xmax, ymax = extent
+        corners = [(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]
+        box = self.arcpy.Polygon(self.arcpy.Array([self.arcpy.Point(x, y) for x, y in corners]), sr)
+        layer = 'extent_{}'.format(uuid.uuid4().hex)
+        self.arcpy.MakeFeatureLayer_management(table, layer)
+        self.arcpy.SelectLayerByLocation_management(layer, 'INTERSECT', box)
+        return layer
+
+    def _cursor(self, table, fields, where_clause, spatial_reference):
+        if spatial_reference is None:
+            return self.arcpy.da.SearchCursor(table, fields, where_clause)
+        return self.arcpy.da.SearchCursor(table, fields, where_clause,
+                                          spatial_reference=self._spatial_reference(spatial_reference))
+
+    def read_rows(self, table, fields, where_clause=None, spatial_reference=None, extent=None):
+        source = self._select_extent(table, extent, spatial_reference)
+        try:
+            with self._cursor(source, fields, where_clause, spatial_reference) as cursor:
+                for row in cursor:
+                    yield row
+        finally:
+            if source != table:
+                self.arcpy.Delete_management(source)
+
+    def read_batches(self, table, fields, where_clause=None, batch_size=DEFAULT_BATCH_SIZE, spatial_reference=None,
+                     extent=None):
+        rows = []
+        for row in self.read_rows(table, fields, where_clause, spatial_reference, extent):
+            rows.append(row)
+            if len(rows) == batch_size:
+                yield rows_to_batch(fields, rows)
+                rows = []
+        if rows:
+            yield rows_to_batch(fields, rows)
+
+    def insert_rows(self, table, fields, rows):
+        count = 0
+        with self.arcpy.da.InsertCursor(table, fields) as cursor:
+            for row in rows:
+                cursor.insertRow(row)
+                count += 1
+        return count
+
+    def update_rows(self, table, fields, update_function, where_clause=None):
+        count = 0
+        with self.arcpy.da.UpdateCursor(table, fields, where_clause) as cursor:
+            for row in cursor:
+                new_row = update_function(list(row))
+                if new_row is not None:
+                    cursor.updateRow(new_row)
+                    count += 1
+        return count
+
+    def create_table(self, out_path, field_types, geometry_type=None, spatial_reference=None):
+        workspace, name = os.path.split(out_path)
+        if self.arcpy.Exists(out_path):
+            self.arcpy.Delete_management(out_path)
+        if geometry_type:
+            self.arcpy.CreateFeatureclass_management(workspace, name, geometry_type,
+                                                     spatial_reference=spatial_reference)
+        else:
+            self.arcpy.CreateTable_management(workspace, name)
+        for field, (field_type, length) in field_types:
+            self.arcpy.AddField_management(out_path, field, field_type, field_length=length)
+        return out_path
+
+    def add_fields(self, table, field_types):
+        existing = {f.name.lower() for f in self.list_fields(table)}
+        new = [(field, t) for field, t in field_types if field.lower() not in existing]
+        if not new:
+            return []
+        if hasattr(self.arcpy.management, 'AddFields'):  # ArcGIS Pro, one schema change
+            self.arcpy.management.AddFields(table, [[field, field_type, '', length or '']
+                                                    for field, (field_type, length) in new])
+        else:
+            for field, (field_type, length) in new:
+                self.arcpy.AddField_management(table, field, field_type, field_length=length)
+        return [field for field, t in new]
+
+
+# ---OGR BACKEND----------------------------------------------------------------------------------------------------
+class OGRBackend:
+    """
+    Data access through GDAL/OGR. Where clauses are passed to OGR as attribute filters, so keep them to the SQL subset
+    shared by ArcGIS and OGR (comparisons, IN, LIKE, IS NULL, AND/OR). Record batches are read through the GDAL Arrow
+    stream interface when it is available (GDAL 3.6+).
+    """
+    name = 'ogr'
+    ESRI_TYPES = {'String': 'String', 'Real': 'Double', 'Integer': 'Integer', 'Integer64': 'Double',
+                  'Date': 'Date', 'DateTime': 'Date', 'Binary': 'Blob'}
+
+    def __init__(self):
+        from osgeo import ogr, gdal
+        ogr.UseExceptions()
+        self.ogr = ogr
+        self.gdal = gdal
+
+    def _open(self, table, update=False):
+        source, name = split_path(table)
+        datasource = self.ogr.Open(source, 1 if update else 0)
+        if datasource is None:
+            raise IOError("Could not open {}".format(source))
+        layer = datasource.GetLayerByName(name) if name else datasource.GetLayer(0)
+        if layer is None:
+            raise IOError("No table named {} in {}".format(name, source))
+        return datasource, layer
+
+    def exists(self, path):
+        try:
+            datasource, layer = self._open(path)
+            return True
+        except Exception:
+            return os.path.exists(path)
+
+    def list_fields(self, table):
+        datasource, layer = self._open(table)
+        definition = layer.GetLayerDefn()
+        fields = [Field(layer.GetFIDColumn() or 'OBJECTID', 'OID', 4)]
+        if layer.GetGeomType() != self.ogr.wkbNone:
+            fields.append(Field(layer.GetGeometryColumn() or 'Shape', 'Geometry', 0))
+        for i in range(definition.GetFieldCount()):
+            f = definition.GetFieldDefn(i)
+            type_name = f.GetFieldTypeName(f.GetType())
+            if type_name == 'Integer' and f.GetSubType() == self.ogr.OFSTInt16:
+                esri_type = 'SmallInteger'
+            else:
+                esri_type = self.ESRI_TYPES.get(type_name, type_name)
+            fields.append(Field(f.GetName(), esri_type, f.GetWidth()))
+        return fields
+
+    def _prepare(self, layer, fields, where_clause):
+        """Push the attribute filter and the field selection down to OGR."""
+        layer.SetAttributeFilter(where_clause or None)
+        definition = layer.GetLayerDefn()
+        all_fields = [definition.GetFieldDefn(i).GetName() for i in range(definition.GetFieldCount())]
+        ignored = [f for f in all_fields if f not in fields]
+        if not set(fields).intersection((GEOMETRY_TOKEN, WKB_TOKEN, AREA_TOKEN, LENGTH_TOKEN, XY_TOKEN)):
+            ignored.append('OGR_GEOMETRY')
+        layer.SetIgnoredFields(ignored)
+        layer.ResetReading()
+
+    def _srs(self, spatial_reference):
+        """
+        OSR spatial reference for a factory code, tried as an EPSG code and then as an ESRI code (e.g. 102039), or for a
+        well-known text string.
+        """
+        from osgeo import osr
+        srs = osr.SpatialReference()
+        if not isinstance(spatial_reference, int):
+            srs.SetFromUserInput(spatial_reference)
+        else:
+            try:
+                srs.ImportFromEPSG(spatial_reference)
+            except RuntimeError:
+                srs.SetFromUserInput('ESRI:{}'.format(spatial_reference))
+        if hasattr(srs, 'SetAxisMappingStrategy'):  # GDAL 3: keep x = longitude for geographic systems
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        return srs
+
+    def _transform(self, layer, spatial_reference, inverse=False):
+        """
+        Transformation from the layer's coordinate system to spatial_reference (or back, if inverse), or None if they
+        are the same.
+        """
+        if spatial_reference is None:
+            return None
+        from osgeo import osr
+        source = layer.GetSpatialRef()
+        target = self._srs(spatial_reference)
+        if source is None or source.IsSame(target):
+            return None
+        source = source.Clone()
+        if hasattr(source, 'SetAxisMappingStrategy'):
+            source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if inverse:
+            return osr.CoordinateTransformation(target, source)
+        return osr.CoordinateTransformation(source, target)
+
+    def _set_extent(self, layer, extent, spatial_reference):
+        """
+        Push a rectangle down to OGR as a spatial filter. A rectangle in another coordinate system is densified and
+        projected to the layer's, and the filter is its bounding rectangle.
+        """
+        if extent is None:
+            layer.SetSpatialFilter(None)
+            return
+        xmin, ymin, xmax, ymax = extent
+        inverse = self._transform(layer, spatial_reference, inverse=True)
+        if inverse is not None:
+            ring = self.ogr.Geometry(self.ogr.wkbLinearRing)
+            for x, y in [(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]:
+                ring.AddPoint_2D(x, y)
+            ring.Segmentize(max(xmax - xmin, ymax - ymin) / 100.0)
+            ring.Transform(inverse)
+            xmin, xmax, ymin, ymax = ring.GetEnvelope()
+        layer.SetSpatialFilterRect(xmin, ymin, xmax, ymax)
+
+    def _value(self, feature, field, transform=None):
+        if field == OID_TOKEN:
+            return feature.GetFID()
+        if field in TOKENS:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                return None
+            if transform is not None:
+                geometry = geometry.Clone()
+                geometry.Transform(transform)
+            if field == GEOMETRY_TOKEN:
+                return geometry.Clone()
+            if field == WKB_TOKEN:
+                return bytes(geometry.ExportToWkb())
+            if field == AREA_TOKEN:
+                return geometry.GetArea()
+            if field == XY_TOKEN:
+                is_point = self.ogr.GT_Flatten(geometry.GetGeometryType()) == self.ogr.wkbPoint
+                point = geometry if is_point else geometry.Centroid()
+                return point.GetX(), point.GetY()
+            return geometry.Length()
+        return feature.GetField(field)
+
+    def read_rows(self, table, fields, where_clause=None, spatial_reference=None, extent=None):
+        datasource, layer = self._open(table)
+        self._set_extent(layer, extent, spatial_reference)
+        self._prepare(layer, fields, where_clause)
+        transform = self._transform(layer, spatial_reference)
+        for feature in layer:
+            yield tuple([self._value(feature, f, transform) for f in fields])
+
+    def read_batches(self, table, fields, where_clause=None, batch_size=DEFAULT_BATCH_SIZE, spatial_reference=None,
+                     extent=None):
+        datasource, layer = self._open(table)
+        self._set_extent(layer, extent, spatial_reference)
+        self._prepare(layer, fields, where_clause)
+        transform = self._transform(layer, spatial_reference)
+        arrow_ok = hasattr(layer, 'GetArrowStreamAsNumPy') and transform is None and \
+            not set(fields).intersection((OID_TOKEN, GEOMETRY_TOKEN, AREA_TOKEN, LENGTH_TOKEN, XY_TOKEN))
+        if arrow_ok:
+            geometry_column = layer.GetGeometryColumn() or 'wkb_geometry'
+            options = ['MAX_FEATURES_IN_BATCH={}'.format(batch_size), 'INCLUDE_FID=NO']
+            for arrow_batch in layer.GetArrowStreamAsNumPy(options=options):
+                yield {f: arrow_batch[geometry_column if f == WKB_TOKEN else f] for f in fields}
+        else:
+            rows = []
+            for feature in layer:
+                rows.append(tuple([self._value(feature, f, transform) for f in fields]))
+                if len(rows) == batch_size:
+                    yield rows_to_batch(fields, rows)
+                    rows = []
+            if rows:
+                yield rows_to_batch(fields, rows)
+
+    def _set_values(self, feature, fields, row):
+        for field, value in zip(fields, row):
+            if field in (OID_TOKEN, AREA_TOKEN, LENGTH_TOKEN):
+                continue
+            elif field == GEOMETRY_TOKEN:
+                feature.SetGeometry(value)
+            elif field == WKB_TOKEN:
+                feature.SetGeometry(self.ogr.CreateGeometryFromWkb(value) if value is not None else None)
+            elif field == XY_TOKEN:
+                point = None
+                if value is not None and value[0] is not None:
+                    point = self.ogr.Geometry(self.ogr.wkbPoint)
+                    point.AddPoint_2D(*value)
+                feature.SetGeometry(point)
+            elif value is None:
+                feature.SetFieldNull(field)
+            else:
+                feature.SetField(field, value)
+
+    def insert_rows(self, table, fields, rows):
+        datasource, layer = self._open(table, update=True)
+        definition = layer.GetLayerDefn()
+        count = 0
+        layer.StartTransaction()
+        for row in rows:
+            feature = self.ogr.Feature(definition)
+            self._set_values(feature, fields, row)
+            layer.CreateFeature(feature)
+            count += 1
+        layer.CommitTransaction()
+        return count
+
+    def update_rows(self, table, fields, update_function, where_clause=None):
+        datasource, layer = self._open(table, update=True)
+        layer.SetAttributeFilter(where_clause or None)
+        count = 0
+        layer.StartTransaction()
+        for feature in layer:
+            new_row = update_function([self._value(feature, f) for f in fields])
+            if new_row is not None:
+                self._set_values(feature, fields, new_row)
+                layer.SetFeature(feature)
+                count += 1
+        layer.CommitTransaction()
+        return count
+
+    def create_table(self, out_path, field_types, geometry_type=None, spatial_reference=None):
+        source, name = split_path(out_path)
+        extension = os.path.splitext(source)[1].lower()
+        driver = self.ogr.GetDriverByName(OGR_DRIVERS.get(extension, 'GPKG'))
+        datasource = self.ogr.Open(source, 1) if os.path.exists(source) else driver.CreateDataSource(source)
+        name = name or os.path.splitext(os.path.basename(source))[0]
+        if datasource.GetLayerByName(name) is not None:
+            datasource.DeleteLayer(name)
+        ogr_geometry = {'POINT': self.ogr.wkbPoint, 'POLYLINE': self.ogr.wkbMultiLineString,
+                        'POLYGON': self.ogr.wkbMultiPolygon}.get((geometry_type or '').upper(), self.ogr.wkbNone)
+        srs = self._srs(spatial_reference) if spatial_reference else None
+        layer = datasource.CreateLayer(name, srs, ogr_geometry)
+        ogr_types = {'DOUBLE': self.ogr.OFTReal, 'LONG': self.ogr.OFTInteger, 'SHORT': self.ogr.OFTInteger,
+                     'TEXT': self.ogr.OFTString}
+        for field, (field_type, length) in field_types:
+            definition = self.ogr.FieldDefn(field, ogr_types[field_type])
+            if length:
+                definition.SetWidth(length)
+            layer.CreateField(definition)
+        datasource.FlushCache()
+        return out_path
+
+    def add_fields(self, table, field_types):
+        datasource, layer = self._open(table, update=True)
+        existing = {f.name.lower() for f in self.list_fields(table)}
+        ogr_types = {'DOUBLE': self.ogr.OFTReal, 'LONG': self.ogr.OFTInteger, 'SHORT': self.ogr.OFTInteger,
+                     'TEXT': self.ogr.OFTString}
+        added = []
+        for field, (field_type, length) in field_types:
+            if field.lower() in existing:
+                continue
+            definition = self.ogr.FieldDefn(field, ogr_types[field_type])
+            if length:
+                definition.SetWidth(length)
+            layer.CreateField(definition)
+            added.append(field)
+        datasource.FlushCache()
+        return added
+
+
+# ---PUBLIC INTERFACE-----------------------------------------------------------------------------------------------
+def exists(path, backend=None):
+    """
+    Test whether a table, feature class or data source exists.
+    :param str path: Path to test
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :return: bool
+    """
+    return get_backend(backend).exists(path)
+
+
+def list_fields(table, backend=None):
+    """
+    List the fields of a table with their ArcGIS type names ('String', 'Double', 'Integer', 'SmallInteger', 'Date',
+    'OID', 'Geometry').
+    :param str table: Path to the table or feature class
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :return: List of Field(name, type, length)
+    """
+    return get_backend(backend).list_fields(table)
+
+
+def read_rows(table, fields, where_clause=None, backend=None, spatial_reference=None, extent=None):
+    """
+    Read row tuples, like arcpy.da.SearchCursor. Only the listed fields are read and the where clause and extent are
+    applied by the data source.
+    :param str table: Path to the table or feature class
+    :param list fields: Field names and/or the tokens OID@, SHAPE@, SHAPE@WKB, SHAPE@AREA, SHAPE@LENGTH, SHAPE@XY
+    :param str where_clause: (Optional) SQL filter
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :param spatial_reference: (Optional) Factory code (e.g. 102039) or well-known text of the coordinate system to
+    project the geometry tokens to. Default is the coordinate system of the table.
+    :param tuple extent: (Optional) (xmin, ymin, xmax, ymax) in the output coordinate system. Only features whose
+    bounding rectangle (OGR) or shape (arcpy) intersects it are read.
+    :return: Generator of row tuples
+    """
+    return get_backend(backend).read_rows(table, list(fields), where_clause, spatial_reference, extent)
+
+
+def read_batches(table, fields, where_clause=None, batch_size=DEFAULT_BATCH_SIZE, backend=None, spatial_reference=None,
+                 extent=None):
+    """
+    Read columnar record batches. Only the listed fields are read and the where clause is applied by the data source.
+    :param str table: Path to the table or feature class
+    :param list fields: Field names and/or tokens, see read_rows
+    :param str where_clause: (Optional) SQL filter
+    :param int batch_size: Maximum rows per batch
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :param spatial_reference: (Optional) Factory code or well-known text of the coordinate system to project the
+    geometry to
+    :param tuple extent: (Optional) (xmin, ymin, xmax, ymax) filter in the output coordinate system, see read_rows
+    :return: Generator of dictionaries with key = field, value = numpy array
+    """
+    return get_backend(backend).read_batches(table, list(fields), where_clause, batch_size, spatial_reference, extent)
+
+
+def read_columns(table, fields, where_clause=None, backend=None):
+    """
+    Read whole columns into memory as a single record batch.
+    :return: Dictionary with key = field, value = numpy array
+    """
+    fields = list(fields)
+    batches = list(read_batches(table, fields, where_clause, backend=backend))
+    if not batches:
+        return rows_to_batch(fields, [])
+    return {f: np.concatenate([b[f] for b in batches]) for f in fields}
+
+
+def insert_rows(table, fields, rows, backend=None):
+    """
+    Append rows to an existing table, like arcpy.da.InsertCursor.
+    :param str table: Path to the table or feature class
+    :param list fields: Field names and/or tokens, in row order
+    :param rows: Iterable of row tuples
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :return: Number of rows inserted
+    """
+    return get_backend(backend).insert_rows(table, list(fields), rows)
+
+
+def update_rows(table, fields, update_function, where_clause=None, backend=None):
+    """
+    Update rows in place, like arcpy.da.UpdateCursor. update_function receives each row as a list and returns the
+    new row, or None to leave the row unchanged.
+    :param str table: Path to the table or feature class
+    :param list fields: Field names and/or tokens
+    :param update_function: Function of one row list returning the new row or None
+    :param str where_clause: (Optional) SQL filter
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :return: Number of rows updated
+    """
+    return get_backend(backend).update_rows(table, list(fields), update_function, where_clause)
+
+
+def add_fields(table, field_types, backend=None):
+    """
+    Add several fields to an existing table at once, skipping any that already exist. Uses a single AddFields call
+    where arcpy has it (ArcGIS Pro).
+    :param str table: Path to the table or feature class
+    :param field_types: List of (name, (arcpy field type, length)) as returned by infer_field_type
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :return: List of the field names added
+    """
+    return get_backend(backend).add_fields(table, list(field_types))
+
+
+def write_batches(out_path, batches, fields, geometry_type=None, spatial_reference=None, backend=None):
+    """
+    Bulk write record batches to a new table in a file geodatabase, GeoPackage or Parquet file. The table schema is
+    taken from the first batch. Geometry is read from the SHAPE@WKB (or SHAPE@) column if present.
+    :param str out_path: e.g. r'D:\\out.gdb\\lakes', '/data/out.gpkg/lakes' or '/data/lakes.parquet'
+    :param batches: Iterable of record batches
+    :param list fields: Field names and/or geometry token to write, in order
+    :param str geometry_type: 'POINT', 'POLYLINE', 'POLYGON' or None for a table
+    :param spatial_reference: arcpy SpatialReference (arcpy backend) or EPSG code (ogr backend and Parquet)
+    :param str backend: (Optional) 'arcpy' or 'ogr', see get_backend
+    :return: out_path
+    """
+    fields = list(fields)
+    if out_path.lower().endswith('.parquet'):
+        return _write_parquet(out_path, batches, fields)
+
+    implementation = get_backend(backend)
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        raise ValueError("No batches to write to {}".format(out_path))
+    attribute_fields = [f for f in fields if f not in TOKENS]
+    implementation.create_table(out_path, [(f, infer_field_type(first[f])) for f in attribute_fields],
+                                geometry_type, spatial_reference)
+
+    def all_rows():
+        for batch in [first]:
+            for row in batch_to_rows(fields, batch):
+                yield row
+        for batch in batches:
+            for row in batch_to_rows(fields, batch):
+                yield row
+    implementation.insert_rows(out_path, fields, all_rows())
+    return out_path
+
+
+def _write_parquet(out_path, batches, fields):
+    """Write record batches to Parquet with pyarrow; geometry is stored as WKB in a column named 'geometry'."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    names = ['geometry' if f == WKB_TOKEN else f for f in fields]
+    for batch in batches:
+        table = pa.Table.from_arrays([pa.array(batch[f].tolist()) for f in fields], names=names)
+        if writer is None:
+            writer = pq.ParquetWriter(out_path, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+    return out_path
@@ -9,20 +9,19 @@
 import os
 import arcpy
 import lagosGIS
+from lagosGIS import parquet_release
 
-arcpy.env.workspace = 'in_memory'
-arcpy.env.overwriteOutput = True
 CURRENT_WORKING_GDB = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.9.gdb'
 OUT_FOLDER_LOCUS = r'D:\Continental_Limnology\Data_Working\Tool_Execution\2021-05-20_Export-LOCUS'
 OUT_GDB_LOCUS = r'D:\Continental_Limnology\Data_Working\Tool_Execution\2021-05-20_Export-LOCUS\gis_locus_v1.0.gdb'
 OUT_FOLDER_GEO = r'D:\Continental_Limnology\Data_Working\Tool_Execution\2021-11-28_Export-GEOGIS'
 OUT_GDB_GEO = r'D:\Continental_Limnology\Data_Working\Tool_Execution\2021-11-28_Export-GEOGIS\gis_geo_v1.0.gdb'
 OUT_GDB_SIMPLE = r'D:\Continental_Limnology\Data_Working\Tool_Execution\2021-11-28_Export-GEOGIS\simple_gis_geo_v1.0.gdb'
+OUT_FOLDER_PARQUET = r'D:\Continental_Limnology\Data_Working\Tool_Execution\2021-11-28_Export-Parquet'
 FIELD_WARN_MSG = "WARNING: Specified fields missing from input dataset ({})"
 
 # ---SET UP EXPORT NAMES/REQUIREMENTS-----------------------------------------------------------------------------
 lake_fc = os.path.join(CURRENT_WORKING_GDB, 'LAGOS_US_All_Lakes_1ha')
-lake_fc_fields = [f.name for f in arcpy.ListFields(lake_fc)]
 
 # lake information
 lake_info_fields = ['lagoslakeid',
@@ -94,8 +93,6 @@ lake_char_fields = [
 # watersheds
 ws = os.path.join(CURRENT_WORKING_GDB, 'ws')
 nws = os.path.join(CURRENT_WORKING_GDB, 'nws')
-ws_fc_fields = [f.name for f in arcpy.ListFields(ws)]
-nws_fc_fields = [f.name for f in arcpy.ListFields(nws)]
 ws_shp_export = os.path.join(OUT_GDB_LOCUS, 'ws')
 nws_shp_export = os.path.join(OUT_GDB_LOCUS, 'nws')
 
@@ -175,6 +172,14 @@ zones = ['buff100',
          'epanutr']
 
 
+def warn_missing_fields(dataset, field_list):
+    """Print a warning for each field in field_list that is missing from the dataset."""
+    dataset_fields = [f.name for f in arcpy.ListFields(dataset)]
+    for f in field_list:
+        if f not in dataset_fields:
+            print(FIELD_WARN_MSG.format(f))
+
+
 # ---EXPORT LOCUS TABLES & GIS-------------------------------------------------------------------------------------
 def export_locus(export_info=True, export_gis=True):
     """
@@ -186,34 +191,26 @@ def export_locus(export_info=True, export_gis=True):
     if export_info:
         # lake_information
         print('lake_information')
-        for f in lake_info_fields:
-            if f not in lake_fc_fields:
-                print(FIELD_WARN_MSG.format(f))
+        warn_missing_fields(lake_fc, lake_info_fields)
         temp_lake_info = lagosGIS.select_fields(lake_fc, 'temp_lake_info', lake_info_fields, convert_to_table=True)
         lagosGIS.export_to_csv(temp_lake_info, OUT_FOLDER_LOCUS, new_table_name='lake_information',
                                rename_fields=False, export_qa_version=False)
 
         # lake_characteristics
         print('lake_characteristics')
-        for f in lake_char_fields:
-            if f not in lake_fc_fields:
-                print(FIELD_WARN_MSG.format(f))
+        warn_missing_fields(lake_fc, lake_char_fields)
         temp_lake_char = lagosGIS.select_fields(lake_fc, 'temp_lake_char', lake_char_fields, convert_to_table=True)
         lagosGIS.export_to_csv(temp_lake_char, OUT_FOLDER_LOCUS, new_table_name = 'lake_characteristics',
                                rename_fields=False, export_qa_version=False)
 
         # lake_watersheds
         print('watersheds')
-        for f in ws_fields:
-            if f not in ws_fc_fields:
-                print(FIELD_WARN_MSG.format(f))
+        warn_missing_fields(ws, ws_fields)
         temp_lake_ws = lagosGIS.select_fields(ws, 'temp_lake_ws', ws_fields, convert_to_table=True)
         lagosGIS.export_to_csv(temp_lake_ws, OUT_FOLDER_LOCUS, new_table_name='lake_watersheds_ws',
                                rename_fields=False, export_qa_version=False)
 
-        for f in nws_fields:
-            if f not in nws_fc_fields:
-                print(FIELD_WARN_MSG.format(f))
+        warn_missing_fields(nws, nws_fields)
         temp_lake_nws = lagosGIS.select_fields(nws, 'temp_lake_nws', nws_fields, convert_to_table=True)
         lagosGIS.export_to_csv(temp_lake_nws, OUT_FOLDER_LOCUS, new_table_name='lake_watersheds_nws',
                                rename_fields=False, export_qa_version=False)
@@ -233,6 +230,43 @@ def export_locus(export_info=True, export_gis=True):
 
 
 # ---EXPORT GEO INFORMATION & GIS-------------------------------------------------------------------------------------
+def zone_info_fields(zone_name, zone_fc):
+    """
+    Lists the fields of a spatial division's information table.
+    :param zone_name: Shortname/prefix for the spatial division
+    :param zone_fc: The spatial division feature class
+    :return: List of field names
+    """
+    # Specify the right fields for this spatial division
+    field_vars = ['zoneid',
+                  'sourceid',
+                  'name',
+                  'fips',
+                  'states',
+                  'area_ha',
+                  'perimeter_m',
+                  'originalarea_pct',
+                  'lat_decdeg',
+                  'lon_decdeg',
+                  'inusa_pct',
+                  'onlandborder',
+                  'oncoast',
+                  'ismultipart']
+    if not arcpy.ListFields(zone_fc, field_vars[3]):
+        field_vars.pop(3)
+    lake_zones = ['buff100', 'buff500', 'nws', 'ws']
+    if zone_name in lake_zones:
+        field_vars.remove('sourceid')
+        field_vars.remove('name')
+        field_vars.remove('originalarea_pct')
+    if zone_name == 'state':
+        field_vars.remove('states')
+    field_list = ['{}_{}'.format(zone_name, f) for f in field_vars]
+    if 'sourceid' in field_list[1]:
+        field_list[1] = arcpy.ListFields(zone_fc, '*sourceid*')[0].name
+    return field_list
+
+
 def export_zone(zone_name, export_info=True, export_gis=True, export_simple_gis=True, export_glaciation=True):
     """
     Exports a single spatial division's information table and GIS dataset for LAGOS-US GEO spatial divisions. Does not
@@ -248,33 +282,7 @@ def export_zone(zone_name, export_info=True, export_gis=True, export_simple_gis=
     zone_fc = os.path.join(CURRENT_WORKING_GDB, zone_name)
 
     if export_info:
-        # Specify the right fields for this spatial division
-        field_vars = ['zoneid',
-                      'sourceid',
-                      'name',
-                      'fips',
-                      'states',
-                      'area_ha',
-                      'perimeter_m',
-                      'originalarea_pct',
-                      'lat_decdeg',
-                      'lon_decdeg',
-                      'inusa_pct',
-                      'onlandborder',
-                      'oncoast',
-                      'ismultipart']
-        if not arcpy.ListFields(zone_fc, field_vars[3]):
-            field_vars.pop(3)
-        lake_zones = ['buff100', 'buff500', 'nws', 'ws']
-        if zone_name in lake_zones:
-            field_vars.remove('sourceid')
-            field_vars.remove('name')
-            field_vars.remove('originalarea_pct')
-        if zone_name == 'state':
-            field_vars.remove('states')
-        field_list = ['{}_{}'.format(zone_name, f) for f in field_vars]
-        if 'sourceid' in field_list[1]:
-            field_list[1] = arcpy.ListFields(zone_fc, '*sourceid*')[0].name
+        field_list = zone_info_fields(zone_name, zone_fc)
 
         # Check for missing fields
         for f in field_list:
@@ -322,19 +330,65 @@ def export_zone(zone_name, export_info=True, export_gis=True, export_simple_gis=
                                rename_fields=False, export_qa_version=False)
 
 
+# ---EXPORT PARQUET RELEASE----------------------------------------------------------------------------------------
+def export_parquet_release(out_folder=OUT_FOLDER_PARQUET, export_info=True, export_gis=True):
+    """
+    Export the same LOCUS tables, GEO information tables and GIS layers as export_locus and export_zone, as Parquet and
+    GeoParquet files with a *_schema.json sidecar each. See parquet_release.write_table.
+    :param out_folder: The directory for the Parquet release
+    :param export_info: Boolean. Whether to export the information tables
+    :param export_gis: Boolean. Whether to export the GIS layers as GeoParquet
+    :return: None
+    """
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    if export_info:
+        print('LOCUS tables')
+        parquet_release.write_table(lake_fc, out_folder, 'lake_information', lake_info_fields,
+                                    partition_field='lake_centroidstate')
+        parquet_release.write_table(lake_fc, out_folder, 'lake_characteristics', lake_char_fields)
+        parquet_release.write_table(ws, out_folder, 'lake_watersheds_ws', ws_fields)
+        parquet_release.write_table(nws, out_folder, 'lake_watersheds_nws', nws_fields)
+
+        for z in zones:
+            print('zone_information (subset for division {})'.format(z))
+            zone_fc = os.path.join(CURRENT_WORKING_GDB, z)
+            parquet_release.write_table(zone_fc, out_folder, '{}_information'.format(z), zone_info_fields(z, zone_fc))
+            parquet_release.write_table(zone_fc, out_folder, '{}_glaciatedlatewisc'.format(z),
+                                        ['{}_{}'.format(z, f) for f in ['zoneid', 'glaciatedlatewisc_pct']])
+
+    if export_gis:
+        print('GIS layers')
+        parquet_release.write_table(lake_fc, out_folder, 'lake', ['lagoslakeid'], include_geometry=True)
+        parquet_release.write_table(lake_fc + '_points', out_folder, 'lake_as_point',
+                                    ['lagoslakeid', 'nws_zoneid', 'ws_zoneid'], include_geometry=True)
+        parquet_release.write_table(cat, out_folder, 'catchment', cat_fields, include_geometry=True)
+        for z in zones:
+            zone_fc = os.path.join(CURRENT_WORKING_GDB, z)
+            gis_fields = ['lagoslakeid', '{}_zoneid'.format(z)] if z in ('ws', 'nws') else ['{}_zoneid'.format(z)]
+            parquet_release.write_table(zone_fc, out_folder, z, gis_fields, include_geometry=True, dictionary_fields=[])
+
+
 # ---RUN ALL-----------------------------------------------------------------------------------------------------
-# RUN LOCUS
-export_locus()
+def main():
+    arcpy.env.workspace = 'in_memory'
+    arcpy.env.overwriteOutput = True
+
+    # RUN LOCUS
+    export_locus()
+
+    # RUN GEO
+    for z in zones:
+        if z not in ['ws', 'nws']:
+            export_gis = False
+        else:
+            export_gis = True
+        export_zone(z, True, export_gis, True, True)
 
-# RUN GEO
-for z in zones:
-    if z not in ['ws', 'nws']:
-        export_gis = False
-    else:
-        export_gis = True
-    export_zone(z, True, export_gis, True, True)
+    # # add lake to simple gis
+    simple_lake = os.path.join(OUT_GDB_SIMPLE, 'simple_lake')
+    lagosGIS.select_fields(lake_fc + '_points', simple_lake, ['lagoslakeid'])
 
 
-# # add lake to simple gis
-simple_lake = os.path.join(OUT_GDB_SIMPLE, 'simple_lake')
-lagosGIS.select_fields(lake_fc + '_points', simple_lake, ['lagoslakeid'])
+if __name__ == '__main__':
+    main()
@@ -10,22 +10,23 @@ import os
 import math
 from tempfile import NamedTemporaryFile
 import shutil
-import arcpy
+import data_access
 
 
-def describe_arcgis_table_csv(in_table, out_path, field_list=[], rename_fields=True):
+def describe_fields(in_table, field_list=[], rename_fields=True, string_lengths=None):
     """
-    Creates a companion table to a CSV table export that describes the field properties for each field as they were
-    stored in the file geodatabase table.
-    :param in_table: The feature class or table that will be exported to CSV
-    :param out_path: The output table location
+    Describes the field properties for each field as they are stored in the file geodatabase table. Used for the schema
+    tables of both the CSV and the Parquet exports.
+    :param in_table: The feature class or table that will be exported
     :param field_list: (Optional) The list of fields to be described. Default is all fields.
-    :param rename_fields: Whether the fields are to be renamed in the exported CSV table
-    :return: The output table location
+    :param rename_fields: Whether the fields are to be renamed in the exported table
+    :param string_lengths: (Optional) Dictionary of the longest value by string field, if already known. Otherwise the
+    string fields are read to find them.
+    :return: List of dictionaries with keys column_name, column_esri_type, column_esri_length, column_string_min
     """
 
     # Identify fields to be described
-    all_fields = arcpy.ListFields(in_table)
+    all_fields = data_access.list_fields(in_table)
     if field_list:
         fields = [f for f in all_fields if f.name in field_list]
     else:
@@ -33,19 +34,46 @@ def describe_arcgis_table_csv(in_table, out_path, field_list=[], rename_fields=T
 
     # Define length for string fields as the longest character string value actually found in the table
     string_fields = [f.name for f in fields if f.type == 'String']
-    if string_fields:
-        try:
-            arr = arcpy.da.TableToNumpyArray(in_table, string_fields)
-        except:
-            arr = arcpy.da.FeatureClassToNumPyArray(in_table, string_fields)
+    if string_lengths is None and string_fields:
+        columns = data_access.read_columns(in_table, string_fields)
 
         #gets the maximum string length for each field and returns a dictionary named with the fields
-        string_lengths = dict(zip(string_fields, [len(max(arr[f], key=len)) for f in string_fields]))
-    else:
+        string_lengths = dict(zip(string_fields, [max([len(v) for v in columns[f] if v] + [0]) for f in string_fields]))
+    elif string_lengths is None:
         string_lengths = {}
 
-    # Initialize  and populate output table with arcpy.Field object properties, unless string length
+    descriptions = []
+    for f in fields:
+        shortest = string_lengths.get(f.name, '')
+
+        # Re-name fields with necessary
+        if rename_fields: # duplicated from below, not my favorite way
+            if 'OBJECTID' in f.name:
+                continue
+            short_f_orig = os.path.splitext(os.path.basename(in_table))[0]
+            short_f = short_f_orig.replace('_QA_ONLY', '')
+            f = f._replace(name='{}_{}'.format(short_f, f.name).lower())
+
+        descriptions.append({'column_name': f.name,
+                             'column_esri_type': f.type,
+                             'column_esri_length': f.length,
+                             'column_string_min': shortest
+                             })
+    return descriptions
 
+
+def describe_arcgis_table_csv(in_table, out_path, field_list=[], rename_fields=True):
+    """
+    Creates a companion table to a CSV table export that describes the field properties for each field as they were
+    stored in the file geodatabase table.
+    :param in_table: The feature class or table that will be exported to CSV
+    :param out_path: The output table location
+    :param field_list: (Optional) The list of fields to be described. Default is all fields.
+    :param rename_fields: Whether the fields are to be renamed in the exported CSV table
+    :return: The output table location
+    """
+
+    # Initialize  and populate output table with the field properties
     with open(out_path, 'wb') as csv_file:
         writer = csv.DictWriter(csv_file, fieldnames=['column_name',
                                                       'column_esri_type',
@@ -54,27 +82,7 @@ def describe_arcgis_table_csv(in_table, out_path, field_list=[], rename_fields=T
                                                       ]
                                 )
         writer.writeheader()
-
-        for f in fields:
-            # Re-name fields with necessary
-            if rename_fields: # duplicated from below, not my favorite way
-                if 'OBJECTID' in f.name:
-                    continue
-                short_f_orig = os.path.splitext(os.path.basename(in_table))[0]
-                short_f = short_f_orig.replace('_QA_ONLY', '')
-                f.name = '{}_{}'.format(short_f, f.name).lower()
-
-            if f.name in string_lengths:
-                shortest = string_lengths[f.name]
-            else:
-                shortest = ''
-
-            # Write out the results
-            out_dict = {'column_name': f.name,
-                        'column_esri_type': f.type,
-                        'column_esri_length': f.length,
-                        'column_string_min': shortest
-                        }
+        for out_dict in describe_fields(in_table, field_list, rename_fields):
             writer.writerow(out_dict)
 
     return out_path
@@ -164,6 +172,7 @@ def export(in_table, out_folder, output_schema=True, prefix='', new_table_name='
     :param field_list: A list of column names to save in the output
     :return: None
     """
+    import arcpy
 
     # Get file basename without extension and specify auxiliary table output paths
     if arcpy.env.workspace == 'in_memory' and ':' not in in_table:
@@ -178,7 +187,7 @@ def export(in_table, out_folder, output_schema=True, prefix='', new_table_name='
     if field_list:
         fields_qa = field_list
     else:
-        fields_qa = [f.name for f in arcpy.ListFields(in_table) if f.type <> 'Geometry' and f.type <> 'OID' and f.name <> 'Shape_Area' and f.name <> 'Shape_Length' and f.name <> 'TARGET_FID']
+        fields_qa = [f.name for f in data_access.list_fields(in_table) if f.type != 'Geometry' and f.type != 'OID' and f.name != 'Shape_Area' and f.name != 'Shape_Length' and f.name != 'TARGET_FID']
     ha_prefix = tuple(["Ha_{}".format(d) for d in range(10)])
     fields = [f for f in fields_qa if not f.startswith(ha_prefix) and f not in ['CELL_COUNT', 'ORIGINAL_COUNT']]
 
@@ -186,18 +195,16 @@ def export(in_table, out_folder, output_schema=True, prefix='', new_table_name='
     if export_qa_version:
         with open(out_qa_csv, 'w') as f:
             f.write(','.join(fields_qa) + '\n')  # csv headers
-            with arcpy.da.SearchCursor(in_table, fields_qa) as cursor:
-                for row in cursor:
-                    values = map(format_value, row)
-                    f.write(','.join(values) + '\n')
+            for row in data_access.read_rows(in_table, fields_qa):
+                values = map(format_value, row)
+                f.write(','.join(values) + '\n')
 
     # Export table with original names to the output location
     with open(out_csv, 'w') as f:
         f.write(','.join(fields)+'\n') #csv headers
-        with arcpy.da.SearchCursor(in_table, fields) as cursor:
-            for row in cursor:
-                values = map(format_value, row)
-                f.write(','.join(values)+'\n')
+        for row in data_access.read_rows(in_table, fields):
+            values = map(format_value, row)
+            f.write(','.join(values)+'\n')
 
     # Modify the field names in place, if elected
     if rename_fields:
@@ -222,6 +229,7 @@ def export(in_table, out_folder, output_schema=True, prefix='', new_table_name='
 
 
 def main():
+    import arcpy
     in_table = arcpy.GetParameterAsText(0)
     out_folder = arcpy.GetParameterAsText(1)
     output_schema = arcpy.GetParameter(2)
@@ -13,6 +13,8 @@ from collections import Counter
 from arcpy import analysis as AN
 from arcpy import management as DM
 import lagosGIS
+import lake_name_index
+import lake_site_index
 
 # Features to use for geographic linking.
 # Change these to match your computer. It's not very elegant.
@@ -63,9 +65,56 @@ def spatialize_sites(lake_points_csv, out_fc, in_x_field, in_y_field, in_crs='NA
     return out_fc
 
 
+def link_site(name, lakes, stream):
+    """
+    Apply the linking rules to the spatial link evidence for one site. The criteria flow from most convincing (inside
+    lake) to least convincing link. The manual review flag indicates only superficial review needed (-1) for
+    convincing matches, and review needed (>=1, higher values need more scrutiny) if the match is less convincing or
+    needs discrimination.
+    :param name: The lake name recorded with the observation
+    :param lakes: List of (lagoslakeid, GNIS name, distance) for the lakes within 100m, nearest first (see
+    lake_site_index)
+    :param stream: (Permanent_Identifier, GNIS name) of the stream polygon containing the site, or None
+    :return: List of (Auto_Comment, Manual_Review, Shared_Words, Linked_lagoslakeid), one per suggested link
+    """
+    links = []
+    inside = [lake for lake in lakes if lake[2] == 0]
+    within_10 = [lake for lake in lakes if lake[2] <= 10]
+    if inside:  # if the point is directly in a polygon
+        for mid_0, mname_0, distance in inside:
+            words = None
+            if name and mname_0:
+                words = lagosGIS.list_shared_words(name, mname_0, exclude_lake_words=False)
+            links.append(('Exact location link', -1, words, mid_0))
+    elif within_10:  # if the point is only within 10m of a lake
+        for mid_10, mname_10, distance in within_10:
+            words = None
+            if name and mname_10:
+                words = lagosGIS.list_shared_words(name, mname_10, exclude_lake_words=False)
+            if words:
+                links.append(('Linked by common name and location', -1, words, mid_10))
+            else:
+                links.append(('Linked by common location', 1, words, mid_10))
+    elif stream is not None:  # if there is a stream match
+        links.append(('Not linked because represented as river in NHD', 2, None, None))
+    elif lakes:  # if the point is only within 100m of lake(s)
+        for mid_100, mname_100, distance in lakes:
+            words = None
+            if name and mname_100:
+                words = lagosGIS.list_shared_words(name, mname_100, exclude_lake_words=True)
+            if words:
+                links.append(('Linked by common name and location', 1, words, mid_100))
+            else:
+                links.append(('Linked by common location', 2, words, mid_100))
+    else:
+        links.append((None, None, None, None))
+    return links
+
+
 def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
                             lake_name_field, lake_county_field='', state='',
-                            master_gdb=r'C:\Users\smithn78\Dropbox\CL_HUB_GEO\Lake_Georeferencing\Masters_for_georef.gdb'
+                            master_gdb=r'C:\Users\smithn78\Dropbox\CL_HUB_GEO\Lake_Georeferencing\Masters_for_georef.gdb',
+                            index_dir=''
                             ):
     """
     Evaluate water quality sampling point locations and either assign the point to a lake polygon or flag the
@@ -83,6 +132,8 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
     :param state: (Optional) The 2-letter abbreviation of the U.S. state the dataset is limited to
     :param master_gdb: Location of master geodatabase used for linking that contains the collateral matching information
     described in the variables MASTER_LAKES_FC, MASTER_LAKES_LINES, MASTER_STREAMS_FC, and MASTER_XWALK in this script
+    :param index_dir: (Optional) Directory for the lake and stream index built from master_gdb on first use. Default
+    is master_gdb with the extension replaced by "_index". Delete it to rebuild after editing the master layers.
     :return: A point feature class containing the original input rows with the following fields added to document and
     control the semi-automated linking process.
         -Auto_Comment: Match status of site suggested by georeference_lakes. Permitted values:
@@ -106,6 +157,9 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
         -Total_points_in_lake_poly: The number of unique site identifiers suggested to be linked to the same LAGOS-US
         lake as this site, including this site in the count.
         -Note: A field provided for any free-form notes and comments about linking determinations during manual review.
+        -Name_Match_lagoslakeid: For sites not linked by location, the lake in the same county and state with the best
+        matching name, if lake_county_field was provided. A suggestion for review only.
+        -Name_Match_Words: Lake name elements common to the site and the name-matched lake
     """
 
     # ---SETUP----------------------------------------------------------------------------------------------------
@@ -113,15 +167,14 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
     master_lakes_lines = os.path.join(master_gdb, MASTER_LAKES_LINES)
     master_streams_fc = os.path.join(master_gdb, MASTER_STREAMS_FC)
     master_xwalk = os.path.join(master_gdb, MASTER_XWALK)
+    if not index_dir:
+        index_dir = '{}_index'.format(os.path.splitext(master_gdb)[0])
 
     state = state.upper()
     if state not in STATES:
         raise ValueError('Use the 2-letter state code abbreviation')
     arcpy.env.workspace = 'in_memory'
     out_short = os.path.splitext(os.path.basename(out_fc))[0]
-    join1 = '{}_1'.format(out_short)
-    join2 = '{}_2'.format(out_short)
-    join3 = '{}_3'.format(out_short)
     join4 = '{}_4'.format(out_short)
     point_fields = [f.name for f in arcpy.ListFields(sample_sites_point_fc)]
 
@@ -136,21 +189,36 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
         arcpy.AlterField_management(sample_sites_point_fc, temp_id_field, new_field_name=site_id_field)
 
     # ---SPATIAL LINK EVIDENCE GATHERING ----------------------------------------------------------------------
-    # Perform joins to gather spatial link information to apply rules later
-    # Join 1: point inside lake
-    # Join 2: point inside double-banked stream polygon (not lake)
-    # Join 3: point within 10m of lake border
-    # Join 4: point within 100m of lake border
-    join1 = AN.SpatialJoin(sample_sites_point_fc, master_lakes_fc, join1, 'JOIN_ONE_TO_MANY', 'KEEP_ALL',
-                           match_option='INTERSECT')
-    join2 = AN.SpatialJoin(join1, master_streams_fc, join2, 'JOIN_ONE_TO_MANY', 'KEEP_ALL', match_option='INTERSECT')
-    join3 = AN.SpatialJoin(join2, master_lakes_fc, join3, 'JOIN_ONE_TO_MANY', 'KEEP_ALL', match_option='INTERSECT',
-                           search_radius='10 meters')
-    join4 = AN.SpatialJoin(join3, master_lakes_fc, join4, 'JOIN_ONE_TO_MANY', 'KEEP_ALL', match_option='INTERSECT',
-                           search_radius='100 meters')
+    # One query of the lake and stream index (built from the master layers on first use) gives, for each site, the
+    # lakes within 100m ranked by distance (0m = point inside lake) and the double-banked stream polygon containing
+    # the point, to apply rules later
+    site_fields = [f.name for f in arcpy.ListFields(sample_sites_point_fc) if f.type not in ('OID', 'Geometry')]
+    sites = [row for row in arcpy.da.SearchCursor(sample_sites_point_fc, site_fields + ['SHAPE@XY'])]
+    # The index is built in the master lakes' coordinate system, so query it with the sites projected to match. The
+    # rows above keep the sites' own coordinates for the output.
+    master_sr = arcpy.Describe(master_lakes_fc).spatialReference
+    site_xy = [xy if xy is not None and xy[0] is not None else (float('nan'), float('nan'))
+               for xy, in arcpy.da.SearchCursor(sample_sites_point_fc, ['SHAPE@XY'], spatial_reference=master_sr)]
+    index = lake_site_index.open_index(index_dir, master_lakes_fc, master_streams_fc, MASTER_LAKE_ID,
+                                       MASTER_GNIS_NAME)
+    candidates = index.candidates(site_xy, 100)
+
+    # Name matches within the same county, for the sites with no lake or stream nearby
+    name_matches = {}
+    if lake_county_field:
+        unlinked = [i for i, (lakes, stream) in enumerate(candidates) if not lakes and stream is None]
+        county_index = site_fields.index(lake_county_field)
+        name_index = site_fields.index(lake_name_field)
+        lake_names = lake_name_index.open_index(os.path.join(index_dir, 'names'), master_lakes_fc, MASTER_LAKE_ID,
+                                                [MASTER_GNIS_NAME], MASTER_COUNTY_NAME, MASTER_STATE_NAME)
+        matches = lake_names.match([sites[i][name_index] for i in unlinked], [sites[i][county_index] for i in unlinked],
+                                   [state] * len(unlinked), limit=1)
+        name_matches = {i: match[0] for i, match in zip(unlinked, matches) if match}
 
     # ---APPLY DISTANCE & NAME-BASED LOGIC TO CHOOSE LINK---------------------------------------------------------
-    # Set-up for editing lake assignment values
+    # Set-up for writing lake assignment values, one row per suggested link
+    DM.CreateFeatureclass('in_memory', join4, 'POINT', template=sample_sites_point_fc,
+                          spatial_reference=arcpy.Describe(sample_sites_point_fc).spatialReference)
     DM.AddField(join4, 'Auto_Comment', 'TEXT', field_length=100)
     DM.AddField(join4, 'Manual_Review', 'SHORT')
     DM.AddField(join4, 'Shared_Words', 'TEXT', field_length=100)
@@ -158,81 +226,43 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
     DM.AddField(join4, 'GEO_Discovered_Name', 'TEXT', field_length=255)
     DM.AddField(join4, 'Duplicate_Candidate', 'TEXT', field_length=1)
     DM.AddField(join4, 'Is_Legacy_Link', 'TEXT', field_length=1)
-    update_fields = [site_id_field,
-                     lake_name_field,
-                     MASTER_LAKE_ID,
-                     MASTER_GNIS_NAME,  # 0m match
-                     'PERMANENT_IDENTIFIER_1', 'GNIS_NAME_1',  # stream match
-                     MASTER_LAKE_ID + '_1', MASTER_GNIS_NAME + '_12',  # 10m match
-                     MASTER_LAKE_ID + '_12', MASTER_GNIS_NAME + '_12_13',  # 100m match
-                     'Auto_Comment',
-                     'Manual_Review',
-                     'Shared_Words',
-                     'Linked_lagoslakeid']
-
-    # Evaluate match criteria for each lake and transfer the linked lagoslakeid value to the Linked_lagoslakeid field
-    # if the match is accepted.
-    # Update the comment to describe the match type.
-    # Update the manual review flag to indicate only superficial review needed (-1) for convincing matches, and review
-    # needed (>=1, higher values need more scrutiny) if the match is less convincing or needs discrimination
-    # These criteria flow from most convincing (inside lake) to least convincing link.
-    cursor = arcpy.da.UpdateCursor(join4, update_fields)
-    arcpy.AddMessage("Calculating link status...")
-    for row in cursor:
-        id, name, mid_0, mname_0, stream_id, streamname_0, mid_10, mname_10, mid_100, mname_100, comment, review, words, lagosid = row
-        if mid_0 is not None:  # if the point is directly in a polygon
-            if name and mname_0:
-                words = lagosGIS.list_shared_words(name, mname_0, exclude_lake_words=False)
-            comment = 'Exact location link'
-            lagosid = mid_0
-            review = -1
-        elif mid_0 is None and mid_10 is not None:  # if the point is only within 10m of a lake
-            if name and mname_10:
-                words = lagosGIS.list_shared_words(name, mname_10, exclude_lake_words=False)
-            if words:
-                comment = 'Linked by common name and location'
-                lagosid = mid_10
-                review = -1
-            else:
-                comment = 'Linked by common location'
-                lagosid = mid_10
-                review = 1
-        elif mid_0 is None and mid_10 is None:
-            if stream_id is not None:  # if there is a stream match
-                comment = 'Not linked because represented as river in NHD'
-                review = 2
-            else:
-                if mid_100 is not None:  # if the point is only within 100m of lake(s)
-                    if name and mname_100:
-                        words = lagosGIS.list_shared_words(name, mname_100, exclude_lake_words=True)
-                    if words:
-                        comment = 'Linked by common name and location'
-                        lagosid = mid_100
-                        review = 1
-                    else:
-                        comment = 'Linked by common location'
-                        lagosid = mid_100
-                        review = 2
-        cursor.updateRow((id, name, mid_0, mname_0, stream_id, streamname_0, mid_10, mname_10, mid_100, mname_100,
-                          comment, review, words, lagosid))
+    DM.AddField(join4, 'Name_Match_lagoslakeid', 'LONG')
+    DM.AddField(join4, 'Name_Match_Words', 'TEXT', field_length=100)
+    if arcpy.ListFields(join4, 'Comment'):
+        comment_field_name = 'Comment_LAGOS'
+    else:
+        comment_field_name = 'Comment'
+    DM.AddField(join4, comment_field_name, 'TEXT', field_length=100)
+    link_fields = ['Auto_Comment', 'Manual_Review', 'Shared_Words', 'Linked_lagoslakeid', 'Is_Legacy_Link',
+                   'Name_Match_lagoslakeid', 'Name_Match_Words']
+    insert_fields = site_fields + ['SHAPE@XY'] + link_fields
+    if 'Comment' not in site_fields:
+        insert_fields.append('Comment')
 
-    # --- LEGACY LINKING TO LAGOS-NE IDENTIFIERS-------------------------------------------------------------------
-    # If the dataset is from a state that was in LAGOS-NE, flag site for manual review if the match type above was
-    # not 'Exact location link' and transfer the lake info that was linked previously for LAGOS-NE (so that sites
-    # already matched in LAGOS-NE are not forgotten or over-written by this process for LAGOS-US)
+    # If the dataset is from a state that was in LAGOS-NE, the lake info that was linked previously for LAGOS-NE
+    legacy_links = {}
     if state in LAGOSNE_STATES:
-        DM.JoinField(join4, site_id_field, master_xwalk, 'lagosne_legacyid',
-                     ['lagoslakeid', 'lagos_lakename', 'lagos_state'])
-        update_fields = [site_id_field, lake_name_field,
-                         MASTER_LAKE_ID + '_12_13', 'lagos_lakename', 'lagos_state',  # crosswalk match
-                         'Auto_Comment', 'Manual_Review', 'Shared_Words',
-                         'Linked_lagoslakeid', 'Is_Legacy_Link']
+        for legacy_id, mid_x, mname_x, state_x in arcpy.da.SearchCursor(
+                master_xwalk, ['lagosne_legacyid', 'lagoslakeid', 'lagos_lakename', 'lagos_state']):
+            if legacy_id not in legacy_links:
+                legacy_links[legacy_id] = (mid_x, mname_x, state_x)
 
-        with arcpy.da.UpdateCursor(join4, update_fields) as uCursor:
-            for uRow in uCursor:
-                id, name, mid_x, mname_x, state_x, comment, review, words, lagosid, legacy_flag = uRow
-                # fields are populated already from links above. Revise only if legacy links
-                if mid_x is not None:
+    arcpy.AddMessage("Calculating link status...")
+    site_id_index = site_fields.index(site_id_field)
+    name_index = site_fields.index(lake_name_field)
+    with arcpy.da.InsertCursor(join4, insert_fields) as cursor:
+        for i, (site, (lakes, stream)) in enumerate(zip(sites, candidates)):
+            id, name = site[site_id_index], site[name_index]
+            name_match_id, name_match_words = name_matches.get(i, (None, None, None))[:2]
+            for comment, review, words, lagosid in link_site(name, lakes, stream):
+                legacy_flag = None
+
+                # --- LEGACY LINKING TO LAGOS-NE IDENTIFIERS----------------------------------------------------
+                # Flag site for manual review if the match type above was not 'Exact location link' and transfer
+                # the legacy link (so that sites already matched in LAGOS-NE are not forgotten or over-written by
+                # this process for LAGOS-US)
+                if id in legacy_links:
+                    mid_x, mname_x, state_x = legacy_links[id]
                     if state == state_x:
                         legacy_flag = 'Y'  # set to Y regardless of whether using legacy comment if state matches
                     if comment != 'Exact location link':
@@ -245,25 +275,18 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
                         if name and mname_x:
                             words = lagosGIS.list_shared_words(name, mname_x)  # update words only if legacy comment
 
-                new_row = id, name, mid_x, mname_x, state_x, comment, review, words, lagosid, legacy_flag
-                uCursor.updateRow(new_row)
-
-    # ---ASSIGN REVIEW FLAGS FOR EXTREMES--------------------------------------------------------------------------
-    # No match
-    # Assign high scrutiny, assign and/or copy the no-match comment
-    if arcpy.ListFields(join4, 'Comment'):
-        comment_field_name = 'Comment_LAGOS'
-    else:
-        comment_field_name = 'Comment'
-
-    DM.AddField(join4, comment_field_name, 'TEXT', field_length=100)
-    with arcpy.da.UpdateCursor(join4, ['Manual_Review', 'Auto_Comment', 'Comment']) as cursor:
-        for flag, ac, comment in cursor:
-            if flag is None:
-                flag = 3
-                ac = 'Not linked'
-            comment = ac
-            cursor.updateRow((flag, ac, comment))
+                # ---ASSIGN REVIEW FLAGS FOR EXTREMES---------------------------------------------------------------
+                # No match
+                # Assign high scrutiny, assign and/or copy the no-match comment
+                if review is None:
+                    review = 3
+                    comment = 'Not linked'
+                row = list(site) + [comment, review, words, lagosid, legacy_flag, name_match_id, name_match_words]
+                if 'Comment' in site_fields:
+                    row[site_fields.index('Comment')] = comment
+                else:
+                    row.append(comment)
+                cursor.insertRow(row)
 
     # Assign lowest scrutiny value for points more than 100m inside lake, very convincing match
     DM.MakeFeatureLayer(join4, 'join5_lyr')
@@ -277,7 +300,7 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
     copy_fields = point_fields + ['Linked_lagoslakeid', 'Auto_Comment', 'Manual_Review',
                                   'Is_Legacy_Link',
                                   'Shared_Words', 'Comment', 'Duplicate_Candidate',
-                                  'GEO_Discovered_Name']
+                                  'GEO_Discovered_Name', 'Name_Match_lagoslakeid', 'Name_Match_Words']
     copy_fields.remove('Shape')
     copy_fields.remove('OBJECTID')
 
@@ -287,9 +310,7 @@ def georeference_lake_sites(sample_sites_point_fc, out_fc, site_id_field,
     # ---MANAGE ONE-TO-MANY SCENARIOS------------------------------------------------------------------------------
 
     # Remove any duplicates on all non-OID fields.
-    # (These originate from the join3/join4 transition because a point can be both
-    # within 10m and 100m of lakes, this code takes the closest lake as true for my current sanity.
-    # Or, in other words, this is a hack solution.)
+    # (Sites repeated in the input, or a site with the same suggested link twice.)
     out_fc_fields = [f.name for f in arcpy.ListFields(out_fc) if f.name != 'OBJECTID']
     DM.DeleteIdentical(out_fc, out_fc_fields)
 
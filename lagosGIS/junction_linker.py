@@ -0,0 +1,148 @@
+# filename: junction_linker.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): CONN
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Link points (e.g. dams) to the nearest lake junctions (the inlets and outlets from locate_lake_inlets and
+# locate_lake_outlets) with a KD-tree, returning the k nearest junctions for every point in one query as a tidy link
+# table, in place of GenerateNearTable and pivoting the near table.
+
+import os
+
+import numpy as np
+
+import data_access
+
+SEARCH_RADIUS = 250000  # meters
+BRUTE_FORCE_CELLS = 2 ** 24  # distances held at once when scipy is not available
+
+
+def nearest(query_xy, target_xy, k=3, max_distance=np.inf):
+    """
+    Find the k nearest targets of each query point. Uses scipy's cKDTree if available, otherwise compares blocks of
+    query points to all targets.
+    :param query_xy: (n, 2) array of query point coordinates
+    :param target_xy: (m, 2) array of target point coordinates, in the same projected coordinate system
+    :param k: Number of neighbors
+    :param max_distance: Targets farther than this are not returned
+    :return: Tuple of arrays (query index, rank, target index, distance), one entry per link, ordered by query point
+    and rank. Ranks start at 1. Targets at equal distance are ranked in target order.
+    """
+    query_xy = np.asarray(query_xy, dtype=np.float64).reshape(-1, 2)
+    target_xy = np.asarray(target_xy, dtype=np.float64).reshape(-1, 2)
+    k = min(k, len(target_xy))
+    if not k or not len(query_xy):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0)
+    valid = np.flatnonzero(~np.isnan(query_xy).any(axis=1))
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        cKDTree = None
+
+    # gather each point's k nearest targets plus any target tied with the k-th, so ties can be ranked by target order
+    queries, targets = [], []
+    if cKDTree is not None:
+        tree = cKDTree(target_xy)
+        kk = min(k + 1, len(target_xy))
+        # the tree's bound is exclusive, and targets at exactly max_distance are kept
+        distances, found = tree.query(query_xy[valid], k=kk, distance_upper_bound=np.nextafter(max_distance, np.inf))
+        distances, found = np.asarray(distances).reshape(-1, kk), np.asarray(found).reshape(-1, kk)
+        tied = np.zeros(len(valid), dtype=bool)
+        if kk > k:
+            tied = np.isfinite(distances[:, k]) & (distances[:, k] == distances[:, k - 1])
+        queries.append(np.repeat(valid[~tied], k))
+        targets.append(found[~tied, :k].ravel())
+        for row in np.flatnonzero(tied):
+            # a little past the k-th distance so rounding in the tree does not drop targets at exactly that distance
+            tied_targets = tree.query_ball_point(query_xy[valid[row]], distances[row, k - 1] * (1 + 1e-9))
+            queries.append(np.full(len(tied_targets), valid[row], dtype=np.int64))
+            targets.append(np.array(tied_targets, dtype=np.int64))
+    else:
+        block = max(1, BRUTE_FORCE_CELLS // len(target_xy))
+        for start in range(0, len(valid), block):
+            rows = valid[start:start + block]
+            d = np.sqrt(((query_xy[rows, None, :] - target_xy[None, :, :]) ** 2).sum(axis=2))
+            kth = np.partition(d, k - 1, axis=1)[:, k - 1]
+            block_rows, block_targets = np.nonzero(d <= kth[:, None])
+            queries.append(rows[block_rows])
+            targets.append(block_targets)
+    queries = np.concatenate(queries).astype(np.int64) if queries else np.zeros(0, dtype=np.int64)
+    targets = np.concatenate(targets).astype(np.int64) if targets else np.zeros(0, dtype=np.int64)
+
+    # distance threshold, tie rule and ranks
+    keep = targets < len(target_xy)  # cKDTree marks missing neighbors with the number of targets
+    queries, targets = queries[keep], targets[keep]
+    distances = np.sqrt(((query_xy[queries] - target_xy[targets]) ** 2).sum(axis=1))
+    keep = distances <= max_distance
+    queries, targets, distances = queries[keep], targets[keep], distances[keep]
+    order = np.lexsort((targets, distances, queries))
+    queries, targets, distances = queries[order], targets[order], distances[order]
+    ranks = np.arange(len(queries)) - np.searchsorted(queries, queries) + 1
+    keep = ranks <= k
+    return queries[keep], ranks[keep], targets[keep], distances[keep]
+
+
+class JunctionLinker:
+    """
+    KD-tree linker over one or more junction point feature classes.
+    :param junction_fcs: Junction point feature classes, e.g. [LAGOS_inlets, LAGOS_outlets]
+    :param str id_field: Lake identifier field in the junction feature classes
+    """
+
+    def __init__(self, junction_fcs, id_field='lagoslakeid'):
+        self.id_field = id_field
+        xy, oids, ids, sources = [], [], [], []
+        for fc in junction_fcs:
+            name = os.path.basename(fc)
+            for oid, lake_id, point in data_access.read_rows(fc, ['OID@', id_field, 'SHAPE@XY']):
+                if point is None or point[0] is None:
+                    continue
+                xy.append(point)
+                oids.append(oid)
+                ids.append(lake_id)
+                sources.append(name)
+        self.xy = np.array(xy, dtype=np.float64).reshape(-1, 2)
+        self.oids = np.array(oids, dtype=np.int64)
+        self.ids = np.array(ids, dtype=object)
+        self.sources = np.array(sources, dtype=object)
+
+    def link(self, xy, k=3, max_distance=SEARCH_RADIUS):
+        """
+        Link points to their k nearest junctions.
+        :param xy: (n, 2) array of point coordinates, in the projection of the junctions
+        :param k: Number of junctions per point
+        :param max_distance: Search radius
+        :return: Record batch (dictionary of arrays) with one row per link: query (index of the point), NEAR_RANK,
+        NEAR_FC (junction feature class name), NEAR_FID (junction OID), near_<id_field>, and NEAR_DIST
+        """
+        queries, ranks, targets, distances = nearest(xy, self.xy, k, max_distance)
+        return {'query': queries,
+                'NEAR_RANK': ranks,
+                'NEAR_FC': self.sources[targets],
+                'NEAR_FID': self.oids[targets],
+                'near_{}'.format(self.id_field): self.ids[targets],
+                'NEAR_DIST': distances}
+
+    def link_table(self, points_fc, point_id_field, out_table, k=3, max_distance=SEARCH_RADIUS,
+                   spatial_reference=None):
+        """
+        Write the links for every point in a feature class to a table.
+        :param str points_fc: Point feature class
+        :param str point_id_field: Identifier field of the points, e.g. 'DAMID'
+        :param str out_table: Output table path, e.g. r'D:\\links.gdb\\dam_junctions'
+        :param k: Number of junctions per point
+        :param max_distance: Search radius
+        :param spatial_reference: (Optional) Factory code or well-known text of the junctions' coordinate system, to
+        project the points to when they are stored in another one. Default is no projection.
+        :return: out_table
+        """
+        point_ids, xy = [], []
+        for point_id, point in data_access.read_rows(points_fc, [point_id_field, 'SHAPE@XY'],
+                                                     spatial_reference=spatial_reference):
+            point_ids.append(point_id)
+            xy.append(point if point is not None and point[0] is not None else (np.nan, np.nan))
+        links = self.link(xy, k, max_distance)
+        links[point_id_field] = np.array(point_ids, dtype=object)[links.pop('query')]
+        fields = [point_id_field, 'NEAR_RANK', 'NEAR_FC', 'NEAR_FID', 'near_{}'.format(self.id_field), 'NEAR_DIST']
+        return data_access.write_batches(out_table, [links], fields)
@@ -0,0 +1,214 @@
+# filename: lake_name_index.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LIMNO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Save an inverted index from normalized name words to the master lakes, partitioned by state and county, and
+# score the name matches for a batch of sampling sites at once, in place of comparing the site name to each candidate
+# lake name one pair at a time.
+
+import json
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+
+import data_access
+
+MANIFEST_NAME = 'names.json'
+EXCLUSION_WORDS = frozenset(['LAKE', 'POND', 'RESERVOIR', 'DAM'])  # same as lagosGIS.list_shared_words
+PLACE_SUFFIXES = ('COUNTY', 'PARISH', 'BOROUGH')
+NON_WORD = re.compile(r'[^0-9A-Z]+')
+
+
+# ---NORMALIZATION------------------------------------------------------------------------------------------------------
+def tokens(name, exclude_lake_words=False):
+    """
+    Split a lake name into normalized words: upper case, with punctuation removed.
+    :param name: Lake name, or None
+    :param exclude_lake_words: Drop the generic words in EXCLUSION_WORDS
+    :return: List of unique words in name order
+    """
+    if not name:
+        return []
+    words = []
+    for word in NON_WORD.sub(' ', name.upper()).split():
+        if word not in words and not (exclude_lake_words and word in EXCLUSION_WORDS):
+            words.append(word)
+    return words
+
+
+def normalize_place(name):
+    """Normalize a county or state name for partitioning, e.g. 'St. Louis County' and 'ST LOUIS' give 'ST LOUIS'."""
+    words = NON_WORD.sub(' ', (name or '').upper()).split()
+    if words and words[-1] in PLACE_SUFFIXES:
+        words = words[:-1]
+    return ' '.join(words)
+
+
+# ---BUILD--------------------------------------------------------------------------------------------------------------
+def build(out_dir, lakes_fc, id_field, name_fields, county_field=None, state_field=None):
+    """
+    Build the index of lake name words and save it to out_dir.
+    :param out_dir: Directory for the index
+    :param lakes_fc: Lakes feature class or table
+    :param id_field: Lake identifier field, e.g. 'lagoslakeid'
+    :param name_fields: Name fields to index together, e.g. ['GNIS_Name', 'lagos_lakename']
+    :param county_field: (Optional) County name field, for county partitions
+    :param state_field: (Optional) State abbreviation field, for state partitions
+    :return: out_dir
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    fields = [id_field] + list(name_fields) + [f for f in (county_field, state_field) if f]
+    vocabulary = {}
+    counties = {'': 0}
+    states = {'': 0}
+    ids, lake_words, lake_counties, lake_states = [], [], [], []
+    for row in data_access.read_rows(lakes_fc, fields):
+        row = list(row)
+        names = row[1:1 + len(name_fields)]
+        county = normalize_place(row[1 + len(name_fields)]) if county_field else ''
+        state = normalize_place(row[-1]) if state_field else ''
+        words = []
+        for name in names:
+            words.extend(w for w in tokens(name) if w not in words)
+        ids.append(row[0])
+        lake_words.append([vocabulary.setdefault(w, len(vocabulary)) for w in words])
+        lake_counties.append(counties.setdefault(county, len(counties)))
+        lake_states.append(states.setdefault(state, len(states)))
+
+    # postings: for each word, the lakes containing it (compressed sparse rows)
+    word_ids = np.array([w for words in lake_words for w in words], dtype=np.int64)
+    lake_of_word = np.repeat(np.arange(len(lake_words), dtype=np.int64), [len(words) for words in lake_words])
+    order = np.argsort(word_ids, kind='mergesort')
+    postings = lake_of_word[order]
+    posting_offsets = np.concatenate([[0], np.cumsum(np.bincount(word_ids, minlength=len(vocabulary)))])
+    lake_offsets = np.concatenate([[0], np.cumsum([len(words) for words in lake_words])])
+
+    arrays = {'postings': postings, 'posting_offsets': posting_offsets, 'lake_words': word_ids,
+              'lake_offsets': lake_offsets, 'lake_counties': np.array(lake_counties, dtype=np.int64),
+              'lake_states': np.array(lake_states, dtype=np.int64)}
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, '{}.npy'.format(name)), np.asarray(array, dtype=np.int64))
+    words_by_id = sorted(vocabulary, key=vocabulary.get)
+    with open(os.path.join(out_dir, 'vocabulary.json'), 'w') as f:
+        json.dump({'ids': ids, 'words': words_by_id,
+                   'counties': sorted(counties, key=counties.get), 'states': sorted(states, key=states.get)}, f)
+    sources = {'lakes': lakes_fc, 'id_field': id_field, 'name_fields': list(name_fields),
+               'county_field': county_field, 'state_field': state_field}
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({'sources': sources, 'built': datetime.now().isoformat()}, f, indent=2)
+    return out_dir
+
+
+# ---QUERY--------------------------------------------------------------------------------------------------------------
+class LakeNameIndex:
+    """
+    Query an index made by build.
+    :param index_dir: Directory written by build
+    """
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(index_dir, 'vocabulary.json')) as f:
+            vocabulary = json.load(f)
+        self.ids = vocabulary['ids']
+        self.words = vocabulary['words']
+        self.word_index = {w: i for i, w in enumerate(self.words)}
+        self.county_index = {c: i for i, c in enumerate(vocabulary['counties'])}
+        self.state_index = {s: i for i, s in enumerate(vocabulary['states'])}
+        for name in ('postings', 'posting_offsets', 'lake_words', 'lake_offsets', 'lake_counties', 'lake_states'):
+            setattr(self, name, np.load(os.path.join(index_dir, '{}.npy'.format(name)), mmap_mode='r'))
+        self.lake_word_counts = np.diff(self.lake_offsets)
+        self.excluded = np.array([w in EXCLUSION_WORDS for w in self.words], dtype=bool)
+        lake_of_word = np.repeat(np.arange(len(self.ids)), self.lake_word_counts)
+        self.excluded_counts = np.bincount(lake_of_word, weights=self.excluded[np.asarray(self.lake_words)],
+                                           minlength=len(self.ids)).astype(np.int64)
+
+    def lake_name_words(self, lake, exclude_lake_words=False):
+        words = self.lake_words[self.lake_offsets[lake]:self.lake_offsets[lake + 1]]
+        return [self.words[w] for w in words if not (exclude_lake_words and self.excluded[w])]
+
+    def match(self, names, counties=None, states=None, exclude_lake_words=True, limit=5):
+        """
+        Score the lakes sharing name words with each site. All sites are looked up together: the postings of every
+        site word are gathered at once and the shared words counted per site and lake pair.
+        :param names: List of site lake names
+        :param counties: (Optional) List of site county names. Only lakes in the same county are returned.
+        :param states: (Optional) List of site state abbreviations. Only lakes in the same state are returned.
+        :param exclude_lake_words: Ignore the generic words in EXCLUSION_WORDS
+        :param limit: Maximum matches returned per site
+        :return: List with one list per site of (lake id, shared words, score), best first. The score is the share of
+        the words in either name that are in both (1 = same words).
+        """
+        site_words = [[self.word_index[w] for w in tokens(name, exclude_lake_words) if w in self.word_index]
+                      for name in names]
+        site_word_counts = np.array([len(tokens(name, exclude_lake_words)) for name in names], dtype=np.int64)
+        word_ids = np.array([w for words in site_words for w in words], dtype=np.int64)
+        site_of_word = np.repeat(np.arange(len(names), dtype=np.int64), [len(words) for words in site_words])
+        results = [[] for name in names]
+        if not len(word_ids):
+            return results
+
+        # gather the postings of every site word
+        starts = np.asarray(self.posting_offsets)[word_ids]
+        lengths = np.asarray(self.posting_offsets)[word_ids + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return results
+        run_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + np.arange(total) - run_starts
+        lakes = np.asarray(self.postings)[positions]
+        sites = np.repeat(site_of_word, lengths)
+
+        # partitions
+        keep = np.ones(total, dtype=bool)
+        if counties is not None:
+            site_counties = np.array([self.county_index.get(normalize_place(c), -1) for c in counties])
+            keep &= np.asarray(self.lake_counties)[lakes] == site_counties[sites]
+        if states is not None:
+            site_states = np.array([self.state_index.get(normalize_place(s), -1) for s in states])
+            keep &= np.asarray(self.lake_states)[lakes] == site_states[sites]
+        lakes, sites = lakes[keep], sites[keep]
+        if not len(lakes):
+            return results
+
+        # shared words per site and lake pair
+        pair_keys = sites * len(self.ids) + lakes
+        pairs, shared = np.unique(pair_keys, return_counts=True)
+        pair_sites, pair_lakes = pairs // len(self.ids), pairs % len(self.ids)
+        lake_counts = self.lake_word_counts[pair_lakes]
+        if exclude_lake_words:
+            lake_counts = lake_counts - self.excluded_counts[pair_lakes]
+        scores = shared / (site_word_counts[pair_sites] + lake_counts - shared).astype(np.float64)
+
+        order = np.lexsort((pair_lakes, -scores, pair_sites))
+        for i in order:
+            site = pair_sites[i]
+            if len(results[site]) < limit:
+                lake = pair_lakes[i]
+                site_set = set(tokens(names[site], exclude_lake_words))
+                words = [w for w in self.lake_name_words(lake, exclude_lake_words) if w in site_set]
+                results[site].append((self.ids[lake], ' '.join(words), float(scores[i])))
+        return results
+
+
+def open_index(index_dir, lakes_fc, id_field, name_fields, county_field=None, state_field=None):
+    """
+    Open the index in index_dir, building it first if it does not exist or was built from other sources. Delete the
+    directory to rebuild it after editing the sources in place.
+    :return: LakeNameIndex
+    """
+    sources = {'lakes': lakes_fc, 'id_field': id_field, 'name_fields': list(name_fields),
+               'county_field': county_field, 'state_field': state_field}
+    manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+    current = False
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            current = json.load(f)['sources'] == sources
+    if not current:
+        build(index_dir, lakes_fc, id_field, name_fields, county_field, state_field)
+    return LakeNameIndex(index_dir)
@@ -0,0 +1,203 @@
+# filename: lake_site_index.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LIMNO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Save the master lakes and stream polygons used for georeferencing sampling sites as memory-mapped arrays
+# once, and answer for a batch of sites the lakes within a search radius, ranked by distance, and the stream polygon
+# containing each site, in place of a chain of national spatial joins for each dataset. Requires shapely.
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+import data_access
+
+MANIFEST_NAME = 'index.json'
+LAYERS = ('lakes', 'streams')
+SEARCH_RADIUS = 100  # meters
+
+
+# ---BUILD--------------------------------------------------------------------------------------------------------------
+def build(out_dir, lakes_fc, streams_fc, lake_id_field='lagoslakeid', name_field='GNIS_Name',
+          stream_id_field='Permanent_Identifier'):
+    """
+    Save the polygons to out_dir as bounds, WKB and attributes, plus a manifest recording the sources.
+    :param out_dir: Directory for the index
+    :param lakes_fc: Polygon feature class of the lakes that sites can be linked to
+    :param streams_fc: Polygon feature class of the NHDArea stream/river polygons
+    :param lake_id_field: Lake identifier field in lakes_fc
+    :param name_field: Name field in both feature classes
+    :param stream_id_field: Identifier field in streams_fc
+    :return: out_dir
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    sources = {'lakes': [lakes_fc, lake_id_field, name_field], 'streams': [streams_fc, stream_id_field, name_field]}
+    for layer in LAYERS:
+        fc, id_field, layer_name_field = sources[layer]
+        bounds, blobs, ids, names = [], [], [], []
+        for feature_id, name, wkb in data_access.read_rows(fc, [id_field, layer_name_field, 'SHAPE@WKB']):
+            if wkb is None:
+                continue
+            blob = np.frombuffer(bytes(wkb), dtype=np.uint8)
+            bounds.append(_wkb_bounds(blob))
+            blobs.append(blob)
+            ids.append(feature_id)
+            names.append(name)
+        offsets = np.cumsum([0] + [len(b) for b in blobs]).astype(np.int64)
+        np.save(os.path.join(out_dir, '{}_bounds.npy'.format(layer)), np.array(bounds, dtype=np.float64).reshape(-1, 4))
+        np.save(os.path.join(out_dir, '{}_offsets.npy'.format(layer)), offsets)
+        np.save(os.path.join(out_dir, '{}_wkb.npy'.format(layer)),
+                np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8))
+        with open(os.path.join(out_dir, '{}_attributes.json'.format(layer)), 'w') as f:
+            json.dump({'ids': ids, 'names': names}, f)
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({'sources': sources, 'built': datetime.now().isoformat()}, f, indent=2)
+    return out_dir
+
+
+def _wkb_bounds(blob):
+    from shapely import wkb as shapely_wkb
+    return shapely_wkb.loads(blob.tobytes()).bounds
+
+
+# ---QUERY--------------------------------------------------------------------------------------------------------------
+class _Layer:
+    """
+    Polygons of one layer. The STRtree is built over the saved bounding boxes, and a polygon is only parsed from the
+    memory-mapped WKB when a site falls within the search radius of its box.
+    """
+
+    def __init__(self, index_dir, name):
+        from shapely.geometry import box
+        from shapely.strtree import STRtree
+        self.bounds = np.load(os.path.join(index_dir, '{}_bounds.npy'.format(name)), mmap_mode='r')
+        self.offsets = np.load(os.path.join(index_dir, '{}_offsets.npy'.format(name)), mmap_mode='r')
+        self.blobs = np.load(os.path.join(index_dir, '{}_wkb.npy'.format(name)), mmap_mode='r')
+        with open(os.path.join(index_dir, '{}_attributes.json'.format(name))) as f:
+            attributes = json.load(f)
+        self.ids = attributes['ids']
+        self.names = attributes['names']
+        self.boxes = [box(*b) for b in self.bounds]
+        self.tree = STRtree(self.boxes) if self.boxes else None
+        self.index_of = {id(b): i for i, b in enumerate(self.boxes)}
+        self.polygons = {}
+
+    def polygon(self, i):
+        if i not in self.polygons:
+            from shapely import wkb as shapely_wkb
+            self.polygons[i] = shapely_wkb.loads(self.blobs[self.offsets[i]:self.offsets[i + 1]].tobytes())
+        return self.polygons[i]
+
+    def within(self, xy, radius):
+        """
+        Find the polygons within radius of each point.
+        :param xy: (n, 2) array of point coordinates
+        :param radius: Search distance
+        :return: Tuple of arrays (point index, polygon index, distance), sorted by point, then distance
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        if self.tree is None:
+            points, polygons, distances = np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+        else:
+            try:
+                import shapely
+                vectorized = hasattr(shapely, 'from_wkb')
+            except ImportError:
+                vectorized = False
+            query = self._within_vectorized if vectorized else self._within_loop
+            points, polygons, distances = query(xy, radius)
+        keep = distances <= radius
+        points, polygons, distances = points[keep], polygons[keep], distances[keep]
+        order = np.lexsort((polygons, distances, points))
+        return points[order], polygons[order], distances[order]
+
+    def _within_vectorized(self, xy, radius):
+        """Box query and exact distances for all points at once, with the shapely 2 array API."""
+        import shapely
+        sites = np.flatnonzero(~np.isnan(xy).any(axis=1))
+        x, y = xy[sites, 0], xy[sites, 1]
+        found_sites, polygons = self.tree.query(shapely.box(x - radius, y - radius, x + radius, y + radius))
+        points = sites[found_sites]
+        geometries = np.empty(len(self.boxes), dtype=object)
+        for i in np.unique(polygons):
+            geometries[i] = self.polygon(i)
+        distances = shapely.distance(shapely.points(xy[points]), geometries[polygons])
+        return points.astype(np.int64), polygons.astype(np.int64), np.asarray(distances, dtype=np.float64)
+
+    def _within_loop(self, xy, radius):
+        """The same query one point at a time, for shapely 1.x."""
+        from shapely.geometry import Point, box
+        points, polygons, distances = [], [], []
+        for p, (x, y) in enumerate(xy):
+            if np.isnan(x) or np.isnan(y):
+                continue
+            point = Point(x, y)
+            for found in self.tree.query(box(x - radius, y - radius, x + radius, y + radius)):
+                # shapely 1.x returns the geometries themselves, later versions return indices
+                i = int(found) if isinstance(found, (int, np.integer)) else self.index_of[id(found)]
+                points.append(p)
+                polygons.append(i)
+                distances.append(self.polygon(i).distance(point))
+        return (np.array(points, dtype=np.int64), np.array(polygons, dtype=np.int64),
+                np.array(distances, dtype=np.float64))
+
+
+class LakeSiteIndex:
+    """
+    Query an index made by build. Layers are loaded the first time they are needed.
+    :param index_dir: Directory written by build
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        self.layers = {}
+
+    def layer(self, name):
+        if name not in self.layers:
+            self.layers[name] = _Layer(self.index_dir, name)
+        return self.layers[name]
+
+    def candidates(self, xy, radius=SEARCH_RADIUS):
+        """
+        Find the link candidates for a batch of sites.
+        :param xy: (n, 2) array of site coordinates, in the projection of the master layers
+        :param radius: Search distance for lakes
+        :return: List with one tuple per site of (lakes, stream). lakes is a list of (lake id, name, distance) for the
+        lakes within radius, nearest first, with distance 0 for a site inside the lake. stream is (id, name) of the
+        stream polygon containing the site, or None.
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        lakes = [[] for i in range(len(xy))]
+        streams = [None] * len(xy)
+        lake_layer = self.layer('lakes')
+        for p, i, distance in zip(*lake_layer.within(xy, radius)):
+            lakes[p].append((lake_layer.ids[i], lake_layer.names[i], float(distance)))
+        stream_layer = self.layer('streams')
+        for p, i, distance in zip(*stream_layer.within(xy, 0)):
+            if streams[p] is None:
+                streams[p] = (stream_layer.ids[i], stream_layer.names[i])
+        return list(zip(lakes, streams))
+
+
+def open_index(index_dir, lakes_fc, streams_fc, lake_id_field='lagoslakeid', name_field='GNIS_Name',
+               stream_id_field='Permanent_Identifier'):
+    """
+    Open the index in index_dir, building it first if it does not exist or was built from other sources. Delete the
+    directory to rebuild it after editing the sources in place.
+    :return: LakeSiteIndex
+    """
+    sources = {'lakes': [lakes_fc, lake_id_field, name_field], 'streams': [streams_fc, stream_id_field, name_field]}
+    manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+    current = False
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            current = json.load(f)['sources'] == sources
+    if not current:
+        build(index_dir, lakes_fc, streams_fc, lake_id_field, name_field, stream_id_field)
+    return LakeSiteIndex(index_dir)
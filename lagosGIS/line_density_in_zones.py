@@ -7,6 +7,9 @@
 import os
 import arcpy
 import lagosGIS
+import data_access
+import scratch
+import tracing
 from datetime import datetime as dt
 
 
@@ -23,8 +26,13 @@ def calc(zones_fc, zone_field, lines_fc, out_table, where_clause='', rename_labe
     """
 
     # Setup: enforce coordinates, make names, filter lines if elected
-    arcpy.env.workspace = 'in_memory'
     arcpy.env.outputCoordinatesystem = arcpy.SpatialReference(102039)
+    with scratch.ScratchWorkspace('line_density', scratch.estimate_mb(lines_fc, zones_fc)) as scratch_ws:
+        _calc(zones_fc, zone_field, lines_fc, out_table, where_clause, rename_label, scratch_ws)
+
+
+def _calc(zones_fc, zone_field, lines_fc, out_table, where_clause, rename_label, scratch_ws):
+    """The steps of calc, with every intermediate in scratch_ws."""
 
     if rename_label:
         density_field_name = '{}_mperha'.format(rename_label)
@@ -32,26 +40,25 @@ def calc(zones_fc, zone_field, lines_fc, out_table, where_clause='', rename_labe
         density_field_name = '{}_mperha'.format(os.path.basename(lines_fc))
 
     if where_clause:
-        lines_prep = arcpy.Select_analysis(lines_fc, 'lines_prep', where_clause)
+        lines_prep = arcpy.Select_analysis(lines_fc, scratch_ws.path('lines_prep'), where_clause)
     elif arcpy.Describe(lines_fc).spatialReference.factoryCode not in (102039, 5070):
-        lines_prep = arcpy.CopyFeatures_management(lines_fc, 'lines_prep')
+        lines_prep = arcpy.CopyFeatures_management(lines_fc, scratch_ws.path('lines_prep'))
     else:
         lines_prep = lines_fc
 
     # Perform identity analysis to join fields and crack lines at polygon boundaries
     arcpy.AddMessage("Cracking lines... {}".format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
-    lines_identity = arcpy.Identity_analysis(lines_prep, zones_fc, 'lines_identity')
+    with tracing.span('crack lines'):
+        lines_identity = arcpy.Identity_analysis(lines_prep, zones_fc, scratch_ws.path('lines_identity'))
     arcpy.AddMessage("Summarizing results... {}".format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
-    arcpy.AddField_management(lines_identity, 'length_m', 'DOUBLE')
-    with arcpy.da.UpdateCursor(lines_identity, ['length_m', 'SHAPE@LENGTH']) as cursor:
-        for row in cursor:
-            row[0] = row[1]
-            cursor.updateRow(row)
+    with tracing.span('measure lengths'):
+        arcpy.AddField_management(lines_identity, 'length_m', 'DOUBLE')
+        data_access.update_rows(lines_identity, ['length_m', 'SHAPE@LENGTH'], lambda row: [row[1], row[1]])
 
     def summarize_cracked(cracked_lines, density_field_name):
         # Calculate total length grouped by zone (numerator)
-        lines_stat = arcpy.Statistics_analysis(cracked_lines, 'lines_stat', 'length_m SUM', zone_field)
-        lines_stat_full = lagosGIS.one_in_one_out(lines_stat, zones_fc, zone_field, 'lines_stat_full')
+        lines_stat = arcpy.Statistics_analysis(cracked_lines, scratch_ws.path('lines_stat'), 'length_m SUM', zone_field)
+        lines_stat_full = lagosGIS.one_in_one_out(lines_stat, zones_fc, zone_field, scratch_ws.path('lines_stat_full'))
 
         # Get area of zones for density calc (denominator)
         zones_area = {}
@@ -78,19 +85,12 @@ def calc(zones_fc, zone_field, lines_fc, out_table, where_clause='', rename_labe
         arcpy.DeleteField_management(lines_stat_full, 'SUM_length_m')
         arcpy.DeleteField_management(lines_stat_full, 'FREQUENCY')
 
-        # Copy output to an in_memory fc with same name as output field so we can delete lines_stat_full
-        summarized = arcpy.CopyRows_management(lines_stat_full, density_field_name)
-
-        # Cleanup
-        for item in [lines_stat, lines_stat_full]:
-            arcpy.Delete_management(item)
-        return summarized
+        return lines_stat_full
 
-    # Run summary, copy to output, clean up
-    summary = summarize_cracked(lines_identity, density_field_name)
-    arcpy.CopyRows_management(summary, out_table)
-    for item in ['lines_prep', lines_identity]:
-        arcpy.Delete_management(item)
+    # Run summary, copy to output (scratch data is cleaned up on exit)
+    with tracing.span('summarize'):
+        summary = summarize_cracked(lines_identity, density_field_name)
+        arcpy.CopyRows_management(summary, out_table)
 
 
 def main():
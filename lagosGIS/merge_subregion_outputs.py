@@ -10,35 +10,55 @@ import os
 import arcpy
 from arcpy import management as DM
 import lagosGIS
+import bulk_merge
 
 # Setup
 NUM_SUBREGIONS = 202
 
-def merge_matching_master(output_list, output_fc, master_file, join_field = 'lagoslakeid'):
-    """Merges subregion-level GIS files and filters them to match a master merged file based on selected identifier"""
+def merge_matching_master(output_list, output_fc, master_file, join_field = 'lagoslakeid', pushdown = True,
+                          processes = 1):
+    """
+    Merges subregion-level GIS files and filters them to match a master merged file based on selected identifier
+    :param output_list: List of the subregion outputs
+    :param output_fc: Output feature class or table
+    :param master_file: Master merged file containing the identifiers to keep
+    :param join_field: The identifier field, in both master_file and the subregion outputs
+    :param pushdown: (Optional) If True (default), the master identifiers are loaded first and rows not in the master
+    set are dropped as the subregion outputs are read, writing only the kept rows directly to output_fc. If False,
+    everything is merged to the scratch geodatabase, trimmed and then copied to output_fc.
+    :param processes: (Optional) Number of reader processes for the merge, see bulk_merge.merge
+    :return: output_fc
+    """
+    if len(output_list) < NUM_SUBREGIONS:
+        print("Incomplete list of inputs. There should be {} inputs.".format(NUM_SUBREGIONS))
+        return output_fc
+
+    if pushdown:
+        arcpy.AddMessage("Loading master list...")
+        master_set = {r[0] for r in arcpy.da.SearchCursor(master_file, join_field)}
+        arcpy.AddMessage("Merging outputs matching master list...")
+        bulk_merge.merge(output_list, output_fc, processes=processes, keep=(join_field, master_set))
+        return output_fc
+
     arcpy.env.scratchWorkspace = os.getenv("TEMP")
     arcpy.env.workspace = arcpy.env.scratchGDB
     if arcpy.Exists('outputs_merged'):
         arcpy.Delete_management('outputs_merged')
 
-    if len(output_list) >= NUM_SUBREGIONS:
-        arcpy.AddMessage("Merging outputs...")
-        outputs_merged = lagosGIS.efficient_merge(output_list, 'outputs_merged')
-        arcpy.AddMessage("Merge completed, trimming to master list...")
-        data_type = arcpy.Describe(outputs_merged).dataType
-
-        master_set = {r[0] for r in arcpy.da.SearchCursor(master_file, join_field)}
-        with arcpy.da.UpdateCursor(outputs_merged, join_field) as u_cursor:
-            for row in u_cursor:
-                if row[0] not in master_set:
-                    u_cursor.deleteRow()
-        if data_type == "FeatureClass":
-            DM.CopyFeatures(outputs_merged, output_fc)
-        else:
-            DM.CopyRows(outputs_merged, output_fc)
-
+    arcpy.AddMessage("Merging outputs...")
+    outputs_merged = lagosGIS.efficient_merge(output_list, 'outputs_merged', processes=processes)
+    arcpy.AddMessage("Merge completed, trimming to master list...")
+    data_type = arcpy.Describe(outputs_merged).dataType
+
+    master_set = {r[0] for r in arcpy.da.SearchCursor(master_file, join_field)}
+    with arcpy.da.UpdateCursor(outputs_merged, join_field) as u_cursor:
+        for row in u_cursor:
+            if row[0] not in master_set:
+                u_cursor.deleteRow()
+    if data_type == "FeatureClass":
+        DM.CopyFeatures(outputs_merged, output_fc)
     else:
-        print("Incomplete list of inputs. There should be {} inputs.".format(NUM_SUBREGIONS))
+        DM.CopyRows(outputs_merged, output_fc)
 
     return output_fc
 
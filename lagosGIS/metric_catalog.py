@@ -0,0 +1,273 @@
+# filename: metric_catalog.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Load geo_metric_provenance.csv once per process into an indexed catalog of the GEO metrics (used to rename
+# the zonal summary outputs to the LAGOS-US standard), and plan the GEO run from it: expand every dataset and zone
+# type marked in the catalog into one job, order the jobs so that the jobs sharing an expensive input (the same zone
+# raster, the same unflat table, the same reference layer) run back to back, and write them as a job control CSV for
+# read_job_control.
+
+import csv
+import os
+import threading
+from collections import defaultdict, namedtuple
+
+PROVENANCE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'geo_metric_provenance.csv')
+FIRST_ZONE_COLUMN = 'lake'  # the zone type columns start here and run to the end of the header
+JOB_CONTROL_HEADER = ['Line', 'Function', 'Arg1', 'Arg2', 'Arg3', 'Arg4', 'Arg5', 'Arg6', 'Arg7', 'Arg8', 'Output',
+                      'CSV']
+PLANNED_FUNCTIONS = {'zonal_attribution_of_raster_data': 'lagosGIS.zonal_summary_of_raster_data',
+                     'point_attribution_of_raster_data': 'lagosGIS.point_attribution_of_raster_data',
+                     'zonal_attribution_of_polygon_data': 'lagosGIS.zonal_summary_of_classed_polygons',
+                     'lakes_in_zones': 'lagosGIS.lake_density'}
+TEMPLATE_MARKERS = ('yyyy',)  # ready paths standing for a series of files, e.g. the monthly PRISM rasters
+
+Metric = namedtuple('Metric', ['line', 'data_type', 'zone_name', 'zone_has_overlaps', 'zone_geometry', 'main_feature',
+                               'subgroup', 'units', 'function_name', 'ready_path', 'subgroup_original_code',
+                               'subgroup_original_name', 'zones'])
+Job = namedtuple('Job', ['function', 'args', 'output', 'csv', 'zone', 'zone_input', 'unflat_table', 'dataset'])
+
+_lock = threading.Lock()
+_catalogs = {}
+
+
+# ---CATALOG------------------------------------------------------------------------------------------------------------
+def _plain_path(path):
+    """Strip the r'...' wrapper from a path in the provenance file, as read_job_control.cook_string does."""
+    return path[2:-1] if path.startswith("r'") and path.endswith("'") else path
+
+
+class MetricCatalog:
+    """
+    The rows of geo_metric_provenance.csv, indexed by main feature, function and zone type.
+    :param str provenance_csv: Path of the provenance file
+    """
+
+    def __init__(self, provenance_csv=PROVENANCE_CSV):
+        self.provenance_csv = provenance_csv
+        self.metrics = []
+        self.zone_datasets = {}
+        self.by_feature = defaultdict(list)
+        self.by_function = defaultdict(list)
+        self.by_zone = defaultdict(list)
+        self._mappings = {}
+
+        with open(provenance_csv) as csv_file:
+            reader = csv.DictReader(csv_file)
+            header = reader.fieldnames
+            self.zone_columns = [c for c in header[header.index(FIRST_ZONE_COLUMN):] if c]
+            for line, row in enumerate(reader, start=2):
+                if not row['data_type']:
+                    continue
+                metric = Metric(line=line,
+                                data_type=row['data_type'],
+                                zone_name=row['zone_name'],
+                                zone_has_overlaps=row['zone_has_overlaps'] == 'Y',
+                                zone_geometry=row['zone_geometry'],
+                                main_feature=row['main_feature'],
+                                subgroup=row['subgroup'].strip(),
+                                units=tuple(row['units{}'.format(i)] for i in range(1, 5) if row['units{}'.format(i)]),
+                                function_name=row['function_name'],
+                                ready_path=_plain_path(row['ready_path']),
+                                subgroup_original_code=row['subgroup_original_code'],
+                                subgroup_original_name=row['subgroup_original_name'],
+                                zones=tuple(z for z in self.zone_columns if row[z] == 'Y'))
+                self.metrics.append(metric)
+                if metric.data_type == 'zone':
+                    self.zone_datasets[(metric.zone_name, metric.zone_geometry)] = metric.ready_path
+                    continue
+                if metric.main_feature:
+                    self.by_feature[metric.main_feature].append(metric)
+                self.by_function[metric.function_name].append(metric)
+                for zone in metric.zones:
+                    self.by_zone[zone].append(metric)
+
+    def zone_dataset(self, zone_name, geometry='polygon'):
+        """The ready path of a zone dataset, e.g. zone_dataset('hu12', 'raster'), or None if it is not listed."""
+        return self.zone_datasets.get((zone_name, geometry))
+
+    def subgroup_mapping(self, rename_tag):
+        """
+        The output names of the classes of the datasets whose main feature is part of rename_tag, e.g. the NLCD class
+        codes to 'forest', 'developedhighintensity'... for 'hu12_nlcd2011'. Computed once per tag.
+        :param str rename_tag: Variable name used for the output columns of a zonal summary
+        :return: Dictionary of subgroup_original_code to subgroup
+        """
+        with _lock:
+            if rename_tag not in self._mappings:
+                matches = [m for feature, metrics in self.by_feature.items() if feature in rename_tag
+                           for m in metrics]
+                matches.sort(key=lambda m: m.line)
+                self._mappings[rename_tag] = {m.subgroup_original_code: m.subgroup for m in matches}
+            return dict(self._mappings[rename_tag])
+
+
+def load(provenance_csv=PROVENANCE_CSV):
+    """The catalog for provenance_csv, read on the first call in this process and reused after that."""
+    path = os.path.abspath(provenance_csv)
+    with _lock:
+        if path not in _catalogs:
+            _catalogs[path] = MetricCatalog(path)
+        return _catalogs[path]
+
+
+# ---PLANNER------------------------------------------------------------------------------------------------------------
+def zone_field(zone):
+    """The id field of a zone type: lagoslakeid for lakes, flat<zone>_zoneid for flattened zones, else <zone>_zoneid."""
+    return 'lagoslakeid' if zone == 'lake' else '{}_zoneid'.format(zone)
+
+
+def _variable_name(zone, metric):
+    # composition and density metrics cover every subgroup of the dataset in one output
+    if metric.data_type == 'zonal_stats' and metric.subgroup:
+        return '{}_{}_{}'.format(zone, metric.main_feature, metric.subgroup)
+    return '{}_{}'.format(zone, metric.main_feature)
+
+
+def expand_jobs(catalog, out_gdb, csv_folder, zones=None, zone_datasets=None, unflat_tables=None):
+    """
+    Expand the catalog into one job per dataset and zone type, for the metrics computed by the functions in
+    PLANNED_FUNCTIONS.
+    :param MetricCatalog catalog: See load
+    :param str out_gdb: Geodatabase for the output tables
+    :param str csv_folder: Directory for the CSV exports
+    :param zones: (Optional) Zone types to plan, e.g. ['hu12', 'county']. Default is all.
+    :param dict zone_datasets: (Optional) Zone datasets by (zone type, geometry), overriding or adding to those in
+    the catalog, e.g. {('flatbuff100', 'polygon'): path}
+    :param dict unflat_tables: (Optional) The flatten_overlaps output table of each flattened zone type, e.g.
+    {'flatbuff100': path}. Raster summaries for a flattened zone type without one are skipped.
+    :return: Tuple of (list of Job, list of (metric line, zone, reason) for the combinations not planned)
+    """
+    datasets = dict(catalog.zone_datasets)
+    datasets.update(zone_datasets or {})
+    unflat_tables = unflat_tables or {}
+    jobs = []
+    seen = set()
+    skipped = []
+
+    for function_name in sorted(PLANNED_FUNCTIONS):
+        for metric in catalog.by_function[function_name]:
+            for zone in metric.zones:
+                if zones and zone not in zones:
+                    continue
+                if function_name == 'lakes_in_zones':
+                    name = '{}_lakedensity'.format(zone)
+                elif function_name == 'zonal_attribution_of_raster_data' and zone.startswith('flat'):
+                    name = _variable_name(zone[len('flat'):], metric)  # results are unflattened to the zones
+                else:
+                    name = _variable_name(zone, metric)
+                # the subgroups of one dataset share a job
+                if (function_name, name) in seen:
+                    continue
+                seen.add((function_name, name))
+                if not metric.ready_path or any(t in metric.ready_path for t in TEMPLATE_MARKERS):
+                    skipped.append((metric.line, zone, 'no single ready path'))
+                    continue
+                output = os.path.join(out_gdb, name)
+                units = metric.units[0] if metric.units and metric.data_type == 'zonal_stats' else ''
+                unflat_table = ''
+
+                if function_name == 'zonal_attribution_of_raster_data':
+                    # summarize against the zone raster made once for all datasets, if there is one
+                    zone_input = datasets.get((zone, 'raster')) or datasets.get((zone, 'polygon'))
+                    if zone.startswith('flat'):
+                        unflat_table = unflat_tables.get(zone)
+                        if not unflat_table:
+                            skipped.append((metric.line, zone, 'no unflat table'))
+                            continue
+                    args = [zone_input, zone_field(zone), metric.ready_path, output,
+                            metric.data_type == 'composition', unflat_table, name, units]
+                elif function_name == 'point_attribution_of_raster_data':
+                    zone_input = datasets.get((zone, 'point'))
+                    args = [zone_input, zone_field(zone), metric.ready_path, output, name, units]
+                elif function_name == 'zonal_attribution_of_polygon_data':
+                    zone_input = datasets.get((zone, 'polygon'))
+                    class_field = metric.subgroup_original_name or metric.main_feature
+                    args = [zone_input, zone_field(zone), metric.ready_path, output, class_field, name]
+                else:
+                    zone_input = datasets.get((zone, 'polygon'))
+                    args = [zone_input, zone_field(zone), metric.ready_path, output]
+                if not zone_input:
+                    skipped.append((metric.line, zone, 'no zone dataset'))
+                    continue
+
+                jobs.append(Job(function=PLANNED_FUNCTIONS[function_name], args=args, output=output,
+                                csv=os.path.join(csv_folder, '{}.csv'.format(name)), zone=zone,
+                                zone_input=zone_input, unflat_table=unflat_table, dataset=metric.ready_path))
+    return jobs, skipped
+
+
+def order_jobs(jobs):
+    """
+    Order the jobs so that those sharing inputs run back to back: grouped by zone input (each zone raster or zone
+    feature class, with its unflat table), and within a group by dataset, so the jobs reading the same reference layer
+    (e.g. PAD-US or the lakes) follow each other too.
+    :param jobs: List of Job
+    :return: List of lists of Job, one list per zone input
+    """
+    groups = defaultdict(list)
+    for job in jobs:
+        groups[(job.zone_input, job.unflat_table)].append(job)
+    ordered = []
+    for key in sorted(groups):
+        ordered.append(sorted(groups[key], key=lambda j: (j.dataset, j.function, j.output)))
+    return ordered
+
+
+def _format_arg(arg):
+    if isinstance(arg, bool):
+        return str(arg)
+    if arg and ('\\' in arg or '/' in arg):
+        return "r'{}'".format(arg)
+    return arg
+
+
+def write_job_control(groups, out_csv):
+    """
+    Write the ordered jobs as a job control CSV (see read_job_control.read_job_control).
+    :param groups: Output of order_jobs
+    :param str out_csv: Output CSV path
+    :return: out_csv
+    """
+    with open(out_csv, 'wb') as csv_file:
+        writer = csv.DictWriter(csv_file, JOB_CONTROL_HEADER)
+        writer.writeheader()
+        line = 0
+        for group in groups:
+            for job in group:
+                line += 1
+                row = {'Line': line, 'Function': job.function, 'Output': _format_arg(job.output),
+                       'CSV': _format_arg(job.csv)}
+                for i, arg in enumerate(job.args):
+                    row['Arg{}'.format(i + 1)] = _format_arg(arg)
+                writer.writerow(row)
+    return out_csv
+
+
+def plan(out_csv, out_gdb, csv_folder, zones=None, zone_datasets=None, unflat_tables=None,
+         provenance_csv=PROVENANCE_CSV):
+    """
+    Plan the GEO zonal metrics in geo_metric_provenance.csv and write the job control CSV to run them.
+    :param str out_csv: Output job control CSV
+    :param str out_gdb: Geodatabase for the output tables
+    :param str csv_folder: Directory for the CSV exports
+    :param zones: (Optional) Zone types to plan. Default is all.
+    :param dict zone_datasets: (Optional) Zone datasets by (zone type, geometry), see expand_jobs
+    :param dict unflat_tables: (Optional) Unflat tables by flattened zone type, see expand_jobs
+    :param str provenance_csv: (Optional) Provenance file
+    :return: Tuple of (list of lists of Job as written, list of skipped (metric line, zone, reason))
+    """
+    catalog = load(provenance_csv)
+    jobs, skipped = expand_jobs(catalog, out_gdb, csv_folder, zones, zone_datasets, unflat_tables)
+    groups = order_jobs(jobs)
+    write_job_control(groups, out_csv)
+    print("Planned {} jobs in {} groups of shared zone inputs to {}.".format(len(jobs), len(groups), out_csv))
+    reasons = defaultdict(int)
+    for line, zone, reason in skipped:
+        reasons[reason] += 1
+    for reason, count in sorted(reasons.items()):
+        print("Skipped {} dataset and zone combinations: {}".format(count, reason))
+    return groups, skipped
@@ -14,10 +14,8 @@ import arcpy
 # Locate files and specify raster processing environments
 GDALDEM = r'C:\cygwin64\bin\gdaldem.exe' # version GDAL 3.3.0, released 2021/04/26
 
-zip_dir = 'F:/Continental_Limnology/Data_Downloaded/3DEP_National_Elevation_Dataset/Zipped'
-arcpy.env.snapRaster = './common_grid.tif'
-arcpy.env.cellSize = './common_grid.tif'
-arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(5070)
+ZIP_DIR = 'F:/Continental_Limnology/Data_Downloaded/3DEP_National_Elevation_Dataset/Zipped'
+COMMON_GRID = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common_grid.tif')
 
 
 def process_file(file):
@@ -54,10 +52,22 @@ def process_file(file):
             arcpy.Delete_management(f)
 
 
-# Run all the files through
-zip_files = [os.path.join(zip_dir, f) for f in os.listdir(zip_dir)]
-counter = 0
-for f in zip_files:
-    counter += 1
-    print(counter)
-    process_file(f)
+def process_all(zip_dir=ZIP_DIR):
+    """
+    Run all the files in zip_dir through process_file.
+    :param zip_dir: Directory of the zipped NED downloads
+    :return: None
+    """
+    arcpy.env.snapRaster = COMMON_GRID
+    arcpy.env.cellSize = COMMON_GRID
+    arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(5070)
+    zip_files = [os.path.join(zip_dir, f) for f in os.listdir(zip_dir)]
+    counter = 0
+    for f in zip_files:
+        counter += 1
+        print(counter)
+        process_file(f)
+
+
+if __name__ == '__main__':
+    process_all()
@@ -0,0 +1,280 @@
+# filename: national_network.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Stitch the per-subregion NHD flow networks into one national network, stored as one published partition
+# per HU4 plus an index of the flowlines where flow crosses from one partition to another.
+
+import csv
+import json
+import os
+from collections import defaultdict, deque
+
+import arcpy
+import numpy as np
+
+from NHDNetwork import NHDNetwork
+import shared_network
+
+MANIFEST_NAME = 'national.json'
+EDGES_NAME = 'cross_partition_edges.csv'
+LOCAL_NAME = 'local_flowline.npy'
+
+
+def build_national_network(nhd_gdb_list, out_dir, exclude_intermittent_flow=False):
+    """
+    Publish every subregion network as a partition and index the flow between partitions. Each subregion flow table
+    names the flowlines just across its boundary (the outlet of the upstream subregion and the inlet of the downstream
+    subregion) by Permanent_Identifier. Those boundary flowlines are matched to the partition that actually contains
+    them, and each match is written to the cross-partition edge index.
+    :param list nhd_gdb_list: NHD or NHDPlus HR geodatabases, one per HU4
+    :param str out_dir: Directory to hold the partitions and index
+    :param bool exclude_intermittent_flow: Whether to drop intermittent flow from every partition
+    :return: out_dir
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    # ---PUBLISH PARTITIONS-----
+    partitions = []
+    for gdb in nhd_gdb_list:
+        network = NHDNetwork(gdb)
+        arcpy.AddMessage("Publishing partition for {}...".format(network.huc4))
+        if exclude_intermittent_flow:
+            network.drop_intermittent_flow()
+        partition_dir = network.publish(os.path.join(out_dir, network.huc4))
+
+        # flag the nodes that are flowlines in this gdb, the others are boundary flowlines from the flow table
+        flowline_ids = np.load(os.path.join(partition_dir, 'flowline_ids.npy'), mmap_mode='r')
+        local_ids = [r[0] for r in network._read_rows(network.flowline, ['Permanent_Identifier'])]
+        local = np.zeros(flowline_ids.size, dtype=bool)
+        local_index = shared_network.lookup_ids(flowline_ids, local_ids)
+        local[local_index[local_index >= 0]] = True
+        np.save(os.path.join(partition_dir, LOCAL_NAME), local)
+        partitions.append(network.huc4)
+        del network
+
+    # ---MATCH BOUNDARY FLOWLINES-----
+    arcpy.AddMessage("Matching boundary flowlines across partitions...")
+    boundary = {}
+    for huc4 in partitions:
+        partition = shared_network.SharedNetwork(os.path.join(out_dir, huc4))
+        local = np.load(os.path.join(out_dir, huc4, LOCAL_NAME))
+        foreign = np.flatnonzero(~local)
+        upstream_counts = np.diff(partition.upstream_indptr)[foreign]
+        directions = np.where(upstream_counts > 0, 'outlet', 'inlet')
+        boundary[huc4] = dict(zip(shared_network.decode_ids(partition.flowline_ids, foreign), directions.tolist()))
+
+    all_boundary_ids = {id for ids in boundary.values() for id in ids}
+    owners = {}
+    for huc4 in partitions:
+        partition = shared_network.SharedNetwork(os.path.join(out_dir, huc4))
+        local = np.load(os.path.join(out_dir, huc4, LOCAL_NAME), mmap_mode='r')
+        candidates = list(all_boundary_ids)
+        found = shared_network.lookup_ids(partition.flowline_ids, candidates)
+        for id, index in zip(candidates, found):
+            if index >= 0 and local[index]:
+                owners[id] = huc4
+
+    with open(os.path.join(out_dir, EDGES_NAME), 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['partition', 'Permanent_Identifier', 'direction', 'owner_partition'])
+        for huc4 in partitions:
+            for id, direction in sorted(boundary[huc4].items()):
+                if id in owners:
+                    writer.writerow([huc4, id, direction, owners[id]])
+
+    unmatched = all_boundary_ids.difference(owners.keys())
+    if unmatched:
+        arcpy.AddMessage("{} boundary flowlines flow to or from outside the partitions supplied.".format(
+            len(unmatched)))
+
+    with open(manifest_path, 'w') as f:
+        json.dump({'partitions': partitions,
+                   'exclude_intermittent_flow': exclude_intermittent_flow}, f, indent=2)
+    return out_dir
+
+
+class NationalNetwork:
+    """
+    Trace across subregion boundaries on a network built with build_national_network. Partitions are attached only
+    when a trace reaches them, and every trace is started from a known subregion. Traces use the complete network with
+    no barriers.
+
+    :param str national_dir: Directory written by build_national_network
+
+    Attributes
+    ----------
+    :ivar list partition_names: HU4 codes of all partitions in the national network
+    :ivar dict partitions: Attached partitions, key = HU4 code, value = shared_network.SharedNetwork
+    :ivar dict crossings: Key = HU4 code, value = dictionary with key = boundary flowline Permanent_Identifier,
+    value = HU4 code of the partition containing that flowline
+    """
+
+    def __init__(self, national_dir):
+        manifest_path = os.path.join(national_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            raise Exception("No national network found at {}.".format(national_dir))
+        with open(manifest_path) as f:
+            self.partition_names = json.load(f)['partitions']
+        self.path = national_dir
+        self.partitions = {}
+        self.crossings = defaultdict(dict)
+        with open(os.path.join(national_dir, EDGES_NAME)) as f:
+            for row in csv.DictReader(f):
+                self.crossings[row['partition']][row['Permanent_Identifier']] = row['owner_partition']
+        self._crossing_indices = {}
+
+    def partition(self, huc4):
+        """
+        Attach to a partition if not already attached.
+        :param str huc4: HU4 code of the partition
+        :return: shared_network.SharedNetwork for the partition
+        """
+        if huc4 not in self.partitions:
+            if huc4 not in self.partition_names:
+                raise ValueError("{} is not a partition of this national network.".format(huc4))
+            partition = shared_network.SharedNetwork(os.path.join(self.path, huc4))
+            crossing_ids = list(self.crossings[huc4].keys())
+            crossing_index = shared_network.lookup_ids(partition.flowline_ids, crossing_ids)
+            self._crossing_indices[huc4] = (crossing_index, [self.crossings[huc4][id] for id in crossing_ids])
+            self.partitions[huc4] = partition
+        return self.partitions[huc4]
+
+    def _walk_partitions(self, huc4, start_ids, direction, first_flowlines=None):
+        """
+        Trace within a partition, then continue the trace in the partitions on the far side of any boundary flowlines
+        reached.
+        :return: Tuple of (set of flowline Permanent_Identifiers, set of waterbody Permanent_Identifiers, set of
+        partitions touched)
+        """
+        flowlines = set()
+        waterbodies = set()
+        started = defaultdict(set)
+        queue = deque([(huc4, start_ids, first_flowlines)])
+        while queue:
+            huc4, ids, trace = queue.popleft()
+            ids = [id for id in ids if id not in started[huc4]]
+            if not ids and trace is None:
+                continue
+            started[huc4].update(ids)
+            partition = self.partition(huc4)
+            if direction == 'up':
+                indptr, indices = partition.upstream_indptr, partition.upstream_indices
+            else:
+                indptr, indices = partition.downstream_indptr, partition.downstream_indices
+            if trace is None:
+                start = shared_network.lookup_ids(partition.flowline_ids, ids)
+                trace = partition._walk(indptr, indices, start[start >= 0])
+            flowlines.update(shared_network.decode_ids(partition.flowline_ids, trace))
+            waterbodies.update(shared_network.decode_ids(partition.waterbody_ids,
+                                                         partition._flowline_waterbodies(trace)))
+
+            # hand off to neighboring partitions
+            crossing_index, crossing_owners = self._crossing_indices[huc4]
+            in_trace = np.zeros(partition.flowline_ids.size, dtype=bool)
+            in_trace[trace] = True
+            reached = (crossing_index >= 0) & in_trace[crossing_index]
+            handoff = defaultdict(list)
+            reached_ids = shared_network.decode_ids(partition.flowline_ids, crossing_index[reached])
+            for id, owner in zip(reached_ids, np.array(crossing_owners)[reached].tolist()):
+                handoff[owner].append(id)
+            for owner, owner_ids in handoff.items():
+                queue.append((owner, owner_ids, None))
+        return flowlines, waterbodies, set(started.keys())
+
+    # ---WATERSHED TRACING METHODS--------------------------------------------------------------------------------------
+    def trace_up_from_a_flowline(self, flowline_start_id, huc4, include_wb_permids=True):
+        """
+        Trace the national network upstream of the input flowline, crossing subregion boundaries.
+        :param str flowline_start_id: Flowline Permanent_Identifier of flow destination (upstream trace start point).
+        :param str huc4: HU4 code of the subregion containing the flowline
+        :param bool include_wb_permids: Whether to include waterbody Permanent_Identifiers in the trace.
+        :return: List of Permanent_Identifier values in the upstream network trace, including the start
+        """
+        flowlines, waterbodies, touched = self._walk_partitions(huc4, [flowline_start_id], 'up')
+        flowlines.add(flowline_start_id)
+        return list(flowlines.union(waterbodies)) if include_wb_permids else list(flowlines)
+
+    def trace_down_from_a_flowline(self, flowline_start_id, huc4, include_wb_permids=True):
+        """
+        Trace the national network downstream of the input flowline, crossing subregion boundaries.
+        :param str flowline_start_id: Flowline Permanent_Identifier of the downstream trace start point.
+        :param str huc4: HU4 code of the subregion containing the flowline
+        :param bool include_wb_permids: Whether to include waterbody Permanent_Identifiers in the trace.
+        :return: List of Permanent_Identifier values in the downstream network trace, including the start
+        """
+        flowlines, waterbodies, touched = self._walk_partitions(huc4, [flowline_start_id], 'down')
+        flowlines.add(flowline_start_id)
+        return list(flowlines.union(waterbodies)) if include_wb_permids else list(flowlines)
+
+    def trace_up_from_a_waterbody(self, waterbody_start_id, huc4):
+        """
+        Trace the national network upstream of the input waterbody, crossing subregion boundaries. See
+        NHDNetwork.trace_up_from_a_waterbody.
+        :param str waterbody_start_id: Waterbody Permanent_Identifier of flow destination (upstream trace start point).
+        :param str huc4: HU4 code of the subregion containing the waterbody outlet(s)
+        :return: List of Permanent_Identifier values for flowlines and waterbodies in the upstream network trace.
+        Empty list if waterbody is isolated.
+        """
+        return list(self._trace_waterbody(waterbody_start_id, huc4, 'up'))
+
+    def trace_down_from_a_waterbody(self, waterbody_start_id, huc4):
+        """
+        Trace the national network downstream of the input waterbody, crossing subregion boundaries. See
+        NHDNetwork.trace_down_from_a_waterbody.
+        :param str waterbody_start_id: Waterbody Permanent_Identifier of the downstream trace start point.
+        :param str huc4: HU4 code of the subregion containing the waterbody inlet(s)
+        :return: List of Permanent_Identifier values for flowlines and waterbodies in the downstream network trace.
+        """
+        return list(self._trace_waterbody(waterbody_start_id, huc4, 'down'))
+
+    def _trace_waterbody(self, waterbody_start_id, huc4, direction):
+        partition = self.partition(huc4)
+        partition.deactivate_stops()
+        if direction == 'up':
+            indptr, indices = partition.upstream_indptr, partition.upstream_indices
+        else:
+            indptr, indices = partition.downstream_indptr, partition.downstream_indices
+        trace, waterbodies = partition._trace_waterbody(waterbody_start_id, indptr, indices, indptr, indices)
+        if not trace.size:
+            return set()
+        flowlines, waterbodies, touched = self._walk_partitions(huc4, [], direction, first_flowlines=trace)
+        return flowlines.union(waterbodies)
+
+    # ---OTHER CONNECTIVITY CALCULATIONS--------------------------------------------------------------------------------
+    def find_upstream_lakes(self, waterbody_start_id, huc4, result_type='list', area_threshold=0):
+        """
+        Identify and/or summarize the count or area of lakes upstream of this focal lake across the whole national
+        network. See NHDNetwork.find_upstream_lakes.
+        :param str waterbody_start_id: The Permanent_Identifier for the lake to be assessed
+        :param str huc4: HU4 code of the subregion containing the lake outlet(s)
+        :param str result_type: 'list', 'count', or 'area_hectares'. The result type to be returned.
+        :param float area_threshold: An area threshold applied to filter the upstream lakes to be identified/summarized.
+        :return: A list, int, or float corresponding to the result_type selected.
+        """
+        valid_result_type = {'list', 'count', 'area_hectares'}
+        if result_type not in valid_result_type:
+            raise ValueError("result_type must be one of {}".format(valid_result_type))
+
+        trace_up_other = self._trace_waterbody(waterbody_start_id, huc4, 'up').difference({waterbody_start_id})
+        # lakes split by a subregion boundary are in more than one partition but have the same area in each
+        lakes_areas = {}
+        for partition in self.partitions.values():
+            candidates = list(trace_up_other)
+            index = shared_network.lookup_ids(partition.waterbody_ids, candidates)
+            for id, i in zip(candidates, index):
+                if i >= 0 and partition.lake_area[i] >= area_threshold:
+                    lakes_areas[id] = float(partition.lake_area[i])
+        upstream_lakes = list(lakes_areas.keys())
+
+        if result_type == 'list':
+            return upstream_lakes
+        if result_type == 'count':
+            return len(upstream_lakes)
+        if result_type == 'area_hectares':
+            return sum(lakes_areas.values()) * 100  # convert to hectares
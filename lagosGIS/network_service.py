@@ -0,0 +1,216 @@
+# filename: network_service.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Long-running localhost service that keeps NHDNetwork graphs in memory and answers batches of network
+# queries, plus the client used to talk to it.
+
+import json
+import time
+from collections import OrderedDict
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urllib2 import Request, urlopen
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.request import Request, urlopen
+
+import NHDNetwork
+
+DEFAULT_PORT = 8765
+
+# key = NHDNetwork method that answers the query, value = type of Permanent_Identifier it takes (None = no id)
+QUERIES = {'trace_up_from_a_flowline': 'flowline',
+           'trace_down_from_a_flowline': 'flowline',
+           'trace_up_from_a_waterbody': 'waterbody',
+           'trace_down_from_a_waterbody': 'waterbody',
+           'find_upstream_lakes': 'waterbody',
+           'classify_waterbody_connectivity': 'waterbody',
+           'identify_lake_inlets': 'waterbody',
+           'identify_lake_outlets': 'waterbody',
+           'identify_subregion_inlets': None,
+           'identify_subregion_outlets': None}
+
+
+class NetworkCache:
+    """
+    Least-recently-used cache of fully prepared NHDNetwork instances, one per HU4.
+
+    :param str gdb_template: Path to the NHD geodatabases with {} in place of the 4-digit HU4 code, e.g.
+    r'D:\\NHDPlus\\NHDPLUS_H_{}_HU4_GDB.gdb'
+    :param int max_networks: Number of networks to hold in memory before evicting the least recently used
+    :param bool force_lagos: Passed to NHDNetwork.define_lakes
+    """
+
+    def __init__(self, gdb_template, max_networks=4, force_lagos=False):
+        self.gdb_template = gdb_template
+        self.max_networks = max_networks
+        self.force_lagos = force_lagos
+        self.networks = OrderedDict()
+
+    def get(self, huc4):
+        """
+        Return the network for a subregion, building it if it is not already in memory.
+        :param str huc4: 4-digit HU4 code
+        :return: NHDNetwork instance
+        """
+        if huc4 in self.networks:
+            network = self.networks.pop(huc4)
+        else:
+            start = time.time()
+            network = NHDNetwork.NHDNetwork(self.gdb_template.format(huc4))
+            network.prepare_upstream()
+            network.prepare_downstream()
+            network.map_flowlines_to_waterbodies()
+            network.map_waterbodies_to_flowlines()
+            network.define_lakes(strict_minsize=False, force_lagos=self.force_lagos)
+            network.activate_10ha_lake_stops()
+            network.deactivate_stops()
+            print("Loaded network for {} in {:.1f} seconds.".format(huc4, time.time() - start))
+            while len(self.networks) >= self.max_networks:
+                evicted, _ = self.networks.popitem(last=False)
+                print("Evicted network for {}.".format(evicted))
+        self.networks[huc4] = network
+        return network
+
+
+def run_queries(cache, request):
+    """
+    Answer a batch of queries. Each query names one of the QUERIES and the HU4 it applies to. Errors are reported per
+    query so that one bad identifier does not fail the batch.
+    :param NetworkCache cache: The cache holding the networks
+    :param dict request: {'queries': [{'huc4': '0411', 'query': 'trace_up_from_a_waterbody', 'id': '...'}, ...]}
+    Queries may include 'kwargs' with keyword arguments for the method, such as result_type for find_upstream_lakes.
+    :return: {'results': [{'result': ...} or {'error': '...'}, ...]} in the same order as the queries
+    """
+    results = []
+    for query in request.get('queries', []):
+        try:
+            name = query['query']
+            if name not in QUERIES:
+                raise ValueError("query must be one of {}".format(sorted(QUERIES.keys())))
+            network = cache.get(query['huc4'])
+            method = getattr(network, name)
+            kwargs = query.get('kwargs', {})
+            if QUERIES[name]:
+                result = method(query['id'], **kwargs)
+            else:
+                result = method(**kwargs)
+            if isinstance(result, (set, tuple)):
+                result = list(result)
+            results.append({'result': result})
+        except Exception as e:
+            results.append({'error': '{}: {}'.format(type(e).__name__, e)})
+    return {'results': results}
+
+
+def serve(gdb_template, port=DEFAULT_PORT, max_networks=4, force_lagos=False):
+    """
+    Run the network query service on localhost until interrupted. POST a JSON batch (see run_queries) to /query, or
+    GET /status to list the networks in memory. Requests are answered one at a time, so NHDNetwork barrier state is
+    never shared between concurrent queries.
+    :param str gdb_template: Path to the NHD geodatabases with {} in place of the 4-digit HU4 code
+    :param int port: Localhost port to listen on
+    :param int max_networks: Number of networks to hold in memory before evicting the least recently used
+    :param bool force_lagos: Passed to NHDNetwork.define_lakes
+    :return: None
+    """
+    cache = NetworkCache(gdb_template, max_networks, force_lagos)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/status':
+                self._respond({'networks': list(cache.networks.keys()), 'max_networks': cache.max_networks})
+            else:
+                self._respond({'error': 'Unknown path {}'.format(self.path)}, 404)
+
+        def do_POST(self):
+            if self.path != '/query':
+                self._respond({'error': 'Unknown path {}'.format(self.path)}, 404)
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                request = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError as e:
+                self._respond({'error': 'Request is not valid JSON: {}'.format(e)}, 400)
+                return
+            self._respond(run_queries(cache, request))
+
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    print("NHDNetwork query service listening on http://127.0.0.1:{}".format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class NetworkServiceClient:
+    """
+    Client for a running network query service.
+
+    :param int port: Localhost port the service is listening on
+    :param float timeout: Seconds to wait for a response. Allow for network construction the first time an HU4 is
+    queried.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, timeout=600):
+        self.url = 'http://127.0.0.1:{}'.format(port)
+        self.timeout = timeout
+
+    def _post(self, payload):
+        request = Request(self.url + '/query', json.dumps(payload).encode('utf-8'),
+                          {'Content-Type': 'application/json'})
+        return json.loads(urlopen(request, timeout=self.timeout).read().decode('utf-8'))
+
+    def status(self):
+        """
+        :return: Dictionary listing the HU4s currently held in memory by the service
+        """
+        return json.loads(urlopen(self.url + '/status', timeout=self.timeout).read().decode('utf-8'))
+
+    def query(self, huc4, query, ids=None, **kwargs):
+        """
+        Run one kind of query for many identifiers in a single request.
+        :param str huc4: 4-digit HU4 code of the subregion
+        :param str query: One of the QUERIES, named for the NHDNetwork method that answers it
+        :param list ids: Waterbody or flowline Permanent_Identifiers, required for all but the subregion inlet/outlet
+        queries
+        :param kwargs: Keyword arguments for the NHDNetwork method, e.g. result_type='count'
+        :return: Dictionary with key = Permanent_Identifier (or huc4 for subregion queries), value = result
+        """
+        if query not in QUERIES:
+            raise ValueError("query must be one of {}".format(sorted(QUERIES.keys())))
+        if QUERIES[query] and ids is None:
+            raise ValueError("Query {} needs a list of {} Permanent_Identifiers.".format(query, QUERIES[query]))
+        keys = ids if QUERIES[query] else [huc4]
+        queries = [{'huc4': huc4, 'query': query, 'id': key, 'kwargs': kwargs} for key in keys]
+        results = self._post({'queries': queries})['results']
+        output = {}
+        for key, result in zip(keys, results):
+            if 'error' in result:
+                raise Exception("Query {} failed for {}: {}".format(query, key, result['error']))
+            output[key] = result['result']
+        return output
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve NHDNetwork queries on localhost.')
+    parser.add_argument('gdb_template', help='NHD geodatabase path with {} in place of the HU4 code')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max_networks', type=int, default=4)
+    parser.add_argument('--force_lagos', action='store_true')
+    args = parser.parse_args()
+    serve(args.gdb_template, args.port, args.max_networks, args.force_lagos)
@@ -5,10 +5,14 @@
 # tool type: re-usable (NO ArcGIS Toolbox)
 
 import os
+from multiprocessing import Pool
+
 import arcpy
 
+import nhd_staging
+
 
-def batch_add_merge_ids(nhd_parent_directory, overwrite=False):
+def batch_add_merge_ids(nhd_parent_directory, overwrite=False, processes=1):
     """
     Adds a new id field called nhd_merge_id to all feature classes containing the identifier "Permanent_Identifier"
     in all NHD geodatabases in the parent directory provided. The resulting field can be used to link multiple
@@ -16,31 +20,34 @@ def batch_add_merge_ids(nhd_parent_directory, overwrite=False):
     ID conflicts. Outputs will also need a merge rule to be safely combined, see nhd_gp_output_merge.
 
     :param nhd_parent_directory: The directory containing all (unzipped) NHD subregion geodatabases.
+    :param overwrite: Recalculate nhd_merge_id where it already exists.
+    :param processes: Number of geodatabases to update at once. Use more than 1 only from a script with an
+    if __name__ == '__main__' guard. See also nhd_staging.stage_nhd, which unzips the subregions as well.
     :return: None
     """
-    # Find all fcs containing a field called "Permanent_Identifier"
+    # Find all geodatabases with feature classes containing a field called "Permanent_Identifier"
     print("Finding feature classes containing Permanent_Identifier...")
-    fcs = []
+    gdbs = []
     for dirpath, dirnames, filenames in arcpy.da.Walk(nhd_parent_directory, datatype="FeatureClass"):
-        for filename in filenames:
-            if filename in ['NHDWaterbody', 'NHDFlowline', 'NHDArea']:
-                fc = os.path.join(dirpath, filename)
-                fcs.append(fc)
+        if any(f in nhd_staging.MERGE_ID_FEATURE_CLASSES for f in filenames):
+            gdb = dirpath[:dirpath.lower().index('.gdb') + 4]
+            if gdb not in gdbs:
+                gdbs.append(gdb)
 
-    # For each fc in the list, calculate a new field. The two fields being concatenated into the new field are
+    # For each gdb in the list, calculate a new field. The two fields being concatenated into the new field are
     # a composite key in a naive merge of all NHD features (with full identicals removed).
-    for fc in fcs:
-        print("Adding new identifier all_merge_id to {}...".format(fc.split(nhd_parent_directory)[1]))
-        if arcpy.ListFields(fc, "nhd_merge_id"):
-            if overwrite:
-                arcpy.DeleteField_management(fc, "nhd_merge_id")
-            else:
-                continue
-        arcpy.AddField_management(fc, "nhd_merge_id", "TEXT", field_length=70)
-        with arcpy.da.UpdateCursor(fc, ["nhd_merge_id", "Permanent_Identifier", "FDate"]) as cursor:
-            for row in cursor:
-                row[0] = '{}_{}'.format(row[1], str(row[2]))
-                cursor.updateRow(row)
+    print("Adding new identifier nhd_merge_id in {} geodatabases...".format(len(gdbs)))
+    tasks = [(gdb, nhd_staging.MERGE_ID_FEATURE_CLASSES, overwrite) for gdb in gdbs]
+    if processes > 1 and len(tasks) > 1:
+        pool = Pool(min(processes, len(tasks)))
+        try:
+            pool.map(nhd_staging._stamp_worker, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            nhd_staging.stamp_merge_ids(*task)
 
 
 def batch_add_merge_ids2(nhd_parent_directory):
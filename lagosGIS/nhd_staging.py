@@ -0,0 +1,195 @@
+# filename: nhd_staging.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Stage the NHD subregion downloads for processing: extract the NHD_H* archives concurrently, skipping any
+# archive whose checksum is unchanged since it was last staged, stamp nhd_merge_id in each geodatabase in parallel
+# worker processes, and record the staged subregions with their row counts in a manifest.
+
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+from datetime import datetime
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+import data_access
+
+MANIFEST_NAME = 'nhd_staging.json'
+MERGE_ID_FEATURE_CLASSES = ('NHDWaterbody', 'NHDFlowline', 'NHDArea')
+MERGE_ID_LENGTH = 70
+CHUNK_SIZE = 2 ** 20
+
+
+# ---ARCHIVES-----------------------------------------------------------------------------------------------------------
+def list_archives(zip_dir, pattern='NHD_H'):
+    """List the subregion archives in zip_dir, e.g. NHD_H_0101_HU4_GDB.zip."""
+    return sorted(os.path.join(zip_dir, f) for f in os.listdir(zip_dir)
+                  if pattern in f and f.endswith('.zip') and os.path.isfile(os.path.join(zip_dir, f)))
+
+
+def gdb_for_archive(zip_path, out_dir):
+    """The geodatabase an archive extracts to, e.g. NHD_H_0101_HU4_GDB.zip gives NHD_H_0101_HU4_GDB.gdb."""
+    return os.path.join(out_dir, '{}.gdb'.format(os.path.splitext(os.path.basename(zip_path))[0]))
+
+
+def checksum(path):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_archive(zip_path, out_dir, previous_checksum=None):
+    """
+    Extract one archive unless its checksum matches previous_checksum and its geodatabase exists. A changed archive
+    replaces the old geodatabase.
+    :param str zip_path: Subregion archive
+    :param str out_dir: Directory for the geodatabases
+    :param str previous_checksum: (Optional) Checksum recorded when the archive was last staged
+    :return: Tuple of (zip_path, checksum, True if the archive was extracted)
+    """
+    zip_checksum = checksum(zip_path)
+    gdb = gdb_for_archive(zip_path, out_dir)
+    if zip_checksum == previous_checksum and os.path.exists(gdb):
+        return zip_path, zip_checksum, False
+    if os.path.exists(gdb):
+        shutil.rmtree(gdb)
+    zf = zipfile.ZipFile(zip_path)
+    try:
+        zf.extractall(out_dir)
+    finally:
+        zf.close()
+    return zip_path, zip_checksum, True
+
+
+def _extract_worker(args):
+    return extract_archive(*args)
+
+
+# ---MERGE IDS----------------------------------------------------------------------------------------------------------
+def merge_id(permanent_identifier, fdate):
+    """
+    The nhd_merge_id for a feature: Permanent_Identifier and FDate, which together are a composite key in a naive merge
+    of all NHD features (with full identicals removed). Dates read through OGR are formatted as arcpy formats them.
+    """
+    fdate = str(fdate)
+    if len(fdate) >= 10 and fdate[4] == '/':
+        fdate = fdate[:19].replace('/', '-')
+    return '{}_{}'.format(permanent_identifier, fdate)
+
+
+def stamp_merge_ids(gdb, feature_classes=MERGE_ID_FEATURE_CLASSES, overwrite=False):
+    """
+    Add nhd_merge_id to the NHD feature classes in one geodatabase and count their rows.
+    :param str gdb: Subregion geodatabase
+    :param feature_classes: Feature class names, found at the top level or in the Hydrography dataset
+    :param bool overwrite: Recalculate nhd_merge_id where it already exists
+    :return: Tuple of (gdb, dictionary of feature class name to row count)
+    """
+    counts = {}
+    for name in feature_classes:
+        fc = os.path.join(gdb, name)
+        if not data_access.exists(fc):
+            fc = os.path.join(gdb, 'Hydrography', name)
+            if not data_access.exists(fc):
+                continue
+        stamped = 'nhd_merge_id' in [f.name for f in data_access.list_fields(fc)]
+        if stamped and not overwrite:
+            counts[name] = sum(1 for row in data_access.read_rows(fc, [data_access.OID_TOKEN]))
+            continue
+        data_access.add_fields(fc, [('nhd_merge_id', ('TEXT', MERGE_ID_LENGTH))])
+        counts[name] = data_access.update_rows(fc, ['nhd_merge_id', 'Permanent_Identifier', 'FDate'],
+                                               lambda row: [merge_id(row[1], row[2])] + row[1:])
+    return gdb, counts
+
+
+def _stamp_worker(args):
+    return stamp_merge_ids(*args)
+
+
+# ---PIPELINE-----------------------------------------------------------------------------------------------------------
+def read_manifest(out_dir):
+    """The staging manifest in out_dir, or an empty one if the directory has not been staged yet."""
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'subregions': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(out_dir, manifest):
+    manifest['updated'] = datetime.now().isoformat()
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def stage_nhd(zip_dir, out_dir, threads=4, processes=1, overwrite_merge_ids=False,
+              feature_classes=MERGE_ID_FEATURE_CLASSES):
+    """
+    Extract the NHD subregion archives and add nhd_merge_id, redoing only the subregions whose archive changed or
+    that were not completely staged before, and write the manifest (nhd_staging.json) to out_dir.
+    :param str zip_dir: Directory of the downloaded NHD_H*.zip archives
+    :param str out_dir: Directory for the extracted geodatabases
+    :param int threads: Number of archives extracted at once. Threads are used because hashing and decompressing
+    release the interpreter lock, so no guard on the main script is needed.
+    :param int processes: Number of processes stamping merge ids, one geodatabase each. Use more than 1 only from a
+    script with an if __name__ == '__main__' guard, since the workers re-import the main script on Windows.
+    :param bool overwrite_merge_ids: Recalculate nhd_merge_id in every geodatabase
+    :param feature_classes: Feature classes to stamp
+    :return: The manifest, a dictionary with 'subregions': {geodatabase name: {'archive', 'checksum', 'extracted',
+    'staged', 'row_counts'}}
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    manifest = read_manifest(out_dir)
+    subregions = manifest['subregions']
+    archives = list_archives(zip_dir)
+
+    # ---EXTRACT-----
+    start = datetime.now()
+    tasks = []
+    for zip_path in archives:
+        previous = subregions.get(os.path.basename(gdb_for_archive(zip_path, out_dir)), {})
+        tasks.append((zip_path, out_dir, previous.get('checksum') if previous.get('extracted') else None))
+    pool = ThreadPool(max(1, min(threads, len(tasks))))
+    try:
+        extracted = pool.map(_extract_worker, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    for zip_path, zip_checksum, was_extracted in extracted:
+        name = os.path.basename(gdb_for_archive(zip_path, out_dir))
+        entry = subregions.setdefault(name, {})
+        entry.update({'archive': os.path.basename(zip_path), 'checksum': zip_checksum})
+        if was_extracted:
+            entry.update({'extracted': datetime.now().isoformat(), 'staged': False, 'row_counts': {}})
+    print("Extracted {} of {} archives in {} seconds.".format(sum(e for z, c, e in extracted), len(archives),
+                                                               (datetime.now() - start).seconds))
+    write_manifest(out_dir, manifest)
+
+    # ---MERGE IDS-----
+    start = datetime.now()
+    names = [os.path.basename(gdb_for_archive(zip_path, out_dir)) for zip_path in archives]
+    to_stamp = [n for n in names if overwrite_merge_ids or not subregions[n].get('staged')]
+    tasks = [(os.path.join(out_dir, n), feature_classes, overwrite_merge_ids) for n in to_stamp]
+    if processes > 1 and len(tasks) > 1:
+        pool = Pool(min(processes, len(tasks)))
+        try:
+            stamped = pool.map(_stamp_worker, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        stamped = [stamp_merge_ids(*task) for task in tasks]
+    for gdb, counts in stamped:
+        subregions[os.path.basename(gdb)].update({'staged': True, 'row_counts': counts})
+    print("Added nhd_merge_id in {} geodatabases in {} seconds.".format(len(stamped),
+                                                                       (datetime.now() - start).seconds))
+    write_manifest(out_dir, manifest)
+    return manifest
@@ -0,0 +1,198 @@
+# filename: parquet_release.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Write release tables and layers as (Geo)Parquet instead of CSV: typed columns, text ID and flag columns
+# dictionary-encoded, min/max statistics for every row group, optional partitioning by a field, and a JSON schema
+# sidecar built from the same field descriptions as the CSV schema tables. Requires pyarrow.
+
+import json
+import os
+
+import numpy as np
+
+import data_access
+from export_to_csv import describe_fields
+
+ROW_GROUP_SIZE = 100000
+COMPRESSION = 'zstd'
+GEOMETRY_COLUMN = 'geometry'
+ALBERS_CRS = 'ESRI:102039'  # USGS Albers, the projection of all LAGOS-US layers
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+SKIPPED_TYPES = ('OID', 'Geometry', 'Blob', 'Raster')
+MANAGED_FIELDS = ('shape_length', 'shape_area')
+
+
+# ---SCHEMA-------------------------------------------------------------------------------------------------------------
+def arrow_type(field):
+    """The Arrow type for an ArcGIS field type."""
+    import pyarrow as pa
+    types = {'String': pa.string(), 'GUID': pa.string(), 'GlobalID': pa.string(), 'Integer': pa.int32(),
+             'SmallInteger': pa.int16(), 'Double': pa.float64(), 'Single': pa.float32(),
+             'Date': pa.timestamp('ms')}
+    return types[field.type]
+
+
+def geo_metadata(crs=ALBERS_CRS):
+    """
+    The GeoParquet 'geo' file metadata for a WKB geometry column. The CRS is written as PROJJSON when pyproj is
+    available, otherwise as a PROJJSON identifier only.
+    """
+    try:
+        import pyproj
+        projjson = pyproj.CRS.from_user_input(crs).to_json_dict()
+    except ImportError:
+        authority, code = crs.split(':')
+        projjson = {'id': {'authority': authority, 'code': int(code)}}
+    return {'version': '1.0.0', 'primary_column': GEOMETRY_COLUMN,
+            'columns': {GEOMETRY_COLUMN: {'encoding': 'WKB', 'geometry_types': [], 'crs': projjson}}}
+
+
+def _release_fields(in_table, field_list):
+    fields = [f for f in data_access.list_fields(in_table)
+              if f.type not in SKIPPED_TYPES and f.name.lower() not in MANAGED_FIELDS]
+    if field_list:
+        by_name = {f.name: f for f in fields}
+        missing = [name for name in field_list if name not in by_name]
+        if missing:
+            print("WARNING: Specified fields missing from input dataset ({})".format(', '.join(missing)))
+        fields = [by_name[name] for name in field_list if name in by_name]
+    unique = []
+    for f in fields:
+        if f not in unique:
+            unique.append(f)
+    return unique
+
+
+# ---WRITER-------------------------------------------------------------------------------------------------------------
+class _PartitionWriters:
+    """One Parquet writer per output file, opened when the first rows for it arrive."""
+
+    def __init__(self, schema, dictionary_fields, row_group_size, compression):
+        self.schema = schema
+        self.dictionary_fields = dictionary_fields
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.writers = {}
+        self.rows = {}
+
+    def write(self, path, table):
+        import pyarrow.parquet as pq
+        if path not in self.writers:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            self.writers[path] = pq.ParquetWriter(path, self.schema, compression=self.compression,
+                                                  use_dictionary=self.dictionary_fields or False,
+                                                  write_statistics=True)
+            self.rows[path] = 0
+        self.writers[path].write_table(table, row_group_size=self.row_group_size)
+        self.rows[path] += table.num_rows
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        return self.rows
+
+
+def _to_arrow(batch, fields, include_geometry, schema):
+    import pyarrow as pa
+    arrays = []
+    for field in fields:
+        values = [None if isinstance(v, float) and np.isnan(v) else v for v in batch[field.name].tolist()]
+        if field.type in ('Integer', 'SmallInteger'):
+            values = [None if v is None else int(v) for v in values]
+        array = pa.array(values, type=arrow_type(field))
+        if pa.types.is_dictionary(schema.field(field.name).type):
+            array = array.dictionary_encode()
+        arrays.append(array)
+    if include_geometry:
+        arrays.append(pa.array([bytes(v) if v is not None else None for v in batch[data_access.WKB_TOKEN].tolist()],
+                               type=pa.binary()))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_table(in_table, out_folder, name='', field_list=[], include_geometry=False, partition_field=None,
+                dictionary_fields=None, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION, crs=ALBERS_CRS):
+    """
+    Export a table or feature class to Parquet (GeoParquet with include_geometry), with a schema sidecar named
+    <name>_schema.json.
+    :param in_table: The table or feature class to export
+    :param out_folder: The directory for the outputs
+    :param name: (Optional) Output name. Default is the name of the input.
+    :param field_list: (Optional) Fields to export, in order. Default is all attribute fields.
+    :param include_geometry: Write the shapes as WKB in a 'geometry' column with GeoParquet metadata
+    :param partition_field: (Optional) Field to partition by. The output is then a directory <name> with one
+    <partition_field>=<value> subdirectory per value (Hive layout), and the field is stored in the directory names only.
+    :param dictionary_fields: (Optional) Fields to dictionary-encode. Default is all text fields (the zone ids, state
+    lists and flags).
+    :param row_group_size: Maximum rows per row group. Every row group stores min/max statistics for every column.
+    :param compression: Parquet compression codec
+    :param crs: CRS of the geometry, for the GeoParquet metadata
+    :return: Path of the Parquet file, or of the directory if partitioned
+    """
+    import pyarrow as pa
+    if not name:
+        name = os.path.splitext(os.path.basename(str(in_table)))[0]
+    fields = _release_fields(in_table, field_list)
+    partition = [f for f in fields if f.name == partition_field]
+    if partition_field and not partition:
+        raise ValueError("Partition field {} is not in {}".format(partition_field, in_table))
+    data_fields = [f for f in fields if f.name != partition_field]
+    if dictionary_fields is None:
+        dictionary_fields = [f.name for f in data_fields if f.type in ('String', 'GUID', 'GlobalID')]
+    dictionary_fields = [f for f in dictionary_fields if f != partition_field]
+
+    schema_fields = [pa.field(f.name, pa.dictionary(pa.int32(), arrow_type(f)) if f.name in dictionary_fields
+                              else arrow_type(f)) for f in data_fields]
+    if include_geometry:
+        schema_fields.append(pa.field(GEOMETRY_COLUMN, pa.binary()))
+    schema = pa.schema(schema_fields)
+    if include_geometry:
+        schema = schema.with_metadata({'geo': json.dumps(geo_metadata(crs))})
+
+    # ---WRITE-----
+    read_fields = [f.name for f in fields] + ([data_access.WKB_TOKEN] if include_geometry else [])
+    string_lengths = {f.name: 0 for f in fields if f.type == 'String'}
+    out_path = os.path.join(out_folder, name if partition_field else '{}.parquet'.format(name))
+    writers = _PartitionWriters(schema, dictionary_fields, row_group_size, compression)
+    try:
+        for batch in data_access.read_batches(in_table, read_fields):
+            for f in string_lengths:
+                string_lengths[f] = max([string_lengths[f]] + [len(v) for v in batch[f].tolist() if v])
+            table = _to_arrow(batch, data_fields, include_geometry, schema)
+            if not partition_field:
+                writers.write(out_path, table)
+                continue
+            values = np.array([NULL_PARTITION if v is None else str(v) for v in batch[partition_field].tolist()],
+                              dtype=object)
+            for value in sorted(set(values)):
+                rows = np.flatnonzero(values == value)
+                directory = '{}={}'.format(partition_field, value.replace('/', '_').replace('\\', '_'))
+                writers.write(os.path.join(out_path, directory, 'part-0.parquet'), table.take(pa.array(rows)))
+    finally:
+        row_counts = writers.close()
+
+    # ---SCHEMA SIDECAR-----
+    columns = describe_fields(in_table, [f.name for f in fields], rename_fields=False, string_lengths=string_lengths)
+    order = [f.name for f in fields]
+    columns.sort(key=lambda c: order.index(c['column_name']))
+    for column in columns:
+        is_partition = column['column_name'] == partition_field
+        column['parquet_type'] = 'partition' if is_partition else str(schema.field(column['column_name']).type)
+        column['dictionary_encoded'] = column['column_name'] in dictionary_fields
+    if include_geometry:
+        columns.append({'column_name': GEOMETRY_COLUMN, 'column_esri_type': 'Geometry', 'column_esri_length': 0,
+                        'column_string_min': '', 'parquet_type': 'binary (WKB)', 'dictionary_encoded': False})
+    sidecar = {'table': name,
+               'source': str(in_table),
+               'partition_field': partition_field,
+               'row_group_size': row_group_size,
+               'compression': compression,
+               'files': {os.path.relpath(path, out_folder): count for path, count in sorted(row_counts.items())},
+               'columns': columns}
+    if include_geometry:
+        sidecar['geo'] = geo_metadata(crs)
+    with open(os.path.join(out_folder, '{}_schema.json'.format(name)), 'w') as f:
+        json.dump(sidecar, f, indent=2)
+    return out_path
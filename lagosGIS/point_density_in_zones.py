@@ -7,6 +7,8 @@
 import os
 import arcpy
 
+import scratch
+
 
 def calc(zone_fc, zone_field, points_fc, output_table, where_clause='', rename_label=''):
     """
@@ -21,31 +23,33 @@ def calc(zone_fc, zone_field, points_fc, output_table, where_clause='', rename_l
     """
 
     # Set up and filter if elected
-    arcpy.env.workspace = 'in_memory'
-    if where_clause:
-        arcpy.MakeFeatureLayer_management(points_fc, "selected_points", where_clause)
-    else:
-        arcpy.MakeFeatureLayer_management(points_fc, "selected_points")
+    with scratch.ScratchWorkspace('point_density', scratch.estimate_mb(points_fc, zone_fc)) as scratch_ws:
+        selected_points = scratch_ws.name('selected_points')
+        temp_fc = scratch_ws.path('temp_fc')
+        if where_clause:
+            arcpy.MakeFeatureLayer_management(points_fc, selected_points, where_clause)
+        else:
+            arcpy.MakeFeatureLayer_management(points_fc, selected_points)
 
-    # Do the spatial join to assign points to zones
-    arcpy.SpatialJoin_analysis(zone_fc, "selected_points", 'temp_fc',
-                            'JOIN_ONE_TO_ONE', 'KEEP_ALL',
-                            match_option= 'INTERSECT')
+        # Do the spatial join to assign points to zones
+        arcpy.SpatialJoin_analysis(zone_fc, selected_points, temp_fc,
+                                'JOIN_ONE_TO_ONE', 'KEEP_ALL',
+                                match_option= 'INTERSECT')
 
-    # Establish names for output
-    field_names = ['n', 'npersqkm']
-    if rename_label:
-        field_names = ['{}_{}'.format(rename_label, fn) for fn in field_names]
-    field_types = ['LONG', 'DOUBLE']
-    calc_expressions = ['!Join_Count!', '!Join_Count!/!shape.area@squarekilometers!']
+        # Establish names for output
+        field_names = ['n', 'npersqkm']
+        if rename_label:
+            field_names = ['{}_{}'.format(rename_label, fn) for fn in field_names]
+        field_types = ['LONG', 'DOUBLE']
+        calc_expressions = ['!Join_Count!', '!Join_Count!/!shape.area@squarekilometers!']
 
-    # Add and calculate the new fields
-    for fname, ftype, expr in zip(field_names, field_types, calc_expressions):
-        arcpy.AddField_management('temp_fc', fname, ftype)
-        arcpy.CalculateField_management('temp_fc', fname, expr, 'PYTHON')
+        # Add and calculate the new fields
+        for fname, ftype, expr in zip(field_names, field_types, calc_expressions):
+            arcpy.AddField_management(temp_fc, fname, ftype)
+            arcpy.CalculateField_management(temp_fc, fname, expr, 'PYTHON')
 
-    # Select fields for output and clean up
-    arcpy.CopyRows_management('temp_fc', output_table)
+        # Select fields for output (scratch data is cleaned up on exit)
+        arcpy.CopyRows_management(temp_fc, output_table)
     keep_fields = [zone_field] + field_names
     out_fields = [f.name for f in arcpy.ListFields(output_table)]
     for f in out_fields:
@@ -54,8 +58,6 @@ def calc(zone_fc, zone_field, points_fc, output_table, where_clause='', rename_l
                 arcpy.DeleteField_management(output_table, f)
             except:
                 continue
-    arcpy.Delete_management('selected_points')
-    arcpy.Delete_management('temp_fc')
 
 
 def main():
@@ -8,9 +8,7 @@
 import os
 import arcpy
 from arcpy import env
-this_files_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(this_files_dir)
-SNAP_RASTER = '../common_grid.tif'
+SNAP_RASTER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common_grid.tif')
 CELL_SIZE = 90
 
 
@@ -8,8 +8,9 @@
 import csv
 import os
 import time
-import arcpy
 import lagosGIS
+import scratch
+import tracing
 
 ARG_NUMBERS = ['Arg1', 'Arg2', 'Arg3', 'Arg4', 'Arg5', 'Arg6', 'Arg7', 'Arg8']
 
@@ -31,7 +32,7 @@ def cook_string(input):
     return result
 
 
-def read_job_control(job_control_csv, start_line=-1, end_line=-1, validate=False, validate_args=[]):
+def read_job_control(job_control_csv, start_line=-1, end_line=-1, validate=False, validate_args=[], trace_log=''):
     """
     Reads a job control file with the following CSV format: First column contains function name to run. Columns contain
     arguments to use, in order.
@@ -42,8 +43,11 @@ def read_job_control(job_control_csv, start_line=-1, end_line=-1, validate=False
     :param validate: (Optional) Boolean. Whether to validate the inputs only, do not actually execute commands.
     :param validate_args: (Optional) If validate=True, provide a list of the argument labels to validate. Use
     ['Arg1', 'Arg2', 'Arg3'] etc.
+    :param trace_log: (Optional) Path of a .jsonl file to trace the geoprocessing calls of each line to. A report of
+    the time, memory and rows by line and call is printed at the end of the run.
     :return: None
     """
+    import arcpy
 
     # Define valid CSV file header
     # Line is sequential integer identifying row number
@@ -107,28 +111,38 @@ def read_job_control(job_control_csv, start_line=-1, end_line=-1, validate=False
     # Call each tool and export the result to CSV
     if not validate:
         exceptions = []
-        for call, output, csv_path in zip(calls, outputs, csv_paths):
-            output_dir = os.path.dirname(output)
-            if not arcpy.Exists(output_dir):
-                raise Exception("Provide a valid geodatabase for the output.")
-            if not arcpy.Exists(output):
-                print(time.ctime())
-                print(call)
-                try:
-                    eval(call)
-                    out_folder = os.path.dirname(csv_path)
-                    lagosGIS.export_to_csv(output, out_folder, rename_fields=False)
-                except Exception as e:
-                    exceptions.append(e.message)
-                    print('WARNING: {}'.format(e.message))
-            else:
-                print("{} already exists.".format(output))
-
-            # Keep in_memory workspace from carrying over to the next call
-            arcpy.Delete_management('in_memory')
+        if trace_log:
+            tracing.enable(trace_log)
+        try:
+            for line, call, output, csv_path in zip(lines, calls, outputs, csv_paths):
+                output_dir = os.path.dirname(output)
+                if not arcpy.Exists(output_dir):
+                    raise Exception("Provide a valid geodatabase for the output.")
+                if not arcpy.Exists(output):
+                    print(time.ctime())
+                    print(call)
+                    try:
+                        with tracing.span('Line {} {}'.format(line['Line'], cook_string(line['Function']))):
+                            eval(call)
+                            out_folder = os.path.dirname(csv_path)
+                            lagosGIS.export_to_csv(output, out_folder, rename_fields=False)
+                    except Exception as e:
+                        exceptions.append(e.message)
+                        print('WARNING: {}'.format(e.message))
+                else:
+                    print("{} already exists.".format(output))
+
+                # Keep in_memory workspace from carrying over to the next call, unless a scratch workspace (possibly
+                # of a tool running in another thread) is still using it
+                scratch.clear_memory()
+        finally:
+            if trace_log:
+                tracing.disable()
 
         # Finish
         print("ALL EXCEPTION MESSAGES FROM THIS RUN:----------------")
         for emsg in exceptions:
             print(emsg)
+        if trace_log:
+            print(tracing.report(trace_log))
 
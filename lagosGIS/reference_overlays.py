@@ -0,0 +1,283 @@
+# filename: reference_overlays.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Cut the national reference layers (land borders, coastline, states, glacial extent) into tiles once, store
+# them on disk (one directory per layer source and settings), and answer the zone flags that depend on them
+# (onlandborder, oncoast, states, inusa_pct, glaciatedlatewisc_pct) for a whole zone feature class in one pass, instead
+# of a spatial join or tabulate intersection against the national layers for each flag and each zone type. Requires
+# shapely.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+import data_access
+
+MANIFEST_NAME = 'overlays.json'
+TILE_SIZE = 50000  # meters, in the cache coordinate system
+ALBERS = 102039  # USGS Albers, the cache coordinate system. Layers and zones are projected to it as they are read.
+LAYERS = ('land_border', 'coastline', 'states', 'glacial_extent')
+FLAGS = ('onlandborder', 'oncoast', 'states', 'inusa_pct', 'glaciatedlatewisc_pct')
+FLAG_LAYERS = {'onlandborder': 'land_border',
+               'oncoast': 'coastline',
+               'states': 'states',
+               'inusa_pct': 'states',
+               'glaciatedlatewisc_pct': 'glacial_extent'}
+FLAG_FIELDS = {'onlandborder': ('TEXT', 2),
+               'oncoast': ('TEXT', 2),
+               'states': ('TEXT', 255),
+               'inusa_pct': ('DOUBLE', None),
+               'glaciatedlatewisc_pct': ('DOUBLE', None)}
+
+
+# ---BUILD--------------------------------------------------------------------------------------------------------------
+def tile_geometry(geometry, tile_size=TILE_SIZE):
+    """
+    Cut a geometry along a regular grid. The pieces cover the geometry exactly and overlap only along tile edges, so
+    a zone intersects the geometry if it intersects any piece and the overlap areas of the pieces add up.
+    :param geometry: shapely geometry
+    :param tile_size: Grid spacing
+    :return: List of non-empty shapely geometries
+    """
+    from shapely.geometry import box
+    if geometry.is_empty:
+        return []
+    minx, miny, maxx, maxy = geometry.bounds
+    pieces = []
+    for col in range(int(np.floor(minx / tile_size)), int(np.floor(maxx / tile_size)) + 1):
+        for row in range(int(np.floor(miny / tile_size)), int(np.floor(maxy / tile_size)) + 1):
+            tile = box(col * tile_size, row * tile_size, (col + 1) * tile_size, (row + 1) * tile_size)
+            if geometry.within(tile):
+                return [geometry]
+            piece = geometry.intersection(tile)
+            if not piece.is_empty:
+                pieces.append(piece)
+    return pieces
+
+
+def cache_key(layer, source, tile_size=TILE_SIZE, spatial_reference=ALBERS):
+    """
+    Name of the cache subdirectory for one layer: the SHA-1 of its manifest entries, so that every source and setting
+    combination has its own tiles and runs with different sources never overwrite each other's.
+    """
+    settings = {'layer': layer, 'source': source, 'tile_size': tile_size, 'spatial_reference': spatial_reference}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def build(out_dir, layer, source, tile_size=TILE_SIZE, spatial_reference=ALBERS):
+    """
+    Tile one reference layer and save it to out_dir. The layer is projected to spatial_reference as it is read and
+    saved as piece bounds, piece WKB and the piece values (the 'states' field for the states layer), plus a manifest
+    recording the source and the settings. The files are written to a temporary directory that is renamed to out_dir
+    when complete, so a concurrent run never reads a half-written layer.
+    :param out_dir: Directory for the layer cache
+    :param layer: One of LAYERS
+    :param source: Feature class for the layer: the line or polygon land borders with Canada and Mexico, the coastline
+    lines, the U.S. states polygons with field 'states' containing the state abbreviation, or the late Wisconsin
+    glacial extent polygons
+    :param tile_size: Grid spacing for the tiles
+    :param int spatial_reference: Factory code of the cache coordinate system. Use an equal-area system, since the
+    percentages are ratios of areas measured in it.
+    :return: out_dir
+    """
+    from shapely import wkb as shapely_wkb
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    temp_dir = tempfile.mkdtemp(prefix='{}_'.format(layer), dir=parent)
+    try:
+        fields = ['SHAPE@WKB', 'states'] if layer == 'states' else ['SHAPE@WKB']
+        bounds, blobs, values = [], [], []
+        for row in data_access.read_rows(source, fields, spatial_reference=spatial_reference):
+            if row[0] is None:
+                continue
+            for piece in tile_geometry(shapely_wkb.loads(bytes(row[0])), tile_size):
+                bounds.append(piece.bounds)
+                blobs.append(np.frombuffer(piece.wkb, dtype=np.uint8))
+                values.append(row[1] if layer == 'states' else None)
+        offsets = np.cumsum([0] + [len(b) for b in blobs]).astype(np.int64)
+        np.save(os.path.join(temp_dir, 'bounds.npy'), np.array(bounds, dtype=np.float64).reshape(-1, 4))
+        np.save(os.path.join(temp_dir, 'offsets.npy'), offsets)
+        np.save(os.path.join(temp_dir, 'wkb.npy'), np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8))
+        with open(os.path.join(temp_dir, 'values.json'), 'w') as f:
+            json.dump(values, f)
+        with open(os.path.join(temp_dir, MANIFEST_NAME), 'w') as f:
+            json.dump({'layer': layer, 'source': source, 'tile_size': tile_size,
+                       'spatial_reference': spatial_reference, 'built': datetime.now().isoformat()}, f, indent=2)
+        try:
+            os.rename(temp_dir, out_dir)
+        except OSError:
+            # another run finished the same layer first; its tiles are identical
+            if not os.path.exists(os.path.join(out_dir, MANIFEST_NAME)):
+                raise
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+    return out_dir
+
+
+# ---QUERY--------------------------------------------------------------------------------------------------------------
+class _Layer:
+    """Pieces of one reference layer, with an STRtree over them and prepared geometries made as they are needed."""
+
+    def __init__(self, cache_dir, name):
+        from shapely import wkb as shapely_wkb
+        from shapely.strtree import STRtree
+        self.name = name
+        self.offsets = np.load(os.path.join(cache_dir, 'offsets.npy'))
+        blobs = np.load(os.path.join(cache_dir, 'wkb.npy'), mmap_mode='r')
+        with open(os.path.join(cache_dir, 'values.json')) as f:
+            self.values = json.load(f)
+        self.pieces = [shapely_wkb.loads(blobs[self.offsets[i]:self.offsets[i + 1]].tobytes())
+                       for i in range(len(self.offsets) - 1)]
+        self.tree = STRtree(self.pieces) if self.pieces else None
+        self.index_of = {id(piece): i for i, piece in enumerate(self.pieces)}
+        self.prepared = {}
+
+    def candidates(self, geometry):
+        """Indices of the pieces whose bounding boxes intersect the geometry, in layer order."""
+        if self.tree is None:
+            return []
+        result = self.tree.query(geometry)
+        # shapely 2 returns indices, shapely 1.x returns the geometries themselves
+        if len(result) and not isinstance(result[0], (int, np.integer)):
+            result = [self.index_of[id(g)] for g in result]
+        return sorted(int(i) for i in result)
+
+    def prepare(self, i):
+        if i not in self.prepared:
+            from shapely.prepared import prep
+            self.prepared[i] = prep(self.pieces[i])
+        return self.prepared[i]
+
+    def intersects(self, geometry):
+        return any(self.prepare(i).intersects(geometry) for i in self.candidates(geometry))
+
+    def intersecting_values(self, geometry):
+        """Values of the intersecting pieces, without repeats, in layer order."""
+        values = []
+        for i in self.candidates(geometry):
+            if self.values[i] not in values and self.prepare(i).intersects(geometry):
+                values.append(self.values[i])
+        return values
+
+    def overlap_area(self, geometry):
+        area = 0.0
+        for i in self.candidates(geometry):
+            prepared = self.prepare(i)
+            if prepared.contains(geometry):
+                area += geometry.area
+            elif prepared.intersects(geometry):
+                area += self.pieces[i].intersection(geometry).area
+        return area
+
+
+class ReferenceOverlays:
+    """
+    Query layer caches made by build. Layers are loaded the first time they are needed.
+    :param dict layer_dirs: Layer name to the directory written by build, for the layers that were built
+    :param int spatial_reference: Factory code of the cache coordinate system
+    """
+
+    def __init__(self, layer_dirs, spatial_reference=ALBERS):
+        self.layer_dirs = layer_dirs
+        self.spatial_reference = spatial_reference
+        self.layers = {}
+
+    def layer(self, name):
+        if name not in self.layers:
+            if name not in self.layer_dirs:
+                raise ValueError("The {} layer was not built. Open the overlays with the flags that need it.".format(
+                    name))
+            self.layers[name] = _Layer(self.layer_dirs[name], name)
+        return self.layers[name]
+
+    def overlay(self, wkbs, flags=FLAGS):
+        """
+        Compute the reference flags for a batch of zone geometries, reading each geometry once.
+        :param wkbs: Iterable of zone polygon WKB, in the cache coordinate system (self.spatial_reference)
+        :param flags: Any of FLAGS
+        :return: Dictionary of flag name to list of values, in the order of wkbs. Flags are 'Y'/'N', states are
+        space-separated abbreviations (None if outside all states), and percentages are rounded as in LAGOS-US GEO:
+        inusa_pct to 2 digits and at most 100, glaciatedlatewisc_pct to 0 below 0.01 and 100 from 99.99.
+        """
+        from shapely import wkb as shapely_wkb
+        unknown = set(flags).difference(FLAGS)
+        if unknown:
+            raise ValueError("Unknown flags: {}".format(', '.join(sorted(unknown))))
+        result = {flag: [] for flag in flags}
+        for wkb in wkbs:
+            zone = shapely_wkb.loads(bytes(wkb)) if wkb is not None else None
+            if zone is None or zone.is_empty:
+                for flag in flags:
+                    result[flag].append(None)
+                continue
+            if 'onlandborder' in flags:
+                result['onlandborder'].append('Y' if self.layer('land_border').intersects(zone) else 'N')
+            if 'oncoast' in flags:
+                result['oncoast'].append('Y' if self.layer('coastline').intersects(zone) else 'N')
+            if 'states' in flags:
+                states = self.layer('states').intersecting_values(zone)
+                result['states'].append(' '.join(states) if states else None)
+            if 'inusa_pct' in flags:
+                pct = 100 * self.layer('states').overlap_area(zone) / zone.area
+                result['inusa_pct'].append(min(round(pct, 2), 100))
+            if 'glaciatedlatewisc_pct' in flags:
+                pct = 100 * self.layer('glacial_extent').overlap_area(zone) / zone.area
+                result['glaciatedlatewisc_pct'].append(100 if pct >= 99.99 else 0 if pct < 0.01 else pct)
+        return result
+
+
+def open_overlays(cache_root, land_border, coastline, states, glacial_extent, tile_size=TILE_SIZE,
+                  spatial_reference=ALBERS, flags=FLAGS):
+    """
+    Open the layer caches under cache_root that the flags need, building any that do not exist yet. Each layer is
+    cached in its own subdirectory named by cache_key, so scripts using other sources or settings can share the root.
+    :param cache_root: Directory holding the layer caches
+    :param flags: Flags that will be computed, any of FLAGS. Only the layers they need are read and tiled, so e.g.
+    onlandborder and oncoast never tile the states or the glacial extent.
+    :return: ReferenceOverlays
+    """
+    sources = dict(zip(LAYERS, (land_border, coastline, states, glacial_extent)))
+    unknown = set(flags).difference(FLAGS)
+    if unknown:
+        raise ValueError("Unknown flags: {}".format(', '.join(sorted(unknown))))
+    layer_dirs = {}
+    for layer in sorted(set(FLAG_LAYERS[flag] for flag in flags)):
+        layer_dir = os.path.join(cache_root, cache_key(layer, sources[layer], tile_size, spatial_reference))
+        if not os.path.exists(os.path.join(layer_dir, MANIFEST_NAME)):
+            build(layer_dir, layer, sources[layer], tile_size, spatial_reference)
+        layer_dirs[layer] = layer_dir
+    return ReferenceOverlays(layer_dirs, spatial_reference)
+
+
+def add_overlay_fields(zone_fc, zone_name, overlays, flags=FLAGS):
+    """
+    Add or refresh reference flag fields for every zone in one read and one update of the feature class.
+    :param zone_fc: Zone polygon feature class, in any coordinate system (projected to the cache's as it is read)
+    :param zone_name: Prefix for the field names, e.g. 'ws' gives ws_onlandborder. Use '' for no prefix.
+    :param ReferenceOverlays overlays: The reference cache
+    :param flags: Any of FLAGS
+    :return: zone_fc
+    """
+    flags = list(flags)
+    fields = ['{}_{}'.format(zone_name, flag) if zone_name else flag for flag in flags]
+    data_access.add_fields(zone_fc, [(field, FLAG_FIELDS[flag]) for field, flag in zip(fields, flags)])
+
+    oids, wkbs = [], []
+    for oid, wkb in data_access.read_rows(zone_fc, ['OID@', 'SHAPE@WKB'], spatial_reference=overlays.spatial_reference):
+        oids.append(oid)
+        wkbs.append(wkb)
+    result = overlays.overlay(wkbs, flags)
+    del wkbs
+    row_index = {oid: i for i, oid in enumerate(oids)}
+    data_access.update_rows(zone_fc, ['OID@'] + fields,
+                            lambda row: [row[0]] + [result[flag][row_index[row[0]]] for flag in flags])
+    return zone_fc
@@ -11,7 +11,7 @@ import arcpy
 from arcpy import management as DM
 from arcpy import analysis as AN
 
-import calc_glaciation
+import reference_overlays
 from lagosGIS import create_temp_GDB
 
 # files accessed by this script
@@ -25,6 +25,8 @@ LAGOS_LAKES = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.7.gdb
 GLACIAL_EXTENT = r'C:\Users\smithn78\Dropbox\CL_HUB_GEO\GEO_datadownload_inprogress\DATA_glaciationlatewisc\Pre-processed\lgm_glacial_world.shp'
 STATE_FC = r'D:\Continental_Limnology\Data_Downloaded\LAGOS_ZONES_ALL\TIGER_Boundaries\Unzipped Original\tl_2016_us_state.shp'
 STATE_FC_FINDSTATE = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.7.gdb\Spatial_Classifications\state'
+# tiled copies of the reference layers, one subdirectory per source, built on first use
+REFERENCE_OVERLAYS = r'D:\Continental_Limnology\Data_Working\Reference_Overlays'
 
 # files to control this script
 ZONE_CONTROL_CSV = r"C:\Users\smithn78\Dropbox\CL_HUB_GEO\Reprocessing_LAGOS_Zones.csv"
@@ -165,25 +167,6 @@ def process_zone(zone_fc, output, zone_name, zone_id_field, zone_name_field, oth
                 cursor.updateRow(row)
                 counter += 1
 
-    print("Edge flags...")
-    # add flag fields
-    DM.AddField(trimmed, 'onlandborder', 'TEXT', field_length = 2)
-    DM.AddField(trimmed, 'oncoast', 'TEXT', field_length = 2)
-
-    # identify border zones
-    border_lyr = DM.MakeFeatureLayer(LAND_BORDER, 'border_lyr')
-    DM.SelectLayerByLocation(trimmed_lyr, 'INTERSECT', border_lyr)
-    DM.CalculateField(trimmed_lyr, 'onlandborder', "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(trimmed_lyr, 'SWITCH_SELECTION')
-    DM.CalculateField(trimmed_lyr, 'onlandborder' ,"'N'", 'PYTHON')
-
-    # identify coastal zones
-    coastal_lyr = DM.MakeFeatureLayer(COASTLINE, 'coastal_lyr')
-    DM.SelectLayerByLocation(trimmed_lyr, 'INTERSECT', coastal_lyr)
-    DM.CalculateField(trimmed_lyr, 'oncoast', "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(trimmed_lyr, 'SWITCH_SELECTION')
-    DM.CalculateField(trimmed_lyr, 'oncoast' ,"'N'", 'PYTHON')
-
     # label sourcezoneid
     sourceid_name = 'sourceid_{}'.format(zone_id_field.replace('_', ''))
     arcpy.AlterField(trimmed, zone_id_field, 'sourceid', clear_field_alias=True)
@@ -191,12 +174,11 @@ def process_zone(zone_fc, output, zone_name, zone_id_field, zone_name_field, oth
     # add lat long
     spatial_divisions_processing.add_lat_lon(trimmed)
 
-    print("State assignment...")
-    # State?
-    spatial_divisions_processing.find_states(trimmed, STATE_FC_FINDSTATE)
-
-    # glaciation status
-    calc_glaciation.calc(trimmed, GLACIAL_EXTENT, 'ZoneID')
+    print("Edge flags, state assignment, glaciation...")
+    flags = ['onlandborder', 'oncoast', 'states', 'glaciatedlatewisc_pct']
+    overlays = reference_overlays.open_overlays(REFERENCE_OVERLAYS, LAND_BORDER, COASTLINE, STATE_FC_FINDSTATE,
+                                                GLACIAL_EXTENT, flags=flags)
+    reference_overlays.add_overlay_fields(trimmed, '', overlays, flags)
 
     # preface the names with the division prefix if needed
     DM.DeleteField(trimmed, 'ORIG_FID')
@@ -353,7 +335,7 @@ def process_buffer_zones(zones_fc, zone_name=''):
         sys.exit(1)
 
     # add field names except those added by functions below
-    # which are lat, lon, states, inusa, lateglaciatedwisc
+    # which are lat, lon, and the reference flags onlandborder, oncoast, states, inusa, lateglaciatedwisc
     area_ha = '{}_area_ha'.format(zone_name)
     perimeter_m = '{}_perimeter_m'.format(zone_name)
     onlandborder = '{}_onlandborder'.format(zone_name)
@@ -367,8 +349,6 @@ def process_buffer_zones(zones_fc, zone_name=''):
             DM.DeleteField(zones_fc, fieldname)
     DM.AddField(zones_fc, area_ha, 'DOUBLE')
     DM.AddField(zones_fc, perimeter_m, 'DOUBLE')
-    DM.AddField(zones_fc, onlandborder, 'TEXT', field_length=2)
-    DM.AddField(zones_fc, oncoast, 'TEXT', field_length=2)
     DM.AddField(zones_fc, ismultipart, 'TEXT', field_length=2)
 
     # calc geometry
@@ -383,36 +363,14 @@ def process_buffer_zones(zones_fc, zone_name=''):
             row = [area, perim, multi, shape]
             cursor.updateRow(row)
 
-    # calc edge flags
-    arcpy.AddMessage("Calculating edge flags...")
-    zone_layer = DM.MakeFeatureLayer(zones_fc, 'zone_layer')
-    border_lyr = DM.MakeFeatureLayer(LAND_BORDER, 'border_lyr')
-    DM.SelectLayerByLocation(zone_layer, 'INTERSECT', border_lyr)
-    DM.CalculateField(zone_layer, onlandborder, "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(zone_layer, 'SWITCH_SELECTION')
-    DM.CalculateField(zone_layer, onlandborder, "'N'", 'PYTHON')
-
-    # identify coastal zones
-    coastal_lyr = DM.MakeFeatureLayer(COASTLINE, 'coastal_lyr')
-    DM.SelectLayerByLocation(zone_layer, 'INTERSECT', coastal_lyr)
-    DM.CalculateField(zone_layer, oncoast, "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(zone_layer, 'SWITCH_SELECTION')
-    DM.CalculateField(zone_layer, oncoast, "'N'", 'PYTHON')
-
     # add lat long
     spatial_divisions_processing.add_lat_lon(zones_fc, zone_name)
 
-    print("State assignment...")
-    # State?
-    spatial_divisions_processing.find_states(zones_fc, STATE_FC_FINDSTATE, zone_name)
-
-    # glaciation status
-    calc_glaciation.calc(zones_fc, GLACIAL_EXTENT, zoneid, zone_name)
-
-    # fix
-
-    # in usa
-    spatial_divisions_processing.inusa_pct(zones_fc, zoneid, STATE_FC_FINDSTATE, zone_name)
+    # edge flags, states, glaciation and in usa, from the tiled reference layers in one pass
+    arcpy.AddMessage("Calculating edge flags, states, glaciation and percent in USA...")
+    overlays = reference_overlays.open_overlays(REFERENCE_OVERLAYS, LAND_BORDER, COASTLINE, STATE_FC_FINDSTATE,
+                                                GLACIAL_EXTENT)
+    reference_overlays.add_overlay_fields(zones_fc, zone_name, overlays)
 
     # cleanup
     for field in arcpy.ListFields(zones_fc, '*Join_Count*', '*TARGET_FID'):
@@ -8,6 +8,8 @@ import os
 import arcpy
 from arcpy import management as DM
 from arcpy import analysis as AN
+from lagosGIS import reference_overlays
+from lagosGIS import zone_attribution
 from run_tools import make_lagos_lakes
 
 # Calculate zoneids for the lakes
@@ -19,63 +21,25 @@ GLACIAL_EXTENT = r'C:\Users\smithn78\Dropbox\CL_HUB_GEO\GEO_datadownload_inprogr
                     DATA_glaciationlatewisc\Pre-processed\lgm_glacial.shp'
 LAND_BORDER = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.6.gdb\NonPublished\Derived_Land_Borders'
 COASTLINE = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.6.gdb\NonPublished\TIGER_Coastline'
+# tiled copies of the reference layers, one subdirectory per source, built on first use
+REFERENCE_OVERLAYS = r'D:\Continental_Limnology\Data_Working\Reference_Overlays'
 STATES_NEGATIVE_BUFFER = r'C:\Users\smithn78\Documents\ArcGIS\Default.gdb\state_negative_100m_buffer'
 
-def add_zoneids_to_lakes(lakes_points_fc, lakes_poly, mgdb):
+def add_zoneids_to_lakes(lakes_points_fc, lakes_poly, mgdb, processes=1):
     """Add the LAGOS spatial division ZoneIDs that correspond to the
-    lake's central point (= the point representation.)"""
+    lake's central point (= the point representation.) Lakes outside every zone get the closest zone.
+    All zone layers are queried from one read of the lake points and written in one update pass per lakes layer.
+    Use processes > 1 only when calling from a script with an if __name__ == '__main__' guard, since the worker
+    processes re-import the main script on Windows."""
     zones = ['hu12', 'hu8', 'hu4',
              'county', 'state',
              'epanutr4', 'wwf', 'mlra', 'bailey', 'neon', 'omernik3', 'epanutr']
-    for z in zones:
-        print(z)
-        zone = os.path.join(mgdb, z)
-        zoneid = '{}_zoneid'.format(z)
-        if not arcpy.ListFields(lakes_points_fc, zoneid):
-            DM.AddField(lakes_points_fc, zoneid, 'TEXT', '20')
-
-        join_fc = arcpy.SpatialJoin_analysis(lakes_points_fc,
-                                             zone, 'in_memory/join_fc', 'JOIN_ONE_TO_ONE', match_option='INTERSECT')
-        zoneid1 = '{}_1'.format(zoneid)
-        # joined always gets _1 suffix bc same name in lakes
-        join_missing = arcpy.Select_analysis(join_fc,
-                                             'in_memory/join_missing', '{} is null'.format(zoneid1))
-        arcpy.DeleteField_management(join_missing, zoneid1)
-        update_vals = {}
-
-        # if there was no INTERSECT zone, find the CLOSEST zone
-        count_missing = int(DM.GetCount(join_missing).getOutput(0))
-        print(count_missing)
-        if count_missing > 0:
-            print("Using CLOSEST join...")
-            join_fc2 = arcpy.SpatialJoin_analysis(join_missing, zone, 'in_memory/join_fc2', 'JOIN_ONE_TO_ONE',
-                                                  match_option='CLOSEST')
-            update_vals = {r[0]: r[1] for r in arcpy.da.SearchCursor(join_fc2, ['lagoslakeid', zoneid1])}
-
-        # make a dict from combining the INTERSECT and CLOSEST results
-        zone_dict = {r[0]: r[1] for r in arcpy.da.SearchCursor(join_fc, ['lagoslakeid', zoneid1])}
-        for k, v in list(zone_dict.items()):
-            if not v:
-                zone_dict[k] = update_vals[k]
-
-        with arcpy.da.UpdateCursor(lakes_points_fc, ['lagoslakeid', zoneid]) as u_cursor:
-            for row in u_cursor:
-                row[1] = zone_dict[row[0]]
-                u_cursor.updateRow(row)
-
-        DM.Delete('in_memory')
-
-    # update the main lakes layer
-    zoneids = ['{}_zoneid'.format(z) for z in zones]
-    point_dict = {r[0]:r[1:] for r in arcpy.da.SearchCursor(lakes_points_fc, ['lagoslakeid'] + zoneids)}
-
-    for z in zoneids:
-        if not arcpy.ListFields(lakes_poly, z):
-            DM.AddField(lakes_poly, z, 'TEXT', field_length=20)
-    with arcpy.da.UpdateCursor(lakes_poly, ['lagoslakeid'] + zoneids) as u_cursor:
-        for row in u_cursor:
-            row[1:] = point_dict[row[0]]
-            u_cursor.updateRow(row)
+    zone_layers = [(os.path.join(mgdb, z), '{}_zoneid'.format(z)) for z in zones]
+    lake_ids, zoneids = zone_attribution.attribute_points(lakes_points_fc, zone_layers, 'lagoslakeid', processes)
+
+    # update the lake points and the main lakes layer
+    for fc in [lakes_points_fc, lakes_poly]:
+        zone_attribution.write_attributes(fc, 'lagoslakeid', lake_ids, zoneids)
 
 
 def calc_glaciation(fc, zone_field, zone_name=''):
@@ -159,24 +123,10 @@ def lake_zone_flags():
             uCursor.updateRow(row)
 
     print("Edge flags...")
-    # add flag fields
-    DM.AddField(trimmed, 'onlandborder', 'TEXT', field_length=2)
-    DM.AddField(trimmed, 'oncoast', 'TEXT', field_length=2)
-
-    trimmed_lyr = DM.MakeFeatureLayer(trimmed, 'trimmed_lyr')
-    # identify border zones
-    border_lyr = DM.MakeFeatureLayer(LAND_BORDER, 'border_lyr')
-    DM.SelectLayerByLocation(trimmed_lyr, 'INTERSECT', border_lyr)
-    DM.CalculateField(trimmed_lyr, 'onlandborder', "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(trimmed_lyr, 'SWITCH_SELECTION')
-    DM.CalculateField(trimmed_lyr, 'onlandborder', "'N'", 'PYTHON')
-
-    # identify coastal zones
-    coastal_lyr = DM.MakeFeatureLayer(COASTLINE, 'coastal_lyr')
-    DM.SelectLayerByLocation(trimmed_lyr, 'INTERSECT', coastal_lyr)
-    DM.CalculateField(trimmed_lyr, 'oncoast', "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(trimmed_lyr, 'SWITCH_SELECTION')
-    DM.CalculateField(trimmed_lyr, 'oncoast', "'N'", 'PYTHON')
+    edge_flags = ['onlandborder', 'oncoast']
+    overlays = reference_overlays.open_overlays(REFERENCE_OVERLAYS, LAND_BORDER, COASTLINE, STATES, GLACIAL_EXTENT,
+                                                flags=edge_flags)
+    reference_overlays.add_overlay_fields(trimmed, '', overlays, edge_flags)
 
 
 #---MAKE THE LAKES AND ADD ALL FIELDS-----------------------------------------------------------------------------------
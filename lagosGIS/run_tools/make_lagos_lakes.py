@@ -5,10 +5,10 @@
 # tool type: code journal (no ArcGIS Toolbox)
 
 import os
-import zipfile
 import arcpy
 
 import nhd_merge_helpers
+import nhd_staging
 
 
 # Locations. Change these for your system. To re-run this code, you can always run this whole section.
@@ -25,6 +25,8 @@ US_SPATIAL_EXTENT = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0
 USGS_ALBERS_PROJ = arcpy.SpatialReference(102039)
 LAGOS_LAKE_FILTER = "AreaSqKm > .009 AND AreaHa >= 1 AND FCode IN (39000,39004,39009,39010,39011,39012,43600,43613,43615,43617,43618,43619,43621)"
 LAGOS_LAKES_FC = 'D:/Continental_Limnology/Data_Working/LAGOS_US_Predecessors.gdb/NHDWaterbody_LAGOS'
+STAGING_THREADS = 8
+STAGING_PROCESSES = 1  # more than 1 needs an if __name__ == '__main__' guard around the call on Windows
 
 def make_lagos_lakes():
     """This function contains multiple steps used to merge NHDWaterbody layers from 202 subregions comprising the
@@ -41,23 +43,13 @@ def make_lagos_lakes():
 
     #wget -t 20 ftp://rockyftp.cr.usgs.gov/vdelivery/Datasets/Staged/Hydrography/NHD/HU4/HighResolution/GDB/NHD_H_[0,1][0,1,2,3,4,5,6,7,8,9]*_GDB.*[zip,xml]
 
-    nhd_zip_list = [f for f in os.listdir(NHD_DOWNLOAD_DIR)
-                    if os.path.isfile(os.path.join(NHD_DOWNLOAD_DIR, f)) and "NHD_H" in f and f.endswith('.zip')]
-
-    # Unzip
-    for f in nhd_zip_list:
-        dest_file = os.path.join(NHD_UNZIPPED_DIR, "{0}.gdb".format(os.path.splitext(os.path.basename(f))[0]))
-        if not os.path.exists(dest_file):
-            zf = zipfile.ZipFile(f)
-            zf.extractall(NHD_UNZIPPED_DIR)
-        else:
-            print("{} is already unzipped.").format(os.path.basename(dest_file))
-
-
+    # Unzip, and
     # Step 2: Add the nhd_merge_id. It just concatenates Permanent_Identifier and FDate together so that we can
     # de-duplicate merged NHD features and output features from tools that need to be run with the network data
     # with methods that won't cause any misalignment.
-    nhd_merge_helpers.batch_add_merge_ids(NHD_UNZIPPED_DIR)
+    # Archives are extracted concurrently and skipped when their checksum matches the last staging run. The staged
+    # subregions and their row counts are recorded in nhd_staging.json in NHD_UNZIPPED_DIR.
+    nhd_staging.stage_nhd(NHD_DOWNLOAD_DIR, NHD_UNZIPPED_DIR, threads=STAGING_THREADS, processes=STAGING_PROCESSES)
 
 
     # Step 3: Merge all the lakes and remove full duplicates. Also delete duplicate Permanent_Identifiers by keeping
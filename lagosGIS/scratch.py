@@ -0,0 +1,188 @@
+# filename: scratch.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): all
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Scratch workspaces for the intermediate datasets of the tools. Each call gets its own name prefix, so tools
+# can run side by side in one process without overwriting each other's 'temp_fc', is placed in memory or in a
+# temporary file geodatabase depending on its estimated size and a memory budget shared by all the workspaces open in
+# the process, and deletes everything it created on exit, even after an error.
+
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+MEMORY_WORKSPACE = 'in_memory'
+MEMORY_BUDGET_MB = 4096  # in_memory data allowed at once across all scratch workspaces in this process
+SIZE_FACTOR = 3  # intermediates (identity, spatial join, rasterization) are usually a few times the input size
+GEOMETRY_BYTES = {'Point': 32, 'Multipoint': 512, 'Polyline': 4096, 'Polygon': 8192}
+FIELD_BYTES = {'String': None, 'Double': 8, 'Single': 4, 'Integer': 4, 'SmallInteger': 2, 'Date': 8, 'OID': 4,
+               'GUID': 38, 'GlobalID': 38}
+PIXEL_BYTES = {'U1': 1, 'U2': 1, 'U4': 1, 'U8': 1, 'S8': 1, 'U16': 2, 'S16': 2, 'U32': 4, 'S32': 4, 'F32': 4,
+               'F64': 8}
+
+_lock = threading.Lock()
+_budget = {'limit_mb': MEMORY_BUDGET_MB, 'reserved_mb': 0.0, 'open_in_memory': 0}
+
+
+# ---MEMORY BUDGET------------------------------------------------------------------------------------------------------
+def set_memory_budget(limit_mb):
+    """Set the in_memory budget shared by the scratch workspaces of this process."""
+    with _lock:
+        _budget['limit_mb'] = limit_mb
+
+
+def memory_available_mb():
+    """Budget not reserved by the scratch workspaces currently open in memory."""
+    with _lock:
+        return _budget['limit_mb'] - _budget['reserved_mb']
+
+
+def _reserve(size_mb, force=False):
+    with _lock:
+        if not force and _budget['reserved_mb'] + size_mb > _budget['limit_mb']:
+            return False
+        _budget['reserved_mb'] += size_mb
+        _budget['open_in_memory'] += 1
+        return True
+
+
+def _release(size_mb):
+    with _lock:
+        _budget['reserved_mb'] = max(0.0, _budget['reserved_mb'] - size_mb)
+        _budget['open_in_memory'] -= 1
+
+
+def clear_memory():
+    """
+    Delete everything in the in_memory workspace, unless a scratch workspace is open in memory (possibly in another
+    thread), in which case only the scratch workspaces' own cleanup applies.
+    :return: True if in_memory was cleared
+    """
+    import arcpy
+    with _lock:
+        if _budget['open_in_memory']:
+            return False
+        arcpy.Delete_management(MEMORY_WORKSPACE)
+        return True
+
+
+# ---SIZE ESTIMATES-----------------------------------------------------------------------------------------------------
+def estimate_mb(*datasets):
+    """
+    Estimate the memory used by the intermediates of a tool from the size of its inputs: cells times pixel depth for
+    rasters, rows times field widths plus a typical geometry size for feature classes and tables, times SIZE_FACTOR.
+    Inputs that cannot be described count as 0.
+    :param datasets: Input feature classes, tables or rasters
+    :return: Estimate in megabytes
+    """
+    import arcpy
+    total = 0
+    for dataset in datasets:
+        if not dataset:
+            continue
+        try:
+            description = arcpy.Describe(dataset)
+            if description.dataType in ('RasterDataset', 'RasterLayer', 'RasterBand'):
+                raster = arcpy.Raster(dataset)
+                total += raster.width * raster.height * raster.bandCount * PIXEL_BYTES.get(raster.pixelType, 4)
+                continue
+            rows = int(arcpy.GetCount_management(dataset).getOutput(0))
+            row_bytes = GEOMETRY_BYTES.get(getattr(description, 'shapeType', None), 0)
+            for field in arcpy.ListFields(dataset):
+                width = FIELD_BYTES.get(field.type, 8)
+                row_bytes += field.length if width is None else width
+            total += rows * row_bytes
+        except (IOError, RuntimeError, arcpy.ExecuteError):
+            continue
+    return SIZE_FACTOR * total / 1024.0 ** 2
+
+
+# ---WORKSPACE----------------------------------------------------------------------------------------------------------
+class ScratchWorkspace:
+    """
+    Context manager for the intermediate datasets of one tool call.
+
+        with ScratchWorkspace('line_density', estimate_mb(lines_fc, zones_fc)) as scratch:
+            lines_identity = arcpy.Identity_analysis(lines_fc, zones_fc, scratch.path('lines_identity'))
+
+    :param str prefix: Readable part of the name prefix, e.g. the tool name
+    :param float size_mb: Estimated size of the intermediates, see estimate_mb. The workspace is in memory if this
+    fits in the memory budget left, otherwise in a new temporary file geodatabase.
+    :param bool in_memory: (Optional) Force the placement: True for in_memory, False for a temporary geodatabase
+    :param bool set_workspace: Also make the scratch workspace arcpy.env.workspace until exit, for code using bare
+    names. arcpy.env is shared by all threads, so leave this False for tools that may run side by side.
+    """
+
+    def __init__(self, prefix='scratch', size_mb=0, in_memory=None, set_workspace=False):
+        self.prefix = prefix
+        self.size_mb = size_mb
+        self.force_in_memory = in_memory
+        self.set_workspace = set_workspace
+        self.namespace = '{}_{}'.format(prefix, uuid.uuid4().hex[:8])
+        self.workspace = None
+        self.in_memory = False
+        self.temp_dir = None
+        self.created = []
+        self._previous_workspace = None
+
+    def __enter__(self):
+        import arcpy
+        if self.force_in_memory is None:
+            self.in_memory = _reserve(self.size_mb)
+        elif self.force_in_memory:
+            self.in_memory = _reserve(self.size_mb, force=True)
+        if self.in_memory:
+            self.workspace = MEMORY_WORKSPACE
+        else:
+            self.temp_dir = tempfile.mkdtemp(prefix='{}_'.format(self.namespace))
+            self.workspace = arcpy.CreateFileGDB_management(self.temp_dir, 'scratch.gdb').getOutput(0)
+            arcpy.AddMessage("Scratch data for {} (about {:.0f} MB) is written to {}.".format(
+                self.prefix, self.size_mb, self.workspace))
+        if self.set_workspace:
+            self._previous_workspace = arcpy.env.workspace
+            arcpy.env.workspace = self.workspace
+        return self
+
+    def path(self, name):
+        """
+        A unique path in the scratch workspace, deleted on exit.
+        :param str name: Name of the intermediate, e.g. 'temp_fc'
+        :return: Path, e.g. 'in_memory/line_density_1f3a9c2e_temp_fc'
+        """
+        unique_name = '{}_{}'.format(self.namespace, name)
+        if self.in_memory:
+            path = '{}/{}'.format(MEMORY_WORKSPACE, unique_name)
+        else:
+            path = os.path.join(self.workspace, unique_name)
+        if path not in self.created:
+            self.created.append(path)
+        return path
+
+    def name(self, name):
+        """A unique layer or view name (layers are not datasets, but are deleted on exit too)."""
+        layer = '{}_{}'.format(self.namespace, name)
+        if layer not in self.created:
+            self.created.append(layer)
+        return layer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        import arcpy
+        try:
+            for item in reversed(self.created):
+                try:
+                    if arcpy.Exists(item):
+                        arcpy.Delete_management(item)
+                except (RuntimeError, arcpy.ExecuteError):
+                    continue
+            if self.temp_dir:
+                arcpy.ClearWorkspaceCache_management()
+                shutil.rmtree(self.temp_dir, ignore_errors=True)
+        finally:
+            if self.set_workspace:
+                arcpy.env.workspace = self._previous_workspace
+            if self.in_memory:
+                _release(self.size_mb)
+        return False
@@ -0,0 +1,241 @@
+# filename: shape_metrics.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Compute polygon shape metrics (area, perimeter, parts, convex hull axes, isoperimetric quotient) and
+# centroid lat/lon for many polygons at once from WKB, with numpy, in place of one geoprocessing tool or cursor per
+# metric.
+
+import struct
+
+import numpy as np
+
+# EPSG:5070 NAD83 / Conus Albers, on the GRS80 ellipsoid
+ALBERS_SEMI_MAJOR = 6378137.0
+ALBERS_FLATTENING = 1 / 298.257222101
+ALBERS_LAT_ORIGIN = 23.0
+ALBERS_LON_ORIGIN = -96.0
+ALBERS_PARALLELS = (29.5, 45.5)
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+BATCH_SIZE = 10000
+
+
+# ---WKB----------------------------------------------------------------------------------------------------------------
+def parse_polygon_wkb(wkb):
+    """
+    Read the rings of a Polygon or MultiPolygon from WKB. Z and M values are dropped.
+    :param wkb: WKB bytes, e.g. from the SHAPE@WKB token
+    :return: Tuple of (list of (n, 2) float64 arrays, one per ring, number of parts, list of booleans, True for the
+    rings that are holes). Holes are rings but not parts.
+    """
+    wkb = bytes(wkb)
+    rings = []
+    holes = []
+    parts = [0]
+
+    def read_polygon(offset):
+        order = '<' if wkb[offset:offset + 1] in (b'\x01', 1) else '>'
+        geometry_type = struct.unpack(order + 'I', wkb[offset + 1:offset + 5])[0]
+        has_z = bool(geometry_type & 0x80000000) or (geometry_type % 10000) // 1000 in (1, 3)
+        has_m = bool(geometry_type & 0x40000000) or (geometry_type % 10000) // 1000 in (2, 3)
+        base_type = (geometry_type & 0x0FFFFFFF) % 1000
+        offset += 5
+        count = struct.unpack(order + 'I', wkb[offset:offset + 4])[0]
+        offset += 4
+        if base_type == WKB_MULTIPOLYGON:
+            for i in range(count):
+                offset = read_polygon(offset)
+            return offset
+        if base_type != WKB_POLYGON:
+            raise ValueError("Geometry type {} is not a polygon.".format(geometry_type))
+        dims = 2 + has_z + has_m
+        if count:
+            parts[0] += 1
+        for i in range(count):
+            n = struct.unpack(order + 'I', wkb[offset:offset + 4])[0]
+            offset += 4
+            coords = np.frombuffer(wkb, dtype=order + 'f8', count=n * dims, offset=offset).reshape(n, dims)
+            rings.append(coords[:, :2].astype(np.float64))
+            holes.append(i > 0)  # the first ring of each polygon is its shell
+            offset += 8 * n * dims
+        return offset
+
+    read_polygon(0)
+    return rings, parts[0], holes
+
+
+# ---METRICS------------------------------------------------------------------------------------------------------------
+def convex_hull(points):
+    """
+    Convex hull by monotone chain, after discarding the points inside the octagon of the extreme points
+    (Akl-Toussaint), which removes most vertices of a watershed outline with one vectorized test.
+    :param points: (n, 2) array
+    :return: (h, 2) array of hull vertices, counter-clockwise
+    """
+    order = np.lexsort((points[:, 1], points[:, 0]))
+    points = points[order]
+    points = points[np.r_[True, np.any(np.diff(points, axis=0) != 0, axis=1)]]
+    if len(points) < 3:
+        return points
+    x, y = points[:, 0], points[:, 1]
+    s, d = x + y, x - y
+    extremes = [np.argmin(x), np.argmin(d), np.argmax(y), np.argmax(s), np.argmax(x), np.argmax(d), np.argmin(y),
+                np.argmin(s)]
+    quad = points[sorted(set(extremes), key=extremes.index)]
+    if len(quad) >= 3:
+        # strictly inside every edge of the convex octagon of extreme points (ordered clockwise here)
+        inside = np.ones(len(points), dtype=bool)
+        for (x0, y0), (x1, y1) in zip(quad, np.roll(quad, -1, axis=0)):
+            inside &= (x1 - x0) * (y - y0) - (y1 - y0) * (x - x0) < 0
+        points = points[~inside]
+
+    def half(pts):
+        chain = []
+        for p in pts:
+            while len(chain) >= 2 and ((chain[-1][0] - chain[-2][0]) * (p[1] - chain[-2][1]) -
+                                       (chain[-1][1] - chain[-2][1]) * (p[0] - chain[-2][0])) <= 0:
+                chain.pop()
+            chain.append((p[0], p[1]))
+        return chain
+
+    pts = points.tolist()  # sorted by x, then y
+    lower, upper = half(pts), half(pts[::-1])
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def hull_axes(points):
+    """
+    Length, width and orientation of the convex hull, as MinimumBoundingGeometry(CONVEX_HULL, MBG_FIELDS) defines
+    MBG_Length, MBG_Width and MBG_Orientation: the length is the longest distance between two hull vertices, the
+    width is the shortest distance between two hull vertices, and the orientation is the direction of the length line
+    in degrees clockwise from north (0-180).
+    :param points: (n, 2) array of polygon vertices
+    :return: Tuple of (length, width, orientation)
+    """
+    hull = convex_hull(points)
+    if len(hull) < 2:
+        return 0.0, 0.0, 0.0
+    longest, pair = -1.0, (0, 0)
+    shortest = np.inf
+    for start in range(0, len(hull), 1024):
+        block = hull[start:start + 1024]
+        d2 = ((block[:, None, :] - hull[None, :, :]) ** 2).sum(axis=2)
+        i, j = np.unravel_index(np.argmax(d2), d2.shape)
+        if d2[i, j] > longest:
+            longest, pair = d2[i, j], (start + i, j)
+        rows = np.arange(len(block))
+        d2[rows, start + rows] = np.inf  # distance from each vertex to itself
+        shortest = min(shortest, d2.min())
+    p, q = hull[pair[0]], hull[pair[1]]
+    dx, dy = q - p
+    orientation = np.degrees(np.arctan2(dx, dy)) % 180
+    return float(np.sqrt(longest)), float(np.sqrt(shortest)), float(orientation)
+
+
+def isoperimetric(area, perimeter):
+    """Isoperimetric quotient, 1 for a circle and near 0 for slivers (same pi as the LOCUS sliver flag rules)."""
+    return (4 * 3.14159 * area) / (perimeter ** 2)
+
+
+def albers_to_geographic(x, y):
+    """
+    Inverse Albers equal-area conic projection for EPSG:5070 (Snyder 1987, eq. 14-21 to 14-23 and 3-16), vectorized.
+    :param x: Array of Albers x coordinates (meters)
+    :param y: Array of Albers y coordinates (meters)
+    :return: Tuple of (latitude, longitude) arrays in NAD83 decimal degrees
+    """
+    a = ALBERS_SEMI_MAJOR
+    e2 = 2 * ALBERS_FLATTENING - ALBERS_FLATTENING ** 2
+    e = np.sqrt(e2)
+
+    def m(phi):
+        return np.cos(phi) / np.sqrt(1 - e2 * np.sin(phi) ** 2)
+
+    def q(phi):
+        sin = np.sin(phi)
+        return (1 - e2) * (sin / (1 - e2 * sin ** 2) - np.log((1 - e * sin) / (1 + e * sin)) / (2 * e))
+
+    phi0, phi1, phi2 = np.radians([ALBERS_LAT_ORIGIN] + list(ALBERS_PARALLELS))
+    n = (m(phi1) ** 2 - m(phi2) ** 2) / (q(phi2) - q(phi1))
+    c = m(phi1) ** 2 + n * q(phi1)
+    rho0 = a * np.sqrt(c - n * q(phi0)) / n
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    rho = np.sqrt(x ** 2 + (rho0 - y) ** 2)
+    theta = np.arctan2(x, rho0 - y)
+    q_point = (c - (rho * n / a) ** 2) / n
+    phi = np.arcsin(np.clip(q_point / 2, -1, 1))
+    for i in range(10):  # converges to well under a millimeter in 3 or 4 iterations
+        sin = np.sin(phi)
+        phi = phi + (1 - e2 * sin ** 2) ** 2 / (2 * np.cos(phi)) * (
+            q_point / (1 - e2) - sin / (1 - e2 * sin ** 2) + np.log((1 - e * sin) / (1 + e * sin)) / (2 * e))
+    return np.degrees(phi), ALBERS_LON_ORIGIN + np.degrees(theta / n)
+
+
+def polygon_metrics(wkbs):
+    """
+    Area, perimeter, part count and convex hull axes for many polygons. Area and perimeter are computed for all rings
+    of the batch at once, hull axes one polygon at a time.
+    :param wkbs: Sequence of polygon WKB
+    :return: Dictionary of arrays: area, perimeter, part_count, hull_length, hull_width, hull_orientation
+    """
+    count = len(wkbs)
+    result = {k: np.zeros(count) for k in ('area', 'perimeter', 'hull_length', 'hull_width', 'hull_orientation')}
+    result['part_count'] = np.zeros(count, dtype=np.int64)
+    for start in range(0, count, BATCH_SIZE):
+        coords, ring_ids, ring_features, ring_signs = [], [], [], []
+        for i, wkb in enumerate(wkbs[start:start + BATCH_SIZE]):
+            feature = start + i
+            if wkb is None:
+                continue
+            rings, parts, holes = parse_polygon_wkb(wkb)
+            result['part_count'][feature] = parts
+            if rings:
+                vertices = np.concatenate(rings)
+                (result['hull_length'][feature], result['hull_width'][feature],
+                 result['hull_orientation'][feature]) = hull_axes(vertices)
+            for ring, hole in zip(rings, holes):
+                ring_ids.append(np.full(len(ring), len(ring_features)))
+                ring_features.append(feature)
+                ring_signs.append(-1.0 if hole else 1.0)
+                coords.append(ring)
+        if not coords:
+            continue
+        xy = np.concatenate(coords)
+        ring_of_vertex = np.concatenate(ring_ids)
+        ring_features = np.array(ring_features)
+        # segments between consecutive vertices of the same ring (rings are closed in WKB)
+        same_ring = ring_of_vertex[:-1] == ring_of_vertex[1:]
+        x0, y0, x1, y1 = xy[:-1, 0], xy[:-1, 1], xy[1:, 0], xy[1:, 1]
+        cross = np.where(same_ring, x0 * y1 - x1 * y0, 0)
+        seg_length = np.where(same_ring, np.hypot(x1 - x0, y1 - y0), 0)
+        n_rings = len(ring_features)
+        ring_area = np.bincount(ring_of_vertex[:-1], weights=cross, minlength=n_rings) / 2
+        ring_length = np.bincount(ring_of_vertex[:-1], weights=seg_length, minlength=n_rings)
+        # ring orientation is not reliable in WKB from every source, so holes are known by position, not winding
+        net_area = np.abs(ring_area) * np.array(ring_signs)
+        result['area'] += np.bincount(ring_features, weights=net_area, minlength=count)
+        result['perimeter'] += np.bincount(ring_features, weights=ring_length, minlength=count)
+    return result
+
+
+def sliver_flag(lake_arearatio, area_m2, isoperimetric_quotient):
+    """
+    Flag watersheds that are slivers of the lake rather than real drainage areas. See the LOCUS Guide documentation
+    for ws_sliverflag; the table there explains these criteria.
+    :param lake_arearatio: Array of watershed area / focal lake area
+    :param area_m2: Array of watershed areas in square meters
+    :param isoperimetric_quotient: Array, result of isoperimetric
+    :return: Array of 'Y' or 'N'
+    """
+    ratio = np.asarray(lake_arearatio, dtype=np.float64)
+    area_m2 = np.asarray(area_m2, dtype=np.float64)
+    conditions = [(0.02 < ratio) & (ratio <= 1.0) & (isoperimetric_quotient <= 0.003),
+                  ratio <= 0.025,
+                  (0.025 < ratio) & (ratio <= 0.10) & (area_m2 <= 15000),
+                  (0.10 < ratio) & (ratio <= 0.13) & (area_m2 <= 10000),
+                  (0.13 < ratio) & (ratio <= 0.3) & (area_m2 <= 5000)]
+    return np.where(np.logical_or.reduce(conditions), 'Y', 'N')
@@ -0,0 +1,447 @@
+# filename: shared_network.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Publish a built NHDNetwork to memory-mapped arrays so that many worker processes can trace the same network
+# read-only without each one building and holding its own copy of the NHDNetwork dictionaries.
+
+import json
+import os
+
+import numpy as np
+
+MANIFEST_NAME = 'network.json'
+ARRAY_NAMES = ('flowline_ids',
+               'waterbody_ids',
+               'upstream_indptr',
+               'upstream_indices',
+               'downstream_indptr',
+               'downstream_indices',
+               'flowline_waterbody',
+               'waterbody_flowline_indptr',
+               'waterbody_flowline_indices',
+               'lake_area')
+INDEX_DTYPE = np.int32
+
+
+# ---UTILITIES------------------------------------------------------------------------------------------------------
+def intern_ids(ids):
+    """
+    Convert Permanent_Identifiers to a sorted, de-duplicated, fixed-width byte string array. Positions in this array are
+    the integer identifiers used by every other array in a published network.
+    :param ids: Iterable of Permanent_Identifier strings
+    :return: numpy array of dtype S<n>
+    """
+    ids = sorted(set(ids))
+    width = max([len(i) for i in ids] + [1])
+    return np.array(ids, dtype='S{}'.format(width))
+
+
+def lookup_ids(interned_ids, ids):
+    """
+    Find the integer identifier for each Permanent_Identifier with a binary search of the interned array, which works
+    the same on a memory-mapped array as on an in-memory one.
+    :param interned_ids: Sorted array from intern_ids
+    :param ids: Iterable of Permanent_Identifier strings
+    :return: numpy array of integer identifiers, -1 where the Permanent_Identifier is not in the network
+    """
+    ids = list(ids)
+    # ids wider than the interned width would be truncated by the cast and could match a shorter id, so they never match
+    too_long = np.array([len(i) > interned_ids.itemsize for i in ids], dtype=bool)
+    ids = np.array(ids, dtype=interned_ids.dtype)
+    if not ids.size or not interned_ids.size:
+        return np.full(ids.size, -1, dtype=INDEX_DTYPE)
+    positions = np.searchsorted(interned_ids, ids)
+    positions[positions == interned_ids.size] = 0
+    return np.where((interned_ids[positions] == ids) & ~too_long, positions, -1).astype(INDEX_DTYPE)
+
+
+def decode_ids(interned_ids, indices):
+    """
+    Convert integer identifiers back to Permanent_Identifier strings.
+    :param interned_ids: Sorted array from intern_ids
+    :param indices: Integer identifiers
+    :return: List of Permanent_Identifier strings
+    """
+    return interned_ids[np.asarray(indices, dtype=np.int64)].astype(str).tolist()
+
+
+def build_csr(adjacency, interned_ids):
+    """
+    Pack an adjacency dictionary (such as NHDNetwork.upstream) into compressed sparse row arrays. The neighbors of node
+    i are indices[indptr[i]:indptr[i + 1]].
+    :param dict adjacency: Dictionary with key = Permanent_Identifier, value = list of Permanent_Identifiers
+    :param interned_ids: Sorted array from intern_ids defining the node numbering
+    :return: Tuple of (indptr, indices) arrays
+    """
+    keys = [k for k, v in adjacency.items() if v]
+    key_index = lookup_ids(interned_ids, keys)
+    counts = np.zeros(interned_ids.size, dtype=np.int64)
+    neighbor_lists = [adjacency[k] for k in keys]
+    counts[key_index] = [len(v) for v in neighbor_lists]
+    indptr = np.zeros(interned_ids.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    indices = np.empty(indptr[-1], dtype=INDEX_DTYPE)
+    for i, neighbors in zip(key_index, neighbor_lists):
+        indices[indptr[i]:indptr[i + 1]] = lookup_ids(interned_ids, neighbors)
+    return indptr, indices
+
+
+def gather_neighbors(indptr, indices, nodes):
+    """
+    Collect the neighbors of many nodes at once from compressed sparse row arrays.
+    :param indptr: CSR row pointer array
+    :param indices: CSR column index array
+    :param nodes: Integer identifiers of the nodes
+    :return: numpy array of neighbor identifiers (may contain duplicates)
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return indices[offsets + np.arange(total)]
+
+
+# ---PUBLISHING-----------------------------------------------------------------------------------------------------
+def publish_network(network, out_dir):
+    """
+    Write a built NHDNetwork to a directory of memory-mappable arrays. Any dictionaries the network has not yet built
+    are built first. The intermittent flow and lake definition settings in effect on the network are the ones
+    published. The manifest is written last so that readers never attach to a partially written network.
+    :param network: An NHDNetwork instance
+    :param str out_dir: Directory to create (or overwrite) with the published network
+    :return: out_dir
+    """
+    if not network.upstream:
+        network.prepare_upstream()
+    if not network.downstream:
+        network.prepare_downstream()
+    if not network.flowline_waterbody:
+        network.map_flowlines_to_waterbodies()
+    if not network.waterbody_flowline:
+        network.map_waterbodies_to_flowlines()
+    if not network.lakes_areas:
+        network.define_lakes()
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    # intern the ids, '0' is the NHD placeholder for "no flowline" and is not a node
+    flowline_set = set(network.upstream.keys()).union(network.downstream.keys())
+    flowline_set.update(i for v in network.upstream.values() for i in v)
+    flowline_set.update(i for v in network.downstream.values() for i in v)
+    flowline_set.update(network.flowline_waterbody.keys())
+    flowline_set.discard('0')
+    flowline_ids = intern_ids(flowline_set)
+
+    waterbody_set = set(network.waterbody_flowline.keys()).union(network.flowline_waterbody.values())
+    waterbody_set.update(network.lakes_areas.keys())
+    waterbody_ids = intern_ids(waterbody_set)
+
+    upstream = {k: [i for i in v if i != '0'] for k, v in network.upstream.items() if k != '0'}
+    downstream = {k: [i for i in v if i != '0'] for k, v in network.downstream.items() if k != '0'}
+    upstream_indptr, upstream_indices = build_csr(upstream, flowline_ids)
+    downstream_indptr, downstream_indices = build_csr(downstream, flowline_ids)
+
+    # waterbody <-> flowline maps
+    flowline_waterbody = np.full(flowline_ids.size, -1, dtype=INDEX_DTYPE)
+    mapped_flowlines = list(network.flowline_waterbody.keys())
+    flowline_waterbody[lookup_ids(flowline_ids, mapped_flowlines)] = lookup_ids(
+        waterbody_ids, [network.flowline_waterbody[f] for f in mapped_flowlines])
+
+    waterbody_flowline_indptr = np.zeros(waterbody_ids.size + 1, dtype=np.int64)
+    mapped = np.flatnonzero(flowline_waterbody >= 0)
+    order = np.argsort(flowline_waterbody[mapped], kind='mergesort')
+    waterbody_flowline_indices = mapped[order].astype(INDEX_DTYPE)
+    np.cumsum(np.bincount(flowline_waterbody[mapped], minlength=waterbody_ids.size),
+              out=waterbody_flowline_indptr[1:])
+
+    # lake areas in square kilometers, NaN for waterbodies that are not in the lake population
+    lake_area = np.full(waterbody_ids.size, np.nan)
+    lake_ids = list(network.lakes_areas.keys())
+    lake_area[lookup_ids(waterbody_ids, lake_ids)] = [network.lakes_areas[i] for i in lake_ids]
+
+    arrays = {'flowline_ids': flowline_ids,
+              'waterbody_ids': waterbody_ids,
+              'upstream_indptr': upstream_indptr,
+              'upstream_indices': upstream_indices,
+              'downstream_indptr': downstream_indptr,
+              'downstream_indices': downstream_indices,
+              'flowline_waterbody': flowline_waterbody,
+              'waterbody_flowline_indptr': waterbody_flowline_indptr,
+              'waterbody_flowline_indices': waterbody_flowline_indices,
+              'lake_area': lake_area}
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(out_dir, name + '.npy'), arrays[name])
+
+    manifest = {'gdb': network.gdb,
+                'huc4': network.huc4,
+                'plus': network.plus,
+                'exclude_intermittent_flow': network.exclude_intermittent_flow,
+                'flowline_count': int(flowline_ids.size),
+                'waterbody_count': int(waterbody_ids.size),
+                'lake_count': len(lake_ids)}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return out_dir
+
+
+# ---ATTACHING------------------------------------------------------------------------------------------------------
+class SharedNetwork:
+    """
+    Read-only view of a network published with publish_network. The arrays are memory-mapped, so any number of
+    processes attached to the same directory share one copy of the network in the operating system page cache. The
+    tracing methods mirror the NHDNetwork methods of the same name and return the same results. Barriers are held per
+    instance and never written back to the published arrays.
+
+    :param str published_dir: Directory written by publish_network
+
+    Attributes
+    ----------
+    :ivar str path: Directory the network was attached from
+    :ivar str huc4: 4-digit hydrologic unit code of the published network
+    :ivar bool plus: Whether the published network came from the NHDPlus
+    :ivar bool exclude_intermittent_flow: Whether intermittent flow was dropped before publishing
+    :ivar flowline_ids: Sorted flowline Permanent_Identifiers, position = flowline integer identifier
+    :ivar waterbody_ids: Sorted waterbody Permanent_Identifiers, position = waterbody integer identifier
+    :ivar lake_area: Lake area in square kilometers by waterbody integer identifier, NaN if not a lake
+    """
+
+    def __init__(self, published_dir):
+        manifest_path = os.path.join(published_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            raise Exception("No published network found at {}.".format(published_dir))
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        self.path = published_dir
+        self.gdb = manifest['gdb']
+        self.huc4 = manifest['huc4']
+        self.plus = manifest['plus']
+        self.exclude_intermittent_flow = manifest['exclude_intermittent_flow']
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(os.path.join(published_dir, name + '.npy'), mmap_mode='r'))
+
+        # private to this instance
+        self.waterbody_stop_ids = []
+        self._flowline_stops = None
+        self._waterbody_stops = None
+        self._visited = np.zeros(self.flowline_ids.size, dtype=bool)
+
+    # ---UTILITIES FOR HIGHER METHODS-----------------------------------------------------------------------------------
+    def _waterbody_flowlines(self, waterbody_index):
+        """Integer identifiers of the flowlines inside one waterbody."""
+        return self.waterbody_flowline_indices[self.waterbody_flowline_indptr[waterbody_index]:
+                                               self.waterbody_flowline_indptr[waterbody_index + 1]]
+
+    def _waterbody_flowlines_many(self, waterbody_indices):
+        """Integer identifiers of the flowlines inside many waterbodies."""
+        return gather_neighbors(self.waterbody_flowline_indptr, self.waterbody_flowline_indices, waterbody_indices)
+
+    def _walk(self, indptr, indices, start_indices):
+        """
+        Breadth-first walk from the start nodes, respecting barriers. Start nodes are always in the result. As in the
+        NHDNetwork traces, barriers apply from the second step on, so the start nodes' own neighbors are always reached.
+        :return: numpy array of the integer identifiers of all flowlines reached
+        """
+        visited = self._visited
+        frontier = np.unique(np.asarray(start_indices, dtype=np.int64))
+        reached = [frontier]
+        visited[frontier] = True
+        first_step = True
+        while frontier.size:
+            neighbors = gather_neighbors(indptr, indices, frontier)
+            neighbors = neighbors[~visited[neighbors]]
+            if self._flowline_stops is not None and not first_step:
+                neighbors = neighbors[~self._flowline_stops[neighbors]]
+            first_step = False
+            frontier = np.unique(neighbors)
+            visited[frontier] = True
+            reached.append(frontier)
+        result = np.concatenate(reached)
+        visited[result] = False  # reset the scratch array for the next trace
+        return result
+
+    def _flowline_waterbodies(self, flowline_indices):
+        """Integer identifiers of the waterbodies associated with the flowlines, minus any waterbody barriers."""
+        waterbodies = np.unique(self.flowline_waterbody[flowline_indices])
+        waterbodies = waterbodies[waterbodies >= 0]
+        if self._waterbody_stops is not None:
+            waterbodies = waterbodies[~self._waterbody_stops[waterbodies]]
+        return waterbodies
+
+    def _trace_flowline(self, flowline_start_id, include_wb_permids, indptr, indices):
+        start = lookup_ids(self.flowline_ids, [flowline_start_id])
+        if start[0] < 0:
+            return [flowline_start_id]
+        trace = self._walk(indptr, indices, start)
+        result = decode_ids(self.flowline_ids, trace)
+        if include_wb_permids:
+            result.extend(decode_ids(self.waterbody_ids, self._flowline_waterbodies(trace)))
+        return result
+
+    def _trace_waterbody(self, waterbody_start_id, indptr, indices, reverse_indptr, reverse_indices):
+        """
+        Trace from the lowest (or highest) flowlines of a waterbody without letting the waterbody stop itself.
+        :return: Tuple of (flowline integer identifiers, waterbody integer identifiers) in the trace
+        """
+        waterbody_index = lookup_ids(self.waterbody_ids, [waterbody_start_id])[0]
+        if waterbody_index < 0:
+            return np.empty(0, dtype=INDEX_DTYPE), np.empty(0, dtype=INDEX_DTYPE)
+        own_flowlines = self._waterbody_flowlines(waterbody_index)
+        if not own_flowlines.size:
+            return own_flowlines, np.empty(0, dtype=INDEX_DTYPE)
+
+        # remove waterbody's own flowlines from stop ids--don't want them to stop themselves
+        restore_flowlines = restore_waterbody = None
+        if self._flowline_stops is not None:
+            restore_flowlines = self._flowline_stops[own_flowlines].copy()
+            self._flowline_stops[own_flowlines] = False
+            restore_waterbody = self._waterbody_stops[waterbody_index]
+            self._waterbody_stops[waterbody_index] = False
+
+        # lakes may have multiple outlets (or inlets)
+        ends = np.setdiff1d(own_flowlines, gather_neighbors(reverse_indptr, reverse_indices, own_flowlines))
+        flowlines = self._walk(indptr, indices, ends)
+        waterbodies = self._flowline_waterbodies(flowlines)
+
+        if restore_flowlines is not None:
+            self._flowline_stops[own_flowlines] = restore_flowlines
+            self._waterbody_stops[waterbody_index] = restore_waterbody
+        return flowlines, waterbodies
+
+    # ---NETWORK SETUP FOR TRACING--------------------------------------------------------------------------------------
+    def set_stop_ids(self, waterbody_stop_ids):
+        """
+        Activate waterbodies (and their flowlines) as barriers for tracing on this instance only.
+        :param list waterbody_stop_ids: List of WATERBODY Permanent_Identifiers to act as barriers.
+        :return: None
+        """
+        self.waterbody_stop_ids = list(waterbody_stop_ids)
+        waterbodies = lookup_ids(self.waterbody_ids, self.waterbody_stop_ids)
+        waterbodies = waterbodies[waterbodies >= 0]
+        self._waterbody_stops = np.zeros(self.waterbody_ids.size, dtype=bool)
+        self._waterbody_stops[waterbodies] = True
+        self._flowline_stops = np.zeros(self.flowline_ids.size, dtype=bool)
+        if waterbodies.size:
+            self._flowline_stops[self._waterbody_flowlines_many(waterbodies)] = True
+
+    def activate_10ha_lake_stops(self):
+        """Activate flow barriers at all published lakes greater than 10 hectares in size.
+        :return: List of waterbody Permanent_Identifiers used as barriers
+        """
+        tenha = np.flatnonzero(np.nan_to_num(self.lake_area) >= 0.1)
+        self.set_stop_ids(decode_ids(self.waterbody_ids, tenha))
+        return self.waterbody_stop_ids
+
+    def deactivate_stops(self):
+        """Deactivate all network barriers (flow proceeds unimpeded through entire network).
+        :return: None
+        """
+        self.waterbody_stop_ids = []
+        self._flowline_stops = None
+        self._waterbody_stops = None
+
+    # ---WATERSHED TRACING METHODS--------------------------------------------------------------------------------------
+    def trace_up_from_a_flowline(self, flowline_start_id, include_wb_permids=True):
+        """
+        Trace a network upstream of the input flowline. See NHDNetwork.trace_up_from_a_flowline.
+        :param str flowline_start_id: Flowline Permanent_Identifier of flow destination (upstream trace start point).
+        :param bool include_wb_permids: Whether to include waterbody Permanent_Identifiers in the trace.
+        :return: List of Permanent_Identifier values in the upstream network trace, including the start
+        """
+        return self._trace_flowline(flowline_start_id, include_wb_permids,
+                                    self.upstream_indptr, self.upstream_indices)
+
+    def trace_down_from_a_flowline(self, flowline_start_id, include_wb_permids=True):
+        """
+        Trace a network downstream of the input flowline. See NHDNetwork.trace_down_from_a_flowline.
+        :param str flowline_start_id: Flowline Permanent_Identifier of the downstream trace start point.
+        :param bool include_wb_permids: Whether to include waterbody Permanent_Identifiers in the trace.
+        :return: List of Permanent_Identifier values in the downstream network trace, including the start
+        """
+        return self._trace_flowline(flowline_start_id, include_wb_permids,
+                                    self.downstream_indptr, self.downstream_indices)
+
+    def trace_up_from_a_waterbody(self, waterbody_start_id):
+        """
+        Trace a network upstream of the input waterbody. See NHDNetwork.trace_up_from_a_waterbody.
+        :param waterbody_start_id: Waterbody Permanent_Identifier of flow destination (upstream trace start point).
+        :return: List of Permanent_Identifier values for flowlines and waterbodies in the upstream network trace.
+        Empty list if waterbody is isolated.
+        """
+        flowlines, waterbodies = self._trace_waterbody(waterbody_start_id,
+                                                       self.upstream_indptr, self.upstream_indices,
+                                                       self.upstream_indptr, self.upstream_indices)
+        return decode_ids(self.flowline_ids, flowlines) + decode_ids(self.waterbody_ids, waterbodies)
+
+    def trace_down_from_a_waterbody(self, waterbody_start_id):
+        """
+        Trace a network downstream of the input waterbody. See NHDNetwork.trace_down_from_a_waterbody.
+        :param waterbody_start_id: Waterbody Permanent_Identifier of the downstream trace start point.
+        :return: List of Permanent_Identifier values for flowlines and waterbodies in the downstream network trace.
+        """
+        flowlines, waterbodies = self._trace_waterbody(waterbody_start_id,
+                                                       self.downstream_indptr, self.downstream_indices,
+                                                       self.downstream_indptr, self.downstream_indices)
+        return decode_ids(self.flowline_ids, flowlines) + decode_ids(self.waterbody_ids, waterbodies)
+
+    # ---INLET/OUTLET METHODS-------------------------------------------------------------------------------------------
+    def identify_lake_outlets(self, waterbody_start_id):
+        """
+        Identify the bottom-most flowlines in the lake's internal network. See NHDNetwork.identify_lake_outlets.
+        :param str waterbody_start_id: The waterbody to identify outlets for.
+        :return: A list of the flowline Permanent_Identifiers that are associated with the lake outlets
+        """
+        return self._lake_ends(waterbody_start_id, self.upstream_indptr, self.upstream_indices)
+
+    def identify_lake_inlets(self, waterbody_start_id):
+        """
+        Identify the top-most flowlines in the lake's internal network. See NHDNetwork.identify_lake_inlets.
+        :param str waterbody_start_id: The waterbody to identify inlets for.
+        :return: A list of the flowline Permanent_Identifiers that are associated with the lake inlets
+        """
+        return self._lake_ends(waterbody_start_id, self.downstream_indptr, self.downstream_indices)
+
+    def _lake_ends(self, waterbody_start_id, indptr, indices):
+        waterbody_index = lookup_ids(self.waterbody_ids, [waterbody_start_id])[0]
+        if waterbody_index < 0:
+            return []
+        own_flowlines = self._waterbody_flowlines(waterbody_index)
+        ends = np.setdiff1d(own_flowlines, gather_neighbors(indptr, indices, own_flowlines))
+        return decode_ids(self.flowline_ids, ends)
+
+    # ---OTHER CONNECTIVITY CALCULATIONS--------------------------------------------------------------------------------
+    def find_upstream_lakes(self, waterbody_start_id, result_type='list', area_threshold=0):
+        """
+        Identify and/or summarize the count or area of lakes upstream of this focal lake. See
+        NHDNetwork.find_upstream_lakes.
+        :param str waterbody_start_id: The Permanent_Identifier for the lake to be assessed
+        :param str result_type: 'list', 'count', or 'area_hectares'. The result type to be returned.
+        :param float area_threshold: An area threshold applied to filter the upstream lakes to be identified/summarized.
+        :return: A list, int, or float corresponding to the result_type selected.
+        """
+        valid_result_type = {'list', 'count', 'area_hectares'}
+        if result_type not in valid_result_type:
+            raise ValueError("result_type must be one of {}".format(valid_result_type))
+
+        flowlines, waterbodies = self._trace_waterbody(waterbody_start_id,
+                                                       self.upstream_indptr, self.upstream_indices,
+                                                       self.upstream_indptr, self.upstream_indices)
+        areas = self.lake_area[waterbodies]
+        start_index = lookup_ids(self.waterbody_ids, [waterbody_start_id])[0]
+        upstream_lakes = waterbodies[(areas >= area_threshold) & (waterbodies != start_index)]
+
+        if result_type == 'list':
+            return decode_ids(self.waterbody_ids, upstream_lakes)
+        if result_type == 'count':
+            return int(upstream_lakes.size)
+        if result_type == 'area_hectares':
+            return float(self.lake_area[upstream_lakes].sum()) * 100  # convert to hectares
@@ -7,6 +7,9 @@
 import os
 import arcpy
 from arcpy import analysis as AN, management as DM
+import numpy as np
+
+import shape_metrics
 
 
 def add_lat_lon(fc, zone_name=''):
@@ -25,15 +28,17 @@ def add_lat_lon(fc, zone_name=''):
         DM.AddField(fc, lat, 'DOUBLE')
     if not arcpy.ListFields(fc, lon):
         DM.AddField(fc, lon, 'DOUBLE')
-    orig_crs = arcpy.SpatialReference(5070) # Albers USGS
-    new_crs = arcpy.SpatialReference(4326)  # NAD83
+    # centroids (SHAPE@XY, same as Geometry.centroid) are in Albers USGS, EPSG:5070, and are projected all at once
+    oids, centroids = zip(*arcpy.da.SearchCursor(fc, ['OID@', 'SHAPE@XY'])) or ([], [])
+    centroids = np.array(centroids, dtype=np.float64).reshape(-1, 2)
+    lats, lons = shape_metrics.albers_to_geographic(centroids[:, 0], centroids[:, 1])
+    row_index = {oid: i for i, oid in enumerate(oids)}
 
-    with arcpy.da.UpdateCursor(fc, [lat, lon, 'SHAPE@']) as u_cursor:
+    with arcpy.da.UpdateCursor(fc, ['OID@', lat, lon]) as u_cursor:
         for row in u_cursor:
-            centroid = arcpy.PointGeometry(row[2].centroid, orig_crs)
-            centroid_nad83 = centroid.projectAs(new_crs)
-            row[0] = centroid_nad83.firstPoint.Y
-            row[1] = centroid_nad83.firstPoint.X
+            i = row_index[row[0]]
+            row[1] = float(lats[i])
+            row[2] = float(lons[i])
             u_cursor.updateRow(row)
 
 
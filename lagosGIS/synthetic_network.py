@@ -0,0 +1,166 @@
+# filename: synthetic_network.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Generate NHDPlus HR-like flow networks of any size for testing and benchmarking NHDNetwork without ArcGIS.
+
+import os
+import random
+
+from NHDNetwork import NHDNetwork
+
+# FCodes used by the generator
+PERENNIAL = 46006
+INTERMITTENT = 46003
+EPHEMERAL = 46007
+ARTIFICIAL_PATH = 55800
+LAKE = 39004
+SWAMP = 46600
+
+
+def generate_network_tables(n_flowlines, seed=0, huc4='0000', n_closed_basins=3, closed_basin_fraction=0.1,
+                            lake_fraction=0.03, isolated_lake_fraction=0.2, braid_fraction=0.02,
+                            cycle_fraction=0.001, intermittent_fraction=0.35):
+    """
+    Generate the NHDPlusFlow, NHDFlowline and NHDWaterbody tables for a synthetic subregion. The network includes:
+        dendritic trees with both long main stems and bushy tributaries
+        braided divergences that rejoin the network downstream
+        a small number of cycles
+        lakes with one or more artificial paths converging on the lake outlet, plus isolated lakes with no flowlines
+        intermittent and ephemeral FCodes
+        closed basins draining to network ends ('0') alongside a main basin that drains to the next subregion and
+        receives flow from an upstream subregion
+    The same arguments always produce the same tables.
+
+    :param int n_flowlines: Number of flowlines to generate
+    :param int seed: Random seed
+    :param str huc4: 4-digit code used in the identifiers
+    :param int n_closed_basins: Number of closed basins
+    :param float closed_basin_fraction: Fraction of the flowlines in closed basins
+    :param float lake_fraction: Number of networked lakes as a fraction of the flowline count
+    :param float isolated_lake_fraction: Fraction of all lakes that have no flowlines
+    :param float braid_fraction: Fraction of flowlines with a second, braided downstream connection
+    :param float cycle_fraction: Fraction of flowlines that start a cycle
+    :param float intermittent_fraction: Fraction of non-lake flowlines with intermittent or ephemeral FCodes
+    :return: Dictionary with key = table name, value = (list of field names, list of row tuples)
+    """
+    rng = random.Random(seed)
+    flowline_ids = ['fl{}-{:07d}'.format(huc4, i) for i in range(n_flowlines)]
+
+    # ---TREES-----
+    # each flowline drains to one parent with a lower index, either the previous flowline (long stems) or a random
+    # earlier one (tributary junctions)
+    n_closed = int(n_flowlines * closed_basin_fraction) if n_closed_basins else 0
+    closed_sizes = [n_closed // n_closed_basins] * n_closed_basins if n_closed else []
+    basin_sizes = [n_flowlines - sum(closed_sizes)] + closed_sizes
+    parent = [-1] * n_flowlines
+    basin_outlets = []
+    offset = 0
+    for size in basin_sizes:
+        basin_outlets.append(offset)
+        for i in range(offset + 1, offset + size):
+            if rng.random() < 0.5:
+                parent[i] = max(offset, i - 1 - int(rng.expovariate(0.5)))
+            else:
+                parent[i] = rng.randint(offset, i - 1)
+        offset += size
+
+    flow = []
+    has_child = [False] * n_flowlines
+    for i, p in enumerate(parent):
+        if p >= 0:
+            flow.append((flowline_ids[i], flowline_ids[p]))
+            has_child[p] = True
+
+    # main basin drains to and receives flow from neighboring subregions, closed basins end at '0'
+    flow.append((flowline_ids[basin_outlets[0]], 'outlet{}'.format(huc4)))
+    flow.append(('inlet{}'.format(huc4), flowline_ids[rng.randint(0, basin_sizes[0] - 1)]))
+    for outlet in basin_outlets[1:]:
+        flow.append((flowline_ids[outlet], '0'))
+    flow.extend([('0', flowline_ids[i]) for i in range(n_flowlines) if not has_child[i]])
+
+    # ---DIVERGENCES AND CYCLES-----
+    for i in range(n_flowlines):
+        p = parent[i]
+        if p < 0 or parent[p] < 0:
+            continue
+        draw = rng.random()
+        if draw < braid_fraction:
+            flow.append((flowline_ids[i], flowline_ids[parent[p]]))
+        elif draw < braid_fraction + cycle_fraction:
+            flow.append((flowline_ids[parent[p]], flowline_ids[i]))
+
+    # ---LAKES-----
+    # a lake contains its outlet flowline and the artificial paths that flow into the outlet
+    children = {}
+    for i, p in enumerate(parent):
+        if p >= 0:
+            children.setdefault(p, []).append(i)
+    flowline_waterbody = {}
+    waterbodies = []
+    n_lakes = int(n_flowlines * lake_fraction)
+    candidates = [i for i in children if i not in basin_outlets]
+    rng.shuffle(candidates)
+    for outlet in candidates[:n_lakes]:
+        paths = [outlet] + children[outlet][:rng.randint(1, 3)]
+        if any(i in flowline_waterbody for i in paths):
+            continue
+        waterbody_id = 'wb{}-{:07d}'.format(huc4, len(waterbodies))
+        for i in paths:
+            flowline_waterbody[i] = waterbody_id
+        waterbodies.append(waterbody_id)
+    n_isolated = int(len(waterbodies) * isolated_lake_fraction / (1 - isolated_lake_fraction))
+    waterbodies.extend(['wb{}-{:07d}'.format(huc4, len(waterbodies) + i) for i in range(n_isolated)])
+
+    # ---ATTRIBUTES-----
+    flowline_rows = []
+    for i, id in enumerate(flowline_ids):
+        if i in flowline_waterbody:
+            fcode = ARTIFICIAL_PATH
+        else:
+            draw = rng.random()
+            if draw < intermittent_fraction * 0.85:
+                fcode = INTERMITTENT
+            elif draw < intermittent_fraction:
+                fcode = EPHEMERAL
+            else:
+                fcode = PERENNIAL
+        flowline_rows.append((id, flowline_waterbody.get(i, None), fcode, float(10000000 + i)))
+
+    waterbody_rows = []
+    for i, id in enumerate(waterbodies):
+        area = round(10 ** rng.uniform(-3, 1), 4)  # 0.1 ha to 10 km2
+        fcode = SWAMP if rng.random() < 0.1 else LAKE
+        waterbody_rows.append((id, area, fcode, float(50000000 + i)))
+
+    return {'NHDPlusFlow': (['FromPermID', 'ToPermID'], flow),
+            'NHDFlowline': (['Permanent_Identifier', 'WBArea_Permanent_Identifier', 'FCode', 'NHDPlusID'],
+                            flowline_rows),
+            'NHDWaterbody': (['Permanent_Identifier', 'AreaSqKm', 'FCode', 'NHDPlusID'], waterbody_rows)}
+
+
+class SyntheticNHDNetwork(NHDNetwork):
+    """
+    NHDNetwork built from generated tables instead of a geodatabase. All NHDNetwork methods except
+    save_trace_catchments work without ArcGIS. Other keyword arguments are passed to generate_network_tables.
+
+    :param int n_flowlines: Number of flowlines to generate
+    :param str huc4: 4-digit code used as the network huc4 and in the identifiers
+    :param dict tables: Tables already generated with generate_network_tables, to build another network from the same
+    tables without generating them again. n_flowlines and kwargs are ignored if supplied.
+    """
+
+    def __init__(self, n_flowlines, huc4='0000', tables=None, **kwargs):
+        self.tables = tables if tables else generate_network_tables(n_flowlines, huc4=huc4, **kwargs)
+        NHDNetwork.__init__(self, 'synthetic_{}.gdb'.format(huc4))
+
+    def _exists(self, path):
+        name = os.path.basename(path)
+        return name == 'NHDPlus' or name in self.tables
+
+    def _read_rows(self, table, fields):
+        table_fields, rows = self.tables[os.path.basename(table)]
+        positions = [table_fields.index(f) for f in fields]
+        for row in rows:
+            yield tuple([row[p] for p in positions])
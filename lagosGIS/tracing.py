@@ -0,0 +1,453 @@
+# filename: tracing.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): all
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Trace the geoprocessing tools, arcpy.da cursors and data_access reads and writes called while tracing is
+# enabled, plus named stages, as JSON-lines spans (wall time, CPU time, peak memory, rows in and out, calling tool and
+# stage), and report where a run spent its time: a flame-style breakdown by stage and the slowest calls.
+
+import inspect
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+TOOLBOX_ALIASES = ('management', 'analysis', 'conversion', 'cartography', 'edit', 'sa', 'stats')
+CURSORS = ('SearchCursor', 'InsertCursor', 'UpdateCursor')
+DATA_ACCESS_FUNCTIONS = ('read_rows', 'read_batches', 'read_columns', 'insert_rows', 'update_rows', 'write_batches')
+SKIPPED_FILES = ('tracing.py', 'data_access.py', 'contextlib.py')  # not reported as the calling tool
+
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+_state = {'log': None, 'count_rows': True, 'originals': []}
+
+
+# ---MEASUREMENTS-------------------------------------------------------------------------------------------------------
+def _cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB, or None if it cannot be measured."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024.0 ** 2 if sys.platform == 'darwin' else peak / 1024.0
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024.0 ** 2
+    except ImportError:
+        pass
+    try:  # Windows without psutil
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 1024.0 ** 2
+    except (AttributeError, OSError):
+        return None
+
+
+def _count(dataset):
+    """Row count of a table or feature class argument, or None."""
+    if not _state['count_rows'] or _state.get('get_count') is None:
+        return None
+    if hasattr(dataset, 'getOutput'):
+        dataset = dataset.getOutput(0)
+    if not isinstance(dataset, basestring if sys.version_info[0] == 2 else str):
+        return None
+    try:
+        return int(_state['get_count'](dataset).getOutput(0))
+    except Exception:
+        return None
+
+
+def _caller():
+    """module.function of the innermost lagosGIS (or script) frame outside this module and arcpy."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if os.path.basename(filename) not in SKIPPED_FILES and 'arcpy' not in filename.lower():
+            return '{}.{}'.format(os.path.splitext(os.path.basename(filename))[0], frame.f_code.co_name)
+        frame = frame.f_back
+    return ''
+
+
+# ---SPANS--------------------------------------------------------------------------------------------------------------
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _write(record):
+    with _lock:
+        if _state['log'] is not None:
+            _state['log'].write(json.dumps(record, default=str) + '\n')
+            _state['log'].flush()
+
+
+class _Span:
+    """One traced call or stage. Nested spans record their parent and the path of stage names above them."""
+
+    def __init__(self, name, kind, tool=None, rows_in=None, detail=None):
+        stack = _stack()
+        self.record = {'id': next(_ids), 'parent': stack[-1].record['id'] if stack else None,
+                       'path': [s.record['name'] for s in stack], 'name': name, 'kind': kind,
+                       'tool': tool if tool is not None else _caller(), 'thread': threading.current_thread().name,
+                       'pid': os.getpid(), 'rows_in': rows_in, 'rows_out': None, 'detail': detail}
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def resume(self):
+        _stack().append(self)
+        self._wall_start, self._cpu_start = time.time(), _cpu_seconds()
+        if 'start' not in self.record:
+            self.record['start'] = datetime.now().isoformat()
+
+    def pause(self):
+        self.wall += time.time() - self._wall_start
+        self.cpu += _cpu_seconds() - self._cpu_start
+        stack = _stack()
+        if self in stack:
+            stack.remove(self)
+
+    def finish(self, rows_out=None, error=None):
+        self.record.update({'wall_s': round(self.wall, 6), 'cpu_s': round(self.cpu, 6), 'peak_rss_mb': peak_rss_mb(),
+                            'rows_out': rows_out if rows_out is not None else self.record['rows_out']})
+        if error is not None:
+            self.record['error'] = repr(error)
+        _write(self.record)
+
+    def __enter__(self):
+        self.resume()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pause()
+        self.finish(error=exc_value)
+        return False
+
+
+def span(name, **detail):
+    """
+    A named stage, traced if tracing is enabled. Calls inside it are reported under the stage.
+
+        with tracing.span('crack lines'):
+            arcpy.Identity_analysis(...)
+
+    :param str name: Stage name
+    :param detail: (Optional) Extra values to record, e.g. zone='hu12'
+    :return: Context manager
+    """
+    if _state['log'] is None:
+        return _NoSpan()
+    return _Span(name, 'stage', detail=detail or None)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+# ---WRAPPERS-----------------------------------------------------------------------------------------------------------
+def _wrap_tool(name, function):
+    def traced(*args, **kwargs):
+        traced_span = _Span(name, 'geoprocessing', rows_in=_count(args[0]) if args else None)
+        traced_span.resume()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            traced_span.pause()
+            traced_span.finish(error=e)
+            raise
+        traced_span.pause()
+        traced_span.finish(rows_out=_count(result) if result is not None else None)
+        return result
+    traced.__name__ = getattr(function, '__name__', name)
+    traced.__doc__ = getattr(function, '__doc__', None)
+    traced._traced = function
+    return traced
+
+
+class _TracedCursor:
+    """Proxy for an arcpy.da cursor that counts the rows read, inserted, updated or deleted."""
+
+    def __init__(self, name, cursor_class, args, kwargs):
+        self._rows = 0
+        self._finished = False
+        self._span = _Span(name, 'cursor', detail={'table': str(args[0]) if args else None})
+        self._span.resume()
+        try:
+            self._cursor = cursor_class(*args, **kwargs)
+        except BaseException as e:
+            self._finished = True
+            self._span.pause()
+            self._span.finish(error=e)
+            raise
+        self._span.pause()
+
+    def _timed(self, method, *args):
+        self._span.resume()
+        try:
+            return method(*args)
+        finally:
+            self._span.pause()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            row = self._timed(next, self._cursor)
+        except StopIteration:
+            self._finish()
+            raise
+        self._rows += 1
+        return row
+    __next__ = next
+
+    def insertRow(self, row):
+        self._rows += 1
+        return self._timed(self._cursor.insertRow, row)
+
+    def updateRow(self, row):
+        self._rows += 1
+        return self._timed(self._cursor.updateRow, row)
+
+    def deleteRow(self):
+        self._rows += 1
+        return self._timed(self._cursor.deleteRow)
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self._span.finish(rows_out=self._rows)
+
+    def __enter__(self):
+        self._timed(self._cursor.__enter__)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        result = self._timed(self._cursor.__exit__, exc_type, exc_value, traceback)
+        self._finish()
+        return result
+
+    def __del__(self):
+        self._finish()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _wrap_cursor(name, cursor_class):
+    def traced(*args, **kwargs):
+        return _TracedCursor(name, cursor_class, args, kwargs)
+    traced._traced = cursor_class
+    return traced
+
+
+def _wrap_data_access(name, function):
+    def traced(*args, **kwargs):
+        traced_span = _Span(name, 'data_access', detail={'table': str(args[0]) if args else None})
+        traced_span.resume()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            traced_span.pause()
+            traced_span.finish(error=e)
+            raise
+        traced_span.pause()
+        if not inspect.isgenerator(result):
+            traced_span.finish(rows_out=result if isinstance(result, int) else None)
+            return result
+        return _traced_generator(traced_span, result, batches=name == 'read_batches')
+    traced.__name__ = function.__name__
+    traced.__doc__ = function.__doc__
+    traced._traced = function
+    return traced
+
+
+def _traced_generator(traced_span, generator, batches):
+    """Time only the work done inside the generator, not the caller's work between items."""
+    rows = 0
+    try:
+        while True:
+            traced_span.resume()
+            try:
+                item = next(generator)
+            except StopIteration:
+                break
+            finally:
+                traced_span.pause()
+            rows += len(next(iter(item.values()))) if batches and item else 1
+            yield item
+    finally:
+        traced_span.finish(rows_out=rows)
+
+
+# ---ENABLE/DISABLE-----------------------------------------------------------------------------------------------------
+def _patch(owner, name, wrapper):
+    original = getattr(owner, name)
+    if getattr(original, '_traced', None) is not None:
+        return
+    setattr(owner, name, wrapper(name, original))
+    _state['originals'].append((owner, name, original))
+
+
+def enable(log_path, trace_arcpy=True, trace_data_access=True, count_rows=True):
+    """
+    Start tracing to a JSON-lines file (appended to). Patches the arcpy toolbox functions (e.g. arcpy.Clip_analysis
+    and arcpy.analysis.Clip), the arcpy.da cursors and the data_access read and write functions for this process.
+    Functions imported by name before tracing was enabled (from arcpy.sa import *) are not traced.
+    :param str log_path: Output .jsonl file
+    :param bool trace_arcpy: Trace arcpy tools and cursors
+    :param bool trace_data_access: Trace data_access reads and writes
+    :param bool count_rows: Record the input and output row counts of tools (one Get Count each)
+    :return: log_path
+    """
+    disable()
+    directory = os.path.dirname(os.path.abspath(log_path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    _state['log'] = open(log_path, 'a')
+    _state['count_rows'] = count_rows
+    if trace_arcpy:
+        import arcpy
+        _state['get_count'] = arcpy.GetCount_management
+        for name in dir(arcpy):
+            if name.rsplit('_', 1)[-1] in TOOLBOX_ALIASES and '_' in name and callable(getattr(arcpy, name)):
+                _patch(arcpy, name, _wrap_tool)
+        for alias in TOOLBOX_ALIASES:
+            module = getattr(arcpy, alias, None)
+            if module is None:
+                continue
+            for name in dir(module):
+                if name[:1].isupper() and inspect.isfunction(getattr(module, name)):
+                    _patch(module, name, lambda n, f, a=alias: _wrap_tool('{}.{}'.format(a, n), f))
+        for name in CURSORS:
+            _patch(arcpy.da, name, _wrap_cursor)
+    if trace_data_access:
+        import data_access
+        for name in DATA_ACCESS_FUNCTIONS:
+            _patch(data_access, name, _wrap_data_access)
+    return log_path
+
+
+def disable():
+    """Stop tracing and restore the original functions."""
+    for owner, name, original in reversed(_state['originals']):
+        setattr(owner, name, original)
+    _state['originals'] = []
+    _state['get_count'] = None
+    with _lock:
+        if _state['log'] is not None:
+            _state['log'].close()
+            _state['log'] = None
+
+
+class tracing_to:
+    """
+    Context manager: trace to log_path while the block runs.
+    :param str log_path: Output .jsonl file
+    :param kwargs: Options for enable
+    """
+
+    def __init__(self, log_path, **kwargs):
+        self.log_path = log_path
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        enable(self.log_path, **self.kwargs)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        disable()
+        return False
+
+
+# ---REPORT-------------------------------------------------------------------------------------------------------------
+def read_spans(log_path):
+    """Read the spans of a trace log as a list of dictionaries."""
+    with open(log_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _or_dash(value):
+    return '-' if value is None else value
+
+
+def report(log_path, top=20, width=40):
+    """
+    Summarize a trace log.
+    :param str log_path: Trace log written while tracing was enabled
+    :param int top: Number of slowest calls to list
+    :param int width: Width of the bars in the breakdown
+    :return: Report text with a flame-style breakdown of wall time by stage path and call name (time includes the
+    nested calls, self is the time not in any nested span), then the slowest calls
+    """
+    spans = read_spans(log_path)
+    if not spans:
+        return 'No spans in {}'.format(log_path)
+    by_id = {(s['pid'], s['id']): s for s in spans}
+    child_time = defaultdict(float)
+    for s in spans:
+        if s['parent'] is not None:
+            child_time[(s['pid'], s['parent'])] += s.get('wall_s', 0)
+
+    totals = defaultdict(lambda: {'wall_s': 0.0, 'self_s': 0.0, 'cpu_s': 0.0, 'calls': 0, 'rows': 0})
+    for s in spans:
+        key = tuple(s['path']) + (s['name'],)
+        total = totals[key]
+        total['wall_s'] += s.get('wall_s', 0)
+        total['self_s'] += max(0.0, s.get('wall_s', 0) - child_time[(s['pid'], s['id'])])
+        total['cpu_s'] += s.get('cpu_s', 0)
+        total['calls'] += 1
+        total['rows'] += s.get('rows_out') or 0
+    run_time = sum(s.get('wall_s', 0) for s in spans if s['parent'] is None or (s['pid'], s['parent']) not in by_id)
+    peak = max([s.get('peak_rss_mb') or 0 for s in spans])
+
+    lines = ['Trace {}: {} spans, {:.1f} s traced, peak memory {:.0f} MB'.format(log_path, len(spans), run_time, peak),
+             '', 'BREAKDOWN (wall s, self s, cpu s, calls, rows out)']
+    for key in sorted(totals):
+        total = totals[key]
+        share = total['wall_s'] / run_time if run_time else 0
+        bar = '#' * int(round(share * width))
+        lines.append('{:<{w}} {}{} {:.2f} {:.2f} {:.2f} {} {}'.format(
+            bar, '  ' * (len(key) - 1), key[-1], total['wall_s'], total['self_s'], total['cpu_s'], total['calls'],
+            total['rows'], w=width))
+
+    lines += ['', 'SLOWEST {} CALLS (wall s, cpu s, rows in, rows out, tool, stage)'.format(top)]
+    calls = [s for s in spans if s['kind'] != 'stage']
+    for s in sorted(calls, key=lambda s: -s.get('wall_s', 0))[:top]:
+        lines.append('{:>10.2f} {:>10.2f} {:>10} {:>10}  {} ({}) [{}]{}'.format(
+            s.get('wall_s', 0), s.get('cpu_s', 0), _or_dash(s.get('rows_in')), _or_dash(s.get('rows_out')), s['name'],
+            s['tool'],
+            ' > '.join(s['path']), ' ERROR' if 'error' in s else ''))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(report(sys.argv[1], *[int(a) for a in sys.argv[2:3]]))
@@ -6,6 +6,7 @@
 
 import os
 import re
+import tempfile
 
 import arcpy
 from arcpy import analysis as AN, management as DM
@@ -14,9 +15,71 @@ import lagosGIS
 from lagosGIS.NHDNetwork import NHDNetwork
 from datetime import datetime
 
+CHECKPOINT_INTERVAL = 500  # lakes, about 7 minutes of work at 0.8 seconds per lake
+CHECKPOINT_SHEDS = 'checkpoint_sheds'
+CHECKPOINT_LAKES = 'checkpoint_lakes'
+
+
+def checkpoint_path(output_fc):
+    """Stable location for the checkpoint geodatabase for this output, so that a rerun can find it."""
+    name = 'aggregate_watersheds_checkpoint_{}.gdb'.format(os.path.basename(output_fc))
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def open_checkpoint(checkpoint_gdb, merged_sheds, resume=True):
+    """
+    Load the watersheds saved by an earlier, interrupted run into merged_sheds, or start a new checkpoint.
+    :param checkpoint_gdb: Result of checkpoint_path
+    :param merged_sheds: The feature class accumulating watersheds
+    :param resume: If False, any existing checkpoint is discarded
+    :return: Set of the Permanent_Identifiers of lakes already completed
+    """
+    if arcpy.Exists(checkpoint_gdb) and not resume:
+        DM.Delete(checkpoint_gdb)
+    sheds = os.path.join(checkpoint_gdb, CHECKPOINT_SHEDS)
+    lakes = os.path.join(checkpoint_gdb, CHECKPOINT_LAKES)
+    if not (arcpy.Exists(sheds) and arcpy.Exists(lakes)):
+        if arcpy.Exists(checkpoint_gdb):
+            DM.Delete(checkpoint_gdb)
+        DM.CreateFileGDB(os.path.dirname(checkpoint_gdb), os.path.basename(checkpoint_gdb))
+        DM.CreateFeatureclass(checkpoint_gdb, CHECKPOINT_SHEDS, 'POLYGON',
+                              spatial_reference=arcpy.SpatialReference(5070))
+        DM.AddField(sheds, 'Permanent_Identifier', 'TEXT', field_length=40)
+        DM.CreateTable(checkpoint_gdb, CHECKPOINT_LAKES)
+        DM.AddField(lakes, 'Permanent_Identifier', 'TEXT', field_length=40)
+        return set()
+
+    # lakes are recorded complete only after their watersheds are saved, so drop any saved without the record
+    completed = {r[0] for r in arcpy.da.SearchCursor(lakes, 'Permanent_Identifier')}
+    with arcpy.da.UpdateCursor(sheds, 'Permanent_Identifier') as u_cursor:
+        for row in u_cursor:
+            if row[0] not in completed:
+                u_cursor.deleteRow()
+    DM.Append(sheds, merged_sheds, 'NO_TEST')
+    arcpy.AddMessage("Resuming from checkpoint with {} lakes already completed.".format(len(completed)))
+    return completed
+
+
+def save_checkpoint(checkpoint_gdb, pending):
+    """
+    Save watersheds completed since the last checkpoint.
+    :param checkpoint_gdb: Result of checkpoint_path
+    :param pending: List of (Permanent_Identifier, geometry), geometry is None when the watershed was empty
+    :return: None
+    """
+    with arcpy.da.InsertCursor(os.path.join(checkpoint_gdb, CHECKPOINT_SHEDS),
+                               ['Permanent_Identifier', 'SHAPE@']) as i_cursor:
+        for lake_id, geom in pending:
+            if geom is not None:
+                i_cursor.insertRow([lake_id, geom])
+    with arcpy.da.InsertCursor(os.path.join(checkpoint_gdb, CHECKPOINT_LAKES), ['Permanent_Identifier']) as i_cursor:
+        for lake_id, geom in pending:
+            i_cursor.insertRow([lake_id])
+    del pending[:]
+
 
 def aggregate_watersheds(catchments_fc, nhd_gdb, eligible_lakes_fc, output_fc,
-                         mode=['interlake', 'network']):
+                         mode=['interlake', 'network'], resume=True, checkpoint_interval=CHECKPOINT_INTERVAL):
     """
     Accumulate upstream watersheds for all eligible lakes in this subregion and save result as a feature class.
 
@@ -37,6 +100,9 @@ def aggregate_watersheds(catchments_fc, nhd_gdb, eligible_lakes_fc, output_fc,
     :param mode: Options = 'network', 'interlake', or 'both. For'interlake' (and 'both'), upstream 10ha+ lakes will
     act as sinks in the focal lake's accumulated watershed. 'both' option will output two feature classes, one
     with name ending 'interlake', and one with name ending 'network'
+    :param resume: Continue from the checkpoint left by an earlier run for the same output_fc, if there is one. Use
+    False if the inputs have changed since then.
+    :param checkpoint_interval: Number of lakes accumulated between saves to the checkpoint geodatabase
     :return: ArcGIS Result object(s) for output(s)
     """
 
@@ -97,6 +163,10 @@ def aggregate_watersheds(catchments_fc, nhd_gdb, eligible_lakes_fc, output_fc,
     # Establish output fc
     merged_sheds = DM.CreateFeatureclass('in_memory', 'merged_sheds', 'POLYGON', spatial_reference=albers)
     DM.AddField(merged_sheds, 'Permanent_Identifier', 'TEXT', field_length=40)
+    # watersheds finished by an interrupted run are loaded from the checkpoint
+    checkpoint_gdb = checkpoint_path(output_fc)
+    completed_ids = open_checkpoint(checkpoint_gdb, merged_sheds, resume)
+    pending = []
     sheds_cursor = arcpy.da.InsertCursor(merged_sheds, ['Permanent_Identifier', 'SHAPE@'])
 
     # Looping watersheds processing
@@ -128,6 +198,8 @@ def aggregate_watersheds(catchments_fc, nhd_gdb, eligible_lakes_fc, output_fc,
 
         if len(trace_permids) <= 2:  # headwater lakes have trace length = 2 (lake and flowline)
             single_catchment_ids.append(lake_id)
+        elif lake_id in completed_ids:
+            continue
         else:
             # Loop Step 2: Select catchments with their Permanent_Identifier in the lake's upstream network trace.
             watersheds_query = 'Permanent_Identifier IN ({})'.format(','.join(['\'{}\''.format(id)
@@ -179,10 +251,17 @@ def aggregate_watersheds(catchments_fc, nhd_gdb, eligible_lakes_fc, output_fc,
             this_watershed_geom = DM.CopyFeatures(this_watershed, arcpy.Geometry())
             try:
                 sheds_cursor.insertRow([lake_id, this_watershed_geom[0]])
+                pending.append((lake_id, this_watershed_geom[0]))
             except: # sometimes there is an empty geometry in unusual situations
                 # such as a lake included outside the bounds of the subregion (1109)
                 # or a lake polygon digitized inside another lake polygon (1702)
                 arcpy.AddMessage("WARNING: Lake {} has empty watershed geometry.".format(lake_id))
+                pending.append((lake_id, None))
+            if len(pending) >= checkpoint_interval:
+                save_checkpoint(checkpoint_gdb, pending)
+
+    save_checkpoint(checkpoint_gdb, pending)
+    del sheds_cursor
 
     arcpy.env.overwriteOutput = False
     arcpy.SetLogHistory(True)
@@ -250,6 +329,7 @@ def aggregate_watersheds(catchments_fc, nhd_gdb, eligible_lakes_fc, output_fc,
                  merged_sheds, clipped]:
         DM.Delete(item)
     DM.Delete(temp_gdb)
+    DM.Delete(checkpoint_gdb)
 
     # Add warning if any missing
     final_count = int(DM.GetCount(result).getOutput(0))
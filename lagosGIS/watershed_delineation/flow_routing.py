@@ -0,0 +1,425 @@
+# filename: flow_routing.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Compute D8 flow directions from a filled DEM and label each cell with the catchment seed it drains to, one
+# tile at a time, in place of the Spatial Analyst FlowDirection and Watershed tools.
+
+import os
+import shutil
+import tempfile
+from collections import deque
+from datetime import datetime as dt
+
+import numpy as np
+
+import raster_blocks
+
+TILE_SIZE = 2048
+FDR_NODATA = 255
+CATCHMENT_NODATA = -2147483648
+
+# ESRI D8 direction codes and the (row, column) offset of the cell each one points to
+CODES = (1, 2, 4, 8, 16, 32, 64, 128)
+OFFSETS = {1: (0, 1), 2: (1, 1), 4: (1, 0), 8: (1, -1), 16: (0, -1), 32: (-1, -1), 64: (-1, 0), 128: (-1, 1)}
+CODE_FOR_OFFSET = {v: k for k, v in OFFSETS.items()}
+
+
+# ---FLOW DIRECTION-------------------------------------------------------------------------------------------------
+def d8_block(elevation, nodata):
+    """
+    D8 flow direction toward the steepest downhill neighbor. Cells with no lower neighbor drain off the raster if they
+    are next to NoData, otherwise they are left as 0 for flat resolution. Ties between equally steep neighbors (and
+    between NoData neighbors) go to the first direction in the order of CODES. The Spatial Analyst FlowDirection tool
+    breaks ties with its own lookup instead, so the two can differ wherever two drops are exactly equal.
+    :param elevation: 2D array of elevations for a tile plus a 1-cell border
+    :param nodata: 2D boolean array, same shape, True for NoData and for cells outside the raster
+    :return: uint8 array of direction codes for the tile without the border, FDR_NODATA in NoData cells
+    """
+    h, w = elevation.shape[0] - 2, elevation.shape[1] - 2
+    center = elevation[1:-1, 1:-1]
+    steepest = np.zeros((h, w))
+    codes = np.zeros((h, w), dtype=np.uint8)
+    off_raster = np.zeros((h, w), dtype=np.uint8)
+    for code in CODES:
+        dr, dc = OFFSETS[code]
+        neighbor = elevation[1 + dr:1 + dr + h, 1 + dc:1 + dc + w]
+        neighbor_nodata = nodata[1 + dr:1 + dr + h, 1 + dc:1 + dc + w]
+        drop = (center - neighbor) / (np.sqrt(2) if dr and dc else 1.0)
+        steeper = ~neighbor_nodata & (drop > steepest)
+        codes[steeper] = code
+        steepest[steeper] = drop[steeper]
+        first_off = neighbor_nodata & (off_raster == 0)
+        off_raster[first_off] = code
+    no_downhill = codes == 0
+    codes[no_downhill] = off_raster[no_downhill]
+    codes[nodata[1:-1, 1:-1]] = FDR_NODATA
+    return codes
+
+
+def flat_starts(elevation, codes):
+    """
+    Find the draining cells next to a flat cell (code 0) of the same elevation, where flat resolution starts.
+    :param elevation: 2D array of elevations for a tile plus a 1-cell border
+    :param codes: 2D uint8 array of direction codes, same shape, FDR_NODATA for NoData and outside the raster
+    :return: 2D boolean array for the tile without the border
+    """
+    height, width = codes.shape
+    center = (slice(1, height - 1), slice(1, width - 1))
+    draining = (codes[center] != 0) & (codes[center] != FDR_NODATA)
+    starts = np.zeros((height - 2, width - 2), dtype=bool)
+    for dr, dc in OFFSETS.values():
+        neighbor = (slice(1 + dr, height - 1 + dr), slice(1 + dc, width - 1 + dc))
+        starts |= draining & (codes[neighbor] == 0) & (elevation[neighbor] == elevation[center])
+    return starts
+
+
+def resolve_flats(elevation, codes, starts):
+    """
+    Route flat cells (code 0) toward the nearest cell of the same elevation that already drains, by breadth-first search
+    from the draining cells over the whole raster, so that a flat is resolved the same way however it is tiled. Each
+    step of the search reaches the cells one cell further from the draining cells. A cell that can be reached from
+    several cells of the previous step drains back toward the one whose step to it comes first in the order of CODES,
+    not by the FlowDirection tool's rule.
+    :param elevation: 2D array of elevations, may be a disk-backed array
+    :param codes: 2D uint8 array of direction codes, same shape, FDR_NODATA for NoData, updated in place. May be a
+    disk-backed array.
+    :param starts: Sorted array of raster-wide indices (row * width + column) of the cells to search from, see
+    flat_starts
+    :return: Number of cells resolved
+    """
+    height, width = codes.shape
+    flat_z = elevation.reshape(-1)
+    flat_codes = codes.reshape(-1)
+    frontier = np.asarray(starts, dtype=np.int64)
+    resolved = 0
+    while frontier.size:
+        rows, cols = frontier // width, frontier % width
+        reached = []
+        for code in CODES:
+            dr, dc = OFFSETS[code]
+            r, c = rows + dr, cols + dc
+            inside = (r >= 0) & (r < height) & (c >= 0) & (c < width)
+            source = frontier[inside]
+            target = (r * width + c)[inside]
+            open_flat = (flat_codes[target] == 0) & (flat_z[target] == flat_z[source])
+            target = np.unique(target[open_flat])
+            flat_codes[target] = CODE_FOR_OFFSET[(-dr, -dc)]
+            reached.append(target)
+        frontier = np.unique(np.concatenate(reached))
+        resolved += frontier.size
+    return resolved
+
+
+def _padded(array_mm, window, fill):
+    """Read a window of a raster-sized array with a 1-cell border, fill outside the raster."""
+    height, width = array_mm.shape
+    padded = np.full((window.nrows + 2, window.ncols + 2), fill, dtype=array_mm.dtype)
+    row0, col0 = max(0, window.row - 1), max(0, window.col - 1)
+    row1, col1 = min(height, window.row + window.nrows + 1), min(width, window.col + window.ncols + 1)
+    top, left = row0 - window.row + 1, col0 - window.col + 1
+    padded[top:top + row1 - row0, left:left + col1 - col0] = array_mm[row0:row1, col0:col1]
+    return padded
+
+
+def _read_elevation(reader, window):
+    fill = np.nan if reader.nodata is None else reader.nodata
+    elevation = reader.read_padded(window, 1, fill=fill).astype(np.float64)
+    return elevation, raster_blocks.nodata_mask(elevation, reader.nodata)
+
+
+def _d8_window(reader, window, codes_path, elevation_path):
+    elevation, nodata = _read_elevation(reader, window)
+    codes_mm = np.load(codes_path, mmap_mode='r+')
+    codes_mm[window.row:window.row + window.nrows, window.col:window.col + window.ncols] = d8_block(elevation, nodata)
+    codes_mm.flush()
+    elevation_mm = np.load(elevation_path, mmap_mode='r+')
+    elevation_mm[window.row:window.row + window.nrows, window.col:window.col + window.ncols] = elevation[1:-1, 1:-1]
+    elevation_mm.flush()
+
+
+def _d8_window_worker(args):
+    raster_path, window, codes_path, elevation_path = args
+    reader = raster_blocks.open_raster(raster_path)
+    try:
+        _d8_window(reader, window, codes_path, elevation_path)
+    finally:
+        reader.close()
+
+
+def flow_direction_blocks(reader, writer, clip_reader=None, tile_size=TILE_SIZE, processes=1, raster_path=None,
+                          scratch_dir=None):
+    """
+    Compute D8 flow directions for a filled DEM, one tile at a time. The directions and elevations are held in
+    disk-backed arrays while flats are resolved across the whole raster, so memory use is bounded by the tile size and
+    the size of the flats, and the output does not depend on the tile size.
+
+    :param reader: Reader for the filled DEM, see raster_blocks.open_raster
+    :param writer: Writer for the uint8 output, see raster_blocks.create_raster
+    :param clip_reader: (Optional) Reader for a raster on the same grid. Output is NoData wherever it is NoData, as with
+    Con(IsNull(clip), clip, flow_direction).
+    :param int tile_size: Rows and columns per tile
+    :param int processes: Number of processes used for the first pass. More than 1 requires raster_path.
+    :param str raster_path: Path of the filled DEM, for reopening it in the worker processes
+    :param str scratch_dir: Directory for the disk-backed arrays. Default is a new temporary directory.
+    :return: The result of writer.close()
+    """
+    if clip_reader:
+        raster_blocks.check_same_grid(reader, clip_reader, 'clip raster')
+    work_dir = tempfile.mkdtemp(prefix='flow_direction_', dir=scratch_dir)
+    try:
+        codes_path = os.path.join(work_dir, 'codes.npy')
+        elevation_path = os.path.join(work_dir, 'elevation.npy')
+        codes_mm = np.lib.format.open_memmap(codes_path, mode='w+', dtype=np.uint8,
+                                             shape=(reader.height, reader.width))
+        elevation_mm = np.lib.format.open_memmap(elevation_path, mode='w+', dtype=np.float64,
+                                                 shape=(reader.height, reader.width))
+        del codes_mm, elevation_mm
+        tiles = list(raster_blocks.windows(reader.height, reader.width, tile_size, tile_size))
+
+        # ---STEEPEST DESCENT-----
+        start = dt.now()
+        tasks = [(raster_path, w, codes_path, elevation_path) for w in tiles]
+        if processes > 1 and raster_path:
+            pool = raster_blocks.process_pool(processes)
+            try:
+                pool.map(_d8_window_worker, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                _d8_window(reader, *task[1:])
+        print("Computed steepest descent for {} tiles in {} seconds.".format(len(tiles), (dt.now() - start).seconds))
+
+        # ---FLATS-----
+        # flats can cross tile seams, so the starts are found tile by tile but the search runs over the whole raster
+        start = dt.now()
+        codes_mm = np.load(codes_path, mmap_mode='r+')
+        elevation_mm = np.load(elevation_path, mmap_mode='r')
+        starts = []
+        for window in tiles:
+            tile_starts = flat_starts(_padded(elevation_mm, window, np.nan), _padded(codes_mm, window, FDR_NODATA))
+            r, c = np.nonzero(tile_starts)
+            starts.append((window.row + r) * reader.width + window.col + c)
+        starts = np.sort(np.concatenate(starts))
+        resolved = resolve_flats(elevation_mm, codes_mm, starts)
+        codes_mm.flush()
+        del elevation_mm
+        print("Resolved {} flat cells in {} seconds.".format(resolved, (dt.now() - start).seconds))
+
+        # ---WRITE-----
+        for window in tiles:
+            codes = np.array(codes_mm[window.row:window.row + window.nrows, window.col:window.col + window.ncols])
+            if clip_reader:
+                clip = clip_reader.read(window)
+                codes[raster_blocks.nodata_mask(clip, clip_reader.nodata)] = FDR_NODATA
+            writer.write(window, codes)
+        del codes_mm
+        return writer.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def flow_direction(filled_raster, out_raster, clip_raster=None, tile_size=TILE_SIZE, processes=1, scratch_dir=None):
+    """
+    Compute D8 flow directions (ESRI codes) for a filled DEM raster and save them.
+    :param str filled_raster: Filled DEM, e.g. the output of make_hydrodem
+    :param str out_raster: Output flow direction raster (GeoTIFF)
+    :param str clip_raster: (Optional) Raster on the same grid, such as the NHDPlus fdr. Output is NoData wherever it is
+    NoData.
+    :param int tile_size: Rows and columns per tile
+    :param int processes: Number of processes used for the steepest descent pass
+    :param str scratch_dir: Directory for the disk-backed directions
+    :return: out_raster
+    """
+    reader = raster_blocks.open_raster(filled_raster)
+    clip_reader = raster_blocks.open_raster(clip_raster) if clip_raster else None
+    try:
+        writer = raster_blocks.create_raster(out_raster, reader, np.uint8, FDR_NODATA)
+        return flow_direction_blocks(reader, writer, clip_reader, tile_size, processes, filled_raster, scratch_dir)
+    finally:
+        reader.close()
+        if clip_reader:
+            clip_reader.close()
+
+
+# ---CATCHMENT LABELING---------------------------------------------------------------------------------------------
+def trace_block(codes, seeds, seed_nodata, window, raster_height, raster_width):
+    """
+    Follow the flow directions within one tile to the seed, sink or tile edge where each cell's flow path ends.
+    :param codes: 2D uint8 array of direction codes for the tile
+    :param seeds: 2D array of seed values for the tile
+    :param seed_nodata: 2D boolean array, True where there is no seed
+    :param Window window: Position of the tile in the raster
+    :param int raster_height: Raster rows
+    :param int raster_width: Raster columns
+    :return: Tuple of (labels, exits). labels holds the seed value each cell drains to, or CATCHMENT_NODATA. exits holds
+    the raster-wide index (row * raster_width + column) of the first cell outside the tile on the flow path, or -1
+    when the path ends inside the tile.
+    """
+    h, w = codes.shape
+    rows, cols = np.indices((h, w))
+    downstream = np.arange(h * w).reshape(h, w)
+    end_label = np.full((h, w), CATCHMENT_NODATA, dtype=np.int64)
+    end_exit = np.full((h, w), -1, dtype=np.int64)
+    is_seed = ~seed_nodata
+    end_label[is_seed] = seeds[is_seed]
+
+    for code in CODES:
+        dr, dc = OFFSETS[code]
+        moves = (codes == code) & ~is_seed
+        r, c = rows + dr, cols + dc
+        inside = moves & (r >= 0) & (r < h) & (c >= 0) & (c < w)
+        downstream[inside] = (r * w + c)[inside]
+        global_r, global_c = window.row + r, window.col + c
+        leaves = moves & ~inside & (global_r >= 0) & (global_r < raster_height) & \
+            (global_c >= 0) & (global_c < raster_width)
+        end_exit[leaves] = (global_r * raster_width + global_c)[leaves]
+
+    # pointer jumping: after k rounds every cell points 2^k cells downstream or to the end of its path
+    downstream = downstream.ravel()
+    for i in range(64):
+        jumped = downstream[downstream]
+        if np.array_equal(jumped, downstream):
+            break
+        downstream = jumped
+    cyclic = downstream[downstream] != downstream
+    labels = end_label.ravel()[downstream]
+    exits = end_exit.ravel()[downstream]
+    labels[cyclic] = CATCHMENT_NODATA
+    exits[cyclic] = -1
+    return labels.reshape(h, w), exits.reshape(h, w)
+
+
+def _trace_window(fdr_reader, seed_reader, window, cache_dir):
+    codes = fdr_reader.read(window)
+    seeds = seed_reader.read(window)
+    labels, exits = trace_block(codes, seeds, raster_blocks.nodata_mask(seeds, seed_reader.nodata), window,
+                                fdr_reader.height, fdr_reader.width)
+    name = os.path.join(cache_dir, '{}_{}'.format(window.row, window.col))
+    np.save(name + '_labels.npy', labels)
+    np.save(name + '_exits.npy', exits)
+
+    # the cells on the tile edge are the only ones another tile's flow paths can enter
+    edge = np.zeros(labels.shape, dtype=bool)
+    edge[0, :] = edge[-1, :] = edge[:, 0] = edge[:, -1] = True
+    r, c = np.nonzero(edge)
+    index = (window.row + r) * fdr_reader.width + window.col + c
+    return index, labels[edge], exits[edge]
+
+
+def _trace_window_worker(args):
+    fdr_path, seed_path, window, cache_dir = args
+    fdr_reader = raster_blocks.open_raster(fdr_path)
+    seed_reader = raster_blocks.open_raster(seed_path)
+    try:
+        return _trace_window(fdr_reader, seed_reader, window, cache_dir)
+    finally:
+        fdr_reader.close()
+        seed_reader.close()
+
+
+def _resolve_edges(edge_results):
+    """
+    Follow flow paths across tile edges to their seeds.
+    :return: Dictionary with key = raster-wide index, value = label
+    """
+    label_at = {}
+    exit_at = {}
+    for index, labels, exits in edge_results:
+        label_at.update(zip(index.tolist(), labels.tolist()))
+        exit_at.update(zip(index.tolist(), exits.tolist()))
+    resolved = {}
+    for start in exit_at:
+        path = []
+        on_path = set()
+        cell = start
+        while cell not in resolved:
+            if cell in on_path:
+                resolved[cell] = CATCHMENT_NODATA  # flow cycle, should not happen on a filled DEM
+                break
+            path.append(cell)
+            on_path.add(cell)
+            next_cell = exit_at.get(cell, -1)
+            if next_cell < 0:
+                resolved[cell] = label_at.get(cell, CATCHMENT_NODATA)
+                break
+            cell = next_cell
+        label = resolved[cell]
+        for cell in path:
+            resolved[cell] = label
+    return resolved
+
+
+def label_catchments_blocks(fdr_reader, seed_reader, writer, tile_size=TILE_SIZE, processes=1, fdr_path=None,
+                            seed_path=None, scratch_dir=None):
+    """
+    Label every cell with the value of the seed cell it drains to, the equivalent of the Spatial Analyst Watershed tool.
+    Each tile is traced on its own, then the paths leaving each tile are joined across the tile edges.
+
+    :param fdr_reader: Reader for the D8 flow directions (ESRI codes)
+    :param seed_reader: Reader for the seed (catseed) raster on the same grid
+    :param writer: Writer for the int32 output, see raster_blocks.create_raster
+    :param int tile_size: Rows and columns per tile
+    :param int processes: Number of processes used to trace tiles. More than 1 requires fdr_path and seed_path.
+    :param str fdr_path: Path of the flow direction raster, for the worker processes
+    :param str seed_path: Path of the seed raster, for the worker processes
+    :param str scratch_dir: Directory for cached tile results. Default is a new temporary directory.
+    :return: The result of writer.close()
+    """
+    raster_blocks.check_same_grid(fdr_reader, seed_reader, 'seed raster')
+    cache_dir = tempfile.mkdtemp(prefix='catchments_', dir=scratch_dir)
+    try:
+        tiles = list(raster_blocks.windows(fdr_reader.height, fdr_reader.width, tile_size, tile_size))
+        start = dt.now()
+        if processes > 1 and fdr_path and seed_path:
+            pool = raster_blocks.process_pool(processes)
+            try:
+                edge_results = pool.map(_trace_window_worker,
+                                        [(fdr_path, seed_path, w, cache_dir) for w in tiles], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            edge_results = [_trace_window(fdr_reader, seed_reader, w, cache_dir) for w in tiles]
+        resolved = _resolve_edges(edge_results)
+        print("Traced {} tiles in {} seconds.".format(len(tiles), (dt.now() - start).seconds))
+
+        for window in tiles:
+            name = os.path.join(cache_dir, '{}_{}'.format(window.row, window.col))
+            labels = np.load(name + '_labels.npy')
+            exits = np.load(name + '_exits.npy')
+            leaving = exits >= 0
+            if leaving.any():
+                targets, inverse = np.unique(exits[leaving], return_inverse=True)
+                target_labels = np.array([resolved.get(t, CATCHMENT_NODATA) for t in targets.tolist()],
+                                         dtype=np.int64)
+                labels[leaving] = target_labels[inverse]
+            writer.write(window, labels.astype(np.int32))
+        return writer.close()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def label_catchments(fdr_raster, seed_raster, out_raster, tile_size=TILE_SIZE, processes=1, scratch_dir=None):
+    """
+    Label every cell with the value of the seed cell it drains to and save the result.
+    :param str fdr_raster: D8 flow direction raster, e.g. the output of flow_direction
+    :param str seed_raster: Pour points raster, e.g. the output of add_lake_seeds
+    :param str out_raster: Output catchment raster (GeoTIFF)
+    :param int tile_size: Rows and columns per tile
+    :param int processes: Number of processes used to trace tiles
+    :param str scratch_dir: Directory for cached tile results
+    :return: out_raster
+    """
+    fdr_reader = raster_blocks.open_raster(fdr_raster)
+    seed_reader = raster_blocks.open_raster(seed_raster)
+    try:
+        writer = raster_blocks.create_raster(out_raster, fdr_reader, np.int32, CATCHMENT_NODATA)
+        return label_catchments_blocks(fdr_reader, seed_reader, writer, tile_size, processes, fdr_raster, seed_raster,
+                                       scratch_dir)
+    finally:
+        fdr_reader.close()
+        seed_reader.close()
@@ -0,0 +1,140 @@
+# filename: hydrodem_revision.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Evaluate the revise_hydrodem raster algebra (unfill, burn and protect sink lakes, remove extra NHDPlus sinks)
+# in strips of rows, writing the output once instead of saving every intermediate raster.
+
+import numpy as np
+
+import raster_blocks
+
+DEFAULT_MEMORY_MB = 2048
+AREAL_DROP = 10000  # in cm, so 100m elevation drop
+OUTPUT_NODATA = -3.4028235e+38
+BYTES_PER_CELL = 96  # inputs, masks and float64 working arrays held at once for one cell
+
+
+def focal_minimum(values, valid):
+    """
+    3x3 focal minimum ignoring NoData, the same as FocalStatistics(statistics_type='MINIMUM').
+    :param values: 2D array including a 1-cell border
+    :param valid: 2D boolean array, same shape, False for NoData
+    :return: Tuple of (minimum, valid) for the cells inside the border. A cell is NoData if its whole window is NoData.
+    """
+    h, w = values.shape[0] - 2, values.shape[1] - 2
+    masked = np.where(valid, values, np.inf)
+    minimum = np.full((h, w), np.inf)
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            np.minimum(minimum, masked[1 + dr:1 + dr + h, 1 + dc:1 + dc + w], out=minimum)
+    return minimum, np.isfinite(minimum)
+
+
+def revise_block(hydrodem, hydrodem_nodata, filldepth, filldepth_nodata, catseed_nodata, sink_lakes, sink_centroids,
+                 closed_sinks, areal_drop=AREAL_DROP):
+    """
+    Revise one block of the hydrodem. All inputs include a 1-cell border so the focal minimum can see across the block
+    edges.
+
+    :param hydrodem: NHDPlus hydrodem values
+    :param hydrodem_nodata: Boolean, True where hydrodem is NoData
+    :param filldepth: NHDPlus filldepth values
+    :param filldepth_nodata: Boolean, True where filldepth is NoData
+    :param catseed_nodata: Boolean, True where the LAGOS catseed raster is NoData
+    :param sink_lakes: Boolean, True inside sink lakes
+    :param sink_centroids: Boolean, True at sink lake centroids
+    :param closed_sinks: Boolean, True at NHDPlus closed-lake sinks (PurpCode = 'SC')
+    :param areal_drop: Depth to burn sink lakes, in the hydrodem units
+    :return: Tuple of (values, valid) for the cells inside the border
+    """
+    # only permit sinks that are in the catseed raster, i.e. they are in the LAGOS lake population
+    sinks = sink_lakes & ~catseed_nodata
+    centroids = sink_centroids & sinks
+
+    # unfilled hydrodem with the sink lakes burned in and NoData protection in the lake centers
+    protected = hydrodem - np.where(filldepth_nodata, 0, filldepth) - areal_drop * sinks
+    protected_valid = ~hydrodem_nodata & ~centroids
+
+    # fill NoData with the surrounding minimum where NHDPlus protected a closed lake that is not a LAGOS lake
+    replacement, replacement_valid = focal_minimum(protected, protected_valid)
+    replace = (closed_sinks & catseed_nodata)[1:-1, 1:-1]
+    values = np.where(replace, replacement, protected[1:-1, 1:-1])
+    valid = np.where(replace, replacement_valid, protected_valid[1:-1, 1:-1])
+    return values, valid
+
+
+def revise_blocks(hydrodem_reader, filldepth_reader, catseed_reader, sink_lakes_reader, sink_centroids_reader,
+                  closed_sinks_reader, writer, memory_mb=DEFAULT_MEMORY_MB, areal_drop=AREAL_DROP):
+    """
+    Revise the hydrodem in strips of rows sized to fit the memory budget. Each strip is read with one extra row above
+    and below for the focal minimum.
+
+    :param hydrodem_reader: Reader for the NHDPlus hydrodem
+    :param filldepth_reader: Reader for the NHDPlus filldepth
+    :param catseed_reader: Reader for the LAGOS catseed raster
+    :param sink_lakes_reader: Reader for rasterized sink lakes (any value = inside)
+    :param sink_centroids_reader: Reader for rasterized sink lake centroids
+    :param closed_sinks_reader: Reader for rasterized NHDPlus closed-lake sinks
+    :param writer: Writer for the float32 output
+    :param float memory_mb: Memory budget used to choose the strip height
+    :param areal_drop: Depth to burn sink lakes, in the hydrodem units
+    :return: The result of writer.close()
+    """
+    for reader in (filldepth_reader, catseed_reader, sink_lakes_reader, sink_centroids_reader, closed_sinks_reader):
+        raster_blocks.check_same_grid(hydrodem_reader, reader)
+
+    def read_masked(reader, window, outside):
+        values = reader.read_padded(window, 1, fill=reader.nodata if reader.nodata is not None else 0)
+        return values, raster_blocks.nodata_mask(values, reader.nodata) | outside
+
+    height = hydrodem_reader.height
+    block_rows = raster_blocks.block_rows_for_budget(hydrodem_reader.width, BYTES_PER_CELL, memory_mb, halo=1)
+    for window in raster_blocks.windows(height, hydrodem_reader.width, block_rows):
+        # the border cells that fall outside the raster count as NoData in every input
+        outside = np.ones((window.nrows + 2, window.ncols + 2), dtype=bool)
+        outside[1 - min(1, window.row):window.nrows + 1 + min(1, height - window.row - window.nrows), 1:-1] = False
+        hydrodem, hydrodem_nodata = read_masked(hydrodem_reader, window, outside)
+        filldepth, filldepth_nodata = read_masked(filldepth_reader, window, outside)
+        catseed_nodata = read_masked(catseed_reader, window, outside)[1]
+        sink_lakes = ~read_masked(sink_lakes_reader, window, outside)[1]
+        sink_centroids = ~read_masked(sink_centroids_reader, window, outside)[1]
+        closed_sinks = ~read_masked(closed_sinks_reader, window, outside)[1]
+        values, valid = revise_block(hydrodem.astype(np.float64), hydrodem_nodata, filldepth.astype(np.float64),
+                                     filldepth_nodata, catseed_nodata, sink_lakes, sink_centroids, closed_sinks,
+                                     areal_drop)
+        result = values.astype(np.float32)
+        result[~valid] = OUTPUT_NODATA
+        writer.write(window, result)
+    return writer.close()
+
+
+def revise(hydrodem_raster, filldepth_raster, catseed_raster, sink_lakes, sink_centroids, closed_sinks, out_raster,
+           memory_mb=DEFAULT_MEMORY_MB):
+    """
+    Revise the hydrodem and save the result.
+    :param str hydrodem_raster: NHDPlus hydrodem
+    :param str filldepth_raster: NHDPlus filldepth
+    :param str catseed_raster: LAGOS catseed raster from add_lake_seeds
+    :param sink_lakes: Raster of sink lakes on the hydrodem grid, or iterable of WKB polygons in its projection
+    :param sink_centroids: Raster of sink lake centroids, or iterable of WKB points
+    :param closed_sinks: Raster of NHDPlus closed-lake sinks, or iterable of WKB points
+    :param str out_raster: Output burned DEM (GeoTIFF)
+    :param float memory_mb: Memory budget used to choose the strip height
+    :return: out_raster
+    """
+    import seed_burning
+    hydrodem_reader = raster_blocks.open_raster(hydrodem_raster)
+    readers = [hydrodem_reader, raster_blocks.open_raster(filldepth_raster), raster_blocks.open_raster(catseed_raster)]
+    for features in (sink_lakes, sink_centroids, closed_sinks):
+        if isinstance(features, basestring):
+            readers.append(raster_blocks.open_raster(features))
+        else:
+            readers.append(seed_burning.PolygonRasterizer(hydrodem_reader, [(1, wkb) for wkb in features]))
+    try:
+        writer = raster_blocks.create_raster(out_raster, hydrodem_reader, np.float32, OUTPUT_NODATA)
+        return revise_blocks(*(readers + [writer, memory_mb]))
+    finally:
+        for reader in readers:
+            reader.close()
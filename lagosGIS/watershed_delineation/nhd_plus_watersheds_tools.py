@@ -5,8 +5,9 @@
 # tool type: re-usable (ArcGIS Toolbox)--tools called in individual scripts to make tools
 
 import os
+import shutil
+import tempfile
 from datetime import datetime as dt
-import subprocess as sp
 from collections import defaultdict
 from arcpy import management as DM
 from arcpy import analysis as AN
@@ -14,6 +15,12 @@ from arcpy.sa import *
 import arcpy
 import lagosGIS
 from lagosGIS.NHDNetwork import NHDNetwork
+from lagosGIS import data_access
+import flow_routing
+import hydrodem_revision
+import priority_flood
+import raster_blocks
+import seed_burning
 
 __all__ = [
     "add_waterbody_nhdpid",
@@ -126,23 +133,7 @@ def add_lake_seeds(nhdplus_catseed_raster, nhdplus_gdb, gridcode_table, eligible
 
     # --- WATERBODY SEEDS PREP ------------------
     # add gridcodes to lakes
-    nhdpid_grid = {r[0]: r[1] for r in arcpy.da.SearchCursor(gridcode_table, ['NHDPlusID', 'GridCode'])}
-    this_gdb_ids = tuple(nhdpid_grid.keys())
-    filter_clause = 'NHDPlusID IN {}'.format(this_gdb_ids)
-    eligible_lakes_copy = AN.Select(eligible_lakes_fc, 'eligible_lakes_copy', filter_clause)
-    DM.AddField(eligible_lakes_copy, 'GridCode', 'LONG')
-    with arcpy.da.UpdateCursor(eligible_lakes_copy, ['NHDPlusID', 'GridCode']) as u_cursor:
-        for row in u_cursor:
-            new_row = (row[0], nhdpid_grid[row[0]])
-            u_cursor.updateRow(new_row)
-
-    # --- VECTOR TO RASTER ------------------------
-    # these must be saved as tifs for the mosiac nodata values to work with the watersheds tool
-    lake_seeds = os.path.join(pour_dir, "lakes_raster.tif")
-    arcpy.PolygonToRaster_conversion(eligible_lakes_copy, "GridCode", lake_seeds, "", "", 10)
-    combined = DM.MosaicToNewRaster([nhdplus_catseed_raster, lake_seeds], arcpy.env.workspace, 'combined',
-                                    pixel_type='32_BIT_SIGNED', number_of_bands='1', mosaic_method='LAST')
-    DM.BuildRasterAttributeTable(combined)
+    nhdpid_grid = {r[0]: r[1] for r in data_access.read_rows(gridcode_table, ['NHDPlusID', 'GridCode'])}
 
     # IDENTIFY ERRONEOUS SINKS
     # due to burn/catseed errors in NHD, we are removing all sinks marked "NHDWaterbody closed lake" (SC)
@@ -150,26 +141,41 @@ def add_lake_seeds(nhdplus_catseed_raster, nhdplus_gdb, gridcode_table, eligible
     # in regions with no error: no change, correctly indicated closed lakes would be removed but we have overwritten
     # them with our own lake poly seeds anyway.
     sink = os.path.join(nhdplus_gdb, 'NHDPlusSink')
-    sinks_to_remove = [r[0] for r in arcpy.da.SearchCursor(sink, ['GridCode'], "PurpCode = 'SC'")]
-
-    # Find out if any of the selected sink codes are actually in the raster
-    gridcodes_in_raster = set([r[0] for r in arcpy.da.SearchCursor(combined, 'VALUE')])
-    removable_codes = gridcodes_in_raster.intersection(sinks_to_remove)
-
-    if removable_codes:
-        arcpy.AddMessage("Modifying catseed raster to clean lake seeds...")
-        arcpy.CheckOutExtension('Spatial')
-        cleaned = arcpy.sa.SetNull(combined, combined, 'VALUE in ({})'.format(','.join(['{}'.format(id)                                                                          for id in removable_codes])))
-        cleaned.save(output_raster)
-        arcpy.CheckInExtension('Spatial')
-    else:
-        arcpy.CopyRaster_management(combined, output_raster)
-
-    arcpy.Delete_management(lake_seeds)
+    sinks_to_remove = [r[0] for r in data_access.read_rows(sink, ['GridCode'], "PurpCode = 'SC'")]
+
+    # --- BURN SEEDS ------------------------
+    # lakes are burned into a copy of catseed one strip at a time, and the sink codes are removed in the same pass
+    arcpy.AddMessage("Burning lake seeds into catseed raster...")
+    try:
+        import osgeo.gdal
+        # rasterize lake polygons directly on each strip of the catseed grid: only the lakes inside the catseed extent
+        # are read, projected to the catseed coordinate system
+        catseed = raster_blocks.open_raster(nhdplus_catseed_raster)
+        x0, cell_x, _, y0, _, cell_y = catseed.geotransform
+        extent = (x0, y0 + catseed.height * cell_y, x0 + catseed.width * cell_x, y0)
+        lake_rows = data_access.read_rows(eligible_lakes_fc, ['NHDPlusID', 'SHAPE@WKB'], 'NHDPlusID IS NOT NULL',
+                                          spatial_reference=catseed.projection or None, extent=extent)
+        lakes = [(nhdpid_grid[r[0]], r[1]) for r in lake_rows if r[0] in nhdpid_grid]
+        catseed.close()
+        lake_seeds = None
+    except ImportError:
+        # without GDAL, rasterize the lakes once with arcpy (extent environment limits the selection to this HU4)
+        eligible_lakes_copy = AN.Select(eligible_lakes_fc, 'eligible_lakes_copy', 'NHDPlusID IS NOT NULL')
+        DM.AddField(eligible_lakes_copy, 'GridCode', 'LONG')
+        data_access.update_rows(eligible_lakes_copy, ['NHDPlusID', 'GridCode'],
+                                lambda row: [row[0], nhdpid_grid.get(row[0])])
+        lake_seeds = os.path.join(pour_dir, "lakes_raster.tif")
+        arcpy.PolygonToRaster_conversion(eligible_lakes_copy, "GridCode", lake_seeds, "", "", 10)
+        lakes = lake_seeds
+    seed_burning.burn_seeds(nhdplus_catseed_raster, lakes, output_raster, sinks_to_remove)
+
+    if lake_seeds:
+        arcpy.Delete_management(lake_seeds)
     return output_raster
 
 
-def revise_hydrodem(nhdplus_gdb, hydrodem_raster, filldepth_raster, lagos_catseed_raster, out_raster):
+def revise_hydrodem(nhdplus_gdb, hydrodem_raster, filldepth_raster, lagos_catseed_raster, out_raster,
+                    memory_mb=hydrodem_revision.DEFAULT_MEMORY_MB):
     """Uses the NHDPlus hydrodem and filldepth to reconstitute the un-filled burned DEM, and then synchronizes
     the protected lake regions (those with NoData in center to prevent filling in TauDEM Pit Remove) with the
     catseed raster as modified in add_lake_seeds.
@@ -179,36 +185,20 @@ def revise_hydrodem(nhdplus_gdb, hydrodem_raster, filldepth_raster, lagos_catsee
     :param filldepth_raster: The fill depth raster provided by NHD Plus
     :param lagos_catseed_raster: The modified "catseed" raster created with the Add Lake Seeds tool
     :param out_raster: The output raster
+    :param memory_mb: Memory budget for the raster strips evaluated at once
     :return:
     """
     # ----- SETUP -----------------------------------------------------------------------------------------------------
-    # workspace will be set to hard drive if uncompressed hydrodem is > 8GB, prevents strange
-    # outputs where replacement raster is assigned in more places than it should be or random
-    # NoData gaps appear. Memory wasn't maxed out and neither was temp raster storage space, but
-    # this works anyway using a limit of 8GB on my 64GB machine.
-    # mostly affects subregions ['0902', '1018', '1109', '1710', '1209', '1304', '1606', '1701', '1702']
-    desc = arcpy.Describe(hydrodem_raster)
-    uncompressed_size = (float(desc.width) * desc.height * 4)/(2**30)
-    if uncompressed_size >= 8:
-        temp_gdb = lagosGIS.create_temp_GDB('revise_hydrodem')
-        arcpy.env.workspace = temp_gdb
-    else:
-        temp_gdb = ''
-        arcpy.env.workspace = 'in_memory'
-
-    # per suggestion by Price here
-    # https://community.esri.com/people/curtvprice/blog/2017/03/03/temporary-rasters-in-arcpy
-    arcpy.env.scratchWorkspace = os.path.dirname(lagos_catseed_raster)
-
-    # remaining env settings
+    arcpy.env.workspace = 'in_memory'
+    scratch_dir = os.path.dirname(lagos_catseed_raster)
+    arcpy.env.scratchWorkspace = scratch_dir
     arcpy.env.overwriteOutput = True
     arcpy.env.snapRaster = hydrodem_raster
     arcpy.env.extent = hydrodem_raster
     projection = arcpy.SpatialReference(102039)
     arcpy.env.outputCoordinateSystem = projection
-    arcpy.CheckOutExtension('Spatial')
 
-    # ----- ADD LAGOS SINKS ---------------------------------------------------------------------------------------
+    # ----- IDENTIFY SINKS --------------------------------------------------------------------------------------------
     # identify valid sinks
     network = NHDNetwork(nhdplus_gdb)
     waterbody_ids = network.define_lakes(strict_minsize=True, force_lagos=True).keys()
@@ -217,89 +207,75 @@ def revise_hydrodem(nhdplus_gdb, hydrodem_raster, filldepth_raster, lagos_catsee
     sink_lake_ids = [k for k,v in lake_conn_classes.items() if v in ('Isolated', 'TerminalLk', 'Terminal')]
     sink_lakes_query = 'Permanent_Identifier IN ({})'.format(
         ','.join(['\'{}\''.format(id) for id in sink_lake_ids]))
+    # outputs are projected to match the hydrodem by the outputCoordinateSystem environment
     sink_lakes = arcpy.Select_analysis(network.waterbody, 'sink_lakes', sink_lakes_query)
-
-    # protect these sink lakes in DEM
     sink_centroids = arcpy.FeatureToPoint_management(sink_lakes, 'sink_centroids', 'INSIDE')
-    sinks_raster0 = arcpy.PolygonToRaster_conversion(sink_lakes, "OBJECTID", "sinks_raster0", cellsize=10)
-    centroids_raster0 = arcpy.PointToRaster_conversion(sink_centroids, "OBJECTID", "centroids_raster0", cellsize=10)
-
-    # only permit sinks that are in the catseed raster, i.e. they are in the LAGOS lake population
-    sinks_raster = (IsNull(Raster(sinks_raster0)) == 0) & (IsNull(lagos_catseed_raster) == 0)
-    centroids_raster = ((IsNull(Raster(centroids_raster0)) == 0) & sinks_raster)
-
-    # burn in the sink lakes and add the nodata protection in the center
-    arcpy.AddMessage("Burning sinks...")
-    areal_drop = 10000 # in cm, so 100m elevation drop
-    filldepth = Raster(filldepth_raster)
-    lagos_catseed = Raster(lagos_catseed_raster)
-
-    # operations combined here for processing speed (fewer temporary rasters)
-    # first two terms inside SetNull generate the unfilled hydro raster and third term burns in sinks, like so
-    # unfilled_hydrodem = Raster(hydrodem_raster) - Con(IsNull(filldepth), 0, filldepth)
-    # with_burned_lakes = unfilled_hydrodem - (areal_drop * sinks_raster)
-    # the setnull around the whole thing sets the nodata protection for the lake
-    protected = SetNull(centroids_raster == 1, \
-                    (Raster(hydrodem_raster) - Con(IsNull(filldepth), 0, filldepth) - (areal_drop * sinks_raster)))
-
-    # -----REMOVE POTENTIAL EXCESSIVE NHDPLUS HR SINKS--------------------------------------------------------------
-    # remove all fill-protected lakes that are NOT also in our modified pour points--these are the erroneous sinks
-    arcpy.AddMessage("Removing extraneous sinks (if any)...")
+    # due to burn/catseed errors in NHD, fill-protected lakes that are NOT also in our modified pour points are
+    # erroneous sinks
     nhdplus_sink = os.path.join(nhdplus_gdb, 'NHDPlusSink')
     nhdplus_closed = arcpy.Select_analysis(nhdplus_sink, 'nhdplus_closed', "PurpCode = 'SC'")
-    nhdplus_closed_ras0 = arcpy.PointToRaster_conversion(nhdplus_closed, "OBJECTID", "nhdplus_closed_ras0", cellsize=10)
-    nhdplus_closed_ras = IsNull(Raster(nhdplus_closed_ras0)) == 0
-
-    # use raster calculator to fill nodata with min value that surrounds it (lake is flattish)
-    replacement = arcpy.sa.FocalStatistics(protected, statistics_type='MINIMUM')  # assign lake elevation value
 
-    # fill in NoData cells with "replacement" value,
-    # IF they are a NoData cell used for an NHDWaterbody closed lake sink in NHDPlus (nhdplus_closed_raster == 1)
-    # AND they are not inside a LAGOS lake (IsNull(lagos_catseed_raster) == 1).
-    # ELSE use the burned values from before but also protect LAGOS lakes with central NoData value
-    result = Con((nhdplus_closed_ras) & (IsNull(lagos_catseed)), replacement, protected)
-    result.save(out_raster)
+    # ----- BURN AND PROTECT SINKS, REMOVE EXCESSIVE NHDPLUS HR SINKS -------------------------------------------------
+    # The whole raster calculation is done one strip of rows at a time:
+    # unfilled_hydrodem = Raster(hydrodem_raster) - Con(IsNull(filldepth), 0, filldepth)
+    # protected = SetNull(centroids_raster == 1, unfilled_hydrodem - (areal_drop * sinks_raster))
+    # result = Con(nhdplus_closed_ras & IsNull(lagos_catseed), FocalStatistics(protected, 'MINIMUM'), protected)
+    arcpy.AddMessage("Burning sinks and removing extraneous sinks (if any)...")
+    temp_rasters = []
+    try:
+        import osgeo.gdal
+        # rasterize the sinks directly on each strip of the hydrodem grid
+        features = [[r[0] for r in data_access.read_rows(fc, ['SHAPE@WKB'])]
+                    for fc in (sink_lakes, sink_centroids, nhdplus_closed)]
+    except ImportError:
+        # without GDAL, rasterize the sinks once with arcpy
+        features = [os.path.join(scratch_dir, name) for name in
+                    ('sinks_raster0.tif', 'centroids_raster0.tif', 'nhdplus_closed_ras0.tif')]
+        arcpy.PolygonToRaster_conversion(sink_lakes, "OBJECTID", features[0], cellsize=10)
+        arcpy.PointToRaster_conversion(sink_centroids, "OBJECTID", features[1], cellsize=10)
+        arcpy.PointToRaster_conversion(nhdplus_closed, "OBJECTID", features[2], cellsize=10)
+        temp_rasters = features
+    hydrodem_revision.revise(hydrodem_raster, filldepth_raster, lagos_catseed_raster, features[0], features[1],
+                             features[2], out_raster, memory_mb)
 
     # cleanup
-    arcpy.CheckInExtension('Spatial')
-    for item in ['sink_lakes', 'sink_centroids', 'sinks_raster0', 'centroids_raster0',
-                 'sinks_raster', 'centroids_raster', 'protected', 'nhdplus_closed', 'nhdplus_closed_ras0',
-                 'nhdplus_closed_ras', 'replacement']:
+    for item in ['sink_lakes', 'sink_centroids', 'nhdplus_closed'] + temp_rasters:
         arcpy.Delete_management(item)
     arcpy.env.overwriteOutput = False
 
-def make_hydrodem(burned_raster, hydrodem_raster_out):
+def make_hydrodem(burned_raster, hydrodem_raster_out, tile_size=priority_flood.TILE_SIZE, processes=8):
     """
-    Remove pits from hydro-enforced raster and fill using TauDEM tools.
+    Remove pits from hydro-enforced raster by filling all depressions (same result as TauDEM Pit Remove). Cells next to
+    NoData are not filled, so lakes protected with NoData centers in revise_hydrodem remain sinks.
     :param burned_raster: Output of Burn Streams or Fix HydroDEM
     :param hydrodem_raster_out: The final "hydrodem" raster output to save
-    :return:
+    :param tile_size: Rows and columns of the DEM tiles filled at once, about 1GB of memory per process at 2048
+    :param processes: Number of processes used to fill tiles
+    :return: Path for hydrodem_raster_out
     """
-    arcpy.AddMessage('Filling DEM started at {}...'.format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
-    pitremove_cmd = 'mpiexec -n 8 pitremove -z {} -fel {}'.format(burned_raster, hydrodem_raster_out)
-    print(pitremove_cmd)
-    try:
-        sp.call(pitremove_cmd, stdout=sp.PIPE, stderr=sp.STDOUT)
-    except:
-        arcpy.AddMessage("Tool did not run. Check for correct installation of TauDEM tools.")
-
-def flow_direction(hydrodem_raster, nhd_fdr, flow_direction_raster_out):
+    fill_start = dt.now()
+    arcpy.AddMessage('Filling DEM started at {}...'.format(fill_start.strftime("%Y-%m-%d %H:%M:%S")))
+    priority_flood.fill(burned_raster, hydrodem_raster_out, tile_size, processes)
+    arcpy.AddMessage('Filling DEM finished in {} seconds.'.format((dt.now() - fill_start).seconds))
+    return hydrodem_raster_out
+
+def flow_direction(hydrodem_raster, nhd_fdr, flow_direction_raster_out, tile_size=flow_routing.TILE_SIZE,
+                   processes=8):
     """
     Create the flow direction raster for the subregion.
     :param hydrodem_raster: The modified or final hydrodem raster
     :param nhd_fdr: The fdr raster from NHDPlus
     :param flow_direction_raster_out: The output raster containing the flow directions
-    :return:
+    :param tile_size: Rows and columns of the raster tiles processed at once
+    :param processes: Number of processes used to compute directions
+    :return: Path for flow_direction_raster_out
     """
-    arcpy.CheckOutExtension('Spatial')
     arcpy.AddMessage('Flow direction started at {}...'.format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
-    flow_dir = arcpy.sa.FlowDirection(hydrodem_raster)
     # enforce same bounds as NHD fdr, so catchments have same HU4 boundary
-    flow_dir_clipped = arcpy.sa.Con(arcpy.sa.IsNull(nhd_fdr), nhd_fdr, flow_dir)
-    flow_dir_clipped.save(flow_direction_raster_out)
-    arcpy.CheckInExtension('Spatial')
+    return flow_routing.flow_direction(hydrodem_raster, flow_direction_raster_out, nhd_fdr, tile_size, processes)
 
-def delineate_catchments(flowdir_raster, catseed_raster, nhdplus_gdb, gridcode_table, output_fc):
+def delineate_catchments(flowdir_raster, catseed_raster, nhdplus_gdb, gridcode_table, output_fc,
+                         tile_size=flow_routing.TILE_SIZE, processes=8):
     """
     Delineate local catchments and label them with GridCode, NHDPlusID, SourceFC, and VPUID for the water feature.
 
@@ -308,21 +284,29 @@ def delineate_catchments(flowdir_raster, catseed_raster, nhdplus_gdb, gridcode_t
     :param nhdplus_gdb: NHDPlus HR geodatabase for the subregion needing local catchments delineated.
     :param gridcode_table: Modified NHDPlusID-GridCode mapping table, the result of nhdplustools_hr.update_grid_codes()
     :param output_fc: Output feature class for the local catchments
+    :param tile_size: Rows and columns of the raster tiles traced at once
+    :param processes: Number of processes used to trace tiles
     :return: ArcGIS Result object for output_fc
 
     """
     # establish environments
-    arcpy.CheckOutExtension('Spatial')
     arcpy.env.workspace = 'in_memory'
     arcpy.env.snapRaster = flowdir_raster
     arcpy.env.extent = flowdir_raster
     nhd_network = NHDNetwork(nhdplus_gdb)
 
-    # delineate watersheds with ArcGIS Watershed tool, then convert to polygon
+    # label each cell with the seed it drains to (same as the Watershed tool), then convert to polygon
     arcpy.AddMessage("Delineating catchments...")
-    sheds = arcpy.sa.Watershed(flowdir_raster, catseed_raster, 'Value')
-    arcpy.AddMessage("Watersheds complete.")
-    sheds_poly = arcpy.RasterToPolygon_conversion(sheds, 'sheds_poly', 'NO_SIMPLIFY', 'Value')
+    sheds_dir = tempfile.mkdtemp(prefix='sheds_', dir=os.path.dirname(flowdir_raster))
+    sheds = os.path.join(sheds_dir, 'sheds.tif')
+    try:
+        flow_routing.label_catchments(flowdir_raster, catseed_raster, sheds, tile_size, processes, sheds_dir)
+        arcpy.AddMessage("Watersheds complete.")
+        sheds_poly = arcpy.RasterToPolygon_conversion(sheds, 'sheds_poly', 'NO_SIMPLIFY', 'Value')
+    finally:
+        if arcpy.Exists(sheds):
+            arcpy.Delete_management(sheds)
+        shutil.rmtree(sheds_dir, ignore_errors=True)
     DM.AlterField(sheds_poly, 'gridcode', 'GridCode', clear_field_alias=True)
 
     arcpy.AddMessage("Linking identifiers...")
@@ -6,17 +6,22 @@
 
 import arcpy
 from arcpy import management as DM
+import numpy as np
 
 
 import lagosGIS
-import lagosGIS.calc_glaciation as calc_glaciation
 import lagosGIS.NHDNetwork as NHDNetwork
+import lagosGIS.reference_overlays as reference_overlays
+import lagosGIS.shape_metrics as shape_metrics
+from lagosGIS import data_access
 
 LAND_BORDER =  r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.8.gdb\NonPublished\Derived_Land_Borders'
 COASTLINE = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.8.gdb\NonPublished\TIGER_Coastline'
 STATES_GEO = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.8.gdb\Spatial_Classifications\state'
 MASTER_LAKES = r'D:\Continental_Limnology\Data_Working\LAGOS_US_GIS_Data_v0.8.gdb\Lakes\LAGOS_US_All_Lakes_1ha'
 GLACIAL_EXTENT = r'C:\Users\smithn78\Dropbox\CL_HUB_GEO\GEO_datadownload_inprogress\DATA_glaciationlatewisc\Pre-processed\lgm_glacial_world.shp'
+# tiled copies of the four layers above, one subdirectory per source, built on first use
+REFERENCE_OVERLAYS = r'D:\Continental_Limnology\Data_Working\Reference_Overlays'
 
 # ---POSTPROCESSING FUNCTIONS-------------------------------------------------------------------------------------------
 
@@ -176,98 +181,89 @@ def process_ws(sheds_fc, zone_name, network_fc ='', nhd_gdb='', fits_naming_stan
     mbgconhull_width_m = '{}_mbgconhull_width_m'.format(zone_name)
     mbgconhull_orientation_deg = '{}_mbgconhull_orientation_deg'.format(zone_name)
     meanwidth_m = '{}_meanwidth_m'.format(zone_name)
+    lat = '{}_lat_decdeg'.format(zone_name)
+    lon = '{}_lon_decdeg'.format(zone_name)
     vpuid = 'VPUID'
 
-    # add fields
+    # add fields, in a single schema change where arcpy supports it
     print("Adding fields...")
-    DM.AddField(sheds_fc, 'lagoslakeid', 'LONG')
-    DM.AddField(sheds_fc, zoneid, 'TEXT', field_length = 10)
-    DM.AddField(sheds_fc, onlandborder, 'TEXT', field_length = 2)
-    DM.AddField(sheds_fc, oncoast, 'TEXT', field_length = 2)
-    DM.AddField(sheds_fc, inusa_pct, 'DOUBLE')
-    DM.AddField(sheds_fc, ismultipart, 'TEXT', field_length=2)
+    new_fields = [('lagoslakeid', ('LONG', None)),
+                  (zoneid, ('TEXT', 10)),
+                  (onlandborder, ('TEXT', 2)),
+                  (oncoast, ('TEXT', 2)),
+                  (inusa_pct, ('DOUBLE', None)),
+                  (ismultipart, ('TEXT', 2))]
     if zone_name == 'ws':
-        DM.AddField(sheds_fc, 'ws_sliverflag', 'TEXT', field_length = 2)
-    DM.AddField(sheds_fc, focallakewaterarea_ha, 'DOUBLE')
-    DM.AddField(sheds_fc, area_ha, 'DOUBLE')
-    DM.AddField(sheds_fc, perimeter_m, 'DOUBLE')
-    DM.AddField(sheds_fc, lake_arearatio, 'DOUBLE')
-    DM.AddField(sheds_fc, mbgconhull_length_m, 'DOUBLE')
-    DM.AddField(sheds_fc, mbgconhull_width_m, 'DOUBLE')
-    DM.AddField(sheds_fc, mbgconhull_orientation_deg, 'DOUBLE')
-    DM.AddField(sheds_fc, meanwidth_m, 'DOUBLE')
-    DM.AddField(sheds_fc, vpuid, 'TEXT', field_length=4)
+        new_fields.append(('ws_sliverflag', ('TEXT', 2)))
+    new_fields.extend([(focallakewaterarea_ha, ('DOUBLE', None)),
+                       (area_ha, ('DOUBLE', None)),
+                       (perimeter_m, ('DOUBLE', None)),
+                       (lake_arearatio, ('DOUBLE', None)),
+                       (mbgconhull_length_m, ('DOUBLE', None)),
+                       (mbgconhull_width_m, ('DOUBLE', None)),
+                       (mbgconhull_orientation_deg, ('DOUBLE', None)),
+                       (meanwidth_m, ('DOUBLE', None)),
+                       (lat, ('DOUBLE', None)),
+                       (lon, ('DOUBLE', None)),
+                       (vpuid, ('TEXT', 4))])
+    data_access.add_fields(sheds_fc, new_fields)
     # ws_subtype added by its tool
     # ws_equalsnws added by its tool
     # *_states added by its tool
 
     # ------ CALCULATIONS -----------------------------------------------------------------------------------------
 
-    # add lagoslakeid and copy to zoneid
-    permid_lagosid = {r[0]: r[1] for r in arcpy.da.SearchCursor(MASTER_LAKES, ['Permanent_Identifier', 'lagoslakeid'])}
-    with arcpy.da.UpdateCursor(sheds_fc, ['Permanent_Identifier', 'lagoslakeid', zoneid]) as u_cursor:
-        for row in u_cursor:
-            row[1] = permid_lagosid[row[0]]
-            row[2] = str(row[1])
-            u_cursor.updateRow(row)
-
-    # basic area, perimeter
+    # lagoslakeid, zoneid and all the shape metrics come from one read of the geometries and are saved in one update
     print("Calculating shape metrics...")
+    permid_lagosid = {r[0]: r[1] for r in arcpy.da.SearchCursor(MASTER_LAKES, ['Permanent_Identifier', 'lagoslakeid'])}
     lake_area_dict = {r[0]: r[1] for r in arcpy.da.SearchCursor(MASTER_LAKES, ['lagoslakeid', 'lake_waterarea_ha'])}
-    shape_fields = ['lagoslakeid',
-                    ismultipart,
-                    focallakewaterarea_ha,
-                    area_ha,
-                    perimeter_m,
-                    lake_arearatio,
-                    'SHAPE@']
-    with arcpy.da.UpdateCursor(sheds_fc, shape_fields) as u_cursor:
-        for row in u_cursor:
-            id, multi, lake_area, area, perim, ratio, shape = row
-            if shape.isMultipart:
-                multi = 'Y'
-            else:
-                multi = 'N'
-            lake_area = lake_area_dict[id]
-            area = shape.area / 10000  # convert m to ha
-            perim = shape.length  # in correct units already
-            ratio = area/lake_area
-            row = (id, multi, lake_area, area, perim, ratio, shape)
-            u_cursor.updateRow(row)
+    oids, lagos_ids, centroids, wkbs = [], [], [], []
+    # SHAPE@XY is the same centroid as Geometry.centroid
+    for oid, permid, xy, wkb in arcpy.da.SearchCursor(sheds_fc, ['OID@', 'Permanent_Identifier', 'SHAPE@XY',
+                                                                 'SHAPE@WKB']):
+        oids.append(oid)
+        lagos_ids.append(permid_lagosid[permid])
+        centroids.append(xy)
+        wkbs.append(wkb)
+    metrics = shape_metrics.polygon_metrics(wkbs)
+    del wkbs
+
+    lake_areas = np.array([lake_area_dict[id] for id in lagos_ids], dtype=np.float64)
+    areas_m2 = metrics['area']
+    areas = areas_m2 / 10000  # convert m to ha
+    ratios = areas / lake_areas
+    mean_widths = areas_m2 / metrics['hull_length']
+    centroids = np.array(centroids, dtype=np.float64).reshape(-1, 2)
+    lats, lons = shape_metrics.albers_to_geographic(centroids[:, 0], centroids[:, 1])
+    columns = [lagos_ids,
+               [str(id) for id in lagos_ids],
+               np.where(metrics['part_count'] > 1, 'Y', 'N').tolist(),
+               lake_areas.tolist(),
+               areas.tolist(),
+               metrics['perimeter'].tolist(),  # in correct units already
+               ratios.tolist(),
+               metrics['hull_length'].tolist(),
+               metrics['hull_width'].tolist(),
+               metrics['hull_orientation'].tolist(),
+               mean_widths.tolist(),
+               lats.tolist(),
+               lons.tolist()]
+    metric_fields = ['lagoslakeid', zoneid, ismultipart, focallakewaterarea_ha, area_ha, perimeter_m, lake_arearatio,
+                     mbgconhull_length_m, mbgconhull_width_m, mbgconhull_orientation_deg, meanwidth_m, lat, lon]
+    if zone_name == 'ws':
+        isoperimetric = shape_metrics.isoperimetric(areas_m2, metrics['perimeter'])
+        columns.append(shape_metrics.sliver_flag(ratios, areas_m2, isoperimetric).tolist())
+        metric_fields.append('ws_sliverflag')
+    row_index = {oid: i for i, oid in enumerate(oids)}
+    data_access.update_rows(sheds_fc, ['OID@'] + metric_fields,
+                            lambda row: [row[0]] + [column[row_index[row[0]]] for column in columns])
 
 
-    # BOUNDARY FLAGS
+    # REFERENCE FLAGS
+    # border, coast, percent in USA, states and glaciation are read from the tiled reference layers in one pass
     print('Adding flags...')
-    # identify border zones
-    sheds_fc_lyr = DM.MakeFeatureLayer(sheds_fc)
-    border_lyr = DM.MakeFeatureLayer(LAND_BORDER, 'border_lyr')
-    DM.SelectLayerByLocation(sheds_fc_lyr, 'INTERSECT', border_lyr)
-    DM.CalculateField(sheds_fc_lyr, onlandborder, "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(sheds_fc_lyr, 'SWITCH_SELECTION')
-    DM.CalculateField(sheds_fc_lyr, onlandborder,"'N'", 'PYTHON')
-
-    # identify coastal zones
-    coastal_lyr = DM.MakeFeatureLayer(COASTLINE, 'coastal_lyr')
-    DM.SelectLayerByLocation(sheds_fc_lyr, 'INTERSECT', coastal_lyr)
-    DM.CalculateField(sheds_fc_lyr, oncoast, "'Y'", 'PYTHON')
-    DM.SelectLayerByAttribute(sheds_fc_lyr, 'SWITCH_SELECTION')
-    DM.CalculateField(sheds_fc_lyr, oncoast, "'N'", 'PYTHON')
-    oncoast = '{}_oncoast'.format(zone_name)
-
-    # percent in USA
-    arcpy.AddMessage("Percent in USA...")
-    arcpy.TabulateIntersection_analysis(sheds_fc, zoneid, STATES_GEO, 'in_memory/tabarea')
-    # round to 2 digits and don't let values exceed 100
-    inusa_dict = {r[0]:min(round(r[1],2), 100)
-                  for r in arcpy.da.SearchCursor('in_memory/tabarea', [zoneid, 'PERCENTAGE'])}
-
-    with arcpy.da.UpdateCursor(sheds_fc, [zoneid, inusa_pct]) as u_cursor:
-        for row in u_cursor:
-            if row[0] in inusa_dict:
-                row[1] = inusa_dict[row[0]]
-            else: # occasional border lakes have watersheds completely outside state borders
-                row[1] = 0
-            u_cursor.updateRow(row)
+    overlays = reference_overlays.open_overlays(REFERENCE_OVERLAYS, LAND_BORDER, COASTLINE, STATES_GEO, GLACIAL_EXTENT)
+    reference_overlays.add_overlay_fields(sheds_fc, zone_name, overlays)
 
     # OTHER FLAGS
     # equality and subtype flags
@@ -276,64 +272,6 @@ def process_ws(sheds_fc, zone_name, network_fc ='', nhd_gdb='', fits_naming_stan
         if nhd_gdb:
             calc_watershed_subtype(nhd_gdb, sheds_fc, fits_naming_standard)
 
-    # assign states to zone
-    print('State assignment...')
-    lagosGIS.spatial_divisions_processing.find_states(sheds_fc, STATES_GEO, zone_name)
-    # glaciation status
-    calc_glaciation.calc(sheds_fc, GLACIAL_EXTENT, zoneid, zone_name)
-
-    # mbgconhull metrics
-    print('Adding convex hull metrics...')
-    DM.MinimumBoundingGeometry(sheds_fc, 'in_memory/mbg', 'CONVEX_HULL', mbg_fields_option='MBG_FIELDS')
-    mbg_dict_fields = ['lagoslakeid',
-                       'MBG_Length',
-                       'MBG_Width',
-                       'MBG_Orientation'
-                       ]
-    mbg_dict = {r[0]:r[1:] for r in arcpy.da.SearchCursor('in_memory/mbg', mbg_dict_fields)}
-    mbg_fields = ['lagoslakeid',
-                  mbgconhull_length_m,
-                  mbgconhull_width_m,
-                  mbgconhull_orientation_deg,
-                  area_ha,
-                  meanwidth_m]
-    with arcpy.da.UpdateCursor(sheds_fc, mbg_fields) as u_cursor:
-        for row in u_cursor:
-            id, length, width, orientation, area, meanwidth = row
-            length, width, orientation = mbg_dict[id]
-            meanwidth = area * 10000/length
-            row = [id, length, width, orientation, area, meanwidth]
-            u_cursor.updateRow(row)
-
-    # set sliverflag
-    if zone_name == 'ws':
-        sliver_fields = ['ws_lake_arearatio',
-                         'ws_area_ha',
-                         'ws_perimeter_m',
-                         'ws_sliverflag']
-        with arcpy.da.UpdateCursor(sheds_fc, sliver_fields) as u_cursor:
-            for row in u_cursor:
-                ratio, area_ha, perim, flag = row
-                area_m2 = area_ha * 10000
-                isoperimetric = (4 * 3.14159 * area_m2)/(perim**2)
-
-                # see LOCUS Guide documentation for ws_sliverflag--table there explains these criteria
-                if 0.02 < ratio <= 1.0 and isoperimetric <= 0.003:
-                    flag = 'Y'
-                elif ratio <= 0.025:
-                    flag = 'Y'
-                elif 0.025 < ratio <= 0.10 and area_m2 <= 15000:
-                    flag = 'Y'
-                elif 0.10 < ratio <= 0.13 and area_m2 <= 10000:
-                    flag = 'Y'
-                elif 0.13 < ratio <= 0.3 and area_m2 <= 5000:
-                    flag = 'Y'
-                else:
-                    flag = 'N'
-
-                row = [ratio, area_ha, perim, flag]
-                u_cursor.updateRow(row)
-
     # rename some more fields
     if not fits_naming_standard:
 
@@ -357,7 +295,5 @@ def process_ws(sheds_fc, zone_name, network_fc ='', nhd_gdb='', fits_naming_stan
     lyr_objects = [lyr_object for var_name, lyr_object in locals().items() if var_name.endswith('lyr')]
     for l in lyr_objects:
         DM.Delete(l)
-    DM.Delete('in_memory/tabarea')
-    DM.Delete('in_memory/mbg')
 
     return sheds_fc
\ No newline at end of file
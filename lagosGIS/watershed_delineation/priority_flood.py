@@ -0,0 +1,298 @@
+# filename: priority_flood.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Fill depressions in a DEM with a tiled priority-flood (Barnes, Lehman & Mulla 2014; Barnes 2016) instead of
+# TauDEM pitremove. Cells next to NoData drain freely, the same as in pitremove, so the NoData lake centers written by
+# revise_hydrodem still keep those lakes from being filled.
+
+import heapq
+import os
+import shutil
+import tempfile
+from datetime import datetime as dt
+
+import numpy as np
+
+import raster_blocks
+
+TILE_SIZE = 2048  # rows and columns per tile, about 1 GB of working memory per process
+OUTPUT_NODATA = -3.4028235e+38
+OCEAN = 1  # label for cells that drain off the raster or into NoData
+
+# 8-neighbor offsets as (row, column)
+NEIGHBORS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+# ---TILE FLOOD-----------------------------------------------------------------------------------------------------
+def flood_tile(elevation, nodata):
+    """
+    Fill one tile as if its edges were the edge of the DEM, labeling each cell with the tile-edge watershed it floods
+    from and recording the lowest spill elevation between each pair of adjacent watersheds.
+
+    :param elevation: 2D array of elevations for the tile plus a 1-cell border read from the neighboring tiles
+    :param nodata: 2D boolean array, same shape, True for NoData cells and for cells outside the raster
+    :return: Tuple of (filled elevations, labels, spill edges, label count). Filled elevations and labels cover the tile
+    without the border. Labels are 0 for NoData, OCEAN for watersheds draining off the raster and 2 or more for
+    watersheds draining to the tile edge. Spill edges is a dictionary with key = (label, label), value = elevation.
+    """
+    height, width = elevation.shape
+    inner = np.zeros((height, width), dtype=bool)
+    inner[1:-1, 1:-1] = True
+    valid = inner & ~nodata
+
+    near_nodata = np.zeros((height, width), dtype=bool)
+    for dr, dc in NEIGHBORS:
+        near_nodata[1:-1, 1:-1] |= nodata[1 + dr:height - 1 + dr, 1 + dc:width - 1 + dc]
+    edge = inner.copy()
+    edge[2:-2, 2:-2] = False
+    seeds = valid & (edge | near_nodata)
+
+    labels = np.zeros((height, width), dtype=np.int64)
+    labels[~valid] = -1
+    labels[seeds & near_nodata] = OCEAN
+
+    # plain lists are much faster than numpy arrays for single-cell access
+    z = elevation.astype(np.float64).ravel().tolist()
+    filled = list(z)
+    label = labels.ravel().tolist()
+    is_seed = seeds.ravel().tolist()
+    offsets = [dr * width + dc for dr, dc in NEIGHBORS]
+
+    open_heap = [(z[i], i) for i in np.flatnonzero(seeds).tolist()]
+    heapq.heapify(open_heap)
+    pit = []
+    edges = {}
+    next_label = OCEAN + 1
+    heappush, heappop = heapq.heappush, heapq.heappop
+
+    while open_heap or pit:
+        if pit:
+            c = pit.pop()
+        else:
+            c = heappop(open_heap)[1]
+        c_label = label[c]
+        if c_label == 0:
+            c_label = next_label
+            label[c] = c_label
+            next_label += 1
+        c_level = filled[c]
+        for offset in offsets:
+            n = c + offset
+            n_label = label[n]
+            if n_label == -1:
+                continue
+            if n_label:
+                if n_label != c_label:
+                    key = (c_label, n_label) if c_label < n_label else (n_label, c_label)
+                    spill = c_level if c_level > filled[n] else filled[n]
+                    if spill < edges.get(key, float('inf')):
+                        edges[key] = spill
+                continue
+            label[n] = c_label
+            if is_seed[n]:
+                continue  # already queued at its own elevation
+            if z[n] <= c_level:
+                filled[n] = c_level
+                pit.append(n)
+            else:
+                heappush(open_heap, (z[n], n))
+
+    filled = np.array(filled).reshape(height, width)[1:-1, 1:-1]
+    labels = np.array(label, dtype=np.int64).reshape(height, width)[1:-1, 1:-1]
+    labels[labels < 0] = 0
+    return filled, labels, edges, next_label
+
+
+def _tile_edges(labels, filled):
+    """Labels and elevations along the four sides of a tile, for linking to the neighboring tiles."""
+    return {'top': (labels[0].copy(), filled[0].copy()),
+            'bottom': (labels[-1].copy(), filled[-1].copy()),
+            'left': (labels[:, 0].copy(), filled[:, 0].copy()),
+            'right': (labels[:, -1].copy(), filled[:, -1].copy())}
+
+
+def _flood_window(reader, window, cache_dir):
+    """Run flood_tile on one window and cache its results, returning only what the global graph needs."""
+    if reader.nodata is None:
+        elevation = reader.read_padded(window, 1, fill=np.nan).astype(np.float64)
+    else:
+        elevation = reader.read_padded(window, 1).astype(np.float64)
+    nodata = raster_blocks.nodata_mask(elevation, reader.nodata)
+    filled, labels, edges, n_labels = flood_tile(elevation, nodata)
+    name = '{}_{}'.format(window.row, window.col)
+    np.save(os.path.join(cache_dir, name + '_filled.npy'), filled.astype(np.float32))
+    np.save(os.path.join(cache_dir, name + '_labels.npy'), labels.astype(np.int32))
+    return window, edges, n_labels, _tile_edges(labels, filled)
+
+
+def _flood_window_worker(args):
+    raster_path, window, cache_dir = args
+    reader = raster_blocks.open_raster(raster_path)
+    try:
+        return _flood_window(reader, window, cache_dir)
+    finally:
+        reader.close()
+
+
+# ---GLOBAL SPILL GRAPH---------------------------------------------------------------------------------------------
+def _link(edges, labels_a, z_a, labels_b, z_b):
+    """Add spill edges between two facing tile sides, including diagonal neighbors."""
+    n = len(labels_a)
+    for shift in (-1, 0, 1):
+        a = slice(max(0, -shift), n - max(0, shift))
+        b = slice(max(0, shift), n - max(0, -shift))
+        la, lb = labels_a[a], labels_b[b]
+        spill = np.maximum(z_a[a], z_b[b])
+        keep = (la > 0) & (lb > 0) & (la != lb)
+        for x, y, s in zip(la[keep].tolist(), lb[keep].tolist(), spill[keep].tolist()):
+            key = (x, y) if x < y else (y, x)
+            if s < edges.get(key, float('inf')):
+                edges[key] = s
+
+
+def solve_spill_elevations(edges, n_labels):
+    """
+    Find the elevation each watershed must be filled to before it spills to the edge of the DEM: the lowest possible
+    maximum spill elevation along any path of watersheds to OCEAN.
+    :param dict edges: Key = (label, label), value = spill elevation between the two watersheds
+    :param int n_labels: Number of labels, including 0 and OCEAN
+    :return: numpy array indexed by label. -inf for OCEAN and for watersheds that never reach it.
+    """
+    neighbors = [[] for i in range(n_labels)]
+    for (a, b), spill in edges.items():
+        neighbors[a].append((b, spill))
+        neighbors[b].append((a, spill))
+    level = np.full(n_labels, -np.inf)
+    done = np.zeros(n_labels, dtype=bool)
+    heap = [(-np.inf, OCEAN)]
+    while heap:
+        current, a = heapq.heappop(heap)
+        if done[a]:
+            continue
+        done[a] = True
+        level[a] = current
+        for b, spill in neighbors[a]:
+            if not done[b]:
+                heapq.heappush(heap, (max(current, spill), b))
+    return level
+
+
+# ---MAIN ENGINE----------------------------------------------------------------------------------------------------
+def fill_blocks(reader, writer, tile_size=TILE_SIZE, processes=1, raster_path=None, scratch_dir=None,
+                output_nodata=OUTPUT_NODATA):
+    """
+    Fill all depressions in a DEM, one tile at a time.
+
+    1) Each tile is filled as if its edges drained freely, and labeled by the tile-edge watershed each cell floods from.
+    2) The watersheds of all tiles are joined into one graph at the tile seams and the graph is flooded from the edge of
+    the DEM to find how high each watershed has to be filled to spill out.
+    3) Each tile's final elevation is the greater of its own fill and its watershed's spill elevation.
+
+    :param reader: Reader for the DEM, see raster_blocks.open_raster
+    :param writer: Writer for the output, see raster_blocks.create_raster
+    :param int tile_size: Rows and columns per tile
+    :param int processes: Number of processes used to fill tiles. More than 1 requires raster_path.
+    :param str raster_path: Path of the DEM, for reopening it in the worker processes
+    :param str scratch_dir: Directory for cached tile results. Default is a new temporary directory.
+    :param float output_nodata: Value written to NoData cells
+    :return: The result of writer.close()
+    """
+    cache_dir = tempfile.mkdtemp(prefix='priority_flood_', dir=scratch_dir)
+    try:
+        tiles = list(raster_blocks.windows(reader.height, reader.width, tile_size, tile_size))
+        start = dt.now()
+        if processes > 1 and raster_path:
+            pool = raster_blocks.process_pool(processes)
+            try:
+                results = pool.map(_flood_window_worker, [(raster_path, w, cache_dir) for w in tiles], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_flood_window(reader, w, cache_dir) for w in tiles]
+        print("Filled {} tiles in {} seconds.".format(len(tiles), (dt.now() - start).seconds))
+
+        # ---JOIN TILE WATERSHEDS-----
+        # local labels 2+ are renumbered so that every tile's watersheds have unique global labels
+        start = dt.now()
+        offsets = {}
+        tile_edges = {}
+        edges = {}
+        next_label = OCEAN + 1
+        for window, tile_spills, n_labels, sides in results:
+            offset = next_label - (OCEAN + 1)
+            offsets[(window.row, window.col)] = offset
+            next_label += n_labels - (OCEAN + 1)
+            renumber = lambda x: x + offset if x > OCEAN else x
+            for (a, b), spill in tile_spills.items():
+                key = (renumber(a), renumber(b))
+                if spill < edges.get(key, float('inf')):
+                    edges[key] = spill
+            for side, (labels, filled) in sides.items():
+                sides[side] = (np.where(labels > OCEAN, labels + offset, labels), filled)
+            tile_edges[(window.row, window.col)] = sides
+
+        for (row, col), sides in tile_edges.items():
+            below = tile_edges.get((row + tile_size, col))
+            right = tile_edges.get((row, col + tile_size))
+            if below:
+                _link(edges, sides['bottom'][0], sides['bottom'][1], below['top'][0], below['top'][1])
+            if right:
+                _link(edges, sides['right'][0], sides['right'][1], right['left'][0], right['left'][1])
+            # corner cells of diagonal tiles
+            for other_key, corner, other_corner in (((row + tile_size, col + tile_size), -1, 0),
+                                                    ((row + tile_size, col - tile_size), 0, -1)):
+                other = tile_edges.get(other_key)
+                if other:
+                    _link(edges, sides['bottom'][0][corner:][:1], sides['bottom'][1][corner:][:1],
+                          other['top'][0][other_corner:][:1], other['top'][1][other_corner:][:1])
+        spill_level = solve_spill_elevations(edges, next_label)
+        print("Solved spill elevations for {} watersheds in {} seconds.".format(
+            next_label, (dt.now() - start).seconds))
+
+        # ---WRITE FILLED TILES-----
+        for window in tiles:
+            name = os.path.join(cache_dir, '{}_{}'.format(window.row, window.col))
+            filled = np.load(name + '_filled.npy')
+            labels = np.load(name + '_labels.npy')
+            offset = offsets[(window.row, window.col)]
+            global_labels = np.where(labels > OCEAN, labels + offset, labels)
+            result = np.maximum(filled, spill_level[global_labels]).astype(np.float32)
+            result[labels == 0] = output_nodata
+            writer.write(window, result)
+        return writer.close()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def fill(in_raster, out_raster, tile_size=TILE_SIZE, processes=1, scratch_dir=None):
+    """
+    Fill all depressions in a DEM raster and save the filled DEM, the equivalent of TauDEM pitremove.
+    :param str in_raster: The burned DEM, e.g. the output of revise_hydrodem
+    :param str out_raster: Output filled DEM (GeoTIFF)
+    :param int tile_size: Rows and columns per tile
+    :param int processes: Number of processes used to fill tiles
+    :param str scratch_dir: Directory for cached tile results. Default is the system temporary directory.
+    :return: out_raster
+    """
+    reader = raster_blocks.open_raster(in_raster)
+    try:
+        writer = raster_blocks.create_raster(out_raster, reader, np.float32, OUTPUT_NODATA)
+        return fill_blocks(reader, writer, tile_size, processes, in_raster, scratch_dir)
+    finally:
+        reader.close()
+
+
+def fill_array(elevation, nodata=None, tile_size=TILE_SIZE):
+    """
+    Fill all depressions in a DEM held in memory.
+    :param elevation: 2D numpy array
+    :param nodata: NoData value, if any (NaN is always NoData)
+    :param int tile_size: Rows and columns per tile
+    :return: float32 array of filled elevations with OUTPUT_NODATA in NoData cells
+    """
+    reader = raster_blocks.ArrayReader(elevation, nodata)
+    writer = raster_blocks.ArrayWriter(reader, np.float32, OUTPUT_NODATA)
+    return fill_blocks(reader, writer, tile_size)
@@ -0,0 +1,346 @@
+# filename: raster_blocks.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Read and write subregion rasters one window at a time so that the watershed raster engines can work in
+# bounded memory. Uses GDAL when it is installed and arcpy otherwise.
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+# GeoTIFF creation options for outputs, tiled so that block reads by later steps are cheap
+GTIFF_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
+# memory for each strip saved by ArcpyWriter, small enough for 32-bit ArcMap
+ARCPY_STRIP_MB = 128
+
+Window = namedtuple('Window', ['row', 'col', 'nrows', 'ncols'])
+
+# arcpy SpatialReference properties that define a projected coordinate system, besides its datum
+ARCPY_PROJECTION_PROPERTIES = ('projectionName', 'centralMeridian', 'standardParallel1', 'standardParallel2',
+                               'latitudeOfOrigin', 'falseEasting', 'falseNorthing', 'scaleFactor', 'linearUnitName')
+
+
+# ---WINDOWS--------------------------------------------------------------------------------------------------------
+def windows(height, width, block_rows, block_cols=None):
+    """
+    Divide a raster into blocks, row by row.
+    :param int height: Raster rows
+    :param int width: Raster columns
+    :param int block_rows: Rows per block
+    :param int block_cols: Columns per block. Default is the full raster width (row strips).
+    :return: Generator of Window(row, col, nrows, ncols)
+    """
+    block_cols = block_cols or width
+    for row in range(0, height, block_rows):
+        for col in range(0, width, block_cols):
+            yield Window(row, col, min(block_rows, height - row), min(block_cols, width - col))
+
+
+def block_rows_for_budget(width, bytes_per_cell, memory_mb, halo=0):
+    """
+    Choose how many raster rows to process at once so that all the arrays for one strip fit in a memory budget.
+    :param int width: Raster columns
+    :param int bytes_per_cell: Total bytes held per cell across all the arrays used at once, e.g. 3 float32 inputs and
+    one float32 output = 16
+    :param float memory_mb: Memory budget in MB
+    :param int halo: Extra rows read above and below each strip
+    :return: Rows per strip, at least 1
+    """
+    rows = int(memory_mb * 2**20 // (width * bytes_per_cell)) - 2 * halo
+    return max(1, rows)
+
+
+def nodata_mask(array, nodata):
+    """
+    :return: Boolean array, True where the cell is NoData
+    """
+    mask = np.isnan(array) if array.dtype.kind == 'f' else np.zeros(array.shape, dtype=bool)
+    if nodata is not None:
+        mask |= array == nodata
+    return mask
+
+
+def same_crs(projection, other):
+    """
+    :param projection: WKT string (GDAL) or arcpy SpatialReference
+    :param other: Same type as projection
+    :return: True if the two describe the same coordinate system
+    """
+    if projection == other:
+        return True
+    if not projection or not other:
+        return False
+    if hasattr(projection, 'exportToString'):
+        # compare the definitions, not the names, so that e.g. EPSG:5070 and ESRI:102039 are the same Albers
+        if (projection.type, projection.GCS.datumName) != (other.type, other.GCS.datumName):
+            return False
+        return projection.type != 'Projected' or all(getattr(projection, p) == getattr(other, p)
+                                                     for p in ARCPY_PROJECTION_PROPERTIES)
+    from osgeo import osr
+    a, b = osr.SpatialReference(), osr.SpatialReference()
+    a.ImportFromWkt(projection)
+    b.ImportFromWkt(other)
+    return bool(a.IsSame(b))
+
+
+def check_same_grid(reader, other, name='raster'):
+    """
+    Raise ValueError unless two open rasters have the same size, cell size, origin and coordinate system.
+    :param reader: Reader for the reference raster
+    :param other: Reader for the raster that must be on its grid
+    :param str name: Description of other for the error message
+    """
+    problem = ''
+    if (other.width, other.height) != (reader.width, reader.height):
+        problem = '{} x {} cells instead of {} x {}'.format(other.width, other.height, reader.width, reader.height)
+    elif not np.allclose(other.geotransform, reader.geotransform, rtol=0, atol=abs(reader.geotransform[1]) * 1e-3):
+        problem = 'geotransform {} instead of {}'.format(other.geotransform, reader.geotransform)
+    elif not same_crs(reader.projection, other.projection):
+        problem = 'a different coordinate system'
+    if problem:
+        raise ValueError("The {} {} must be on the same grid as {}: it has {}.".format(name, other.path, reader.path,
+                                                                                      problem))
+
+
+def process_pool(processes):
+    """
+    multiprocessing.Pool for the tile workers. Inside ArcMap or ArcGIS Pro sys.executable is the application, not
+    python, so the workers would start new copies of the application; they are started with the installation's
+    python.exe instead (multiprocessing.set_executable). The calling script still needs an
+    if __name__ == '__main__' guard, since the workers re-import it on Windows.
+    :param int processes: Number of worker processes
+    :return: multiprocessing.Pool
+    """
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        python = os.path.join(sys.exec_prefix, 'python.exe')
+        if os.path.exists(python):
+            multiprocessing.set_executable(python)
+    return multiprocessing.Pool(processes)
+
+
+# ---READERS--------------------------------------------------------------------------------------------------------
+class _Reader:
+    """Shared windowing logic. Subclasses set the raster properties and implement _read."""
+
+    def read(self, window):
+        """
+        :param Window window: Cells to read, must be inside the raster
+        :return: numpy array of shape (nrows, ncols)
+        """
+        return self._read(*window)
+
+    def read_padded(self, window, pad, fill=None):
+        """
+        Read a window plus a border of pad cells on every side. Border cells outside the raster are set to fill.
+        :param Window window: Cells to read
+        :param int pad: Width of the border
+        :param fill: Value for cells outside the raster. Default is the raster NoData value.
+        :return: numpy array of shape (nrows + 2 * pad, ncols + 2 * pad)
+        """
+        fill = self.nodata if fill is None else fill
+        if fill is None:
+            raise ValueError("Raster {} has no NoData value, supply a fill value".format(self.path))
+        row0, col0 = max(0, window.row - pad), max(0, window.col - pad)
+        row1 = min(self.height, window.row + window.nrows + pad)
+        col1 = min(self.width, window.col + window.ncols + pad)
+        inner = self._read(row0, col0, row1 - row0, col1 - col0)
+        padded = np.full((window.nrows + 2 * pad, window.ncols + 2 * pad), fill, dtype=inner.dtype)
+        top, left = row0 - (window.row - pad), col0 - (window.col - pad)
+        padded[top:top + inner.shape[0], left:left + inner.shape[1]] = inner
+        return padded
+
+
+class GDALReader(_Reader):
+    def __init__(self, path):
+        from osgeo import gdal
+        self.path = path
+        self.dataset = gdal.Open(path)
+        if self.dataset is None:
+            raise IOError("Could not open raster {}".format(path))
+        self.band = self.dataset.GetRasterBand(1)
+        self.width = self.dataset.RasterXSize
+        self.height = self.dataset.RasterYSize
+        self.nodata = self.band.GetNoDataValue()
+        self.geotransform = self.dataset.GetGeoTransform()
+        self.projection = self.dataset.GetProjection()
+
+    def _read(self, row, col, nrows, ncols):
+        return self.band.ReadAsArray(col, row, ncols, nrows)
+
+    def close(self):
+        self.band = None
+        self.dataset = None
+
+
+class ArcpyReader(_Reader):
+    def __init__(self, path):
+        import arcpy
+        self.arcpy = arcpy
+        self.path = path
+        raster = arcpy.Raster(path)
+        self.width = raster.width
+        self.height = raster.height
+        self.nodata = raster.noDataValue
+        cell = raster.meanCellWidth
+        self.geotransform = (raster.extent.XMin, cell, 0, raster.extent.YMax, 0, -raster.meanCellHeight)
+        self.projection = raster.spatialReference
+
+    def _read(self, row, col, nrows, ncols):
+        x0, cell_x, _, y0, _, cell_y = self.geotransform
+        lower_left = self.arcpy.Point(x0 + col * cell_x, y0 + (row + nrows) * cell_y)
+        if self.nodata is None:
+            return self.arcpy.RasterToNumPyArray(self.path, lower_left, ncols, nrows)
+        return self.arcpy.RasterToNumPyArray(self.path, lower_left, ncols, nrows, self.nodata)
+
+    def close(self):
+        pass
+
+
+class ArrayReader(_Reader):
+    """Reader for an array already in memory, for small rasters and for testing the engines."""
+
+    def __init__(self, array, nodata=None, geotransform=(0, 1, 0, 0, 0, -1), projection=''):
+        self.path = '<array>'
+        self.array = array
+        self.height, self.width = array.shape
+        self.nodata = nodata
+        self.geotransform = geotransform
+        self.projection = projection
+
+    def _read(self, row, col, nrows, ncols):
+        return self.array[row:row + nrows, col:col + ncols].copy()
+
+    def close(self):
+        pass
+
+
+class ArrayWriter:
+    """Writer into an array in memory; close() returns the array."""
+
+    def __init__(self, template, dtype, nodata=None):
+        self.array = np.empty((template.height, template.width), dtype=dtype)
+        self.nodata = nodata
+
+    def write(self, window, array):
+        self.array[window.row:window.row + window.nrows, window.col:window.col + window.ncols] = array
+
+    def close(self):
+        return self.array
+
+
+def open_raster(path):
+    """
+    Open a raster for windowed reading, with GDAL if it is installed and arcpy otherwise.
+    :param str path: Raster path
+    :return: Reader with width, height, nodata, geotransform and projection properties and read, read_padded and close
+    methods
+    """
+    try:
+        import osgeo.gdal
+    except ImportError:
+        return ArcpyReader(path)
+    return GDALReader(path)
+
+
+# ---WRITERS--------------------------------------------------------------------------------------------------------
+class GDALWriter:
+    DTYPES = {'uint8': 1, 'uint16': 2, 'int16': 3, 'uint32': 4, 'int32': 5, 'float32': 6, 'float64': 7}
+
+    def __init__(self, path, template, dtype, nodata):
+        from osgeo import gdal
+        self.path = path
+        driver = gdal.GetDriverByName('GTiff')
+        if os.path.exists(path):
+            driver.Delete(path)
+        self.dataset = driver.Create(path, template.width, template.height, 1, self.DTYPES[np.dtype(dtype).name],
+                                     GTIFF_OPTIONS)
+        self.dataset.SetGeoTransform(template.geotransform)
+        self.dataset.SetProjection(template.projection)
+        self.band = self.dataset.GetRasterBand(1)
+        if nodata is not None:
+            self.band.SetNoDataValue(nodata)
+        self.dtype = dtype
+
+    def write(self, window, array):
+        self.band.WriteArray(np.asarray(array, dtype=self.dtype), window.col, window.row)
+
+    def close(self):
+        self.band.FlushCache()
+        self.band = None
+        self.dataset = None
+        return self.path
+
+
+class ArcpyWriter:
+    """
+    Collects blocks in a disk-backed array. When closed, saves it with arcpy one row strip at a time, each strip to its
+    own temporary raster, and mosaics the strips into the output, so the whole raster is never held in memory.
+    """
+    PIXEL_TYPES = {'uint8': '8_BIT_UNSIGNED', 'uint16': '16_BIT_UNSIGNED', 'int16': '16_BIT_SIGNED',
+                   'uint32': '32_BIT_UNSIGNED', 'int32': '32_BIT_SIGNED', 'float32': '32_BIT_FLOAT',
+                   'float64': '64_BIT'}
+
+    def __init__(self, path, template, dtype, nodata, memory_mb=ARCPY_STRIP_MB):
+        import arcpy
+        self.arcpy = arcpy
+        self.path = path
+        self.template = template
+        self.nodata = nodata
+        self.memory_mb = memory_mb
+        self.scratch_dir = tempfile.mkdtemp(prefix='arcpy_writer_')
+        self.array = np.lib.format.open_memmap(os.path.join(self.scratch_dir, 'blocks.npy'), mode='w+', dtype=dtype,
+                                               shape=(template.height, template.width))
+
+    def write(self, window, array):
+        self.array[window.row:window.row + window.nrows, window.col:window.col + window.ncols] = array
+
+    def close(self):
+        x0, cell_x, _, y0, _, cell_y = self.template.geotransform
+        self.array.flush()
+        strip_rows = block_rows_for_budget(self.template.width, self.array.dtype.itemsize, self.memory_mb)
+        strips = []
+        try:
+            for window in windows(self.template.height, self.template.width, strip_rows):
+                lower_left = self.arcpy.Point(x0, y0 + (window.row + window.nrows) * cell_y)
+                strip = np.array(self.array[window.row:window.row + window.nrows])
+                raster = self.arcpy.NumPyArrayToRaster(strip, lower_left, cell_x, -cell_y, self.nodata)
+                strip_path = os.path.join(self.scratch_dir, 'strip{}.tif'.format(len(strips)))
+                raster.save(strip_path)
+                del raster, strip
+                strips.append(strip_path)
+            if self.arcpy.Exists(self.path):
+                self.arcpy.Delete_management(self.path)
+            nodata = '' if self.nodata is None else str(self.nodata)
+            self.arcpy.CopyRaster_management(strips[0], self.path, nodata_value=nodata,
+                                             pixel_type=self.PIXEL_TYPES[self.array.dtype.name])
+            if len(strips) > 1:
+                self.arcpy.Mosaic_management(';'.join(strips[1:]), self.path, 'FIRST', nodata_value=nodata)
+            self.arcpy.DefineProjection_management(self.path, self.template.projection)
+        finally:
+            self.array = None
+            for strip_path in strips:
+                self.arcpy.Delete_management(strip_path)
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        return self.path
+
+
+def create_raster(path, template, dtype, nodata):
+    """
+    Create an output raster with the same grid as an open raster, to be written one window at a time.
+    :param str path: Output raster path (GeoTIFF)
+    :param template: Reader returned by open_raster for a raster on the same grid
+    :param dtype: numpy dtype of the output
+    :param nodata: Output NoData value
+    :return: Writer with write(window, array) and close() methods
+    """
+    if isinstance(template, GDALReader):
+        return GDALWriter(path, template, dtype, nodata)
+    return ArcpyWriter(path, template, dtype, nodata)
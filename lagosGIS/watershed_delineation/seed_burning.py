@@ -0,0 +1,156 @@
+# filename: seed_burning.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Burn lake seeds into a copy of the catseed raster and remove unwanted sink seeds in a single windowed pass,
+# replacing the mosaic, attribute table and SetNull steps of add_lake_seeds.
+
+import numpy as np
+
+import raster_blocks
+
+DEFAULT_MEMORY_MB = 1024
+SEED_NODATA = -2147483648
+BYTES_PER_CELL = 13  # int32 catseed, lakes and output plus a boolean mask
+
+
+def code_lookup(codes):
+    """
+    Make a lookup table for testing raster values against a set of codes with one array index per cell.
+    :param codes: Iterable of non-negative integer codes
+    :return: Boolean numpy array, True at the index of each code
+    """
+    codes = np.array(sorted(set(codes)), dtype=np.int64)
+    lookup = np.zeros(int(codes.max()) + 1 if codes.size else 0, dtype=bool)
+    lookup[codes] = True
+    return lookup
+
+
+def in_lookup(values, lookup):
+    """
+    :param values: Integer array
+    :param lookup: Result of code_lookup
+    :return: Boolean array, True where the value is one of the codes
+    """
+    if not lookup.size:
+        return np.zeros(values.shape, dtype=bool)
+    inside = (values >= 0) & (values < lookup.size)
+    result = np.zeros(values.shape, dtype=bool)
+    result[inside] = lookup[values[inside]]
+    return result
+
+
+def burn_block(seeds, seed_nodata, lakes, lake_nodata, remove_lookup, nodata=SEED_NODATA):
+    """
+    Lake seeds take precedence over the catseed values beneath them, then removed codes become NoData.
+    :param seeds: Catseed values for the block
+    :param seed_nodata: Boolean array, True where catseed is NoData
+    :param lakes: Lake GridCodes rasterized on the same block
+    :param lake_nodata: Boolean array, True where there is no lake
+    :param remove_lookup: Result of code_lookup for the codes to remove
+    :param nodata: Output NoData value
+    :return: int32 array
+    """
+    result = np.where(lake_nodata, seeds, lakes).astype(np.int32)
+    result[seed_nodata & lake_nodata] = nodata
+    result[in_lookup(result, remove_lookup)] = nodata
+    return result
+
+
+class PolygonRasterizer(raster_blocks._Reader):
+    """
+    Reader that rasterizes polygons onto each window as it is read, on the grid of a template raster. Cells are
+    assigned when their center is inside a polygon, as in PolygonToRaster. Points are assigned to the cell that contains
+    them, as in PointToRaster. Requires GDAL.
+
+    :param template: Reader for a raster on the target grid
+    :param polygons: Iterable of (integer value, WKB geometry) in the coordinate system of the template, polygons or
+    points
+    :param nodata: Value for cells outside all polygons
+    """
+
+    def __init__(self, template, polygons, nodata=SEED_NODATA):
+        from osgeo import gdal, ogr
+        self.gdal = gdal
+        self.path = '<polygons>'
+        self.width, self.height = template.width, template.height
+        self.geotransform = template.geotransform
+        self.projection = template.projection
+        self.nodata = nodata
+        driver = ogr.GetDriverByName('Memory') or ogr.GetDriverByName('MEM')
+        self.source = driver.CreateDataSource('polygons')
+        self.layer = self.source.CreateLayer('polygons', None, ogr.wkbUnknown)
+        self.layer.CreateField(ogr.FieldDefn('value', ogr.OFTInteger))
+        definition = self.layer.GetLayerDefn()
+        self.count = 0
+        for value, wkb in polygons:
+            feature = ogr.Feature(definition)
+            feature.SetField('value', int(value))
+            feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(wkb)))
+            self.layer.CreateFeature(feature)
+            self.count += 1
+
+    def _read(self, row, col, nrows, ncols):
+        x0, cell_x, _, y0, _, cell_y = self.geotransform
+        left, top = x0 + col * cell_x, y0 + row * cell_y
+        dataset = self.gdal.GetDriverByName('MEM').Create('', ncols, nrows, 1, self.gdal.GDT_Int32)
+        dataset.SetGeoTransform((left, cell_x, 0, top, 0, cell_y))
+        band = dataset.GetRasterBand(1)
+        band.Fill(self.nodata)
+        self.layer.SetSpatialFilterRect(left, top + nrows * cell_y, left + ncols * cell_x, top)
+        self.gdal.RasterizeLayer(dataset, [1], self.layer, options=['ATTRIBUTE=value'])
+        return band.ReadAsArray()
+
+    def close(self):
+        self.layer = None
+        self.source = None
+
+
+def burn_seeds_blocks(seed_reader, lake_reader, writer, remove_codes=(), nodata=SEED_NODATA,
+                      memory_mb=DEFAULT_MEMORY_MB):
+    """
+    Write the catseed raster with lake seeds burned in and removed codes set to NoData, one strip of rows at a time.
+    :param seed_reader: Reader for the NHDPlus catseed raster
+    :param lake_reader: Reader for the lake GridCodes on the same grid, e.g. a PolygonRasterizer
+    :param writer: Writer for the int32 output
+    :param remove_codes: Seed codes to remove, e.g. the GridCodes of closed-lake sinks
+    :param nodata: Output NoData value
+    :param float memory_mb: Memory budget used to choose the strip height
+    :return: The result of writer.close()
+    """
+    raster_blocks.check_same_grid(seed_reader, lake_reader, 'lake raster')
+    remove_lookup = code_lookup(remove_codes)
+    block_rows = raster_blocks.block_rows_for_budget(seed_reader.width, BYTES_PER_CELL, memory_mb)
+    for window in raster_blocks.windows(seed_reader.height, seed_reader.width, block_rows):
+        seeds = seed_reader.read(window)
+        lakes = lake_reader.read(window)
+        writer.write(window, burn_block(seeds, raster_blocks.nodata_mask(seeds, seed_reader.nodata),
+                                        lakes, raster_blocks.nodata_mask(lakes, lake_reader.nodata),
+                                        remove_lookup, nodata))
+    return writer.close()
+
+
+def burn_seeds(catseed_raster, lakes, out_raster, remove_codes=(), memory_mb=DEFAULT_MEMORY_MB):
+    """
+    Burn lake seeds into a copy of the catseed raster and remove unwanted seed codes.
+    :param str catseed_raster: NHDPlus HR catseed raster
+    :param lakes: Either a raster of lake GridCodes on the catseed grid, or an iterable of (GridCode, WKB polygon) in
+    the catseed coordinate system to be rasterized window by window (requires GDAL)
+    :param str out_raster: Output seed raster (GeoTIFF)
+    :param remove_codes: Seed codes to remove
+    :param float memory_mb: Memory budget used to choose the strip height
+    :return: out_raster
+    """
+    seed_reader = raster_blocks.open_raster(catseed_raster)
+    if isinstance(lakes, basestring):
+        lake_reader = raster_blocks.open_raster(lakes)
+    else:
+        lake_reader = PolygonRasterizer(seed_reader, lakes)
+    try:
+        nodata = seed_reader.nodata if seed_reader.nodata is not None else SEED_NODATA
+        writer = raster_blocks.create_raster(out_raster, seed_reader, np.int32, nodata)
+        return burn_seeds_blocks(seed_reader, lake_reader, writer, remove_codes, nodata, memory_mb)
+    finally:
+        seed_reader.close()
+        lake_reader.close()
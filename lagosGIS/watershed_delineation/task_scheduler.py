@@ -0,0 +1,264 @@
+# filename: task_scheduler.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT IN ArcGIS Toolbox)
+# purpose: Run a graph of geoprocessing tasks (e.g. the watersheds tools for many subregions) in parallel processes,
+# starting each task as soon as its inputs have been produced and the CPU, memory and license limits allow.
+
+import multiprocessing
+import traceback
+from collections import defaultdict
+from datetime import datetime as dt
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+WATCHDOG_SECONDS = 60  # how often to check for worker processes that died without reporting
+
+
+class Task:
+    """
+    One tool run, declared with the paths it reads and writes and the resources it needs while running.
+
+    :param str name: Unique task name, e.g. '0411 revise_hydrodem'
+    :param function: Module-level function to run (must be importable by the worker process)
+    :param args: Positional arguments for function
+    :param kwargs: Keyword arguments for function
+    :param inputs: Paths the task reads. Any task that outputs one of these paths must finish first.
+    :param outputs: Paths the task writes. If they all exist already, the task is skipped.
+    :param int cpus: Number of CPU slots used, e.g. the number of processes used by the raster engines
+    :param float memory_mb: Peak memory estimate
+    :param licenses: Names of license tokens held while running, e.g. ['Spatial']. A token with a count of 1 also
+    works as a lock on a shared dataset that the task modifies.
+    :param reads: Names of license tokens for shared datasets the task only reads. Any number of readers run at once,
+    but never while a task holds the token.
+    :param after: Names of other tasks that must finish first, for dependencies that are not through a path
+    """
+
+    def __init__(self, name, function, args=(), kwargs=None, inputs=(), outputs=(), cpus=1, memory_mb=1024,
+                 licenses=(), reads=(), after=()):
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.licenses = list(licenses)
+        self.reads = list(reads)
+        self.after = list(after)
+        self.status = 'waiting'
+        self.error = ''
+        self.start_time = None
+        self.end_time = None
+
+    def __repr__(self):
+        return "Task('{}', {})".format(self.name, self.status)
+
+
+def _run_task(queue, name, function, args, kwargs):
+    """Worker process entry point. Always reports back on the queue so the scheduler never waits on a lost task."""
+    try:
+        function(*args, **kwargs)
+        queue.put((name, ''))
+    except BaseException:
+        queue.put((name, traceback.format_exc()))
+
+
+class Scheduler:
+    """
+    Runs tasks in separate processes, each with its own in_memory workspace. Tasks start when every task producing
+    one of their inputs has succeeded and their resources fit in what remains free. The oldest ready task that does not
+    fit reserves its resources, so a large task is not starved by a stream of small ones. Dependent tasks are started
+    from the completion events of their predecessors rather than by polling for outputs.
+
+    :param int cpus: CPU slots available. Default is the number of CPUs on the machine.
+    :param float memory_mb: Memory available to the tasks
+    :param dict licenses: Number of available tokens for each license name, e.g. {'Spatial': 1}
+    :param exists: Function to test whether an output path exists, e.g. arcpy.Exists
+    """
+
+    def __init__(self, cpus=None, memory_mb=16384, licenses=None, exists=None):
+        self.cpus = cpus or multiprocessing.cpu_count()
+        self.memory_mb = memory_mb
+        self.licenses = dict(licenses or {})
+        self.exists = exists
+        self.tasks = []
+        self.task_index = {}
+        self.producers = {}
+
+    def add(self, task):
+        """
+        Add a task. Tasks are started in the order they were added whenever more than one is ready.
+        :param Task task: The task to add
+        :return: The task
+        """
+        if task.name in self.task_index:
+            raise ValueError("Task name {} is already used.".format(task.name))
+        for output in task.outputs:
+            if output in self.producers:
+                raise ValueError("Output {} is produced by both {} and {}.".format(
+                    output, self.producers[output].name, task.name))
+            self.producers[output] = task
+        for license in task.licenses + task.reads:
+            if self.licenses.get(license, 0) < max(1, task.licenses.count(license)):
+                raise ValueError("Task {} needs {} of license {}, which has {} tokens.".format(
+                    task.name, max(1, task.licenses.count(license)), license, self.licenses.get(license, 0)))
+        self.tasks.append(task)
+        self.task_index[task.name] = task
+        return task
+
+    def _predecessors(self):
+        predecessors = {}
+        for task in self.tasks:
+            names = set(self.producers[i].name for i in task.inputs if i in self.producers)
+            for name in task.after:
+                if name not in self.task_index:
+                    raise ValueError("Task {} runs after unknown task {}.".format(task.name, name))
+                names.add(name)
+            names.discard(task.name)
+            predecessors[task.name] = names
+        return predecessors
+
+    def _check_cycles(self, predecessors):
+        state = {}
+        for start in self.tasks:
+            stack = [(start.name, iter(predecessors[start.name]))]
+            if start.name in state:
+                continue
+            state[start.name] = 'visiting'
+            while stack:
+                name, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    state[name] = 'done'
+                    stack.pop()
+                elif state.get(child) == 'visiting':
+                    raise ValueError("Tasks {} and {} depend on each other.".format(name, child))
+                elif child not in state:
+                    state[child] = 'visiting'
+                    stack.append((child, iter(predecessors[child])))
+
+    def _fits(self, task, free_cpus, free_memory, free_licenses, readers):
+        # a task larger than the whole machine is allowed to run alone
+        cpus = min(task.cpus, self.cpus)
+        memory = min(task.memory_mb, self.memory_mb)
+        # a token holder waits for the readers to finish, and a reader waits until no token is held or reserved
+        return (cpus <= free_cpus and memory <= free_memory and
+                all(free_licenses[l] >= task.licenses.count(l) and not readers[l] for l in task.licenses) and
+                all(free_licenses[l] == self.licenses[l] for l in task.reads))
+
+    def run(self, verbose=True):
+        """
+        Run all tasks. A failed task is recorded and its dependents are skipped; other tasks continue.
+        :param bool verbose: Print a line when each task starts and finishes
+        :return: Dictionary of task name to Task, with status 'done', 'skipped', 'failed' or 'blocked'
+        """
+        predecessors = self._predecessors()
+        self._check_cycles(predecessors)
+        dependents = defaultdict(list)
+        for name, preds in predecessors.items():
+            for p in preds:
+                dependents[p].append(name)
+        remaining = {name: len(preds) for name, preds in predecessors.items()}
+        order = {task.name: i for i, task in enumerate(self.tasks)}
+
+        queue = multiprocessing.Queue()
+        ready = [t for t in self.tasks if remaining[t.name] == 0]
+        running = {}
+        free_cpus, free_memory, free_licenses = self.cpus, self.memory_mb, dict(self.licenses)
+        readers = defaultdict(int)
+
+        def finish(task, status, error=''):
+            task.status = status
+            task.error = error
+            if status in ('done', 'skipped'):
+                for name in dependents[task.name]:
+                    remaining[name] -= 1
+                    if remaining[name] == 0:
+                        ready.append(self.task_index[name])
+                ready.sort(key=lambda t: order[t.name])
+            else:
+                # everything downstream of a failure is blocked
+                stack = list(dependents[task.name])
+                while stack:
+                    blocked = self.task_index[stack.pop()]
+                    if blocked.status == 'waiting':
+                        blocked.status = 'blocked'
+                        blocked.error = 'Predecessor {} failed'.format(task.name)
+                        stack.extend(dependents[blocked.name])
+
+        while ready or running:
+            # ---SKIP TASKS WITH EXISTING OUTPUTS---------------------------------------------------------------------
+            skipped = True
+            while skipped and self.exists:
+                skipped = False
+                for task in list(ready):
+                    if task.outputs and all(self.exists(o) for o in task.outputs):
+                        ready.remove(task)
+                        finish(task, 'skipped')
+                        skipped = True
+                        if verbose:
+                            print('{} outputs exist, skipping'.format(task.name))
+
+            # ---START EVERYTHING THAT FITS--------------------------------------------------------------------------
+            reserved_cpus, reserved_memory, reserved_licenses = 0, 0, defaultdict(int)
+            for task in list(ready):
+                avail_licenses = {l: n - reserved_licenses[l] for l, n in free_licenses.items()}
+                if self._fits(task, free_cpus - reserved_cpus, free_memory - reserved_memory, avail_licenses, readers):
+                    ready.remove(task)
+                    free_cpus -= min(task.cpus, self.cpus)
+                    free_memory -= min(task.memory_mb, self.memory_mb)
+                    for l in task.licenses:
+                        free_licenses[l] -= 1
+                    for l in task.reads:
+                        readers[l] += 1
+                    task.status = 'running'
+                    task.start_time = dt.now()
+                    process = multiprocessing.Process(target=_run_task,
+                                                      args=(queue, task.name, task.function, task.args, task.kwargs))
+                    process.start()
+                    running[task.name] = process
+                    if verbose:
+                        print('{} started at {}'.format(task.name, task.start_time.strftime("%Y-%m-%d %H:%M:%S")))
+                elif not reserved_cpus:
+                    # the oldest task that does not fit holds its place
+                    reserved_cpus = min(task.cpus, self.cpus)
+                    reserved_memory = min(task.memory_mb, self.memory_mb)
+                    for l in task.licenses:
+                        reserved_licenses[l] += 1
+            if not running:
+                if ready:
+                    raise RuntimeError("Tasks {} can never start.".format(', '.join(t.name for t in ready)))
+                break
+
+            # ---WAIT FOR A COMPLETION EVENT------------------------------------------------------------------------
+            try:
+                name, error = queue.get(timeout=WATCHDOG_SECONDS)
+            except Empty:
+                # a worker that exits cleanly has always reported, so only a crashed worker can be lost
+                lost = [n for n, p in running.items() if p.exitcode not in (None, 0)]
+                if not lost:
+                    continue
+                name, error = lost[0], 'Worker process exited with code {}'.format(running[lost[0]].exitcode)
+            process = running.pop(name)
+            process.join()
+            task = self.task_index[name]
+            task.end_time = dt.now()
+            free_cpus += min(task.cpus, self.cpus)
+            free_memory += min(task.memory_mb, self.memory_mb)
+            for l in task.licenses:
+                free_licenses[l] += 1
+            for l in task.reads:
+                readers[l] -= 1
+            finish(task, 'failed' if error else 'done', error)
+            if verbose:
+                minutes = (task.end_time - task.start_time).total_seconds() / 60.0
+                print('{} {} in {:.1f} minutes'.format(task.name, 'FAILED' if error else 'finished', minutes))
+                if error:
+                    print(error)
+
+        return dict(self.task_index)
@@ -10,12 +10,13 @@ from datetime import datetime as dt
 from os import path
 import os
 import subprocess as sp
-from time import sleep
 from zipfile import ZipFile
 import arcpy
 
 import NHDNetwork
 from watershed_delineation import aggregate_watersheds, nhd_plus_watersheds_tools as nt
+from watershed_delineation import hydrodem_revision, seed_burning
+from watershed_delineation.task_scheduler import Scheduler, Task
 
 TOOL_ORDER = ('update_grid_codes', 'add_lake_seeds', 'revise_hydrodem', 'fel', 'fdr',
               'delineate_catchments', 'interlake', 'network')
@@ -42,6 +43,16 @@ arcpy.env.scratchWorkspace = r'D:\Continental_Limnology\Data_Working\Tool_Execut
 # your 7z path, probably the same
 SEVENZ = r'''"C:\Program Files\7-Zip\7z.exe"'''
 
+# tile size and processes for the raster engines (fill, flow direction, catchments), tune per machine
+RASTER_TILE_SIZE = 2048
+RASTER_PROCESSES = 8
+RASTER_MEMORY_MB = RASTER_PROCESSES * 1024 * (RASTER_TILE_SIZE / 2048.0) ** 2  # about 1GB per process at 2048
+
+# resources shared by the subregions running at once in schedule(), tune per machine
+MACHINE_CPUS = None  # all CPUs
+MACHINE_MEMORY_MB = 56 * 1024  # leave some of the 64GB for the OS
+VECTOR_MEMORY_MB = 4096  # estimate for the vector tools, e.g. aggregate_watersheds on a large subregion
+
 # ArcGIS map template path
 MXD="C:\Program Files (x86)\ArcGIS\Desktop10.3\MapTemplates\Standard Page Sizes\North American (ANSI) Page Sizes\Letter (ANSI A) Portrait.mxd"
 
@@ -203,43 +214,23 @@ def run(huc4, last_tool='network', wait = False, burn_override=False):
 
     # fill
     if not arcpy.Exists(paths.lagos_fel) and stop_index >= 3:
-        pit_start = dt.now()
-        arcpy.AddMessage(
-            'Pit Remove started at {}...'.format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
-        pitremove_cmd = 'mpiexec -n 8 pitremove -z {} -fel {}'.format(paths.lagos_burn, paths.lagos_fel)
-        print(pitremove_cmd)
-        sp.call(pitremove_cmd, stdout=sp.PIPE, stderr=sp.STDOUT)
+        nt.make_hydrodem(paths.lagos_burn, paths.lagos_fel, RASTER_TILE_SIZE, RASTER_PROCESSES)
         tool_count += 1
-        pit_diff = dt.now() - pit_start
-        arcpy.AddMessage('Pit Remove finished in {} seconds'.format(pit_diff.seconds))
 
     # fdr
     if not arcpy.Exists(paths.lagos_fdr) and stop_index >= 4:
-        arcpy.CheckOutExtension('Spatial')
-        arcpy.AddMessage('Flow direction started at {}...'.format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
-        arcpy.env.extent = paths.lagos_fel
-        flow_dir = arcpy.sa.FlowDirection(paths.lagos_fel)
-        # enforce same bounds as NHD fdr, so catchments have same HU4 boundary
-        flow_dir_clipped = arcpy.sa.Con(arcpy.sa.IsNull(paths.fdr), paths.fdr, flow_dir)
-        flow_dir_clipped.save(paths.lagos_fdr)
-        arcpy.CheckInExtension('Spatial')
+        nt.flow_direction(paths.lagos_fel, paths.fdr, paths.lagos_fdr, RASTER_TILE_SIZE, RASTER_PROCESSES)
         tool_count += 1
 
     # delineate_catchments
     if not arcpy.Exists(paths.local_catchments) and stop_index >= 5:
         arcpy.AddMessage('Delineating catchments started at {}...'.format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
-        nt.delineate_catchments(paths.lagos_fdr, paths.lagos_catseed, paths.gdb, paths.lagos_gridcode, paths.local_catchments)
+        nt.delineate_catchments(paths.lagos_fdr, paths.lagos_catseed, paths.gdb, paths.lagos_gridcode, paths.local_catchments,
+                                RASTER_TILE_SIZE, RASTER_PROCESSES)
         tool_count += 1
 
     # interlake watersheds
     if not arcpy.Exists(paths.iws_sheds) and stop_index >= 6:
-
-        # wait for predecessor to exist
-        # useful to split this step into 2nd process. in_memory objects won't interfere, should be safe
-        if wait:
-            cat_exists = arcpy.Exists(paths.local_catchments)
-            while not cat_exists:
-                sleep(10)
         arcpy.AddMessage(
             'Interlake watersheds started at {}...'.format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
         aggregate_watersheds.aggregate_watersheds(paths.local_catchments, paths.gdb, LAGOS_LAKES, paths.iws_sheds, 'interlake')
@@ -247,13 +238,6 @@ def run(huc4, last_tool='network', wait = False, burn_override=False):
 
     # network watersheds
     if not arcpy.Exists(paths.network_sheds) and stop_index >= 7:
-
-        # wait for predecessor to exist
-        # useful to split this step into 2nd process. in_memory objects won't interfere, should be safe
-        if wait:
-            cat_exists = arcpy.Exists(paths.local_catchments)
-            while not cat_exists:
-                sleep(10)
         arcpy.AddMessage(
             'Network watersheds started at {}...'.format(dt.now().strftime("%Y-%m-%d %H:%M:%S")))
         aggregate_watersheds.aggregate_watersheds(paths.local_catchments, paths.gdb, LAGOS_LAKES, paths.network_sheds, 'network')
@@ -264,6 +248,105 @@ def run(huc4, last_tool='network', wait = False, burn_override=False):
     return tool_count
 
 
+def prepare(huc4):
+    """Unzip the NHDPlus HR data for the subregion, if needed."""
+    paths = Paths(huc4)
+    if not paths.exist():
+        raise Exception("NHDPlus HR paths do not exist on local machine.")
+    if not path.exists(paths.catseed) or not path.exists(paths.gdb):
+        paths.unzip()
+
+
+def subregion_tasks(huc4, last_tool='network', burn_override=False):
+    """
+    Declare the tools for one subregion as tasks for the scheduler, with the paths each one reads and writes.
+    :param str huc4: 4-digit HUC4
+    :param str last_tool: The last tool in TOOL_ORDER to run
+    :param bool burn_override: Do not revise the hydrodem, use the existing lagos_burn raster
+    :return: List of Task
+    """
+    p = Paths(huc4)
+    stop_index = TOOL_ORDER.index(last_tool)
+    name = lambda tool: '{} {}'.format(huc4, tool)
+    tasks = [Task(name('prepare'), prepare, [huc4], outputs=[p.gdb, p.catseed, p.filldepth, p.hydrodem])]
+
+    if not arcpy.Exists(p.lagos_gridcode):
+        # every subregion updates the shared lakes layer, so they take turns, and no tool reads it meanwhile
+        tasks.append(Task(name('add_waterbody_nhdpid'), nt.add_waterbody_nhdpid, [p.waterbody, LAGOS_LAKES],
+                          inputs=[p.gdb], licenses=['LAGOS_LAKES']))
+        tasks.append(Task(name('update_grid_codes'), nt.update_grid_codes, [p.gdb, p.lagos_gridcode],
+                          inputs=[p.gdb], outputs=[p.lagos_gridcode], after=[name('add_waterbody_nhdpid')]))
+    if stop_index >= 1:
+        tasks.append(Task(name('add_lake_seeds'), nt.add_lake_seeds,
+                          [p.catseed, p.gdb, p.lagos_gridcode, LAGOS_LAKES, p.lagos_catseed],
+                          inputs=[p.catseed, p.gdb, p.lagos_gridcode], outputs=[p.lagos_catseed],
+                          memory_mb=seed_burning.DEFAULT_MEMORY_MB + 1024, reads=['LAGOS_LAKES']))
+    if stop_index >= 2 and not burn_override and not arcpy.Exists(p.network_sheds):
+        tasks.append(Task(name('revise_hydrodem'), nt.revise_hydrodem,
+                          [p.gdb, p.hydrodem, p.filldepth, p.lagos_catseed, p.lagos_burn],
+                          inputs=[p.gdb, p.hydrodem, p.filldepth, p.lagos_catseed], outputs=[p.lagos_burn],
+                          memory_mb=hydrodem_revision.DEFAULT_MEMORY_MB + 1024))
+    if stop_index >= 3:
+        tasks.append(Task(name('fel'), nt.make_hydrodem,
+                          [p.lagos_burn, p.lagos_fel, RASTER_TILE_SIZE, RASTER_PROCESSES],
+                          inputs=[p.lagos_burn], outputs=[p.lagos_fel],
+                          cpus=RASTER_PROCESSES, memory_mb=RASTER_MEMORY_MB))
+    if stop_index >= 4:
+        tasks.append(Task(name('fdr'), nt.flow_direction,
+                          [p.lagos_fel, p.fdr, p.lagos_fdr, RASTER_TILE_SIZE, RASTER_PROCESSES],
+                          inputs=[p.lagos_fel, p.fdr], outputs=[p.lagos_fdr],
+                          cpus=RASTER_PROCESSES, memory_mb=RASTER_MEMORY_MB))
+    if stop_index >= 5:
+        tasks.append(Task(name('delineate_catchments'), nt.delineate_catchments,
+                          [p.lagos_fdr, p.lagos_catseed, p.gdb, p.lagos_gridcode, p.local_catchments,
+                           RASTER_TILE_SIZE, RASTER_PROCESSES],
+                          inputs=[p.lagos_fdr, p.lagos_catseed, p.gdb, p.lagos_gridcode],
+                          outputs=[p.local_catchments], cpus=RASTER_PROCESSES, memory_mb=RASTER_MEMORY_MB))
+    for index, tool, out in ((6, 'interlake', p.iws_sheds), (7, 'network', p.network_sheds)):
+        if stop_index >= index:
+            tasks.append(Task(name(tool), aggregate_watersheds.aggregate_watersheds,
+                              [p.local_catchments, p.gdb, LAGOS_LAKES, out, tool],
+                              inputs=[p.local_catchments, p.gdb], outputs=[out], memory_mb=VECTOR_MEMORY_MB,
+                              reads=['LAGOS_LAKES']))
+    return tasks
+
+
+def schedule(huc4_list, last_tool='network', burn_override=False, cpus=MACHINE_CPUS, memory_mb=MACHINE_MEMORY_MB):
+    """
+    Run the watersheds tools for many subregions at once, keeping the machine busy within the CPU and memory limits.
+    Each tool starts as soon as the tools producing its inputs have finished. Subregions earlier in the list are
+    preferred when several tools are ready, so finished subregions come out steadily.
+    :param huc4_list: List of 4-digit HUC4s
+    :param str last_tool: The last tool in TOOL_ORDER to run
+    :param bool burn_override: Do not revise the hydrodem, use the existing lagos_burn raster
+    :param int cpus: CPU slots available, default is all CPUs
+    :param float memory_mb: Memory available to the tools
+    :return: Dictionary of task name to Task with status and error
+    """
+    scheduler = Scheduler(cpus, memory_mb, licenses={'LAGOS_LAKES': 1}, exists=arcpy.Exists)
+    for huc4 in huc4_list:
+        p = Paths(huc4)
+        if not path.exists(p.out_dir):
+            os.mkdir(p.out_dir)
+        if not path.exists(p.out_gdb):
+            arcpy.CreateFileGDB_management(path.dirname(p.out_gdb), path.basename(p.out_gdb))
+        for task in subregion_tasks(huc4, last_tool, burn_override):
+            scheduler.add(task)
+
+    results = scheduler.run()
+    for huc4 in huc4_list:
+        p = Paths(huc4)
+        tasks = [t for t in results.values() if t.name.startswith(huc4 + ' ')]
+        errors = ['{}: {}'.format(t.name, t.error.strip().splitlines()[-1]) for t in tasks if t.error]
+        ran = [t for t in tasks if t.end_time]
+        minutes = sum((t.end_time - t.start_time).total_seconds() for t in ran) / 60
+        if errors:
+            p.log(LOG_FILE, '; '.join(errors), minutes)
+        elif ran:
+            p.log(LOG_FILE, '{}: SUCCESS'.format(last_tool), minutes)
+    return results
+
+
 def make_run_list(master_HU4):
     """Make a run list that will output one huc4 from most regions first, for QA purposes."""
     regions = ['{:02d}'.format(i) for i in range(1,19)]
@@ -288,20 +371,7 @@ if __name__ == '__main__':
     run_list.sort()
     run_list.remove('0415')
 
-    for huc4 in run_list:
-        p = Paths(huc4)
-        try:
-            last_tool = 'network'
-            start_time = dt.now()
-            tool_count = run(p.huc4, last_tool, burn_override=True)
-            time_diff = dt.now() - start_time
-            if tool_count > 0:
-                p.log(LOG_FILE, '{}: SUCCESS'.format(last_tool), time_diff.seconds/60)
-        except Exception as e:
-            p.log(LOG_FILE, repr(e))
-            print(e)
-        finally:
-            arcpy.Delete_management('in_memory')
+    schedule(run_list, 'network', burn_override=True)
 
 def patch_on_network_flag():
     """Patch implemented on Apr 17 to allow more outlets per subregion, if several large networks appear."""
@@ -4,10 +4,10 @@
 # LAGOS module(s): GEO
 # tool type: re-usable (ArcGIS Toolbox)
 
-import csv
-import os
 import arcpy
+import data_access
 import lagosGIS
+import metric_catalog
 
 
 def summarize(zone_fc, zone_field, class_fc, out_table, class_field, rename_tag=''):
@@ -24,24 +24,18 @@ def summarize(zone_fc, zone_field, class_fc, out_table, class_field, rename_tag=
 
     def rename_to_standard(table, numeric=False):
         """
-        Rename columns in the table according to the LAGOS-US variable taxonomy using name mappings stored in a
-        CSV file in this module.
+        Rename columns in the table according to the LAGOS-US variable taxonomy using the name mappings in
+        geo_metric_provenance.csv (see metric_catalog).
         :param table: Table dataset for which to rename columns
         :param numeric: (Optional) Default False. Whether the class field uses has numeric value type. Output column
         names will be preceded by the class field name if this parameter is True.
         :return: Table dataset location
         """
         # look up the values based on the rename tag
-        this_files_dir = os.path.dirname(os.path.abspath(__file__))
-        os.chdir(this_files_dir)
-        geo_file = os.path.abspath('../geo_metric_provenance.csv')
-        with open(geo_file) as csv_file:
-            reader = csv.DictReader(csv_file)
-            mapping = {row['subgroup_original_code']: row['subgroup']
-                       for row in reader if row['main_feature'] in rename_tag and row['main_feature']}
-            if numeric:
-                mapping = {'{}{}'.format(class_field, k):v for k, v in mapping.items()}
-            arcpy.AddMessage('Renaming fields: {}'.format(mapping))
+        mapping = metric_catalog.load().subgroup_mapping(rename_tag)
+        if numeric:
+            mapping = {'{}{}'.format(class_field, k):v for k, v in mapping.items()}
+        arcpy.AddMessage('Renaming fields: {}'.format(mapping))
 
         # update them
         for old, new in mapping.items():
@@ -60,13 +54,10 @@ def summarize(zone_fc, zone_field, class_fc, out_table, class_field, rename_tag=
     tab = arcpy.TabulateIntersection_analysis(zone_fc, zone_field, class_fc, 'tab', class_field, xy_tolerance='0.001 Meters')
 
     # Guard against all numeric values--can't pivot when that is the case
-    vals = [r[0] for r in arcpy.da.SearchCursor(tab, class_field)]
+    vals = [r[0] for r in data_access.read_rows(tab, [class_field])]
     all_numeric = all([str.isdigit(str(v)) for v in vals])
     if all_numeric:
-        with arcpy.da.UpdateCursor(tab, class_field) as cursor:
-            for row in cursor:
-                row[0] = '{}{}'.format(class_field, row[0])
-                cursor.updateRow(row)
+        data_access.update_rows(tab, [class_field], lambda row: ['{}{}'.format(class_field, row[0])])
     pivot = arcpy.PivotTable_management(tab, zone_field, class_field, "PERCENTAGE", 'pivot')
 
     # Rename variables to fit LAGOS naming standard
@@ -75,10 +66,7 @@ def summarize(zone_fc, zone_field, class_fc, out_table, class_field, rename_tag=
     # Refine output table to ensure output row for every input row and enforce maximum value of 100%
     all_zones = lagosGIS.one_in_one_out(renamed, zone_fc, zone_field, 'all_zones')
     new_fields = [f.name for f in arcpy.ListFields(all_zones) if f.name <> zone_field and f.type not in ('OID', 'Geometry')]
-    with arcpy.da.UpdateCursor(all_zones, new_fields) as cursor:
-        for row in cursor:
-            row = [min(val, 100) if val else 0 for val in row]
-            cursor.updateRow(row)
+    data_access.update_rows(all_zones, new_fields, lambda row: [min(val, 100) if val else 0 for val in row])
 
     arcpy.CopyRows_management(all_zones, out_table)
     for item in [tab, pivot, renamed]:
@@ -4,7 +4,6 @@
 # LAGOS module(s): GEO
 # tool type: re-usable (ArcGIS Toolbox)
 
-import csv
 import os
 import arcpy
 from arcpy import management as DM
@@ -12,6 +11,10 @@ from arcpy import env
 from collections import defaultdict
 
 import lagosGIS
+import data_access
+import metric_catalog
+
+COMMON_GRID = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common_grid.tif')
 
 
 def calc(zone_fc, zone_field, in_value_raster, out_table, is_thematic, unflat_table='',
@@ -94,11 +97,8 @@ def calc(zone_fc, zone_field, in_value_raster, out_table, is_thematic, unflat_ta
         # Set up environments for alignment between zone raster and theme raster
         if isinstance(zone_fc, arcpy.Result):
             zone_fc = zone_fc.getOutput(0)
-        this_files_dir = os.path.dirname(os.path.abspath(__file__))
-        os.chdir(this_files_dir)
-        common_grid = os.path.abspath('../common_grid.tif')
-        env.snapRaster = common_grid
-        env.cellSize = common_grid
+        env.snapRaster = COMMON_GRID
+        env.cellSize = COMMON_GRID
         env.extent = zone_fc
 
         # Convert zones to raster if provided as polygon feature class
@@ -170,9 +170,9 @@ def calc(zone_fc, zone_field, in_value_raster, out_table, is_thematic, unflat_ta
 
         # calculate datacoveragepct by comparing to original areas in zone raster
         # alternative to using JoinField, which is prohibitively slow if zones exceed hu12 count
-        zone_raster_dict = {row[0]: row[1] for row in arcpy.da.SearchCursor(zone_raster, [zone_field, 'Count'])}
+        zone_raster_dict = {row[0]: row[1] for row in data_access.read_rows(zone_raster, [zone_field, 'Count'])}
         temp_entire_table_dict = {row[0]: row[1] for row in
-                                  arcpy.da.SearchCursor(temp_entire_table, [zone_field, 'COUNT'])}
+                                  data_access.read_rows(temp_entire_table, [zone_field, 'COUNT'])}
 
         sum_cell_area = float(env.cellSize) * float(env.cellSize)
         orig_cell_area = zone_size * zone_size
@@ -254,10 +254,9 @@ def calc(zone_fc, zone_field, in_value_raster, out_table, is_thematic, unflat_ta
 
         # ---FIND ORIGINAL VS FLAT ZONE MAPPING-----------------------------------------------------------------
         original_flat = defaultdict(list)
-        with arcpy.da.SearchCursor(unflat_table, [unflat_zoneid, flat_zoneid]) as cursor:
-            for row in cursor:
-                if row[1] not in original_flat[row[0]]:
-                    original_flat[row[0]].append(row[1])
+        for row in data_access.read_rows(unflat_table, [unflat_zoneid, flat_zoneid]):
+            if row[1] not in original_flat[row[0]]:
+                original_flat[row[0]].append(row[1])
 
         # ---DO THE CALCULATION----------------------------------------------------------------------------------
         # Use CELL_COUNT as weight for means to calculate final values for each zone.
@@ -265,7 +264,7 @@ def calc(zone_fc, zone_field, in_value_raster, out_table, is_thematic, unflat_ta
         other_field_names = [f.name for f in editable_fields if f.name not in fixed_fields]
         i_cursor = arcpy.da.InsertCursor(unflat_result, fixed_fields + other_field_names)  # open output table cursor
         # read component stats
-        flat_stats = {r[0]: r[1:] for r in arcpy.da.SearchCursor(
+        flat_stats = {r[0]: r[1:] for r in data_access.read_rows(
             intermediate_table, [flat_zoneid, 'ORIGINAL_COUNT', 'CELL_COUNT', 'datacoveragepct'] + other_field_names)}
 
         count_diff = 0
@@ -336,12 +335,8 @@ def calc(zone_fc, zone_field, in_value_raster, out_table, is_thematic, unflat_ta
 
         else:
             # look up the values based on the rename tag
-            geo_file = os.path.abspath('../geo_metric_provenance.csv')
-            with open(geo_file) as csv_file:
-                reader = csv.DictReader(csv_file)
-                mapping = {row['subgroup_original_code']: row['subgroup']
-                           for row in reader if row['main_feature'] and row['main_feature'] in rename_tag}
-                print(mapping)
+            mapping = metric_catalog.load().subgroup_mapping(rename_tag)
+            print(mapping)
 
             # update them
             for old, new in mapping.items():
@@ -0,0 +1,177 @@
+# filename: zone_attribution.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+# purpose: Assign the zone that contains each point (or the closest zone, for points outside all zones) for many zone
+# layers at once, with one spatial index and one query per layer, in place of two spatial joins and an update cursor
+# pass per layer. Requires shapely.
+
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+
+import data_access
+
+
+# ---ASSIGNMENT---------------------------------------------------------------------------------------------------------
+def _first_per_point(point_index, zone_index, count):
+    """
+    Keep the lowest zone index for each point, like the first match of a one-to-one spatial join.
+    :return: Array of zone index per point, -1 where there was no match
+    """
+    result = np.full(count, -1, dtype=np.int64)
+    if len(point_index):
+        order = np.lexsort((zone_index, point_index))
+        points, first = np.unique(np.asarray(point_index)[order], return_index=True)
+        result[points] = np.asarray(zone_index)[order][first]
+    return result
+
+
+def _assign_vectorized(xy, wkbs):
+    """Point-in-polygon and nearest-polygon queries for all points at once, with the shapely 2 array API."""
+    import shapely
+    from shapely.strtree import STRtree
+    zones = shapely.from_wkb(wkbs)
+    tree = STRtree(zones)
+    points = shapely.points(xy)
+    point_index, zone_index = tree.query(points, predicate='intersects')
+    result = _first_per_point(point_index, zone_index, len(xy))
+    missing = np.flatnonzero(result < 0)
+    if len(missing):
+        point_index, zone_index = tree.query_nearest(points[missing])
+        result[missing] = _first_per_point(point_index, zone_index, len(missing))
+    return result
+
+
+def _assign_loop(xy, wkbs):
+    """The same queries one point at a time, for shapely 1.x."""
+    from shapely import wkb as shapely_wkb
+    from shapely.geometry import Point
+    from shapely.prepared import prep
+    from shapely.strtree import STRtree
+    zones = [shapely_wkb.loads(bytes(w)) for w in wkbs]
+    index_of = {id(zone): i for i, zone in enumerate(zones)}
+    prepared = [prep(zone) for zone in zones]
+    tree = STRtree(zones)
+
+    def index(found):
+        # shapely 1.x returns the geometries themselves, later versions return indices
+        return int(found) if isinstance(found, (int, np.integer)) else index_of[id(found)]
+
+    result = np.full(len(xy), -1, dtype=np.int64)
+    for p, (x, y) in enumerate(xy):
+        point = Point(x, y)
+        for i in sorted(index(zone) for zone in tree.query(point)):
+            if prepared[i].intersects(point):
+                result[p] = i
+                break
+        else:
+            result[p] = index(tree.nearest(point))
+    return result
+
+
+def assign_zones(xy, wkbs):
+    """
+    Find the zone containing each point. Points on a shared edge get the first zone in zone order, and points outside
+    every zone get the closest zone.
+    :param xy: (n, 2) array of point coordinates, NaN for points without geometry
+    :param wkbs: List of zone polygon WKB, in the same coordinate system as the points
+    :return: Array of zone index per point, -1 for points without geometry or if there are no zones
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    result = np.full(len(xy), -1, dtype=np.int64)
+    valid = ~np.isnan(xy).any(axis=1)
+    if not len(wkbs) or not valid.any():
+        return result
+    try:
+        import shapely
+        vectorized = hasattr(shapely, 'from_wkb')
+    except ImportError:
+        vectorized = False
+    if vectorized:
+        result[valid] = _assign_vectorized(xy[valid], [bytes(w) for w in wkbs])
+    else:
+        result[valid] = _assign_loop(xy[valid], wkbs)
+    return result
+
+
+def zone_values(points_path, zone_fc, zone_field):
+    """
+    Assign the values of zone_field to the points saved in points_path.
+    :param str points_path: .npy file of the (n, 2) point coordinates
+    :param str zone_fc: Zone polygon feature class
+    :param str zone_field: Field with the value to assign, e.g. 'hu12_zoneid'
+    :return: List of values per point
+    """
+    xy = np.load(points_path)
+    values, wkbs = [], []
+    for value, wkb in data_access.read_rows(zone_fc, [zone_field, 'SHAPE@WKB']):
+        if wkb is not None:
+            values.append(value)
+            wkbs.append(wkb)
+    return [values[i] if i >= 0 else None for i in assign_zones(xy, wkbs)]
+
+
+def _zone_values_worker(args):
+    return zone_values(*args)
+
+
+# ---ATTRIBUTION--------------------------------------------------------------------------------------------------------
+def attribute_points(points_fc, zone_layers, id_field, processes=1):
+    """
+    Assign zone values to every point for several zone layers, reading the points once and querying each zone layer
+    once. Zone layers are split across processes.
+    :param str points_fc: Point feature class, in the projection of the zone layers
+    :param zone_layers: List of (zone feature class, zone value field) pairs
+    :param str id_field: Unique identifier field of the points, e.g. 'lagoslakeid'
+    :param int processes: Number of worker processes
+    :return: Tuple of (list of point ids, dictionary of zone value field to list of values in point order)
+    """
+    ids, xy = [], []
+    for point_id, point_xy in data_access.read_rows(points_fc, [id_field, 'SHAPE@XY']):
+        ids.append(point_id)
+        xy.append(point_xy if point_xy is not None else (np.nan, np.nan))
+
+    work_dir = tempfile.mkdtemp(prefix='zone_attribution_')
+    try:
+        points_path = os.path.join(work_dir, 'points.npy')
+        np.save(points_path, np.array(xy, dtype=np.float64).reshape(-1, 2))
+        tasks = [(points_path, zone_fc, zone_field) for zone_fc, zone_field in zone_layers]
+        if processes > 1 and len(tasks) > 1:
+            pool = Pool(min(processes, len(tasks)))
+            try:
+                results = pool.map(_zone_values_worker, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [zone_values(*task) for task in tasks]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return ids, {zone_field: values for (zone_fc, zone_field), values in zip(zone_layers, results)}
+
+
+def write_attributes(fc, id_field, ids, attributes, field_length=20):
+    """
+    Write the attribute_points results to a feature class in one update pass, adding any missing text fields.
+    :param str fc: Feature class with id_field, e.g. the lake points or the lake polygons
+    :param str id_field: Identifier field matching the ids
+    :param ids: List of point ids from attribute_points
+    :param dict attributes: Dictionary of field to list of values from attribute_points
+    :param int field_length: Length for new text fields
+    :return: Number of rows updated
+    """
+    fields = sorted(attributes)
+    data_access.add_fields(fc, [(f, ('TEXT', field_length)) for f in fields])
+    rows = {point_id: [attributes[f][i] for f in fields] for i, point_id in enumerate(ids)}
+
+    def update(row):
+        if row[0] not in rows:
+            return None
+        return [row[0]] + rows[row[0]]
+
+    return data_access.update_rows(fc, [id_field] + fields, update)
@@ -0,0 +1,127 @@
+# filename: test_bulk_merge.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import json
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import bulk_merge
+import data_access
+
+
+def test_bare_output_name_is_created_in_the_workspace():
+    workspace = os.path.join('D:', 'scratch.gdb')
+    assert bulk_merge.output_location('LAGOS_outlets', workspace) == (workspace, 'LAGOS_outlets')
+    assert bulk_merge.output_location('in_memory/merged', workspace) == ('in_memory', 'merged')
+    assert bulk_merge.output_location(os.path.join('out.gdb', 'merged'), workspace) == ('out.gdb', 'merged')
+
+
+def test_bare_output_name_without_workspace_raises():
+    with pytest.raises(ValueError):
+        bulk_merge.output_location('outputs_merged', None)
+
+
+def test_harmonize_schema(monkeypatch):
+    fields = {'a': [data_access.Field('OBJECTID', 'OID', 4), data_access.Field('Permanent_Identifier', 'String', 40),
+                    data_access.Field('AreaSqKm', 'Double', 8), data_access.Field('Shape_Area', 'Double', 8)],
+              'b': [data_access.Field('PERMANENT_IDENTIFIER', 'String', 80), data_access.Field('FCode', 'Integer', 4)]}
+    monkeypatch.setattr(data_access, 'list_fields', lambda source: fields[source])
+    schema, source_fields = bulk_merge.harmonize_schema(['a', 'b'], {'fcode': 10, 'AreaSqKm': 10})
+    assert schema == [('Permanent_Identifier', ('TEXT', 80)), ('AreaSqKm', ('DOUBLE', None)),
+                      ('FCode', ('LONG', None))]
+    assert source_fields['b'] == [('PERMANENT_IDENTIFIER', 'Permanent_Identifier'), ('FCode', 'FCode')]
+
+    schema, source_fields = bulk_merge.harmonize_schema(['a'], {'permanent_identifier': 255})
+    assert schema[0] == ('Permanent_Identifier', ('TEXT', 255))
+
+
+def test_filter_batch_keeps_listed_values():
+    batch = {'Permanent_Identifier': np.array(['a', 'b', 'c'], dtype=object), 'x': np.arange(3)}
+    kept = bulk_merge._filter_batch(batch, ('permanent_identifier', {'a', 'c'}))
+    assert kept['x'].tolist() == [0, 2]
+    assert bulk_merge._filter_batch(batch, None) is batch
+
+
+class _Shape(object):
+    """Stands in for an arcpy Polyline with Z and M values and a true curve."""
+
+    def __init__(self, json_text):
+        self.JSON = json_text
+
+    def vertices(self):
+        return json.loads(self.JSON)['curvePaths'][0]
+
+
+def _fake_arcpy(calls):
+    class Extent(object):
+        XMin, YMin, XMax, YMax = 0, 0, 10, 10
+
+    class Description(object):
+        dataType = 'FeatureClass'
+        shapeType = 'Polyline'
+        hasM = hasZ = True
+        extent = Extent()
+        spatialReference = type('SpatialReference', (object,), {'exportToString': lambda self: 'albers'})()
+        catalogPath = 'merged'
+
+    arcpy = types.ModuleType('arcpy')
+    arcpy.env = type('env', (object,), {'workspace': 'D:/out.gdb'})
+    arcpy.ExecuteError = RuntimeError
+    arcpy.Describe = lambda path: Description()
+    arcpy.Exists = lambda path: False
+    arcpy.AsShape = lambda json_text, esri_json: _Shape(json_text)
+    for tool in ('CreateFeatureclass_management', 'AddIndex_management', 'AddSpatialIndex_management'):
+        setattr(arcpy, tool, lambda *args, **kwargs: calls.append((args, kwargs)))
+    return arcpy
+
+
+FLOWLINE = json.dumps({'hasZ': True, 'hasM': True,
+                       'curvePaths': [[[0, 0, 250.5, 0], {'c': [[10, 0, 249.0, 12.5], [5, 3]]}]]})
+
+
+def test_merge_copies_native_geometry_with_z_and_m(monkeypatch):
+    calls, inserted, read = [], [], []
+    monkeypatch.setitem(sys.modules, 'arcpy', _fake_arcpy(calls))
+    monkeypatch.setattr(data_access, 'get_backend', lambda name=None: data_access.ArcpyBackend.__new__(
+        data_access.ArcpyBackend))
+    monkeypatch.setattr(data_access, 'list_fields',
+                        lambda source: [data_access.Field('Permanent_Identifier', 'String', 40)])
+    monkeypatch.setattr(data_access, 'add_fields', lambda table, fields: None)
+
+    def read_batches(source, fields, where_clause=None, batch_size=None):
+        read.append(fields)
+        yield {'Permanent_Identifier': np.array([source], dtype=object),
+               data_access.GEOMETRY_TOKEN: np.array([_Shape(FLOWLINE)], dtype=object)}
+
+    monkeypatch.setattr(data_access, 'read_batches', read_batches)
+    monkeypatch.setattr(data_access, 'insert_rows', lambda table, fields, rows: inserted.append((fields, list(rows))))
+    assert bulk_merge.merge(['a', 'b'], 'merged') == {'a': 1, 'b': 1}
+
+    assert calls[0][1]['has_m'] == 'ENABLED' and calls[0][1]['has_z'] == 'ENABLED'
+    assert read == [['Permanent_Identifier', data_access.GEOMETRY_TOKEN]] * 2
+    [(fields, rows)] = inserted
+    assert fields == ['Permanent_Identifier', data_access.GEOMETRY_TOKEN]
+    for row in rows:
+        assert row[1].vertices() == [[0, 0, 250.5, 0], {'c': [[10, 0, 249.0, 12.5], [5, 3]]}]
+
+    # batches passed between reader processes keep the curves, Z and M
+    batch = {data_access.GEOMETRY_TOKEN: np.array([_Shape(FLOWLINE), None], dtype=object)}
+    unpacked = bulk_merge._unpack(bulk_merge._pack(batch))[data_access.GEOMETRY_TOKEN]
+    assert unpacked[0].vertices() == _Shape(FLOWLINE).vertices() and unpacked[1] is None
+
+
+def test_geometry_token_depends_on_backend(monkeypatch):
+    monkeypatch.setattr(data_access, 'get_backend', lambda name=None: data_access.OGRBackend.__new__(
+        data_access.OGRBackend))
+    assert bulk_merge.geometry_token() == data_access.WKB_TOKEN
+    monkeypatch.setattr(data_access, 'get_backend', lambda name=None: data_access.ArcpyBackend.__new__(
+        data_access.ArcpyBackend))
+    assert bulk_merge.geometry_token() == data_access.GEOMETRY_TOKEN
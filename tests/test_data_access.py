@@ -0,0 +1,150 @@
+# filename: test_data_access.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): all
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+
+ALBERS = 5070  # NAD83 Conus Albers: origin at 96 W, 23 N
+NAD83 = 4269
+
+
+def _point(x, y):
+    return struct.pack('<BIdd', 1, 1, x, y)
+
+
+# ---SHARED UTILITIES-----
+def test_rows_to_batch_and_back():
+    fields = ['id', 'name', 'area', data_access.WKB_TOKEN]
+    rows = [(1, 'a', 1.5, _point(0, 0)), (2, None, 2.5, None)]
+    batch = data_access.rows_to_batch(fields, rows)
+    assert batch['id'].dtype.kind == 'i'
+    assert batch['area'].dtype.kind == 'f'
+    assert batch['name'].dtype == object and batch[data_access.WKB_TOKEN].dtype == object
+    assert list(data_access.batch_to_rows(fields, batch)) == rows
+    assert list(data_access.batch_to_rows(['area', 'id'], batch)) == [(1.5, 1), (2.5, 2)]
+    empty = data_access.rows_to_batch(fields, [])
+    assert sorted(empty) == sorted(fields) and all(len(v) == 0 for v in empty.values())
+
+
+def test_text_columns_are_object_arrays():
+    batch = data_access.rows_to_batch(['name'], [('a',), ('bcd',)])
+    assert batch['name'].dtype == object
+    assert data_access.infer_field_type(batch['name']) == ('TEXT', 50)
+
+
+def test_infer_field_type():
+    assert data_access.infer_field_type(np.array([1.0])) == ('DOUBLE', None)
+    assert data_access.infer_field_type(np.array([1], dtype=np.int16)) == ('SHORT', None)
+    assert data_access.infer_field_type(np.array([1], dtype=np.int64)) == ('LONG', None)
+    assert data_access.infer_field_type(np.array([1, None], dtype=object)) == ('LONG', None)
+    assert data_access.infer_field_type(np.array([1.5, None], dtype=object)) == ('DOUBLE', None)
+    assert data_access.infer_field_type(np.array(['x' * 80, None], dtype=object)) == ('TEXT', 80)
+
+
+def test_split_path():
+    assert data_access.split_path(r'D:\NHD.gdb\Hydrography\NHDFlowline') == ('D:/NHD.gdb', 'NHDFlowline')
+    assert data_access.split_path('/data/zones.gpkg/hu12') == ('/data/zones.gpkg', 'hu12')
+    assert data_access.split_path('/data/lakes.shp') == ('/data/lakes.shp', None)
+
+
+def test_unknown_backend(monkeypatch):
+    monkeypatch.setenv(data_access.BACKEND_ENV, 'postgis')
+    with pytest.raises(ValueError):
+        data_access.get_backend()
+
+
+def test_write_batches_to_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    out_path = str(tmp_path / 'lakes.parquet')
+    batches = [data_access.rows_to_batch(['id', data_access.WKB_TOKEN], [(1, _point(0, 0)), (2, None)]),
+               data_access.rows_to_batch(['id', data_access.WKB_TOKEN], [(3, _point(1, 2))])]
+    assert data_access.write_batches(out_path, batches, ['id', data_access.WKB_TOKEN]) == out_path
+    table = pq.read_table(out_path)
+    assert table.column_names == ['id', 'geometry']
+    assert table.column('id').to_pylist() == [1, 2, 3]
+    assert table.column('geometry').to_pylist() == [_point(0, 0), None, _point(1, 2)]
+
+
+# ---OGR BACKEND-----
+@pytest.fixture
+def gpkg(tmp_path):
+    """GeoPackage with a point layer in Albers: the origin, a point 1000 km to the north-east, and a null shape."""
+    pytest.importorskip('osgeo.ogr')
+    path = str(tmp_path / 'test.gpkg') + '/sites'
+    fields = ['site_id', 'name', 'depth', data_access.WKB_TOKEN]
+    rows = [(1, 'origin', 2.5, _point(0, 0)), (2, 'far', None, _point(1e6, 1e6)), (3, None, 4.0, None)]
+    data_access.write_batches(path, [data_access.rows_to_batch(fields, rows[:2]),
+                                     data_access.rows_to_batch(fields, rows[2:])],
+                              fields, 'POINT', ALBERS, backend='ogr')
+    return path
+
+
+def test_ogr_round_trip(gpkg):
+    fields = data_access.list_fields(gpkg, backend='ogr')
+    assert [f.type for f in fields[:2]] == ['OID', 'Geometry']
+    assert [(f.name, f.type) for f in fields[2:]] == [('site_id', 'Integer'), ('name', 'String'), ('depth', 'Double')]
+    rows = list(data_access.read_rows(gpkg, ['site_id', 'name', 'depth', data_access.XY_TOKEN], backend='ogr'))
+    assert rows == [(1, 'origin', 2.5, (0.0, 0.0)), (2, 'far', None, (1e6, 1e6)), (3, None, 4.0, None)]
+    assert list(data_access.read_rows(gpkg, ['site_id'], 'depth > 3', backend='ogr')) == [(3,)]
+    assert data_access.exists(gpkg, backend='ogr')
+    assert not data_access.exists(gpkg + '_missing', backend='ogr')
+
+
+def test_ogr_projects_geometry_tokens(gpkg):
+    for spatial_reference in (NAD83, data_access.get_backend('ogr')._srs(NAD83).ExportToWkt()):
+        rows = list(data_access.read_rows(gpkg, ['site_id', data_access.XY_TOKEN], backend='ogr',
+                                          spatial_reference=spatial_reference))
+        assert np.allclose(rows[0][1], (-96.0, 23.0))
+        assert rows[1][1][0] > -96 and rows[1][1][1] > 23
+        assert rows[2][1] is None
+
+
+def test_ogr_extent(gpkg):
+    read = lambda **kwargs: [r[0] for r in data_access.read_rows(gpkg, ['site_id'], backend='ogr', **kwargs)]
+    assert read(extent=(-10, -10, 10, 10)) == [1]
+    assert read(extent=(5e5, 5e5, 2e6, 2e6)) == [2]
+    # the extent is in the output coordinate system
+    assert read(extent=(-96.5, 22.5, -95.5, 23.5), spatial_reference=NAD83) == [1]
+    assert read(extent=(-80.5, 22.5, -79.5, 23.5), spatial_reference=NAD83) == []
+
+
+def test_ogr_arrow_and_row_batches_agree(gpkg):
+    # OID@ is not in the Arrow stream, so asking for it reads feature by feature
+    for fields in (['site_id', 'depth'], ['site_id', 'depth', data_access.OID_TOKEN]):
+        batches = list(data_access.read_batches(gpkg, fields, batch_size=2, backend='ogr'))
+        assert [len(b['site_id']) for b in batches] == [2, 1]
+        site_ids = np.concatenate([b['site_id'] for b in batches])
+        depths = np.concatenate([np.asarray(b['depth'], dtype=np.float64) for b in batches])
+        assert site_ids.tolist() == [1, 2, 3]
+        assert depths[[0, 2]].tolist() == [2.5, 4.0]
+    batch = next(data_access.read_batches(gpkg, [data_access.WKB_TOKEN], backend='ogr'))
+    assert [bytes(v) if v is not None else None for v in batch[data_access.WKB_TOKEN]][:2] == [_point(0, 0),
+                                                                                               _point(1e6, 1e6)]
+
+
+def test_ogr_add_fields_skips_existing(gpkg):
+    added = data_access.add_fields(gpkg, [('NAME', ('TEXT', 20)), ('zoneid', ('TEXT', 20)), ('pct', ('DOUBLE', None))],
+                                   backend='ogr')
+    assert added == ['zoneid', 'pct']
+    assert [f.name for f in data_access.list_fields(gpkg, backend='ogr')][2:] == ['site_id', 'name', 'depth', 'zoneid',
+                                                                                 'pct']
+    assert data_access.add_fields(gpkg, [('zoneid', ('TEXT', 20))], backend='ogr') == []
+
+
+def test_ogr_update_and_insert(gpkg):
+    count = data_access.update_rows(gpkg, ['site_id', 'name'], lambda row: [row[0], 'site {}'.format(row[0])],
+                                    'site_id < 3', backend='ogr')
+    assert count == 2
+    data_access.insert_rows(gpkg, ['site_id', data_access.XY_TOKEN], [(4, (5.0, 6.0))], backend='ogr')
+    rows = list(data_access.read_rows(gpkg, ['site_id', 'name', data_access.XY_TOKEN], backend='ogr'))
+    assert rows == [(1, 'site 1', (0.0, 0.0)), (2, 'site 2', (1e6, 1e6)), (3, None, None), (4, None, (5.0, 6.0))]
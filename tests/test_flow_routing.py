@@ -0,0 +1,202 @@
+# filename: test_flow_routing.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+from collections import deque
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS', 'watershed_delineation')))
+import flow_routing
+import priority_flood
+import raster_blocks
+
+
+def _flow_direction(dem, tile_size, nodata=-9999):
+    reader = raster_blocks.ArrayReader(dem, nodata)
+    writer = raster_blocks.ArrayWriter(reader, np.uint8, flow_routing.FDR_NODATA)
+    return flow_routing.flow_direction_blocks(reader, writer, tile_size=tile_size)
+
+
+def _filled_dem(seed, height=30, width=40):
+    rng = np.random.RandomState(seed)
+    # few distinct elevations, so the filled DEM has large flats that cross the tile seams
+    dem = np.round(rng.rand(height, width) * 3).astype(np.float64)
+    dem[rng.rand(height, width) < 0.03] = -9999
+    filled = priority_flood.fill_array(dem, -9999)
+    return np.where(filled == np.float32(priority_flood.OUTPUT_NODATA), -9999, filled).astype(np.float64)
+
+
+def _downstream(codes, row, col):
+    dr, dc = flow_routing.OFFSETS[codes[row, col]]
+    return row + dr, col + dc
+
+
+def _reference_flow_direction(dem, nodata=-9999):
+    """
+    Cell-by-cell D8: the first steepest downhill neighbor in CODES order, else the first neighbor off the raster or in
+    NoData. Flat cells drain one step closer to the nearest draining cell of the same elevation, through the neighbor
+    whose direction back to the flat cell comes first in CODES order.
+    """
+    height, width = dem.shape
+    inside = lambda r, c: 0 <= r < height and 0 <= c < width
+    is_data = lambda r, c: inside(r, c) and dem[r, c] != nodata
+    codes = np.full(dem.shape, flow_routing.FDR_NODATA, dtype=np.uint8)
+    for row in range(height):
+        for col in range(width):
+            if not is_data(row, col):
+                continue
+            best, best_drop, off = 0, 0.0, 0
+            for code in flow_routing.CODES:
+                dr, dc = flow_routing.OFFSETS[code]
+                r, c = row + dr, col + dc
+                if not is_data(r, c):
+                    off = off or code
+                    continue
+                drop = (dem[row, col] - dem[r, c]) / (np.sqrt(2) if dr and dc else 1.0)
+                if drop > best_drop:
+                    best, best_drop = code, drop
+            codes[row, col] = best or off
+
+    # breadth-first distance of each flat cell from the draining cells at its elevation
+    distance = {}
+    queue = deque()
+    for row, col in zip(*np.nonzero((codes != 0) & (codes != flow_routing.FDR_NODATA))):
+        distance[(row, col)] = 0
+        queue.append((row, col))
+    while queue:
+        row, col = queue.popleft()
+        for dr, dc in flow_routing.OFFSETS.values():
+            r, c = row + dr, col + dc
+            if inside(r, c) and codes[r, c] == 0 and (r, c) not in distance and dem[r, c] == dem[row, col]:
+                distance[(r, c)] = distance[(row, col)] + 1
+                queue.append((r, c))
+    resolved = codes.copy()
+    for row, col in zip(*np.nonzero(codes == 0)):
+        if (row, col) not in distance:
+            continue
+        for code in flow_routing.CODES:
+            dr, dc = flow_routing.OFFSETS[code]
+            r, c = row - dr, col - dc  # the cell this one would be reached from in this direction
+            if distance.get((r, c)) == distance[(row, col)] - 1 and dem[r, c] == dem[row, col]:
+                resolved[row, col] = flow_routing.CODE_FOR_OFFSET[(-dr, -dc)]
+                break
+    return resolved
+
+
+def _reference_catchments(codes, seeds):
+    """Follow each cell's flow path one cell at a time to the seed it ends on."""
+    height, width = codes.shape
+    labels = np.full(codes.shape, flow_routing.CATCHMENT_NODATA, dtype=np.int32)
+    for row in range(height):
+        for col in range(width):
+            r, c = row, col
+            for step in range(height * width):
+                if seeds[r, c] != flow_routing.CATCHMENT_NODATA:
+                    labels[row, col] = seeds[r, c]
+                    break
+                if codes[r, c] not in flow_routing.OFFSETS:
+                    break
+                dr, dc = flow_routing.OFFSETS[codes[r, c]]
+                r, c = r + dr, c + dc
+                if not (0 <= r < height and 0 <= c < width):
+                    break
+    return labels
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_flow_direction_matches_path_following_reference(seed):
+    dem = _filled_dem(seed)
+    reference = _reference_flow_direction(dem)
+    for tile_size in (1000, 7):
+        assert np.array_equal(_flow_direction(dem, tile_size), reference), tile_size
+
+
+def test_ties_go_to_the_first_direction_in_codes_order():
+    dem = np.array([[9.0, 5.0, 9.0],
+                    [5.0, 7.0, 5.0],
+                    [9.0, 5.0, 9.0]])
+    # east (1), south (4), west (16) and north (64) are equally steep
+    assert _flow_direction(dem, 1000)[1, 1] == 1
+    assert _reference_flow_direction(dem)[1, 1] == 1
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_catchments_match_path_following_reference(seed):
+    dem = _filled_dem(seed)
+    codes = _flow_direction(dem, 1000)
+    rng = np.random.RandomState(seed)
+    seeds = np.where(rng.rand(*codes.shape) < 0.02, rng.randint(1, 50, codes.shape),
+                     flow_routing.CATCHMENT_NODATA).astype(np.int32)
+    fdr_reader = raster_blocks.ArrayReader(codes, flow_routing.FDR_NODATA)
+    seed_reader = raster_blocks.ArrayReader(seeds, flow_routing.CATCHMENT_NODATA)
+    reference = _reference_catchments(codes, seeds)
+    for tile_size in (1000, 6):
+        writer = raster_blocks.ArrayWriter(fdr_reader, np.int32, flow_routing.CATCHMENT_NODATA)
+        labels = flow_routing.label_catchments_blocks(fdr_reader, seed_reader, writer, tile_size)
+        assert np.array_equal(labels, reference), tile_size
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_flow_direction_does_not_depend_on_tile_size(seed):
+    dem = _filled_dem(seed)
+    whole = _flow_direction(dem, 1000)
+    for tile_size in (3, 4, 7, 12, 25):
+        assert np.array_equal(_flow_direction(dem, tile_size), whole), tile_size
+
+
+def test_flats_drain_without_cycles():
+    dem = _filled_dem(0)
+    codes = _flow_direction(dem, 5)
+    valid = codes != flow_routing.FDR_NODATA
+    assert not (codes[valid] == 0).any()
+    height, width = codes.shape
+    for row, col in zip(*np.nonzero(valid)):
+        for step in range(height * width):
+            row, col = _downstream(codes, row, col)
+            if not (0 <= row < height and 0 <= col < width) or codes[row, col] == flow_routing.FDR_NODATA:
+                break
+        else:
+            pytest.fail('flow cycle')
+
+
+def test_flat_drains_toward_nearest_outlet():
+    dem = np.full((3, 6), 5.0)
+    dem[:, 0] = dem[:, -1] = -9999
+    dem[1, 1] = 4.0
+    codes = _flow_direction(dem, 2)
+    # the flat cells drain to the lower cell through their neighbors, never away from it
+    assert codes[1, 2] == 16
+    assert codes[1, 3] in (16, 32, 8)
+
+
+def test_clip_raster_must_be_on_the_same_grid():
+    dem = _filled_dem(1, 10, 10)
+    reader = raster_blocks.ArrayReader(dem, -9999)
+    shifted = raster_blocks.ArrayReader(dem, -9999, geotransform=(5, 1, 0, 0, 0, -1))
+    writer = raster_blocks.ArrayWriter(reader, np.uint8, flow_routing.FDR_NODATA)
+    with pytest.raises(ValueError):
+        flow_routing.flow_direction_blocks(reader, writer, shifted)
+    other_crs = raster_blocks.ArrayReader(dem, -9999, projection='EPSG:4326')
+    with pytest.raises(ValueError):
+        flow_routing.flow_direction_blocks(reader, writer, other_crs)
+
+
+def test_catchment_labels_do_not_depend_on_tile_size():
+    dem = _filled_dem(2)
+    codes = _flow_direction(dem, 1000)
+    seeds = np.full(codes.shape, flow_routing.CATCHMENT_NODATA, dtype=np.int32)
+    seeds[::7, ::9] = np.arange(seeds[::7, ::9].size).reshape(seeds[::7, ::9].shape) + 1
+    fdr_reader = raster_blocks.ArrayReader(codes, flow_routing.FDR_NODATA)
+    seed_reader = raster_blocks.ArrayReader(seeds, flow_routing.CATCHMENT_NODATA)
+    labels = []
+    for tile_size in (1000, 6):
+        writer = raster_blocks.ArrayWriter(fdr_reader, np.int32, flow_routing.CATCHMENT_NODATA)
+        labels.append(flow_routing.label_catchments_blocks(fdr_reader, seed_reader, writer, tile_size))
+    assert np.array_equal(labels[0], labels[1])
+    assert (labels[0][seeds != flow_routing.CATCHMENT_NODATA] == seeds[seeds != flow_routing.CATCHMENT_NODATA]).all()
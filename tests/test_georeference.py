@@ -0,0 +1,103 @@
+# filename: test_georeference.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LIMNO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import importlib
+import os
+import sys
+import types
+
+import pytest
+
+PACKAGE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PACKAGE)
+sys.path.insert(0, os.path.join(PACKAGE, 'lagosGIS'))
+
+INSIDE = 'Exact location link'
+NAME_AND_LOCATION = 'Linked by common name and location'
+LOCATION = 'Linked by common location'
+RIVER = 'Not linked because represented as river in NHD'
+
+
+@pytest.fixture
+def georeference(monkeypatch):
+    # link_site needs no ArcGIS, but the module imports arcpy for the other steps
+    arcpy = types.ModuleType('arcpy')
+    arcpy.analysis = types.ModuleType('arcpy.analysis')
+    arcpy.management = types.ModuleType('arcpy.management')
+    monkeypatch.setitem(sys.modules, 'arcpy', arcpy)
+    monkeypatch.setitem(sys.modules, 'arcpy.analysis', arcpy.analysis)
+    monkeypatch.setitem(sys.modules, 'arcpy.management', arcpy.management)
+    monkeypatch.delitem(sys.modules, 'georeference', raising=False)
+    yield importlib.import_module('georeference')
+    sys.modules.pop('georeference', None)
+
+
+def _baseline(name, mid_0, mname_0, stream_id, mid_10, mname_10, mid_100, mname_100):
+    """The rules as applied to one row of the original chain of one-to-many spatial joins."""
+    import lagosGIS
+    comment, review, words, lagosid = None, None, None, None
+    if mid_0 is not None:
+        if name and mname_0:
+            words = lagosGIS.list_shared_words(name, mname_0, exclude_lake_words=False)
+        comment, lagosid, review = INSIDE, mid_0, -1
+    elif mid_10 is not None:
+        if name and mname_10:
+            words = lagosGIS.list_shared_words(name, mname_10, exclude_lake_words=False)
+        comment, lagosid, review = (NAME_AND_LOCATION, mid_10, -1) if words else (LOCATION, mid_10, 1)
+    elif stream_id is not None:
+        comment, review = RIVER, 2
+    elif mid_100 is not None:
+        if name and mname_100:
+            words = lagosGIS.list_shared_words(name, mname_100, exclude_lake_words=True)
+        comment, lagosid, review = (NAME_AND_LOCATION, mid_100, 1) if words else (LOCATION, mid_100, 2)
+    return comment, review, words, lagosid
+
+
+def _baseline_links(name, lakes, stream):
+    """Every distinct baseline result over the join rows for the lakes within 0, 10 and 100 m of the site."""
+    tier_0 = [(i, n) for i, n, d in lakes if d == 0] or [(None, None)]
+    tier_10 = [(i, n) for i, n, d in lakes if d <= 10] or [(None, None)]
+    tier_100 = [(i, n) for i, n, d in lakes] or [(None, None)]
+    stream_id = stream[0] if stream else None
+    links = set()
+    for mid_0, mname_0 in tier_0:
+        for mid_10, mname_10 in tier_10:
+            for mid_100, mname_100 in tier_100:
+                links.add(_baseline(name, mid_0, mname_0, stream_id, mid_10, mname_10, mid_100, mname_100))
+    return links
+
+
+CASES = [('inside one lake', 'Big Bass Lake', [(1, 'Big Bass Lake', 0.0), (2, 'Mud Lake', 40.0)], None),
+         ('inside two lakes', 'Mud', [(1, 'Big Bass Lake', 0.0), (2, 'Mud Lake', 0.0)], ('{A}', 'Bass River')),
+         ('inside, no names', None, [(1, None, 0.0)], None),
+         ('within 10 m with a name', 'Bass Lake', [(1, 'Big Bass Lake', 4.0)], None),
+         ('within 10 m, lake word only', 'Lake', [(1, 'Big Bass Lake', 9.5), (2, 'Mud Pond', 10.0)], None),
+         ('within 10 m beats the stream', 'Bass', [(1, 'Big Bass Lake', 10.0)], ('{A}', 'Bass River')),
+         ('stream beats 100 m', 'Bass', [(1, 'Big Bass Lake', 60.0)], ('{A}', 'Bass River')),
+         ('within 100 m with a name', 'Big Bass', [(1, 'Big Bass Lake', 60.0), (2, 'Mud Lake', 80.0)], None),
+         ('within 100 m, lake word only', 'Lake', [(1, 'Big Bass Lake', 50.0)], None),
+         ('only a stream', 'Bass', [], ('{A}', 'Bass River')),
+         ('nothing nearby', 'Bass', [], None)]
+
+
+@pytest.mark.parametrize('case', CASES, ids=[c[0] for c in CASES])
+def test_link_site_matches_the_baseline_rules(georeference, case):
+    description, name, lakes, stream = case
+    links = georeference.link_site(name, lakes, stream)
+    assert len(links) == len(set(links))
+    assert set(links) == _baseline_links(name, lakes, stream)
+
+
+def test_link_site_tiers(georeference):
+    link_site = georeference.link_site
+    assert link_site('Big Bass Lake', [(1, 'Big Bass Lake', 0.0)], None)[0][:2] == (INSIDE, -1)
+    # lake words count as shared within 10 m, but not farther away
+    assert link_site('Lake', [(1, 'Big Bass Lake', 5.0)], None) == [(NAME_AND_LOCATION, -1, 'LAKE', 1)]
+    assert link_site('Mud', [(1, 'Big Bass Lake', 5.0)], None) == [(LOCATION, 1, '', 1)]
+    assert link_site('Lake', [(1, 'Big Bass Lake', 50.0)], None) == [(LOCATION, 2, '', 1)]
+    assert link_site('bass', [(1, 'Big Bass Lake', 50.0)], None) == [(NAME_AND_LOCATION, 1, 'BASS', 1)]
+    assert link_site('Bass', [(1, 'Big Bass Lake', 50.0)], ('{A}', 'Bass River')) == [(RIVER, 2, None, None)]
+    assert link_site('Bass', [], None) == [(None, None, None, None)]
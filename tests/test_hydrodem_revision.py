@@ -0,0 +1,72 @@
+# filename: test_hydrodem_revision.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS', 'watershed_delineation')))
+import hydrodem_revision
+import raster_blocks
+
+NODATA = -9999
+
+
+def _inputs(seed, height=12, width=9):
+    rng = np.random.RandomState(seed)
+    hydrodem = rng.rand(height, width) * 1000 + 20000
+    hydrodem[rng.rand(height, width) < 0.1] = NODATA
+    filldepth = np.where(rng.rand(height, width) < 0.3, rng.rand(height, width) * 50, NODATA)
+    catseed = np.where(rng.rand(height, width) < 0.5, 7, NODATA)
+    sink_lakes = np.where(rng.rand(height, width) < 0.3, 1, NODATA)
+    sink_centroids = np.where(rng.rand(height, width) < 0.1, 1, NODATA)
+    closed_sinks = np.where(rng.rand(height, width) < 0.2, 1, NODATA)
+    return [raster_blocks.ArrayReader(a, NODATA) for a in
+            (hydrodem, filldepth, catseed, sink_lakes, sink_centroids, closed_sinks)]
+
+
+def _revise(readers, memory_mb):
+    writer = raster_blocks.ArrayWriter(readers[0], np.float32, hydrodem_revision.OUTPUT_NODATA)
+    return hydrodem_revision.revise_blocks(*(readers + [writer]), memory_mb=memory_mb)
+
+
+def test_focal_minimum_ignores_nodata():
+    values = np.array([[1, 9, 9], [9, 5, 9], [9, 9, 0]], dtype=np.float64)
+    valid = np.array([[False, True, True], [True, True, True], [True, True, False]])
+    minimum, minimum_valid = hydrodem_revision.focal_minimum(values, valid)
+    assert minimum.tolist() == [[5]] and minimum_valid.all()
+    minimum, minimum_valid = hydrodem_revision.focal_minimum(values, np.zeros((3, 3), dtype=bool))
+    assert not minimum_valid.any()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_strips_match_whole_raster(seed):
+    readers = _inputs(seed)
+    whole = _revise(readers, 1000)
+    # a tiny budget gives one-row strips, so every focal window crosses a strip edge
+    assert np.array_equal(_revise(readers, 0.0001), whole)
+
+
+def test_revision_rules():
+    readers = _inputs(0)
+    hydrodem, filldepth, catseed, sink_lakes, centroids, closed = [r.array for r in readers]
+    result = _revise(readers, 1000)
+    inside = (hydrodem != NODATA) & (closed == NODATA)
+    sinks = (sink_lakes != NODATA) & (catseed != NODATA)
+    expected = hydrodem - np.where(filldepth == NODATA, 0, filldepth) - hydrodem_revision.AREAL_DROP * sinks
+    protected = inside & sinks & (centroids != NODATA)
+    assert (result[protected] == np.float32(hydrodem_revision.OUTPUT_NODATA)).all()
+    kept = inside & ~protected
+    assert np.allclose(result[kept], expected[kept].astype(np.float32))
+
+
+def test_inputs_must_be_on_the_same_grid():
+    readers = _inputs(0)
+    readers[2] = raster_blocks.ArrayReader(readers[2].array, NODATA, geotransform=(30, 1, 0, 0, 0, -1))
+    with pytest.raises(ValueError):
+        _revise(readers, 1000)
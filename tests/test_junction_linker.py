@@ -0,0 +1,81 @@
+# filename: test_junction_linker.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): CONN
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import junction_linker
+
+
+def _reference(query_xy, target_xy, k, max_distance):
+    links = []
+    for q, (qx, qy) in enumerate(query_xy):
+        if math.isnan(qx):
+            continue
+        near = sorted((math.hypot(qx - tx, qy - ty), t) for t, (tx, ty) in enumerate(target_xy))
+        near = [(d, t) for d, t in near if d <= max_distance][:k]
+        links.extend((q, rank + 1, t) for rank, (d, t) in enumerate(near))
+    return links
+
+
+@pytest.fixture(params=['kdtree', 'brute force'])
+def search(request, monkeypatch):
+    if request.param == 'brute force':
+        monkeypatch.setitem(sys.modules, 'scipy.spatial', None)  # import fails as if scipy were not installed
+        monkeypatch.setattr(junction_linker, 'BRUTE_FORCE_CELLS', 50)  # several blocks of query points
+    return request.param
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_nearest_matches_pairwise_distances(search, seed):
+    rng = np.random.RandomState(seed)
+    # integer coordinates give many targets at equal distances
+    query_xy = rng.randint(0, 10, (40, 2)).astype(np.float64)
+    query_xy[3] = np.nan
+    target_xy = rng.randint(0, 10, (25, 2)).astype(np.float64)
+    for k, max_distance in ((1, np.inf), (3, np.inf), (4, 3.0), (30, 2.5)):
+        queries, ranks, targets, distances = junction_linker.nearest(query_xy, target_xy, k, max_distance)
+        assert list(zip(queries.tolist(), ranks.tolist(), targets.tolist())) == _reference(query_xy, target_xy, k,
+                                                                                            max_distance)
+        assert np.allclose(distances, np.hypot(*(query_xy[queries] - target_xy[targets]).T))
+
+
+def test_link_to_junctions(monkeypatch):
+    tables = {'LAGOS_inlets': [(1, 10, (0.0, 0.0)), (2, 11, None)],
+              'LAGOS_outlets': [(1, 10, (5.0, 0.0)), (2, 12, (100.0, 0.0))]}
+    monkeypatch.setattr(data_access, 'read_rows',
+                        lambda table, fields, *args, **kwargs: iter(tables[os.path.basename(table)]))
+    linker = junction_linker.JunctionLinker(['D:/conn.gdb/LAGOS_inlets', 'D:/conn.gdb/LAGOS_outlets'])
+    links = linker.link([(1.0, 0.0), (np.nan, np.nan)], k=2, max_distance=50)
+    assert links['query'].tolist() == [0, 0]
+    assert links['NEAR_FC'].tolist() == ['LAGOS_inlets', 'LAGOS_outlets']
+    assert links['near_lagoslakeid'].tolist() == [10, 10]
+    assert links['NEAR_DIST'].tolist() == [1.0, 4.0]
+
+
+def test_link_table_projects_points_to_the_junctions(monkeypatch):
+    tables = {'LAGOS_inlets': [(1, 10, (0.0, 0.0))], 'dams.shp': [('d1', (2.0, 0.0)), ('d2', None)]}
+    requests, written = [], []
+
+    def read_rows(table, fields, *args, **kwargs):
+        requests.append((os.path.basename(table), kwargs.get('spatial_reference')))
+        return iter(tables[os.path.basename(table)])
+
+    monkeypatch.setattr(data_access, 'read_rows', read_rows)
+    monkeypatch.setattr(data_access, 'write_batches', lambda table, batches, fields: written.append((batches, fields)))
+    linker = junction_linker.JunctionLinker(['D:/conn.gdb/LAGOS_inlets'])
+    linker.link_table('D:/dams/dams.shp', 'DAMID', 'D:/out.gdb/links', k=1, spatial_reference=102039)
+    assert requests == [('LAGOS_inlets', None), ('dams.shp', 102039)]
+    [(batches, fields)] = written
+    assert fields[0] == 'DAMID'
+    assert batches[0]['DAMID'].tolist() == ['d1']
+    assert batches[0]['NEAR_DIST'].tolist() == [2.0]
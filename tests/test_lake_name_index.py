@@ -0,0 +1,67 @@
+# filename: test_lake_name_index.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LIMNO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import lake_name_index
+
+LAKES = [(101, 'Big Bass Lake', None, 'St. Louis County', 'MN'),
+         (102, 'Bass Pond', 'Little Bass Lake', 'St Louis', 'MN'),
+         (103, 'Mud Lake', None, 'St Louis', 'MN'),
+         (104, 'Big Bass Lake', None, 'Vilas', 'WI'),
+         (105, None, None, 'St Louis', 'MN'),
+         (106, "O'Brien Reservoir", None, 'Cook', 'MN')]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_access, 'read_rows', lambda table, fields, *args, **kwargs: iter(LAKES))
+    return lake_name_index.open_index(str(tmp_path), 'lakes', 'lagoslakeid', ['GNIS_Name', 'lagos_lakename'],
+                                      'County_Name', 'State')
+
+
+def _brute_force(name, county, state, limit=5):
+    site = set(lake_name_index.tokens(name, True))
+    scored = []
+    for lake_id, name1, name2, lake_county, lake_state in LAKES:
+        if (lake_name_index.normalize_place(lake_county), lake_state) != (lake_name_index.normalize_place(county),
+                                                                          state):
+            continue
+        words = set(lake_name_index.tokens(name1, True) + lake_name_index.tokens(name2, True))
+        shared = len(site & words)
+        if shared:
+            scored.append((-shared / float(len(site) + len(words) - shared), lake_id))
+    return [(lake_id, -score) for score, lake_id in sorted(scored)[:limit]]
+
+
+def test_tokens_and_places():
+    assert lake_name_index.tokens("O'Brien Lake, the lake", True) == ['O', 'BRIEN', 'THE']
+    assert lake_name_index.normalize_place('St. Louis County') == lake_name_index.normalize_place('ST LOUIS')
+
+
+def test_matches_agree_with_pairwise_scores(index):
+    sites = [('Bass Lake', 'St Louis', 'MN'), ('big bass', 'Vilas', 'WI'), ('Mud', 'Vilas', 'WI'),
+             ('Lake', 'St Louis', 'MN'), ('Little Bass', 'St. Louis', 'MN'), ('OBrien', 'Cook', 'MN')]
+    names, counties, states = zip(*sites)
+    matches = index.match(list(names), list(counties), list(states))
+    for site, site_matches in zip(sites, matches):
+        assert [(m[0], m[2]) for m in site_matches] == _brute_force(*site), site
+    assert matches[4][0] == (102, 'BASS LITTLE', 1.0)  # shared words in the lake's name order
+
+
+def test_index_is_reused_until_the_sources_change(index, tmp_path, monkeypatch):
+    built = []
+    monkeypatch.setattr(lake_name_index, 'build', lambda *args: built.append(args))
+    lake_name_index.open_index(str(tmp_path), 'lakes', 'lagoslakeid', ['GNIS_Name', 'lagos_lakename'], 'County_Name',
+                               'State')
+    assert not built
+    lake_name_index.open_index(str(tmp_path), 'lakes', 'lagoslakeid', ['GNIS_Name'], 'County_Name', 'State')
+    assert len(built) == 1
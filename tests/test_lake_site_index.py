@@ -0,0 +1,88 @@
+# filename: test_lake_site_index.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LIMNO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+shapely_geometry = pytest.importorskip('shapely.geometry')
+box, Point, Polygon = shapely_geometry.box, shapely_geometry.Point, shapely_geometry.Polygon
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import lake_site_index
+
+LAKES = [(1, 'Big Lake', box(0, 0, 100, 100)),
+         (2, None, box(150, 0, 200, 50)),
+         (3, 'Ring Lake', Polygon([(300, 0), (400, 0), (400, 100), (300, 100)], [[(320, 20), (380, 20), (380, 80),
+                                                                                  (320, 80)]])),
+         (4, 'Twin Lake', box(0, 180, 40, 220)),
+         (5, 'Twin Lake', box(60, 180, 100, 220))]
+STREAMS = [('{A1}', 'Bass River', box(100, 0, 150, 40)), ('{A2}', None, box(500, 500, 600, 600))]
+
+
+@pytest.fixture(params=['vectorized', 'loop'])
+def index(request, tmp_path, monkeypatch):
+    tables = {'lakes': LAKES, 'streams': STREAMS}
+    monkeypatch.setattr(data_access, 'read_rows',
+                        lambda table, fields, *args, **kwargs: iter((i, n, g.wkb) for i, n, g in tables[table]))
+    if request.param == 'loop':
+        # the shapely 1.x path, one point at a time
+        monkeypatch.setattr(lake_site_index._Layer, '_within_vectorized', lake_site_index._Layer._within_loop)
+    return lake_site_index.open_index(str(tmp_path), 'lakes', 'streams')
+
+
+def _brute_force(x, y, radius):
+    if np.isnan(x) or np.isnan(y):
+        return []
+    found = [(lake.distance(Point(x, y)), i) for i, (lake_id, name, lake) in enumerate(LAKES)]
+    return [(LAKES[i][0], LAKES[i][1], d) for d, i in sorted(found) if d <= radius]
+
+
+def test_candidates_agree_with_pairwise_distances(index):
+    rng = np.random.RandomState(0)
+    xy = np.column_stack([rng.uniform(-150, 550, 300), rng.uniform(-150, 350, 300)])
+    xy[[0, 1]] = [np.nan, 5], [np.nan, np.nan]
+    for radius in (10, lake_site_index.SEARCH_RADIUS):
+        result = index.candidates(xy, radius)
+        assert len(result) == len(xy)
+        for (x, y), (lakes, stream) in zip(xy, result):
+            expected = _brute_force(x, y, radius)
+            assert [lake[:2] for lake in lakes] == [lake[:2] for lake in expected], (x, y)
+            assert np.allclose([lake[2] for lake in lakes], [lake[2] for lake in expected])
+
+
+def test_inside_lake_has_distance_zero_but_not_in_the_hole(index):
+    (inside, stream), (in_hole, hole_stream) = index.candidates([(50, 50), (350, 50)], 30)
+    assert inside == [(1, 'Big Lake', 0.0)]
+    assert in_hole == [(3, 'Ring Lake', 30.0)]
+
+
+def test_ties_and_names(index):
+    (lakes, stream), = index.candidates([(50, 200)], 10)
+    assert lakes == [(4, 'Twin Lake', 10.0), (5, 'Twin Lake', 10.0)]
+    (lakes, stream), = index.candidates([(175, 25)])
+    assert lakes == [(2, None, 0.0), (1, 'Big Lake', 75.0)]
+
+
+def test_stream_containment(index):
+    result = index.candidates([(125, 20), (125, 45), (550, 550), (100, 20), (np.nan, np.nan)])
+    assert [stream for lakes, stream in result] == [('{A1}', 'Bass River'), None, ('{A2}', None),
+                                                    ('{A1}', 'Bass River'), None]
+    # the site on the shared edge is both in the stream polygon and at distance 0 from the lake
+    assert result[3][0][0] == (1, 'Big Lake', 0.0)
+    assert result[4] == ([], None)
+
+
+def test_index_is_reused_until_the_sources_change(index, tmp_path, monkeypatch):
+    built = []
+    monkeypatch.setattr(lake_site_index, 'build', lambda *args: built.append(args))
+    lake_site_index.open_index(str(tmp_path), 'lakes', 'streams')
+    assert not built
+    lake_site_index.open_index(str(tmp_path), 'lakes', 'streams', name_field='lagos_lakename')
+    assert len(built) == 1
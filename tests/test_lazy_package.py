@@ -0,0 +1,98 @@
+# filename: test_lazy_package.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): all
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# each check runs in a fresh interpreter, so that nothing imported by other tests is in sys.modules
+SETUP = """
+import sys
+import types
+sys.path[:0] = [{root!r}, {package!r}]
+"""
+
+FAKE_ARCPY = """
+arcpy = types.ModuleType('arcpy')
+arcpy.env = types.ModuleType('arcpy.env')
+sys.modules['arcpy'] = arcpy
+"""
+
+
+def _run(script, fake_arcpy=False):
+    setup = SETUP.format(root=ROOT, package=os.path.join(ROOT, 'lagosGIS'))
+    code = setup + (FAKE_ARCPY if fake_arcpy else '') + textwrap.dedent(script)
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    assert process.returncode == 0, output
+    return output
+
+
+def test_import_does_not_import_arcpy():
+    _run("""
+        import lagosGIS
+        assert 'arcpy' not in sys.modules
+        # Python 2 records failed implicit relative imports as None, e.g. lagosGIS.os
+        assert not [m for m, module in sys.modules.items() if m.startswith('lagosGIS.') and module is not None]
+        assert sorted(lagosGIS.__all__) == sorted(set(lagosGIS.__all__))
+        assert lagosGIS.shortname('/data/lakes.shp') == 'lakes'
+        assert 'arcpy' not in sys.modules
+    """)
+
+
+def test_submodules_load_on_first_access():
+    _run("""
+        import lagosGIS
+        read_job_control = lagosGIS.read_job_control
+        assert read_job_control is sys.modules['lagosGIS.read_job_control']
+        assert callable(read_job_control.read_job_control)
+        from lagosGIS import parquet_release
+        assert parquet_release is sys.modules['lagosGIS.parquet_release']
+        assert lagosGIS.parquet_release is parquet_release
+        assert 'arcpy' not in sys.modules
+    """)
+
+
+def test_tools_load_on_first_access():
+    _run("""
+        import lagosGIS
+        fcodes = lagosGIS.LAGOS_FCODE_LIST
+        assert 39004 in fcodes and lagosGIS.LAGOS_FCODE_LIST is fcodes
+        assert 'lagosGIS.NHDNetwork' in sys.modules
+    """)
+
+
+def test_tool_survives_import_of_its_submodule():
+    _run("""
+        import lagosGIS.rasterize_zones
+        module = sys.modules['lagosGIS.rasterize_zones']
+        assert lagosGIS.rasterize_zones is module.rasterize
+        from lagosGIS import rasterize_zones
+        assert rasterize_zones is module.rasterize
+    """, fake_arcpy=True)
+
+
+def test_unknown_names_raise_attribute_error():
+    _run("""
+        import lagosGIS
+        for name in ('no_such_tool', '__wrapped__', 'info'):
+            try:
+                getattr(lagosGIS, name)
+            except AttributeError:
+                pass
+            else:
+                raise AssertionError(name)
+        assert not hasattr(lagosGIS, 'no_such_tool')
+        try:
+            from lagosGIS import no_such_tool
+        except ImportError:
+            pass
+        else:
+            raise AssertionError('no_such_tool')
+    """)
@@ -0,0 +1,58 @@
+# filename: test_metric_catalog.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import metric_catalog
+
+HEADER = ('data_type,data_source_id,data_source_code,zone_name,zone_has_overlaps,zone_geometry,main_feature,subgroup,'
+          'units1,units2,units3,units4,function_name,ready_path,subgroup_original_code,subgroup_original_name,'
+          'lake,hu12,flatbuff100')
+ROWS = ["zone,,,hu12,N,polygon,,,,,,,hand,r'D:\\zones.gdb\\hu12',,,,,",
+        "zone,,,hu12,N,raster,,,,,,,hand,r'D:\\zones.gdb\\hu12_raster',,,,,",
+        "zone,,,flatbuff100,N,raster,,,,,,,hand,r'D:\\zones.gdb\\flatbuff100_raster',,,,,",
+        "composition,,,,,,nlcd2011,forest,percent,,,,zonal_attribution_of_raster_data,r'D:\\nlcd.tif',41,,,Y,Y",
+        "composition,,,,,,nlcd2011,water,percent,,,,zonal_attribution_of_raster_data,r'D:\\nlcd.tif',11,,,Y,Y",
+        "zonal_stats,,,,,,slope,,degrees,,,,zonal_attribution_of_raster_data,r'D:\\slope.tif',,,,Y,",
+        ",,,,,,,,,,,,,,,,,,",
+        "density,,,,,,lakes,,,,,,lakes_in_zones,r'D:\\lakes.gdb\\lakes',,,,Y,"]
+
+
+def _catalog(tmp_path):
+    path = str(tmp_path / 'provenance.csv')
+    with open(path, 'w') as f:
+        f.write('\n'.join([HEADER] + ROWS) + '\n')
+    return metric_catalog.load(path)
+
+
+def test_does_not_import_the_job_runner():
+    assert 'read_job_control' not in sys.modules
+
+
+def test_catalog_indexes(tmp_path):
+    catalog = _catalog(tmp_path)
+    assert metric_catalog.load(catalog.provenance_csv) is catalog
+    assert catalog.zone_columns == ['lake', 'hu12', 'flatbuff100']
+    assert catalog.zone_dataset('hu12', 'raster') == 'D:\\zones.gdb\\hu12_raster'
+    assert len(catalog.by_function['zonal_attribution_of_raster_data']) == 3
+    assert [m.main_feature for m in catalog.by_zone['flatbuff100']] == ['nlcd2011', 'nlcd2011']
+    assert catalog.subgroup_mapping('hu12_nlcd2011') == {'41': 'forest', '11': 'water'}
+
+
+def test_jobs_share_zone_inputs(tmp_path):
+    catalog = _catalog(tmp_path)
+    jobs, skipped = metric_catalog.expand_jobs(catalog, 'out.gdb', 'csv')
+    # the subgroups of the NLCD share a job, and the flattened zone needs its unflat table
+    assert sorted(os.path.basename(j.output) for j in jobs) == ['hu12_lakedensity', 'hu12_nlcd2011', 'hu12_slope']
+    assert skipped == [(5, 'flatbuff100', 'no unflat table')]
+
+    jobs, skipped = metric_catalog.expand_jobs(catalog, 'out.gdb', 'csv', unflat_tables={'flatbuff100': 'unflat'})
+    groups = metric_catalog.order_jobs(jobs)
+    assert [len(g) for g in groups] == [1, 1, 2]
+    assert [j.zone_input for j in groups[2]] == ['D:\\zones.gdb\\hu12_raster'] * 2
+    assert [j.dataset for j in groups[2]] == ['D:\\nlcd.tif', 'D:\\slope.tif']
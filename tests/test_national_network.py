@@ -0,0 +1,135 @@
+# filename: test_national_network.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import csv
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import synthetic_network
+
+UPSTREAM_HUC4 = '0101'
+DOWNSTREAM_HUC4 = '0102'
+
+
+def _stitched_tables(n_flowlines=400):
+    """
+    Two synthetic subregions where the outlet of the upstream subregion flows into a lake in the main basin of the
+    downstream subregion. Each flow table names the flowline across the boundary, like the NHD does.
+    """
+    up = synthetic_network.generate_network_tables(n_flowlines, seed=1, huc4=UPSTREAM_HUC4)
+    down = synthetic_network.generate_network_tables(n_flowlines, seed=2, huc4=DOWNSTREAM_HUC4)
+    up_outlet = [r for r in up['NHDPlusFlow'][1] if r[1] == 'outlet' + UPSTREAM_HUC4][0][0]
+    down_inlet = [r[0] for r in down['NHDFlowline'][1][:n_flowlines // 2] if r[1]][0]
+    for tables in (up, down):
+        fields, rows = tables['NHDPlusFlow']
+        rows = [r for r in rows if r[0] != 'inlet' + DOWNSTREAM_HUC4 and r != ('0', down_inlet)]
+        rows = [(up_outlet, down_inlet) if r == (up_outlet, 'outlet' + UPSTREAM_HUC4) else r for r in rows]
+        if tables is down:
+            rows.append((up_outlet, down_inlet))
+        tables['NHDPlusFlow'] = (fields, rows)
+    merged = {name: (up[name][0], up[name][1] + down[name][1]) for name in up}
+    return {UPSTREAM_HUC4: up, DOWNSTREAM_HUC4: down}, merged, up_outlet, down_inlet
+
+
+@pytest.fixture(scope='module')
+def stitched(tmp_path_factory):
+    fake_arcpy = types.ModuleType('arcpy')
+    fake_arcpy.AddMessage = lambda message: None
+    saved = sys.modules.get('arcpy')
+    sys.modules['arcpy'] = fake_arcpy
+    try:
+        import national_network
+    finally:
+        if saved is None:
+            del sys.modules['arcpy']
+        else:
+            sys.modules['arcpy'] = saved
+    national_network.arcpy = fake_arcpy
+
+    tables, merged, up_outlet, down_inlet = _stitched_tables()
+    original = national_network.NHDNetwork
+    national_network.NHDNetwork = lambda gdb: synthetic_network.SyntheticNHDNetwork(
+        0, huc4=gdb, tables=tables[gdb])
+    try:
+        out_dir = str(tmp_path_factory.mktemp('national'))
+        national_network.build_national_network([UPSTREAM_HUC4, DOWNSTREAM_HUC4], out_dir)
+    finally:
+        national_network.NHDNetwork = original
+    reference = synthetic_network.SyntheticNHDNetwork(0, huc4='0000', tables=merged)
+    return national_network, out_dir, reference, tables, up_outlet, down_inlet
+
+
+def test_cross_partition_edges(stitched):
+    national_network, out_dir, reference, tables, up_outlet, down_inlet = stitched
+    assert sorted(os.listdir(out_dir)) == sorted([UPSTREAM_HUC4, DOWNSTREAM_HUC4, national_network.EDGES_NAME,
+                                                  national_network.MANIFEST_NAME])
+    with open(os.path.join(out_dir, national_network.EDGES_NAME)) as f:
+        rows = [tuple(r) for r in csv.reader(f)]
+    # the subregion inlet and outlet with no partition on the far side are not in the index
+    assert rows == [('partition', 'Permanent_Identifier', 'direction', 'owner_partition'),
+                    (UPSTREAM_HUC4, down_inlet, 'outlet', DOWNSTREAM_HUC4),
+                    (DOWNSTREAM_HUC4, up_outlet, 'inlet', UPSTREAM_HUC4)]
+
+    network = national_network.NationalNetwork(out_dir)
+    assert network.partition_names == [UPSTREAM_HUC4, DOWNSTREAM_HUC4]
+    assert network.partitions == {}
+    with pytest.raises(ValueError):
+        network.partition('0103')
+
+
+def test_traces_match_merged_network(stitched):
+    national_network, out_dir, reference, tables, up_outlet, down_inlet = stitched
+    network = national_network.NationalNetwork(out_dir)
+
+    # the whole upstream subregion main basin is upstream of the downstream outlet
+    down_outlet = 'fl{}-0000000'.format(DOWNSTREAM_HUC4)
+    up_trace = network.trace_up_from_a_flowline(down_outlet, DOWNSTREAM_HUC4)
+    assert up_outlet in up_trace
+    assert sorted(up_trace) == sorted(reference.trace_up_from_a_flowline(down_outlet))
+    assert sorted(network.partitions) == [UPSTREAM_HUC4, DOWNSTREAM_HUC4]
+
+    # a trace that never reaches the boundary stays in its own partition
+    network = national_network.NationalNetwork(out_dir)
+    leaf = [r[1] for r in tables[DOWNSTREAM_HUC4]['NHDPlusFlow'][1] if r[0] == '0'][0]
+    assert sorted(network.trace_up_from_a_flowline(leaf, DOWNSTREAM_HUC4, False)) == [leaf]
+    assert list(network.partitions) == [DOWNSTREAM_HUC4]
+
+    up_ids = [r[0] for r in tables[UPSTREAM_HUC4]['NHDFlowline'][1]]
+    for start in up_ids[::37]:
+        for include_wb_permids in (True, False):
+            assert sorted(network.trace_down_from_a_flowline(start, UPSTREAM_HUC4, include_wb_permids)) == \
+                sorted(reference.trace_down_from_a_flowline(start, include_wb_permids))
+            assert sorted(network.trace_up_from_a_flowline(start, UPSTREAM_HUC4, include_wb_permids)) == \
+                sorted(reference.trace_up_from_a_flowline(start, include_wb_permids))
+
+
+def test_waterbody_traces_match_merged_network(stitched):
+    national_network, out_dir, reference, tables, up_outlet, down_inlet = stitched
+    network = national_network.NationalNetwork(out_dir)
+    crossed = 0
+    for huc4 in (UPSTREAM_HUC4, DOWNSTREAM_HUC4):
+        for waterbody_id in [r[0] for r in tables[huc4]['NHDWaterbody'][1]]:
+            assert sorted(network.trace_up_from_a_waterbody(waterbody_id, huc4)) == \
+                sorted(reference.trace_up_from_a_waterbody(waterbody_id))
+            down_trace = network.trace_down_from_a_waterbody(waterbody_id, huc4)
+            assert sorted(down_trace) == sorted(reference.trace_down_from_a_waterbody(waterbody_id))
+            for result_type in ('count', 'area_hectares'):
+                assert network.find_upstream_lakes(waterbody_id, huc4, result_type, 0.01) == \
+                    pytest.approx(reference.find_upstream_lakes(waterbody_id, result_type, 0.01))
+            if huc4 == UPSTREAM_HUC4 and down_inlet in down_trace:
+                crossed += 1
+    # some upstream lakes drain into the downstream subregion, and their lakes count upstream of the inlet lake
+    assert crossed
+    inlet_lake = [r[1] for r in tables[DOWNSTREAM_HUC4]['NHDFlowline'][1] if r[0] == down_inlet][0]
+    upstream_lakes = network.find_upstream_lakes(inlet_lake, DOWNSTREAM_HUC4)
+    assert any(id.startswith('wb' + UPSTREAM_HUC4) for id in upstream_lakes)
+    assert sorted(upstream_lakes) == sorted(reference.find_upstream_lakes(inlet_lake))
+    with pytest.raises(ValueError):
+        network.find_upstream_lakes(waterbody_id, DOWNSTREAM_HUC4, 'mean')
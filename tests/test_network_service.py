@@ -0,0 +1,138 @@
+# filename: test_network_service.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import network_service
+import synthetic_network
+
+TABLES = {huc4: synthetic_network.generate_network_tables(500, seed=seed, huc4=huc4)
+          for seed, huc4 in enumerate(['0101', '0102', '0103'])}
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Build synthetic networks in place of the geodatabases and record every network built."""
+    built = []
+
+    def build(gdb):
+        huc4 = re.search(r'\d{4}', gdb).group()
+        built.append(huc4)
+        return synthetic_network.SyntheticNHDNetwork(0, huc4=huc4, tables=TABLES[huc4])
+
+    monkeypatch.setattr(network_service.NHDNetwork, 'NHDNetwork', build)
+    return built
+
+
+def _waterbodies(huc4):
+    return [r[0] for r in TABLES[huc4]['NHDWaterbody'][1]]
+
+
+def test_cache_evicts_least_recently_used(builds):
+    cache = network_service.NetworkCache('synthetic_{}.gdb', max_networks=2)
+    first = cache.get('0101')
+    cache.get('0102')
+    assert cache.get('0101') is first
+    cache.get('0103')  # evicts 0102, the least recently used
+    assert list(cache.networks.keys()) == ['0101', '0103']
+    cache.get('0102')
+    assert list(cache.networks.keys()) == ['0103', '0102']
+    assert builds == ['0101', '0102', '0103', '0102']
+
+    # cached networks are fully prepared, with the stops left off
+    network = cache.networks['0102']
+    assert network.upstream and network.downstream and network.lakes_areas and network.tenha_waterbody_ids
+    assert not network.waterbody_stop_ids and not network.flowline_stop_ids
+
+
+def test_run_queries_matches_network_methods(builds):
+    cache = network_service.NetworkCache('synthetic_{}.gdb')
+    reference = synthetic_network.SyntheticNHDNetwork(0, huc4='0101', tables=TABLES['0101'])
+    waterbody_ids = _waterbodies('0101')[:10]
+    flowline_id = TABLES['0101']['NHDFlowline'][1][5][0]
+    queries = [{'huc4': '0101', 'query': 'trace_up_from_a_waterbody', 'id': id} for id in waterbody_ids]
+    queries.append({'huc4': '0101', 'query': 'find_upstream_lakes', 'id': waterbody_ids[0],
+                    'kwargs': {'result_type': 'count'}})
+    queries.append({'huc4': '0101', 'query': 'trace_down_from_a_flowline', 'id': flowline_id})
+    queries.append({'huc4': '0101', 'query': 'identify_subregion_outlets'})
+    # the response must survive the trip through JSON
+    results = json.loads(json.dumps(network_service.run_queries(cache, {'queries': queries})))['results']
+
+    for id, result in zip(waterbody_ids, results):
+        assert sorted(result['result']) == sorted(reference.trace_up_from_a_waterbody(id))
+    assert results[-3]['result'] == reference.find_upstream_lakes(waterbody_ids[0], 'count')
+    assert sorted(results[-2]['result']) == sorted(reference.trace_down_from_a_flowline(flowline_id))
+    assert sorted(results[-1]['result']) == sorted(reference.identify_subregion_outlets())
+    assert builds == ['0101']
+
+
+def test_run_queries_reports_errors_per_query(builds):
+    cache = network_service.NetworkCache('synthetic_{}.gdb')
+    id = _waterbodies('0101')[0]
+    results = network_service.run_queries(cache, {'queries': [
+        {'huc4': '0101', 'query': 'save_trace_catchments', 'id': id},
+        {'huc4': '0101', 'query': 'find_upstream_lakes', 'id': id, 'kwargs': {'result_type': 'mean'}},
+        {'huc4': '0101', 'query': 'trace_up_from_a_waterbody'},
+        {'huc4': '0101', 'query': 'find_upstream_lakes', 'id': id}]})['results']
+    assert results[0]['error'].startswith('ValueError: query must be one of')
+    assert results[1]['error'].startswith('ValueError: result_type must be one of')
+    assert results[2]['error'].startswith('KeyError')
+    assert 'result' in results[3]
+    assert network_service.run_queries(cache, {}) == {'results': []}
+
+
+def test_client_needs_ids_for_per_id_queries():
+    client = network_service.NetworkServiceClient(port=1)
+    with pytest.raises(ValueError):
+        client.query('0101', 'trace_up_from_a_waterbody')
+    with pytest.raises(ValueError):
+        client.query('0101', 'save_trace_catchments', ids=['wb'])
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_client_and_service(builds):
+    port = _free_port()
+    service = threading.Thread(target=network_service.serve, args=('synthetic_{}.gdb', port, 2))
+    service.daemon = True
+    service.start()
+    client = network_service.NetworkServiceClient(port=port, timeout=30)
+    for attempt in range(100):
+        try:
+            assert client.status() == {'networks': [], 'max_networks': 2}
+            break
+        except (IOError, OSError):
+            time.sleep(0.05)
+
+    reference = synthetic_network.SyntheticNHDNetwork(0, huc4='0102', tables=TABLES['0102'])
+    ids = _waterbodies('0102')[:5]
+    counts = client.query('0102', 'find_upstream_lakes', ids, result_type='count')
+    assert counts == {id: reference.find_upstream_lakes(id, 'count') for id in ids}
+    inlets = client.query('0102', 'identify_subregion_inlets')
+    assert list(inlets.keys()) == ['0102']
+    assert sorted(inlets['0102']) == sorted(reference.identify_subregion_inlets())
+    assert client.query('0102', 'trace_up_from_a_waterbody', []) == {}
+    assert client.status()['networks'] == ['0102']
+
+    # an error for one identifier fails the client call
+    with pytest.raises(Exception) as error:
+        client.query('0102', 'find_upstream_lakes', ids[:1], result_type='mean')
+    assert 'result_type must be one of' in str(error.value)
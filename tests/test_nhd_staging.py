@@ -0,0 +1,158 @@
+# filename: test_nhd_staging.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import json
+import os
+import sys
+import zipfile
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import nhd_staging
+
+ROWS = [[None, '{A}', '2012/03/15 10:53:17+00'], [None, '{B}', datetime(2015, 1, 2, 3, 4, 5)]]
+
+
+class _Geodatabases(object):
+    """Stands in for data_access over the extracted geodatabases: feature classes are listed in layers.txt."""
+
+    def __init__(self):
+        self.stamped = {}
+        self.updates = []
+
+    def exists(self, fc, backend=None):
+        gdb, name = os.path.dirname(fc), os.path.basename(fc)
+        layers = os.path.join(gdb, 'layers.txt')
+        if not os.path.exists(layers):
+            return False
+        with open(layers) as f:
+            return name in f.read().split()
+
+    def list_fields(self, fc, backend=None):
+        fields = ['OBJECTID', 'Permanent_Identifier', 'FDate'] + (['nhd_merge_id'] if fc in self.stamped else [])
+        return [data_access.Field(f, 'String', 40) for f in fields]
+
+    def add_fields(self, fc, fields, backend=None):
+        self.stamped.setdefault(fc, None)
+
+    def update_rows(self, fc, fields, update_function, where_clause=None, backend=None):
+        self.updates.append(fc)
+        self.stamped[fc] = [update_function(list(row))[0] for row in ROWS]
+        return len(ROWS)
+
+    def read_rows(self, fc, fields, *args, **kwargs):
+        return iter([(i,) for i in range(len(ROWS))])
+
+
+def _archive(zip_dir, huc4, layers, extra=''):
+    name = 'NHD_H_{}_HU4_GDB'.format(huc4)
+    path = os.path.join(zip_dir, '{}.zip'.format(name))
+    zf = zipfile.ZipFile(path, 'w')
+    zf.writestr('{}.gdb/layers.txt'.format(name), layers)
+    zf.writestr('{}.gdb/Hydrography/layers.txt'.format(name), 'NHDFlowline')
+    zf.writestr('{}.gdb/a00000001.gdbtable'.format(name), extra)
+    zf.close()
+    return path
+
+
+@pytest.fixture
+def staging(tmp_path, monkeypatch):
+    gdbs = _Geodatabases()
+    for method in ('exists', 'list_fields', 'add_fields', 'update_rows', 'read_rows'):
+        monkeypatch.setattr(data_access, method, getattr(gdbs, method))
+    zip_dir, out_dir = str(tmp_path / 'zips'), str(tmp_path / 'staged')
+    os.makedirs(zip_dir)
+    _archive(zip_dir, '0101', 'NHDWaterbody NHDArea')
+    _archive(zip_dir, '0102', 'NHDWaterbody')
+    open(os.path.join(zip_dir, 'README.txt'), 'w').close()
+    manifest = nhd_staging.stage_nhd(zip_dir, out_dir, threads=2)
+    return gdbs, zip_dir, out_dir, manifest
+
+
+def _gdb(out_dir, huc4):
+    return os.path.join(out_dir, 'NHD_H_{}_HU4_GDB.gdb'.format(huc4))
+
+
+def test_merge_id_formats_ogr_dates_as_arcpy():
+    assert nhd_staging.merge_id('x', '2012/03/15 10:53:17+00') == nhd_staging.merge_id('x',
+                                                                                      datetime(2012, 3, 15, 10, 53, 17))
+    assert nhd_staging.merge_id('{A}', '2012/03/15 10:53:17+00') == '{A}_2012-03-15 10:53:17'
+
+
+def test_first_run_stages_every_archive(staging):
+    gdbs, zip_dir, out_dir, manifest = staging
+    assert sorted(manifest['subregions']) == ['NHD_H_0101_HU4_GDB.gdb', 'NHD_H_0102_HU4_GDB.gdb']
+    entry = manifest['subregions']['NHD_H_0101_HU4_GDB.gdb']
+    assert entry['archive'] == 'NHD_H_0101_HU4_GDB.zip'
+    assert entry['checksum'] == nhd_staging.checksum(os.path.join(zip_dir, 'NHD_H_0101_HU4_GDB.zip'))
+    assert entry['staged'] and entry['row_counts'] == {'NHDWaterbody': 2, 'NHDFlowline': 2, 'NHDArea': 2}
+    assert manifest['subregions']['NHD_H_0102_HU4_GDB.gdb']['row_counts'] == {'NHDWaterbody': 2, 'NHDFlowline': 2}
+    flowline = os.path.join(_gdb(out_dir, '0101'), 'Hydrography', 'NHDFlowline')
+    assert gdbs.stamped[flowline] == ['{A}_2012-03-15 10:53:17', '{B}_2015-01-02 03:04:05']
+    with open(os.path.join(out_dir, nhd_staging.MANIFEST_NAME)) as f:
+        assert json.load(f)['subregions'] == manifest['subregions']
+
+
+def test_rerun_skips_unchanged_archives(staging):
+    gdbs, zip_dir, out_dir, manifest = staging
+    extracted = {n: e['extracted'] for n, e in manifest['subregions'].items()}
+    marker = os.path.join(_gdb(out_dir, '0101'), 'a00000002.gdbtable')
+    open(marker, 'w').close()
+    del gdbs.updates[:]
+    manifest = nhd_staging.stage_nhd(zip_dir, out_dir)
+    assert {n: e['extracted'] for n, e in manifest['subregions'].items()} == extracted
+    assert os.path.exists(marker)
+    assert gdbs.updates == []
+    assert manifest['subregions']['NHD_H_0101_HU4_GDB.gdb']['row_counts']['NHDArea'] == 2
+
+
+def test_changed_archive_replaces_its_geodatabase(staging):
+    gdbs, zip_dir, out_dir, manifest = staging
+    old_checksum = manifest['subregions']['NHD_H_0101_HU4_GDB.gdb']['checksum']
+    stale = os.path.join(_gdb(out_dir, '0101'), 'a00000002.gdbtable')
+    open(stale, 'w').close()
+    _archive(zip_dir, '0101', 'NHDWaterbody', extra='new release')
+    del gdbs.updates[:]
+    manifest = nhd_staging.stage_nhd(zip_dir, out_dir)
+    entry = manifest['subregions']['NHD_H_0101_HU4_GDB.gdb']
+    assert entry['checksum'] != old_checksum
+    assert not os.path.exists(stale)
+    with open(os.path.join(_gdb(out_dir, '0101'), 'a00000001.gdbtable')) as f:
+        assert f.read() == 'new release'
+    assert entry['staged'] and entry['row_counts'] == {'NHDWaterbody': 2, 'NHDFlowline': 2}
+    assert all(os.path.basename(os.path.dirname(fc)) != 'NHD_H_0102_HU4_GDB.gdb' for fc in gdbs.updates)
+
+
+def test_unstaged_entry_is_restamped(staging):
+    gdbs, zip_dir, out_dir, manifest = staging
+    # a run interrupted after extracting 0102 but before stamping it
+    manifest['subregions']['NHD_H_0102_HU4_GDB.gdb'].update({'staged': False, 'row_counts': {}})
+    with open(os.path.join(out_dir, nhd_staging.MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+    extracted = manifest['subregions']['NHD_H_0102_HU4_GDB.gdb']['extracted']
+    for fc in list(gdbs.stamped):
+        if 'NHD_H_0102' in fc:
+            del gdbs.stamped[fc]
+    del gdbs.updates[:]
+    manifest = nhd_staging.stage_nhd(zip_dir, out_dir)
+    entry = manifest['subregions']['NHD_H_0102_HU4_GDB.gdb']
+    assert entry['extracted'] == extracted
+    assert entry['staged'] and entry['row_counts'] == {'NHDWaterbody': 2, 'NHDFlowline': 2}
+    assert sorted(os.path.basename(fc) for fc in gdbs.updates) == ['NHDFlowline', 'NHDWaterbody']
+    assert all('NHD_H_0102' in fc for fc in gdbs.updates)
+
+
+def test_existing_merge_ids_are_kept_unless_overwritten(staging):
+    gdbs, zip_dir, out_dir, manifest = staging
+    gdb = _gdb(out_dir, '0102')
+    del gdbs.updates[:]
+    assert nhd_staging.stamp_merge_ids(gdb) == (gdb, {'NHDWaterbody': 2, 'NHDFlowline': 2})
+    assert gdbs.updates == []
+    nhd_staging.stamp_merge_ids(gdb, overwrite=True)
+    assert len(gdbs.updates) == 2
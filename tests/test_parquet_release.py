@@ -0,0 +1,103 @@
+# filename: test_parquet_release.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import parquet_release
+
+FIELDS = [data_access.Field('OBJECTID', 'OID', 4), data_access.Field('lake_zoneid', 'String', 20),
+          data_access.Field('lake_state', 'String', 2), data_access.Field('lake_count', 'Integer', 4),
+          data_access.Field('lake_area_ha', 'Double', 8), data_access.Field('Shape_Area', 'Double', 8)]
+ROWS = {'lake_zoneid': ['ws_1', 'ws_2', 'ws_3', 'ws_4', 'ws_5'],
+        'lake_state': ['MI', 'WI', 'MI', None, 'WI'],
+        'lake_count': [1.0, np.nan, 3.0, 4.0, 5.0],
+        'lake_area_ha': [1.5, 2.5, np.nan, 4.5, 5.5],
+        data_access.WKB_TOKEN: [b'\x01', b'\x02', None, b'\x04', b'\x05']}
+
+
+@pytest.fixture
+def table(monkeypatch):
+    reads = []
+
+    def read_batches(table, fields, *args, **kwargs):
+        reads.append(fields)
+        for start in (0, 3):
+            yield {f: np.array(ROWS[f][start:start + 3], dtype=object) for f in fields}
+
+    monkeypatch.setattr(data_access, 'list_fields', lambda table, backend=None: FIELDS)
+    monkeypatch.setattr(data_access, 'read_batches', read_batches)
+    return reads
+
+
+def _schema(folder, name='lakes'):
+    with open(os.path.join(folder, '{}_schema.json'.format(name))) as f:
+        return json.load(f)
+
+
+def test_plain_file(table, tmp_path):
+    out_path = parquet_release.write_table('lakes.gdb/lakes', str(tmp_path))
+    assert out_path == os.path.join(str(tmp_path), 'lakes.parquet')
+    assert table == [['lake_zoneid', 'lake_state', 'lake_count', 'lake_area_ha']]
+    result = pq.read_table(out_path)
+    assert result.column_names == ['lake_zoneid', 'lake_state', 'lake_count', 'lake_area_ha']
+    assert str(result.schema.field('lake_zoneid').type) == 'dictionary<values=string, indices=int32, ordered=0>'
+    assert str(result.schema.field('lake_count').type) == 'int32'
+    assert result.column('lake_count').to_pylist() == [1, None, 3, 4, 5]
+    assert result.column('lake_area_ha').to_pylist() == [1.5, 2.5, None, 4.5, 5.5]
+    assert result.column('lake_state').to_pylist() == ['MI', 'WI', 'MI', None, 'WI']
+
+    metadata = pq.ParquetFile(out_path).metadata
+    assert metadata.num_row_groups == 2
+    assert metadata.row_group(0).column(2).statistics.has_min_max
+
+    sidecar = _schema(str(tmp_path))
+    assert sidecar['files'] == {'lakes.parquet': 5}
+    assert [c['column_name'] for c in sidecar['columns']] == result.column_names
+    assert [c['column_string_min'] for c in sidecar['columns'][:2]] == [4, 2]
+    assert [c['dictionary_encoded'] for c in sidecar['columns']] == [True, True, False, False]
+
+
+def test_partitioned_output(table, tmp_path):
+    out_path = parquet_release.write_table('lakes', str(tmp_path), partition_field='lake_state',
+                                           dictionary_fields=[])
+    assert sorted(os.listdir(out_path)) == ['lake_state=MI', 'lake_state=WI',
+                                            'lake_state={}'.format(parquet_release.NULL_PARTITION)]
+    sidecar = _schema(str(tmp_path))
+    assert sidecar['files'] == {os.path.join('lakes', 'lake_state=MI', 'part-0.parquet'): 2,
+                                os.path.join('lakes', 'lake_state=WI', 'part-0.parquet'): 2,
+                                os.path.join('lakes', 'lake_state=__HIVE_DEFAULT_PARTITION__', 'part-0.parquet'): 1}
+    michigan = pq.read_table(os.path.join(out_path, 'lake_state=MI', 'part-0.parquet'))
+    assert michigan.column_names == ['lake_zoneid', 'lake_count', 'lake_area_ha']
+    assert michigan.column('lake_zoneid').to_pylist() == ['ws_1', 'ws_3']
+    assert sidecar['columns'][1]['parquet_type'] == 'partition'
+
+
+def test_partition_field_must_exist(table, tmp_path):
+    with pytest.raises(ValueError):
+        parquet_release.write_table('lakes', str(tmp_path), partition_field='lake_huc4')
+
+
+def test_geometry_and_geo_metadata(table, tmp_path, monkeypatch):
+    # without pyproj the CRS is written as an identifier only
+    monkeypatch.setitem(sys.modules, 'pyproj', None)
+    out_path = parquet_release.write_table('lakes', str(tmp_path), field_list=['lake_zoneid'],
+                                           include_geometry=True)
+    assert table == [['lake_zoneid', data_access.WKB_TOKEN]]
+    result = pq.read_table(out_path)
+    assert result.column('geometry').to_pylist() == ROWS[data_access.WKB_TOKEN]
+    geo = json.loads(result.schema.metadata[b'geo'])
+    assert geo['primary_column'] == 'geometry'
+    assert geo['columns']['geometry']['crs'] == {'id': {'authority': 'ESRI', 'code': 102039}}
+    assert _schema(str(tmp_path))['geo'] == geo
@@ -0,0 +1,63 @@
+# filename: test_priority_flood.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import heapq
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS', 'watershed_delineation')))
+import priority_flood
+
+
+def _reference_fill(dem, nodata):
+    """Untiled priority-flood: cells on the edge of the DEM or next to NoData drain freely."""
+    height, width = dem.shape
+    invalid = dem == nodata
+    filled = dem.astype(np.float64).copy()
+    done = invalid.copy()
+    heap = []
+    for row in range(height):
+        for col in range(width):
+            if invalid[row, col]:
+                continue
+            near = [(row + dr, col + dc) for dr, dc in priority_flood.NEIGHBORS]
+            if any(not (0 <= r < height and 0 <= c < width) or invalid[r, c] for r, c in near):
+                heapq.heappush(heap, (filled[row, col], row, col))
+                done[row, col] = True
+    while heap:
+        z, row, col = heapq.heappop(heap)
+        for dr, dc in priority_flood.NEIGHBORS:
+            r, c = row + dr, col + dc
+            if 0 <= r < height and 0 <= c < width and not done[r, c]:
+                done[r, c] = True
+                filled[r, c] = max(filled[r, c], z)
+                heapq.heappush(heap, (filled[r, c], r, c))
+    return np.where(invalid, priority_flood.OUTPUT_NODATA, filled).astype(np.float32)
+
+
+def test_pit_is_filled_to_its_spill_point():
+    dem = np.array([[5, 5, 5, 5, 5],
+                    [5, 4, 4, 4, 5],
+                    [5, 4, 1, 4, 3],
+                    [5, 4, 4, 4, 5],
+                    [5, 5, 5, 5, 5]], dtype=np.float64)
+    filled = priority_flood.fill_array(dem, tile_size=2)
+    expected = dem.copy()
+    expected[1:4, 1:4] = 4
+    assert np.array_equal(filled, expected.astype(np.float32))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_tiled_fill_matches_untiled_fill(seed):
+    rng = np.random.RandomState(seed)
+    dem = np.round(rng.rand(23, 31) * 20)
+    dem[rng.rand(23, 31) < 0.05] = -9999
+    expected = _reference_fill(dem, -9999)
+    for tile_size in (3, 5, 8, 16, 100):
+        assert np.array_equal(priority_flood.fill_array(dem, -9999, tile_size), expected), tile_size
@@ -0,0 +1,99 @@
+# filename: test_raster_blocks.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS', 'watershed_delineation')))
+import raster_blocks
+
+
+class _SpatialReference(object):
+    """Stands in for an arcpy SpatialReference."""
+
+    def __init__(self, name, central_meridian=-96.0, datum='D_North_American_1983'):
+        self.name = name
+        self.type = 'Projected'
+        self.GCS = self
+        self.datumName = datum
+        self.projectionName = 'Albers'
+        self.centralMeridian = central_meridian
+        self.standardParallel1, self.standardParallel2 = 29.5, 45.5
+        self.latitudeOfOrigin = 23.0
+        self.falseEasting = self.falseNorthing = 0.0
+        self.scaleFactor = 1.0
+        self.linearUnitName = 'Meter'
+
+    def exportToString(self):
+        return self.name
+
+
+def test_arcpy_coordinate_systems_compare_by_definition():
+    albers = _SpatialReference('NAD_1983_Contiguous_USA_Albers')
+    assert raster_blocks.same_crs(albers, _SpatialReference('USA_Contiguous_Albers_Equal_Area_Conic_USGS_version'))
+    assert not raster_blocks.same_crs(albers, _SpatialReference('Albers', central_meridian=-100.0))
+    assert not raster_blocks.same_crs(albers, _SpatialReference('Albers', datum='D_WGS_1984'))
+
+
+def test_check_same_grid():
+    reader = raster_blocks.ArrayReader(np.zeros((4, 5)), geotransform=(100, 10, 0, 200, 0, -10))
+    raster_blocks.check_same_grid(reader, raster_blocks.ArrayReader(np.ones((4, 5)),
+                                                                    geotransform=(100.001, 10, 0, 200, 0, -10)))
+    for other in (raster_blocks.ArrayReader(np.zeros((5, 4)), geotransform=reader.geotransform),
+                  raster_blocks.ArrayReader(np.zeros((4, 5)), geotransform=(100, 30, 0, 200, 0, -30)),
+                  raster_blocks.ArrayReader(np.zeros((4, 5)), geotransform=(105, 10, 0, 200, 0, -10))):
+        with pytest.raises(ValueError):
+            raster_blocks.check_same_grid(reader, other)
+
+
+class _FakeArcpy(object):
+    """Records the rasters the ArcpyWriter saves and the tools it runs."""
+
+    def __init__(self):
+        self.saved = {}
+        self.calls = []
+
+    def Point(self, x, y):
+        return (x, y)
+
+    def NumPyArrayToRaster(self, array, lower_left, cell_width, cell_height, nodata):
+        saved = self.saved
+
+        class Raster(object):
+            def save(self, path):
+                saved[path] = (array.copy(), lower_left, nodata)
+        return Raster()
+
+    def Exists(self, path):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+
+def test_arcpy_writer_saves_strips_within_the_budget(monkeypatch):
+    arcpy = _FakeArcpy()
+    monkeypatch.setitem(sys.modules, 'arcpy', arcpy)
+    template = raster_blocks.ArrayReader(np.zeros((10, 4)), geotransform=(100, 2, 0, 50, 0, -2), projection='albers')
+    # 3 rows of 4 float64 cells per strip
+    writer = raster_blocks.ArcpyWriter('out.tif', template, np.float64, -1, memory_mb=100.0 / 2**20)
+    expected = np.arange(40, dtype=np.float64).reshape(10, 4)
+    for window in raster_blocks.windows(10, 4, 4, 2):
+        writer.write(window, expected[window.row:window.row + window.nrows, window.col:window.col + window.ncols])
+    scratch_dir = writer.scratch_dir
+    assert writer.close() == 'out.tif'
+
+    strips = sorted(arcpy.saved.items(), key=lambda item: -item[1][1][1])
+    assert [array.shape for path, (array, lower_left, nodata) in strips] == [(3, 4), (3, 4), (3, 4), (1, 4)]
+    assert [lower_left for path, (array, lower_left, nodata) in strips] == [(100, 44), (100, 38), (100, 32), (100, 30)]
+    assert np.array_equal(np.vstack([array for path, (array, lower_left, nodata) in strips]), expected)
+    tools = [name for name, args, kwargs in arcpy.calls]
+    assert tools[:3] == ['CopyRaster_management', 'Mosaic_management', 'DefineProjection_management']
+    assert arcpy.calls[1][1][1] == 'out.tif' and arcpy.calls[1][2]['nodata_value'] == '-1'
+    assert not os.path.exists(scratch_dir)
@@ -0,0 +1,105 @@
+# filename: test_reference_overlays.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import pytest
+
+shapely_geometry = pytest.importorskip('shapely.geometry')
+box, LineString = shapely_geometry.box, shapely_geometry.LineString
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import reference_overlays
+
+LAYERS = {'land_border': [(LineString([(0, 100), (300, 100)]).wkb,)],
+          'coastline': [(LineString([(0, -50), (10, -50)]).wkb,)],
+          'states': [(box(0, 0, 100, 100).wkb, 'MI'), (box(100, 0, 200, 100).wkb, 'WI')],
+          'glacial_extent': [(box(0, 50, 200, 150).wkb,)]}
+
+
+@pytest.fixture
+def overlays(tmp_path, monkeypatch):
+    requests = []
+
+    def read_rows(table, fields, where_clause=None, backend=None, spatial_reference=None):
+        requests.append((table, spatial_reference))
+        return iter(LAYERS[table])
+
+    monkeypatch.setattr(data_access, 'read_rows', read_rows)
+    cache = reference_overlays.open_overlays(str(tmp_path), 'land_border', 'coastline', 'states', 'glacial_extent',
+                                             tile_size=60)
+    assert sorted(requests) == sorted((layer, reference_overlays.ALBERS) for layer in LAYERS)
+    return cache
+
+
+def _open(root, monkeypatch, land_border='land_border', states='states', **kwargs):
+    built = []
+    build = reference_overlays.build
+    monkeypatch.setattr(reference_overlays, 'build', lambda *args: built.append(args[1:3]) or build(*args))
+    reference_overlays.open_overlays(root, land_border, 'coastline', states, 'glacial_extent', tile_size=60,
+                                     **kwargs)
+    return sorted(built)
+
+
+def test_tiles_cover_the_geometry():
+    square = box(-10, -10, 130, 70)
+    pieces = reference_overlays.tile_geometry(square, 50)
+    assert len(pieces) == 12
+    assert abs(sum(p.area for p in pieces) - square.area) < 1e-6
+
+
+def test_overlay_flags(overlays):
+    zones = [box(50, 50, 150, 150).wkb, box(10, 10, 20, 20).wkb, None]
+    result = overlays.overlay(zones)
+    assert result['onlandborder'] == ['Y', 'N', None]
+    assert result['oncoast'] == ['N', 'N', None]
+    assert result['states'] == ['MI WI', 'MI', None]
+    assert result['inusa_pct'] == [50, 100, None]
+    assert result['glaciatedlatewisc_pct'] == [100, 0, None]
+
+
+def test_cache_is_rebuilt_for_another_coordinate_system(overlays, tmp_path, monkeypatch):
+    built = []
+    monkeypatch.setattr(reference_overlays, 'build', lambda *args: built.append(args[-1]))
+    reference_overlays.open_overlays(str(tmp_path), 'land_border', 'coastline', 'states', 'glacial_extent',
+                                     tile_size=60)
+    assert built == []
+    reference_overlays.open_overlays(str(tmp_path), 'land_border', 'coastline', 'states', 'glacial_extent',
+                                     tile_size=60, spatial_reference=5070)
+    assert built == [5070] * len(LAYERS)
+
+
+def test_sources_have_their_own_caches(overlays, tmp_path, monkeypatch):
+    monkeypatch.setitem(LAYERS, 'other_states', LAYERS['states'][:1])
+    monkeypatch.setattr(data_access, 'read_rows', lambda table, fields, **kwargs: iter(LAYERS[table]))
+    assert _open(str(tmp_path), monkeypatch, states='other_states') == [('states', 'other_states')]
+    # the first source set is still cached and unchanged
+    assert _open(str(tmp_path), monkeypatch) == []
+    assert len(os.listdir(str(tmp_path))) == 5
+    assert overlays.overlay([box(150, 50, 160, 60).wkb])['states'] == ['WI']
+
+
+def test_only_the_layers_for_the_flags_are_built(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_access, 'read_rows', lambda table, fields, **kwargs: iter(LAYERS[table]))
+    flags = ['onlandborder', 'oncoast']
+    assert _open(str(tmp_path), monkeypatch, flags=flags) == [('coastline', 'coastline'),
+                                                              ('land_border', 'land_border')]
+    cache = reference_overlays.open_overlays(str(tmp_path), 'land_border', 'coastline', None, None, tile_size=60,
+                                             flags=flags)
+    assert cache.overlay([box(0, 90, 10, 110).wkb], flags) == {'onlandborder': ['Y'], 'oncoast': ['N']}
+    with pytest.raises(ValueError):
+        cache.overlay([box(0, 90, 10, 110).wkb], ['states'])
+    assert _open(str(tmp_path), monkeypatch, flags=['inusa_pct']) == [('states', 'states')]
+
+
+def test_concurrent_build_keeps_the_finished_layer(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_access, 'read_rows', lambda table, fields, **kwargs: iter(LAYERS[table]))
+    layer_dir = os.path.join(str(tmp_path), 'coastline')
+    reference_overlays.build(layer_dir, 'coastline', 'coastline', 60)
+    reference_overlays.build(layer_dir, 'coastline', 'coastline', 60)
+    assert sorted(os.listdir(str(tmp_path))) == ['coastline']
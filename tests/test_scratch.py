@@ -0,0 +1,50 @@
+# filename: test_scratch.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): all
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import scratch
+
+
+@pytest.fixture
+def budget():
+    scratch.set_memory_budget(100)
+    yield
+    scratch.set_memory_budget(scratch.MEMORY_BUDGET_MB)
+
+
+def test_reservations_stay_within_the_budget(budget):
+    assert scratch._reserve(60)
+    assert not scratch._reserve(50)
+    assert scratch.memory_available_mb() == 40
+    assert scratch._reserve(50, force=True)  # forced in memory, over budget
+    assert scratch.memory_available_mb() == -10
+    scratch._release(50)
+    scratch._release(60)
+    assert scratch.memory_available_mb() == 100
+    assert scratch._budget['open_in_memory'] == 0
+
+
+def test_concurrent_reservations(budget):
+    granted = []
+
+    def reserve():
+        if scratch._reserve(30):
+            granted.append(30)
+    threads = [threading.Thread(target=reserve) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(granted) == 3
+    for size in granted:
+        scratch._release(size)
+    assert scratch.memory_available_mb() == 100
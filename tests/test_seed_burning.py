@@ -0,0 +1,40 @@
+# filename: test_seed_burning.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS', 'watershed_delineation')))
+import raster_blocks
+import seed_burning
+
+NODATA = seed_burning.SEED_NODATA
+
+
+def test_code_lookup():
+    lookup = seed_burning.code_lookup([3, 7, 3])
+    assert seed_burning.in_lookup(np.array([-1, 3, 4, 7, 100]), lookup).tolist() == [False, True, False, True, False]
+    assert not seed_burning.in_lookup(np.array([1, 2]), seed_burning.code_lookup([])).any()
+
+
+def test_lakes_take_precedence_and_sinks_are_removed():
+    seeds = np.array([[1, 1, NODATA], [2, 5, 5]], dtype=np.int32)
+    lakes = np.array([[NODATA, 9, 9], [NODATA, NODATA, NODATA]], dtype=np.int32)
+    seed_reader = raster_blocks.ArrayReader(seeds, NODATA)
+    lake_reader = raster_blocks.ArrayReader(lakes, NODATA)
+    writer = raster_blocks.ArrayWriter(seed_reader, np.int32, NODATA)
+    result = seed_burning.burn_seeds_blocks(seed_reader, lake_reader, writer, remove_codes=[5], memory_mb=0.00001)
+    assert result.tolist() == [[1, 9, 9], [2, NODATA, NODATA]]
+
+
+def test_lake_raster_must_be_on_the_catseed_grid():
+    seeds = raster_blocks.ArrayReader(np.ones((2, 2), dtype=np.int32), NODATA)
+    lakes = raster_blocks.ArrayReader(np.ones((2, 2), dtype=np.int32), NODATA, geotransform=(0, 10, 0, 0, 0, -10))
+    with pytest.raises(ValueError):
+        seed_burning.burn_seeds_blocks(seeds, lakes, raster_blocks.ArrayWriter(seeds, np.int32, NODATA))
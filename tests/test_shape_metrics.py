@@ -0,0 +1,62 @@
+# filename: test_shape_metrics.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS, GEO
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import struct
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import shape_metrics
+
+
+def _square(x0, y0, size, clockwise=False):
+    ring = [(x0, y0), (x0 + size, y0), (x0 + size, y0 + size), (x0, y0 + size), (x0, y0)]
+    return ring[::-1] if clockwise else ring
+
+
+def _polygon_wkb(rings):
+    wkb = struct.pack('<BII', 1, shape_metrics.WKB_POLYGON, len(rings))
+    for ring in rings:
+        wkb += struct.pack('<I', len(ring)) + b''.join(struct.pack('<dd', x, y) for x, y in ring)
+    return wkb
+
+
+def _multipolygon_wkb(polygons):
+    return struct.pack('<BII', 1, shape_metrics.WKB_MULTIPOLYGON, len(polygons)) + b''.join(polygons)
+
+
+def test_hole_area_does_not_depend_on_winding():
+    shell = _square(0, 0, 10)
+    for hole in (_square(4, 4, 2), _square(4, 4, 2, clockwise=True)):
+        metrics = shape_metrics.polygon_metrics([_polygon_wkb([shell, hole])])
+        assert metrics['area'][0] == 96
+        assert metrics['perimeter'][0] == 48
+        assert metrics['part_count'][0] == 1
+
+
+def test_multipolygon_parts_and_area():
+    wkb = _multipolygon_wkb([_polygon_wkb([_square(0, 0, 10, clockwise=True), _square(1, 1, 1, clockwise=True)]),
+                             _polygon_wkb([_square(20, 0, 3)])])
+    rings, parts, holes = shape_metrics.parse_polygon_wkb(wkb)
+    assert (len(rings), parts, holes) == (3, 2, [False, True, False])
+    metrics = shape_metrics.polygon_metrics([wkb, None])
+    assert metrics['area'].tolist() == [108, 0]
+    assert metrics['part_count'].tolist() == [2, 0]
+
+
+def test_hull_axes_match_mbg_definitions():
+    triangle = np.array([(0, 0), (4, 0), (0, 3), (1, 1)], dtype=np.float64)
+    length, width, orientation = shape_metrics.hull_axes(triangle)
+    assert np.isclose(length, 5)
+    assert np.isclose(width, 3)  # shortest distance between two hull vertices
+    assert np.isclose(orientation, 180 - np.degrees(np.arctan2(4, 3)))
+
+
+def test_albers_origin():
+    lat, lon = shape_metrics.albers_to_geographic([0.0], [0.0])
+    assert np.allclose([lat[0], lon[0]], [shape_metrics.ALBERS_LAT_ORIGIN, shape_metrics.ALBERS_LON_ORIGIN])
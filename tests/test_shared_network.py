@@ -0,0 +1,77 @@
+# filename: test_shared_network.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import shared_network
+import synthetic_network
+
+
+def test_lookup_ids():
+    interned = shared_network.intern_ids(['{B}', '{A}', '{C}', '{A}'])
+    assert shared_network.decode_ids(interned, [0, 1, 2]) == ['{A}', '{B}', '{C}']
+    assert shared_network.lookup_ids(interned, ['{C}', '{A}', '{D}', '']).tolist() == [2, 0, -1, -1]
+    assert shared_network.lookup_ids(interned, []).size == 0
+
+
+def test_longer_id_does_not_match_its_prefix():
+    interned = shared_network.intern_ids(['123', '456'])
+    assert shared_network.lookup_ids(interned, ['1234', '4567890', '456']).tolist() == [-1, -1, 1]
+
+
+def test_csr_neighbors():
+    interned = shared_network.intern_ids(['a', 'b', 'c', 'd'])
+    indptr, indices = shared_network.build_csr({'a': ['b', 'c'], 'c': ['d'], 'd': []}, interned)
+    assert indptr.tolist() == [0, 2, 2, 3, 3]
+    assert sorted(shared_network.gather_neighbors(indptr, indices, [0, 2]).tolist()) == [1, 2, 3]
+    assert shared_network.gather_neighbors(indptr, indices, [1, 3]).size == 0
+
+
+def _same(a, b):
+    return sorted(a) == sorted(b)
+
+
+def test_barrier_traces_match_nhdnetwork(tmp_path):
+    network = synthetic_network.SyntheticNHDNetwork(3000, huc4='0415', cycle_fraction=0.005)
+    shared = shared_network.SharedNetwork(network.publish(str(tmp_path / '0415')))
+    flowline_ids = [r[0] for r in network.tables['NHDFlowline'][1]]
+    waterbody_ids = [r[0] for r in network.tables['NHDWaterbody'][1]]
+
+    # every lake over 10 ha, then a handful of small ones, as barriers
+    stop_sets = [None, sorted(id for id, area in network.define_lakes().items() if area < 0.1)[:20]]
+    for stops in stop_sets:
+        if stops is None:
+            stops = network.activate_10ha_lake_stops()
+            assert sorted(shared.activate_10ha_lake_stops()) == sorted(stops)
+        else:
+            network.set_stop_ids(stops)
+            shared.set_stop_ids(stops)
+        assert stops
+
+        # start from the barrier flowlines themselves, from just below them, and from anywhere
+        barrier_flowlines = set(network.flowline_stop_ids)
+        below = {to_id for id in barrier_flowlines for to_id in network.downstream[id]}
+        starts = sorted(barrier_flowlines)[:40] + sorted(below.difference(['0']))[:40] + flowline_ids[::97]
+        for id in starts:
+            for include_wb_permids in (True, False):
+                assert _same(shared.trace_up_from_a_flowline(id, include_wb_permids),
+                             network.trace_up_from_a_flowline(id, include_wb_permids)), id
+                assert _same(shared.trace_down_from_a_flowline(id, include_wb_permids),
+                             network.trace_down_from_a_flowline(id, include_wb_permids)), id
+        for id in waterbody_ids:
+            assert _same(shared.trace_up_from_a_waterbody(id), network.trace_up_from_a_waterbody(id)), id
+            assert _same(shared.trace_down_from_a_waterbody(id), network.trace_down_from_a_waterbody(id)), id
+            assert shared.find_upstream_lakes(id, 'count') == network.find_upstream_lakes(id, 'count'), id
+        assert shared.waterbody_stop_ids == list(stops) and network.waterbody_stop_ids == list(stops)
+
+    network.deactivate_stops()
+    shared.deactivate_stops()
+    for id in flowline_ids[::97]:
+        assert _same(shared.trace_up_from_a_flowline(id), network.trace_up_from_a_flowline(id)), id
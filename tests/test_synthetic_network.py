@@ -0,0 +1,76 @@
+# filename: test_synthetic_network.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import synthetic_network
+
+
+def _downstream(tables):
+    flowline_ids = set(r[0] for r in tables['NHDFlowline'][1])
+    downstream = defaultdict(list)
+    for from_id, to_id in tables['NHDPlusFlow'][1]:
+        if from_id in flowline_ids and to_id in flowline_ids:
+            downstream[from_id].append(to_id)
+    return flowline_ids, downstream
+
+
+def _has_cycle(nodes, downstream):
+    # Kahn's algorithm: a graph is acyclic if every node can be removed in topological order
+    indegree = dict.fromkeys(nodes, 0)
+    for targets in downstream.values():
+        for to_id in targets:
+            indegree[to_id] += 1
+    ready = [n for n, d in indegree.items() if not d]
+    removed = 0
+    while ready:
+        node = ready.pop()
+        removed += 1
+        for to_id in downstream[node]:
+            indegree[to_id] -= 1
+            if not indegree[to_id]:
+                ready.append(to_id)
+    return removed < len(nodes)
+
+
+def test_table_counts():
+    tables = synthetic_network.generate_network_tables(5000, huc4='0415', n_closed_basins=4)
+    flowlines, waterbodies, flow = [tables[t][1] for t in ('NHDFlowline', 'NHDWaterbody', 'NHDPlusFlow')]
+    assert len(flowlines) == 5000
+    assert all(r[0].startswith('fl0415-') for r in flowlines)
+    assert all(r[0].startswith('wb0415-') for r in waterbodies)
+
+    # one subregion outlet and inlet, and one network end per closed basin
+    flowline_ids = set(r[0] for r in flowlines)
+    assert len([r for r in flow if r[1] == 'outlet0415']) == 1
+    assert len([r for r in flow if r[0] == 'inlet0415']) == 1
+    assert len([r for r in flow if r[1] == '0' and r[0] in flowline_ids]) == 4
+
+    # networked lakes contain flowlines, the isolated lakes none
+    networked = set(r[1] for r in flowlines if r[1])
+    isolated = [r[0] for r in waterbodies if r[0] not in networked]
+    assert 0 < len(networked) <= 5000 * 0.03
+    assert len(isolated) == int(len(networked) * 0.2 / 0.8)
+
+
+def test_network_is_acyclic_without_cycles():
+    tables = synthetic_network.generate_network_tables(5000, cycle_fraction=0)
+    flowline_ids, downstream = _downstream(tables)
+    assert not _has_cycle(flowline_ids, downstream)
+    # braids are the only divergences
+    assert any(len(v) > 1 for v in downstream.values())
+
+    tables = synthetic_network.generate_network_tables(5000, cycle_fraction=0.01)
+    assert _has_cycle(*_downstream(tables))
+
+
+def test_same_arguments_same_tables():
+    generate = synthetic_network.generate_network_tables
+    assert generate(1000, seed=3) == generate(1000, seed=3)
+    assert generate(1000, seed=3) != generate(1000, seed=4)
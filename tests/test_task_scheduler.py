@@ -0,0 +1,140 @@
+# filename: test_task_scheduler.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS', 'watershed_delineation')))
+from task_scheduler import Scheduler, Task
+
+
+def _record(log_path, name, seconds):
+    start = time.time()
+    time.sleep(seconds)
+    with open(log_path, 'a') as f:
+        f.write('{},{},{}\n'.format(name, start, time.time()))
+
+
+def _intervals(log_path):
+    with open(log_path) as f:
+        rows = [line.strip().split(',') for line in f]
+    return {name: (float(start), float(end)) for name, start, end in rows}
+
+
+def test_license_without_tokens_raises():
+    scheduler = Scheduler(cpus=2, licenses={'LAGOS_LAKES': 0})
+    with pytest.raises(ValueError):
+        scheduler.add(Task('writer', _record, licenses=['LAGOS_LAKES']))
+    with pytest.raises(ValueError):
+        scheduler.add(Task('reader', _record, reads=['LAGOS_LAKES']))
+
+
+def test_readers_never_run_with_the_token_holder(tmp_path):
+    log_path = str(tmp_path / 'log.csv')
+    scheduler = Scheduler(cpus=4, licenses={'LAGOS_LAKES': 1})
+    for name in ('read1', 'write1', 'read2', 'read3', 'write2'):
+        kind = {'licenses': ['LAGOS_LAKES']} if name.startswith('write') else {'reads': ['LAGOS_LAKES']}
+        scheduler.add(Task(name, _record, [log_path, name, 0.3], **kind))
+    results = scheduler.run(verbose=False)
+    assert all(task.status == 'done' for task in results.values())
+
+    intervals = _intervals(log_path)
+    for writer in ('write1', 'write2'):
+        w_start, w_end = intervals[writer]
+        for name, (start, end) in intervals.items():
+            if name != writer:
+                assert end <= w_start or start >= w_end, (writer, name)
+    # readers share the dataset
+    assert intervals['read2'][0] < intervals['read3'][1] and intervals['read3'][0] < intervals['read2'][1]
+
+
+def _fail(message):
+    raise RuntimeError(message)
+
+
+def test_tasks_run_in_dependency_order(tmp_path):
+    log_path = str(tmp_path / 'log.csv')
+    scheduler = Scheduler(cpus=4)
+    # added in reverse, linked by paths and by name
+    scheduler.add(Task('aggregate', _record, [log_path, 'aggregate', 0.1], inputs=['catchments.tif'],
+                       after=['report']))
+    scheduler.add(Task('report', _record, [log_path, 'report', 0.1], inputs=['fdr.tif']))
+    scheduler.add(Task('catchments', _record, [log_path, 'catchments', 0.1], inputs=['fdr.tif'],
+                       outputs=['catchments.tif']))
+    scheduler.add(Task('fdr', _record, [log_path, 'fdr', 0.1], outputs=['fdr.tif']))
+    results = scheduler.run(verbose=False)
+    assert [results[name].status for name in ('fdr', 'catchments', 'report', 'aggregate')] == ['done'] * 4
+
+    intervals = _intervals(log_path)
+    for before, after in (('fdr', 'catchments'), ('fdr', 'report'), ('catchments', 'aggregate'),
+                          ('report', 'aggregate')):
+        assert intervals[before][1] <= intervals[after][0], (before, after)
+
+
+def test_failed_task_blocks_its_dependents(tmp_path):
+    log_path = str(tmp_path / 'log.csv')
+    scheduler = Scheduler(cpus=2)
+    scheduler.add(Task('fdr', _fail, ['no DEM'], outputs=['fdr.tif']))
+    scheduler.add(Task('catchments', _record, [log_path, 'catchments', 0], inputs=['fdr.tif'],
+                       outputs=['catchments.tif']))
+    scheduler.add(Task('aggregate', _record, [log_path, 'aggregate', 0], after=['catchments']))
+    scheduler.add(Task('other', _record, [log_path, 'other', 0]))
+    results = scheduler.run(verbose=False)
+    assert results['fdr'].status == 'failed' and 'no DEM' in results['fdr'].error
+    assert results['catchments'].status == 'blocked' and results['aggregate'].status == 'blocked'
+    assert results['aggregate'].error == 'Predecessor fdr failed'
+    assert results['other'].status == 'done'
+    assert list(_intervals(log_path).keys()) == ['other']
+
+
+def test_tasks_with_existing_outputs_are_skipped(tmp_path):
+    log_path = str(tmp_path / 'log.csv')
+    existing = {'fdr.tif', 'old.tif'}
+    scheduler = Scheduler(cpus=2, exists=lambda path: path in existing)
+    scheduler.add(Task('fdr', _fail, ['should be skipped'], outputs=['fdr.tif']))
+    scheduler.add(Task('catchments', _record, [log_path, 'catchments', 0], inputs=['fdr.tif'],
+                       outputs=['catchments.tif', 'old.tif']))
+    scheduler.add(Task('aggregate', _record, [log_path, 'aggregate', 0], inputs=['catchments.tif']))
+    results = scheduler.run(verbose=False)
+    # a task runs unless all of its outputs exist, and skipped tasks release their dependents
+    assert [results[name].status for name in ('fdr', 'catchments', 'aggregate')] == ['skipped', 'done', 'done']
+    assert sorted(_intervals(log_path).keys()) == ['aggregate', 'catchments']
+
+
+def test_cyclic_graph_is_rejected():
+    scheduler = Scheduler(cpus=2)
+    scheduler.add(Task('fdr', _fail, ['never run'], inputs=['catchments.tif'], outputs=['fdr.tif']))
+    scheduler.add(Task('catchments', _fail, ['never run'], inputs=['fdr.tif'], outputs=['catchments.tif']))
+    with pytest.raises(ValueError):
+        scheduler.run(verbose=False)
+
+    scheduler = Scheduler(cpus=2)
+    scheduler.add(Task('a', _fail, ['never run'], after=['c']))
+    scheduler.add(Task('b', _fail, ['never run'], after=['a']))
+    scheduler.add(Task('c', _fail, ['never run'], after=['b']))
+    with pytest.raises(ValueError):
+        scheduler.run(verbose=False)
+    assert all(task.status == 'waiting' for task in scheduler.tasks)
+
+
+def test_license_that_can_never_be_granted_is_reported():
+    scheduler = Scheduler(cpus=2, licenses={'Spatial': 1})
+    # unknown license, and more tokens than there are
+    with pytest.raises(ValueError):
+        scheduler.add(Task('fdr', _record, licenses=['Network']))
+    with pytest.raises(ValueError):
+        scheduler.add(Task('fdr', _record, licenses=['Spatial', 'Spatial']))
+    assert not scheduler.tasks
+
+    # tokens withdrawn after the task was added: reported when nothing else can run, not waited on
+    scheduler.add(Task('fdr', _record, licenses=['Spatial']))
+    scheduler.licenses['Spatial'] = 0
+    with pytest.raises(RuntimeError) as error:
+        scheduler.run(verbose=False)
+    assert 'fdr' in str(error.value)
@@ -0,0 +1,44 @@
+# filename: test_tracing.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): all
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import tracing
+
+
+def test_spans_and_report(tmp_path, monkeypatch):
+    def read_rows(table, fields, where_clause=None, backend=None, spatial_reference=None, extent=None):
+        for i in range(3):
+            time.sleep(0.01)
+            yield (i,)
+    monkeypatch.setattr(data_access, 'read_rows', read_rows)
+    log_path = str(tmp_path / 'trace.jsonl')
+
+    with tracing.tracing_to(log_path, trace_arcpy=False):
+        with tracing.span('summarize', zone='hu12'):
+            for row in data_access.read_rows('lakes', ['lagoslakeid']):
+                time.sleep(0.05)  # the caller's work is not charged to the read
+    assert data_access.read_rows is read_rows
+
+    read, stage = tracing.read_spans(log_path)
+    assert (stage['name'], stage['kind'], stage['parent']) == ('summarize', 'stage', None)
+    assert stage['detail'] == {'zone': 'hu12'}
+    assert (read['name'], read['parent'], read['path']) == ('read_rows', stage['id'], ['summarize'])
+    assert read['rows_out'] == 3
+    assert read['detail'] == {'table': 'lakes'}
+    assert read['tool'] == 'test_tracing.test_spans_and_report'
+    assert 0.03 <= read['wall_s'] < 0.1 <= stage['wall_s']
+
+    text = tracing.report(log_path)
+    assert 'summarize' in text and 'read_rows (test_tracing.test_spans_and_report) [summarize]' in text
+
+
+def test_spans_are_free_when_disabled():
+    assert isinstance(tracing.span('anything'), tracing._NoSpan)
@@ -0,0 +1,43 @@
+# filename: test_zone_attribution.py
+# author: Nicole J Smith
+# version: 2.0
+# LAGOS module(s): LOCUS
+# tool type: re-usable (NOT in ArcGIS Toolbox)
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+box = pytest.importorskip('shapely.geometry').box
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lagosGIS')))
+import data_access
+import zone_attribution
+
+ZONES = [box(0, 0, 10, 10).wkb, box(10, 0, 20, 10).wkb, box(0, 10, 20, 20).wkb]
+POINTS = [(5, 5), (15, 5), (10, 5), (30, 5), (5, 12), (-1, 15)]
+EXPECTED = [0, 1, 0, 1, 2, 2]  # on a shared edge, the first zone; outside all zones, the closest one
+
+
+@pytest.mark.parametrize('assign', [zone_attribution.assign_zones, zone_attribution._assign_loop])
+def test_assign_zones(assign):
+    assert assign(np.array(POINTS, dtype=np.float64), ZONES).tolist() == EXPECTED
+
+
+def test_no_zones():
+    assert zone_attribution.assign_zones(POINTS, []).tolist() == [-1] * len(POINTS)
+
+
+def test_attribute_points_for_several_layers(monkeypatch):
+    tables = {'lakes': [(i + 1, xy) for i, xy in enumerate(POINTS)] + [(99, None)],
+              'hu12': [('h{}'.format(i), wkb) for i, wkb in enumerate(ZONES)],
+              'county': [('c0', box(-100, -100, 100, 100).wkb), ('c1', None)]}
+    monkeypatch.setattr(data_access, 'read_rows', lambda table, fields, *args, **kwargs: iter(tables[table]))
+    ids, attributes = zone_attribution.attribute_points('lakes', [('hu12', 'hu12_zoneid'), ('county', 'county_zoneid')],
+                                                        'lagoslakeid')
+    assert ids == [1, 2, 3, 4, 5, 6, 99]
+    # the point without geometry gets no zone
+    assert attributes['hu12_zoneid'] == ['h{}'.format(i) for i in EXPECTED] + [None]
+    assert attributes['county_zoneid'] == ['c0'] * len(POINTS) + [None]